@@ -112,14 +112,13 @@ namespace YoloAnnotator
             {
                 TxtStatus.Text = $"正在加载图片: {imageName}";
                 
-                var base64Image = await _apiService.GetImageBase64Async(imageName);
-                if (string.IsNullOrEmpty(base64Image))
+                var imageBytes = await _apiService.GetImageBytesAsync(imageName);
+                if (imageBytes == null || imageBytes.Length == 0)
                 {
                     TxtStatus.Text = "加载图片失败";
                     return;
                 }
 
-                var imageBytes = Convert.FromBase64String(base64Image);
                 using (var stream = new MemoryStream(imageBytes))
                 {
                     _currentBitmap = new BitmapImage();
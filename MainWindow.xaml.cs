@@ -480,26 +480,20 @@ namespace YoloAnnotator
                 // 从所有标注文件中提取类别
                 if (_imageNames != null && _imageNames.Count > 0)
                 {
-                    foreach (var imageName in _imageNames)
+                    // 一次请求读取所有图片的标注，避免逐张请求
+                    var annotations = await _apiService.GetAnnotationsBulkAsync(_imageNames);
+                    foreach (var annotation in annotations)
                     {
-                        try
+                        if (annotation?.Bboxes != null)
                         {
-                            var annotation = await _apiService.GetAnnotationAsync(imageName);
-                            if (annotation?.Bboxes != null)
+                            foreach (var bbox in annotation.Bboxes)
                             {
-                                foreach (var bbox in annotation.Bboxes)
+                                if (!string.IsNullOrEmpty(bbox.ClassName))
                                 {
-                                    if (!string.IsNullOrEmpty(bbox.ClassName))
-                                    {
-                                        allClassNames.Add(bbox.ClassName);
-                                    }
+                                    allClassNames.Add(bbox.ClassName);
                                 }
                             }
                         }
-                        catch (Exception ex)
-                        {
-                            Console.WriteLine($"读取标注文件 {imageName} 失败: {ex.Message}");
-                        }
                     }
                 }
 
@@ -603,14 +597,12 @@ namespace YoloAnnotator
 
             try
             {
-                var base64Image = await _apiService.GetImageBase64Async(imageName);
-                if (string.IsNullOrEmpty(base64Image))
+                var imageBytes = await _apiService.GetImageBytesAsync(imageName);
+                if (imageBytes == null || imageBytes.Length == 0)
                 {
                     UpdateStatus("加载图片失败");
                     return;
                 }
-
-                var imageBytes = Convert.FromBase64String(base64Image);
                 
                 // 使用 using 语句确保 MemoryStream 正确释放
                 using (var stream = new MemoryStream(imageBytes))
@@ -2150,15 +2142,7 @@ namespace YoloAnnotator
             if (dialog.ShowDialog() == true)
             {
                 UpdateStatus("正在上传图片...");
-                var successCount = 0;
-
-                foreach (var file in dialog.FileNames)
-                {
-                    if (await _apiService.UploadImageAsync(file))
-                    {
-                        successCount++;
-                    }
-                }
+                var successCount = await _apiService.UploadImagesAsync(dialog.FileNames);
 
                 UpdateStatus($"已上传 {successCount}/{dialog.FileNames.Length} 张图片");
                 await LoadImagesAsync();
@@ -2941,10 +2925,9 @@ names: {Newtonsoft.Json.JsonConvert.SerializeObject(_classes)}";
                 // 如果临时文件不存在，从API获取并保存
                 if (!File.Exists(tempImagePath))
                 {
-                    var base64Image = await _apiService.GetImageBase64Async(_currentImageName);
-                    if (!string.IsNullOrEmpty(base64Image))
+                    var imageBytes = await _apiService.GetImageBytesAsync(_currentImageName);
+                    if (imageBytes != null && imageBytes.Length > 0)
                     {
-                        var imageBytes = Convert.FromBase64String(base64Image);
                         await File.WriteAllBytesAsync(tempImagePath, imageBytes);
                     }
                     else
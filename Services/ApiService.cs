@@ -110,6 +110,44 @@ namespace YoloAnnotator.Services
             }
         }
 
+        // 批量上传时每次请求包含的文件数
+        private const int UploadBatchSize = 50;
+
+        /// <summary>
+        /// 批量上传图片（每次请求上传 UploadBatchSize 个文件），返回成功的数量（包括内容重复而未重复保存的图片）
+        /// </summary>
+        public async Task<int> UploadImagesAsync(IReadOnlyList<string> filePaths)
+        {
+            var uploaded = 0;
+            foreach (var batch in filePaths.Where(File.Exists).Chunk(UploadBatchSize))
+            {
+                try
+                {
+                    var request = new RestRequest("/images/upload/batch", Method.Post);
+                    foreach (var filePath in batch)
+                    {
+                        request.AddFile("files", filePath);
+                    }
+
+                    var response = await _client.PostAsync<BatchUploadResponse>(request);
+                    if (response == null)
+                    {
+                        continue;
+                    }
+                    uploaded += response.Uploaded + response.Deduplicated;
+                    if (response.Failed > 0)
+                    {
+                        Console.WriteLine($"[ERROR] 批量上传中 {response.Failed} 张图片失败");
+                    }
+                }
+                catch (Exception ex)
+                {
+                    Console.WriteLine($"[ERROR] 批量上传图片异常: {ex.Message}");
+                }
+            }
+            return uploaded;
+        }
+
         public async Task<string?> GetImageBase64Async(string imageName)
         {
             try
@@ -125,6 +163,64 @@ namespace YoloAnnotator.Services
             }
         }
 
+        // 原始图片字节缓存（按 ETag 做条件请求，未修改时服务器返回 304，不再重复传输）
+        private const int ImageCacheCapacity = 32;
+        private readonly Dictionary<string, (string ETag, byte[] Data)> _imageCache = new();
+        private readonly LinkedList<string> _imageCacheOrder = new();
+
+        public async Task<byte[]?> GetImageBytesAsync(string imageName)
+        {
+            try
+            {
+                var request = new RestRequest($"/images/{Uri.EscapeDataString(imageName)}/raw");
+                if (_imageCache.TryGetValue(imageName, out var cached))
+                {
+                    request.AddHeader("If-None-Match", cached.ETag);
+                }
+
+                var response = await _client.ExecuteAsync(request);
+                if (response.StatusCode == System.Net.HttpStatusCode.NotModified && cached.Data != null)
+                {
+                    return cached.Data;
+                }
+                if (!response.IsSuccessful || response.RawBytes == null)
+                {
+                    return null;
+                }
+
+                string? etag = null;
+                if (response.Headers != null)
+                {
+                    foreach (var header in response.Headers)
+                    {
+                        if (string.Equals(header.Name, "ETag", StringComparison.OrdinalIgnoreCase))
+                        {
+                            etag = header.Value?.ToString();
+                        }
+                    }
+                }
+
+                if (!string.IsNullOrEmpty(etag))
+                {
+                    _imageCache[imageName] = (etag, response.RawBytes);
+                    _imageCacheOrder.Remove(imageName);
+                    _imageCacheOrder.AddLast(imageName);
+                    while (_imageCacheOrder.Count > ImageCacheCapacity)
+                    {
+                        _imageCache.Remove(_imageCacheOrder.First!.Value);
+                        _imageCacheOrder.RemoveFirst();
+                    }
+                }
+
+                return response.RawBytes;
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine($"获取图片失败: {ex.Message}");
+                return null;
+            }
+        }
+
         public async Task<bool> DeleteImageAsync(string imageName)
         {
             try
@@ -363,6 +459,25 @@ namespace YoloAnnotator.Services
             }
         }
 
+        /// <summary>
+        /// 一次请求读取多张图片的标注（顺序与 imageNames 一致，没有标注的图片返回空列表）
+        /// </summary>
+        public async Task<List<AnnotationData>> GetAnnotationsBulkAsync(IEnumerable<string> imageNames)
+        {
+            try
+            {
+                var request = new RestRequest("/batch/annotations/query", Method.Post);
+                request.AddJsonBody(new { image_names = imageNames.ToList() });
+                var response = await _client.PostAsync<BulkAnnotationResponse>(request);
+                return response?.Annotations ?? new List<AnnotationData>();
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine($"批量获取标注失败: {ex.Message}");
+                return new List<AnnotationData>();
+            }
+        }
+
         public async Task<bool> SaveAnnotationAsync(string imageName, AnnotationData annotation)
         {
             try
@@ -782,6 +897,18 @@ namespace YoloAnnotator.Services
             public List<string> Images { get; set; } = new List<string>();
         }
 
+        private class BulkAnnotationResponse
+        {
+            public List<AnnotationData> Annotations { get; set; } = new List<AnnotationData>();
+        }
+
+        private class BatchUploadResponse
+        {
+            public int Uploaded { get; set; }
+            public int Deduplicated { get; set; }
+            public int Failed { get; set; }
+        }
+
         private class ImageResponse
         {
             public string Image { get; set; } = string.Empty;
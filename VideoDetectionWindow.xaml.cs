@@ -12,6 +12,8 @@ using System.Windows.Media.Imaging;
 using System.Windows.Shapes;
 using Microsoft.Win32;
 using System.Net.Http;
+using System.Net.WebSockets;
+using System.Text;
 using System.Text.Json;
 
 namespace YoloAnnotator
@@ -110,6 +112,9 @@ namespace YoloAnnotator
         private bool _isPaused = false;
         private Task? _detectionTask;
         private System.Threading.CancellationTokenSource? _cancellationTokenSource;
+        private ClientWebSocket? _webSocket;
+        private string? _sessionId;
+        private readonly System.Threading.SemaphoreSlim _sendLock = new System.Threading.SemaphoreSlim(1, 1);
         private double _videoWidth = 0;
         private double _videoHeight = 0;
         private DateTime _lastFrameTime;
@@ -145,9 +150,14 @@ namespace YoloAnnotator
             _httpClient.BaseAddress = new Uri("http://localhost:8000");
             
             // 置信度滑块值变化
-            SldConfidence.ValueChanged += (s, e) =>
+            SldConfidence.ValueChanged += async (s, e) =>
             {
                 TxtConfidence.Text = SldConfidence.Value.ToString("F2");
+                // 检测进行中时同步到服务端会话
+                if (_isDetecting)
+                {
+                    await SendControlAsync(new { action = "config", confidence_threshold = SldConfidence.Value });
+                }
             };
             
             // 使用Loaded事件来初始化，避免XAML加载时触发SelectionChanged
@@ -286,7 +296,7 @@ namespace YoloAnnotator
                     "application/json"
                 );
 
-                var response = await _httpClient.PostAsync("/api/video/detect/start", content);
+                var response = await _httpClient.PostAsync("/api/video/sessions", content);
                 var responseText = await response.Content.ReadAsStringAsync();
 
                 if (!response.IsSuccessStatusCode)
@@ -294,13 +304,8 @@ namespace YoloAnnotator
                     throw new Exception($"启动失败: {responseText}");
                 }
 
-                var result = JsonSerializer.Deserialize<JsonElement>(responseText);
-                bool success = result.GetProperty("success").GetBoolean();
-
-                if (!success)
-                {
-                    throw new Exception(result.GetProperty("message").GetString());
-                }
+                var result = JsonSerializer.Deserialize<JsonElement>(responseText).GetProperty("session");
+                _sessionId = result.GetProperty("session_id").GetString();
 
                 // 获取视频信息
                 _videoWidth = 0;
@@ -327,11 +332,21 @@ namespace YoloAnnotator
                     }
                 }
 
-                // 开始检测循环
+                // 连接 WebSocket，服务端持续推送检测结果和画面
+                var webSocketUri = new UriBuilder(_httpClient.BaseAddress!)
+                {
+                    Scheme = "ws",
+                    Path = $"/api/video/sessions/{_sessionId}/ws"
+                }.Uri;
+                _webSocket = new ClientWebSocket();
+                await _webSocket.ConnectAsync(webSocketUri, System.Threading.CancellationToken.None);
+
+                // 开始接收循环
                 _isDetecting = true;
                 _isPaused = false;
                 _cancellationTokenSource = new System.Threading.CancellationTokenSource();
-                _detectionTask = Task.Run(() => DetectionLoop(_cancellationTokenSource.Token));
+                var webSocket = _webSocket;
+                _detectionTask = Task.Run(() => DetectionLoop(webSocket, _cancellationTokenSource.Token));
 
                 TxtStatus.Text = "视频检测进行中...";
                 _lastFrameTime = DateTime.Now;
@@ -340,6 +355,9 @@ namespace YoloAnnotator
             catch (Exception ex)
             {
                 MessageBox.Show($"启动视频检测失败: {ex.Message}", "错误", MessageBoxButton.OK, MessageBoxImage.Error);
+
+                // 释放已创建的会话
+                await CloseSessionAsync();
                 
                 // 恢复UI状态
                 BtnStart.IsEnabled = true;
@@ -361,8 +379,8 @@ namespace YoloAnnotator
                 _isDetecting = false;
                 _cancellationTokenSource?.Cancel();
 
-                // 调用后端停止
-                await _httpClient.PostAsync("/api/video/detect/stop", null);
+                // 关闭 WebSocket 并停止后端会话
+                await CloseSessionAsync();
 
                 // 恢复UI状态
                 BtnStart.IsEnabled = true;
@@ -392,185 +410,244 @@ namespace YoloAnnotator
             }
         }
 
-        private void BtnPause_Click(object sender, RoutedEventArgs e)
+        private async void BtnPause_Click(object sender, RoutedEventArgs e)
         {
             _isPaused = true;
             BtnPause.IsEnabled = false;
             BtnResume.IsEnabled = true;
             TxtStatus.Text = "视频检测已暂停";
+            await SendControlAsync(new { action = "pause" });
         }
 
-        private void BtnResume_Click(object sender, RoutedEventArgs e)
+        private async void BtnResume_Click(object sender, RoutedEventArgs e)
         {
             _isPaused = false;
             BtnPause.IsEnabled = true;
             BtnResume.IsEnabled = false;
             TxtStatus.Text = "视频检测进行中...";
+            await SendControlAsync(new { action = "resume" });
         }
 
-        private async Task DetectionLoop(System.Threading.CancellationToken cancellationToken)
+        /// <summary>
+        /// 通过 WebSocket 发送控制消息（暂停、继续、修改置信度）
+        /// </summary>
+        private async Task SendControlAsync(object control)
         {
+            var webSocket = _webSocket;
+            if (webSocket == null || webSocket.State != WebSocketState.Open)
+                return;
+
+            await _sendLock.WaitAsync();
             try
             {
-                Console.WriteLine("[VIDEO-UI] 检测循环启动");
-                
-                while (_isDetecting && !cancellationToken.IsCancellationRequested)
+                var bytes = Encoding.UTF8.GetBytes(JsonSerializer.Serialize(control));
+                await webSocket.SendAsync(new ArraySegment<byte>(bytes), WebSocketMessageType.Text, true, System.Threading.CancellationToken.None);
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine($"[VIDEO-UI] 发送控制消息失败: {ex.Message}");
+            }
+            finally
+            {
+                _sendLock.Release();
+            }
+        }
+
+        /// <summary>
+        /// 关闭 WebSocket 并停止后端视频会话（释放视频源和模型）
+        /// </summary>
+        private async Task CloseSessionAsync()
+        {
+            var webSocket = _webSocket;
+            var sessionId = _sessionId;
+            _webSocket = null;
+            _sessionId = null;
+
+            if (webSocket != null)
+            {
+                try
                 {
-                    if (_isPaused)
+                    if (webSocket.State == WebSocketState.Open)
                     {
-                        await Task.Delay(100, cancellationToken);
-                        continue;
+                        await webSocket.CloseOutputAsync(WebSocketCloseStatus.NormalClosure, "stop", System.Threading.CancellationToken.None);
                     }
+                }
+                catch (Exception ex)
+                {
+                    Console.WriteLine($"[VIDEO-UI] 关闭 WebSocket 失败: {ex.Message}");
+                }
+                webSocket.Dispose();
+            }
+
+            if (sessionId != null)
+            {
+                try
+                {
+                    await _httpClient.DeleteAsync($"/api/video/sessions/{sessionId}");
+                }
+                catch (Exception ex)
+                {
+                    // 后端会回收空闲会话
+                    Console.WriteLine($"[VIDEO-UI] 停止会话失败: {ex.Message}");
+                }
+            }
+        }
+
+        private async Task DetectionLoop(ClientWebSocket webSocket, System.Threading.CancellationToken cancellationToken)
+        {
+            try
+            {
+                Console.WriteLine("[VIDEO-UI] 接收循环启动");
+
+                var buffer = new byte[64 * 1024];
+                using var message = new MemoryStream();
+                JsonElement? pendingFrame = null;
 
-                    try
+                while (_isDetecting && !cancellationToken.IsCancellationRequested && webSocket.State == WebSocketState.Open)
+                {
+                    // 读取一条完整的消息（大帧会分多次到达）
+                    message.SetLength(0);
+                    WebSocketReceiveResult received;
+                    do
                     {
-                        // 获取置信度值（在UI线程获取，避免线程问题）
-                        float confidence = await Dispatcher.InvokeAsync(() => (float)SldConfidence.Value);
-                        
-                        // 获取视频帧
-                        string url = $"/api/video/detect/frame?confidence_threshold={confidence}";
-                        Console.WriteLine($"[VIDEO-UI] 请求帧: {url}");
-                        
-                        var response = await _httpClient.GetAsync(url, cancellationToken);
-                        Console.WriteLine($"[VIDEO-UI] 响应状态: {response.StatusCode}");
-
-                        if (!response.IsSuccessStatusCode)
-                        {
-                            var errorContent = await response.Content.ReadAsStringAsync();
-                            Console.WriteLine($"[VIDEO-UI] 请求失败: {errorContent}");
-                            break;
-                        }
+                        received = await webSocket.ReceiveAsync(new ArraySegment<byte>(buffer), cancellationToken);
+                        message.Write(buffer, 0, received.Count);
+                    }
+                    while (!received.EndOfMessage && received.MessageType != WebSocketMessageType.Close);
 
-                        var responseText = await response.Content.ReadAsStringAsync();
-                        var result = JsonSerializer.Deserialize<JsonElement>(responseText);
+                    if (received.MessageType == WebSocketMessageType.Close)
+                    {
+                        Console.WriteLine($"[VIDEO-UI] 服务端关闭连接: {received.CloseStatusDescription}");
+                        break;
+                    }
 
-                        if (!result.GetProperty("success").GetBoolean())
-                        {
-                            string message = result.TryGetProperty("message", out var msg)
-                                ? msg.GetString()!
-                                : "获取帧失败";
+                    // 文本消息：帧信息（紧接着是该帧的 JPEG）、会话信息、视频结束或控制回复
+                    if (received.MessageType == WebSocketMessageType.Text)
+                    {
+                        var result = JsonSerializer.Deserialize<JsonElement>(Encoding.UTF8.GetString(message.GetBuffer(), 0, (int)message.Length));
+                        string type = result.GetProperty("type").GetString() ?? "";
 
-                            Console.WriteLine($"[VIDEO-UI] 获取帧失败: {message}");
-                            
-                            if (message.Contains("视频结束"))
-                            {
-                                await Dispatcher.InvokeAsync(() =>
-                                {
-                                    BtnStop_Click(null!, null!);
-                                });
-                                break;
-                            }
-                            continue;
+                        if (type == "frame")
+                        {
+                            pendingFrame = result;
                         }
-
-                        // 解析帧和检测结果
-                        string frameBase64 = result.GetProperty("frame").GetString()!;
-                        var detections = new List<DetectionResult>();
-                        
-                        if (result.TryGetProperty("detections", out var detsElement))
+                        else if (type == "end")
                         {
-                            foreach (var d in detsElement.EnumerateArray())
+                            Console.WriteLine("[VIDEO-UI] 视频结束");
+                            await Dispatcher.InvokeAsync(() =>
                             {
-                                try
-                                                                    {
-                                                                    int classId = d.GetProperty("class_id").GetInt32();
-                                                                    string className = "";
-                                                                    if (d.TryGetProperty("class_name", out var nameElement))
-                                                                    {
-                                                                        className = nameElement.GetString() ?? "";
-                                                                    }
-                                                                    double conf = d.GetProperty("confidence").GetDouble();
-                                
-                                                                    // 如果有类别名称，优先显示类别名称；否则显示 "Class X"
-                                                                    string displayText = !string.IsNullOrEmpty(className)
-                                                                        ? $"{className} ({conf:F2})"
-                                                                        : $"Class {classId} ({conf:F2})";
-                                
-                                                                    detections.Add(new DetectionResult
-                                                                    {
-                                                                        X = d.GetProperty("x").GetDouble(),
-                                                                        Y = d.GetProperty("y").GetDouble(),
-                                                                        Width = d.GetProperty("width").GetDouble(),
-                                                                        Height = d.GetProperty("height").GetDouble(),
-                                                                        ClassId = classId,
-                                                                        Confidence = conf,
-                                                                        DisplayText = displayText,
-                                                                        ClassName = className
-                                                                    });
-                                                                }
-                                                                catch { }                            }
+                                BtnStop_Click(null!, null!);
+                            });
+                            break;
                         }
-                        
-                        Console.WriteLine($"[VIDEO-UI] 检测到 {detections.Count} 个目标，帧大小: {frameBase64.Length} 字符");
+                        else if (type == "control" && !result.GetProperty("success").GetBoolean())
+                        {
+                            Console.WriteLine($"[VIDEO-UI] 控制消息失败: {result.GetProperty("message").GetString()}");
+                        }
+                        continue;
+                    }
+
+                    // 二进制消息：上一条帧信息对应的 JPEG
+                    if (pendingFrame == null)
+                        continue;
+                    var frameInfo = pendingFrame.Value;
+                    pendingFrame = null;
+                    var imageBytes = message.ToArray();
 
-                        // 在UI线程更新显示
-                        await Dispatcher.InvokeAsync(() =>
+                    // 解析检测结果
+                    var detections = new List<DetectionResult>();
+                    if (frameInfo.TryGetProperty("detections", out var detsElement))
+                    {
+                        foreach (var d in detsElement.EnumerateArray())
                         {
                             try
                             {
-                                // 显示视频帧
-                                var imageBytes = Convert.FromBase64String(frameBase64);
-                                using var stream = new MemoryStream(imageBytes);
-                                var bitmapImage = new BitmapImage();
-                                bitmapImage.BeginInit();
-                                bitmapImage.StreamSource = stream;
-                                bitmapImage.CacheOption = BitmapCacheOption.OnLoad;
-                                bitmapImage.EndInit();
-                                bitmapImage.Freeze();
-                                VideoImage.Source = bitmapImage;
-                                
-                                Console.WriteLine($"[VIDEO-UI] 视频帧显示成功: {bitmapImage.PixelWidth}x{bitmapImage.PixelHeight}");
-
-                                // 更新画布大小
-                                if (bitmapImage.PixelWidth > 0 && bitmapImage.PixelHeight > 0)
+                                int classId = d.GetProperty("class_id").GetInt32();
+                                string className = "";
+                                if (d.TryGetProperty("class_name", out var nameElement))
                                 {
-                                    VideoContainer.Width = bitmapImage.PixelWidth;
-                                    VideoContainer.Height = bitmapImage.PixelHeight;
-                                    DetectionCanvas.Width = bitmapImage.PixelWidth;
-                                    DetectionCanvas.Height = bitmapImage.PixelHeight;
+                                    className = nameElement.GetString() ?? "";
                                 }
+                                double conf = d.GetProperty("confidence").GetDouble();
 
-                                // 绘制检测框
-                                DrawDetections(detections, bitmapImage.PixelWidth, bitmapImage.PixelHeight);
+                                // 如果有类别名称，优先显示类别名称；否则显示 "Class X"
+                                string displayText = !string.IsNullOrEmpty(className)
+                                    ? $"{className} ({conf:F2})"
+                                    : $"Class {classId} ({conf:F2})";
 
-                                // 更新检测结果列表
-                                LstDetections.Items.Clear();
-                                foreach (var det in detections)
+                                detections.Add(new DetectionResult
                                 {
-                                    LstDetections.Items.Add(det);
-                                }
+                                    X = d.GetProperty("x").GetDouble(),
+                                    Y = d.GetProperty("y").GetDouble(),
+                                    Width = d.GetProperty("width").GetDouble(),
+                                    Height = d.GetProperty("height").GetDouble(),
+                                    ClassId = classId,
+                                    Confidence = conf,
+                                    DisplayText = displayText,
+                                    ClassName = className
+                                });
+                            }
+                            catch { }
+                        }
+                    }
 
-                                // 更新FPS
-                                _frameCount++;
-                                var elapsed = DateTime.Now - _lastFrameTime;
-                                if (elapsed.TotalSeconds >= 1)
-                                {
-                                    double fps = _frameCount / elapsed.TotalSeconds;
-                                    TxtFPS.Text = $"FPS: {fps:F1}";
-                                    _frameCount = 0;
-                                    _lastFrameTime = DateTime.Now;
-                                }
+                    // 在UI线程更新显示
+                    await Dispatcher.InvokeAsync(() =>
+                    {
+                        try
+                        {
+                            // 显示视频帧
+                            using var stream = new MemoryStream(imageBytes);
+                            var bitmapImage = new BitmapImage();
+                            bitmapImage.BeginInit();
+                            bitmapImage.StreamSource = stream;
+                            bitmapImage.CacheOption = BitmapCacheOption.OnLoad;
+                            bitmapImage.EndInit();
+                            bitmapImage.Freeze();
+                            VideoImage.Source = bitmapImage;
+
+                            // 更新画布大小
+                            if (bitmapImage.PixelWidth > 0 && bitmapImage.PixelHeight > 0)
+                            {
+                                VideoContainer.Width = bitmapImage.PixelWidth;
+                                VideoContainer.Height = bitmapImage.PixelHeight;
+                                DetectionCanvas.Width = bitmapImage.PixelWidth;
+                                DetectionCanvas.Height = bitmapImage.PixelHeight;
                             }
-                            catch (Exception ex)
+
+                            // 绘制检测框
+                            DrawDetections(detections, bitmapImage.PixelWidth, bitmapImage.PixelHeight);
+
+                            // 更新检测结果列表
+                            LstDetections.Items.Clear();
+                            foreach (var det in detections)
                             {
-                                Console.WriteLine($"[VIDEO-UI] UI更新错误: {ex.Message}");
+                                LstDetections.Items.Add(det);
                             }
-                        });
-                    }
-                    catch (TaskCanceledException)
-                    {
-                        break;
-                    }
-                    catch (Exception ex)
-                    {
-                        Console.WriteLine($"[VIDEO-UI] 检测循环错误: {ex.Message}");
-                        await Task.Delay(100, cancellationToken);
-                    }
+
+                            // 更新FPS
+                            _frameCount++;
+                            var elapsed = DateTime.Now - _lastFrameTime;
+                            if (elapsed.TotalSeconds >= 1)
+                            {
+                                double fps = _frameCount / elapsed.TotalSeconds;
+                                TxtFPS.Text = frameInfo.TryGetProperty("latency_ms", out var latency)
+                                    ? $"FPS: {fps:F1}  延迟: {latency.GetDouble():F0} ms"
+                                    : $"FPS: {fps:F1}";
+                                _frameCount = 0;
+                                _lastFrameTime = DateTime.Now;
+                            }
+                        }
+                        catch (Exception ex)
+                        {
+                            Console.WriteLine($"[VIDEO-UI] UI更新错误: {ex.Message}");
+                        }
+                    });
                 }
-                
-                Console.WriteLine("[VIDEO-UI] 检测循环结束");
+
+                Console.WriteLine("[VIDEO-UI] 接收循环结束");
             }
-            catch (TaskCanceledException)
+            catch (OperationCanceledException)
             {
                 Console.WriteLine("[VIDEO-UI] 任务被取消");
             }
@@ -0,0 +1,469 @@
+"""
+标注存储 - 基于 SQLite 的事务性标注存储（替代每张图片一个 JSON 文件）
+
+annotations 表保存每张图片的标注头（宽高、其它字段），shapes 表每个标注框一行并按图片和类别建立索引，
+classes 表维护每个类别的标注数量和图片数量。读写单张图片只涉及该图片的行；类别列表、按类别计数
+以及训练集准备、格式导出等全量操作都通过索引查询完成，不再逐个打开和解析 JSON 文件。
+
+每次写入都在一个事务中完成（不会出现写了一半的标注），并使该图片的版本号加 1。调用方可以传入读取时的
+版本号（expected_version），版本不一致时抛出 AnnotationConflict，避免界面保存与后台批量任务互相覆盖；
+同一张图片的写入还会先获取进程内的图片锁，排队执行而不是在数据库写锁上争抢。
+
+旧版 annotations/*.json 在首次使用时自动导入一次，也可以通过 import_json / export_json 与 JSON 目录互相转换：
+    python annotation_store.py import [目录]
+    python annotation_store.py export [目录]
+"""
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from database import database, Database
+from request_logging import get_logger
+
+logger = get_logger("annotation_store")
+
+BASE_DIR = Path(__file__).parent
+
+# 标注框中有独立列的字段，其余字段原样保存在 extra 中
+SHAPE_FIELDS = ("x", "y", "width", "height", "class_id", "class_name", "confidence",
+                "annotation_type", "angle", "points", "keypoints", "color")
+SHAPE_ALIASES = {"classId": "class_id", "className": "class_name"}
+HEADER_FIELDS = ("image_name", "imageName", "width", "height", "bboxes", "version")
+# 按图片名称分批查询时每批的数量（SQLite 参数个数有上限）
+QUERY_CHUNK = 500
+
+
+def _shape_row(image_name: str, idx: int, bbox: Dict[str, Any]) -> Tuple:
+    bbox = {SHAPE_ALIASES.get(key, key): value for key, value in bbox.items()}
+    extra = {key: value for key, value in bbox.items() if key not in SHAPE_FIELDS}
+    points = bbox.get("points") or []
+    keypoints = bbox.get("keypoints") or []
+    return (
+        image_name, idx,
+        int(bbox.get("class_id") or 0),
+        bbox.get("class_name") or "",
+        bbox.get("annotation_type") or "bbox",
+        float(bbox.get("x") or 0.0), float(bbox.get("y") or 0.0),
+        float(bbox.get("width") or 0.0), float(bbox.get("height") or 0.0),
+        float(bbox.get("angle") or 0.0),
+        float(bbox.get("confidence") or 0.0),
+        json.dumps(points) if points else None,
+        json.dumps(keypoints) if keypoints else None,
+        bbox.get("color"),
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+def _shape_dict(row) -> Dict[str, Any]:
+    bbox = {
+        "x": row["x"],
+        "y": row["y"],
+        "width": row["width"],
+        "height": row["height"],
+        "class_id": row["class_id"],
+        "class_name": row["class_name"],
+        "confidence": row["confidence"],
+        "annotation_type": row["annotation_type"],
+        "angle": row["angle"],
+        "points": json.loads(row["points"]) if row["points"] else [],
+        "keypoints": json.loads(row["keypoints"]) if row["keypoints"] else [],
+        "color": row["color"],
+    }
+    if row["extra"]:
+        bbox.update(json.loads(row["extra"]))
+    return bbox
+
+
+def _class_counts(bboxes: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """类别 -> 数量（忽略空类别名称，与训练集准备的规则一致）"""
+    counts: Dict[str, int] = {}
+    for bbox in bboxes:
+        class_name = (bbox.get("class_name") or bbox.get("className") or "").strip()
+        if class_name:
+            counts[class_name] = counts.get(class_name, 0) + 1
+    return counts
+
+
+def _write_file_atomic(path: Path, text: str):
+    """写入临时文件并 fsync 后重命名，进程崩溃或断电时不会留下截断的文件"""
+    tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class AnnotationConflict(Exception):
+    """保存时的版本号与当前版本不一致（标注已被其他人或后台任务修改）"""
+
+    def __init__(self, image_name: str, expected_version: int, current_version: int):
+        super().__init__(f"标注已被修改: {image_name}（请求版本 {expected_version}，当前版本 {current_version}）")
+        self.image_name = image_name
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+class AnnotationStore:
+    """标注存储"""
+
+    def __init__(self, annotations_dir: Path, db: Database = database):
+        self.annotations_dir = Path(annotations_dir)
+        self.db = db
+        self._import_lock = threading.Lock()
+        self._ready = False
+        # 图片名称 -> [锁, 等待和持有的数量]，没有人使用时删除
+        self._image_locks: Dict[str, list] = {}
+        self._image_locks_guard = threading.Lock()
+
+    def _ensure_ready(self):
+        """首次使用时导入旧版 JSON 标注（只执行一次，结果记录在 meta 表中）"""
+        if self._ready:
+            return
+        with self._import_lock:
+            if self._ready:
+                return
+            if self.db.get_meta("annotations_json_imported") is None:
+                summary = self.import_json(self.annotations_dir, overwrite=False)
+                self.db.set_meta("annotations_json_imported", str(time.time()))
+                if summary["imported"]:
+                    logger.info(f"已从 {self.annotations_dir} 导入旧版标注: {summary}")
+            self._ready = True
+
+    # ==================== 图片锁 ====================
+
+    @contextmanager
+    def lock(self, *image_names: str) -> Iterator[None]:
+        """
+        持有指定图片的写锁（线程安全，多张图片按名称顺序加锁，避免死锁）
+
+        asyncio 代码通过 asyncio.to_thread 调用写方法即可，不要在事件循环线程中直接等待锁。
+        """
+        names = sorted(set(image_names))
+        with self._image_locks_guard:
+            entries = []
+            for name in names:
+                entry = self._image_locks.setdefault(name, [threading.Lock(), 0])
+                entry[1] += 1
+                entries.append((name, entry))
+        acquired = []
+        try:
+            for _, entry in entries:
+                entry[0].acquire()
+                acquired.append(entry[0])
+            yield
+        finally:
+            for image_lock in reversed(acquired):
+                image_lock.release()
+            with self._image_locks_guard:
+                for name, entry in entries:
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._image_locks[name]
+
+    # ==================== 写入 ====================
+
+    def _write(self, conn, image_name: str, document: Dict[str, Any], expected_version: Optional[int] = None) -> int:
+        """
+        在调用方的事务中写入一张图片的完整标注，返回新的版本号
+
+        Args:
+            expected_version: 读取时的版本号（没有标注的图片为 0），与当前版本不一致时抛出 AnnotationConflict；None 不校验
+        """
+        bboxes = list(document.get("bboxes") or [])
+        extra = {key: value for key, value in document.items() if key not in HEADER_FIELDS}
+        row = conn.execute("SELECT version FROM annotations WHERE image_name = ?", (image_name,)).fetchone()
+        current_version = row[0] if row else 0
+        if expected_version is not None and expected_version != current_version:
+            raise AnnotationConflict(image_name, expected_version, current_version)
+        old_classes = self._image_classes(conn, image_name)
+
+        conn.execute(
+            """INSERT INTO annotations (image_name, width, height, shape_count, extra, updated_at, version)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(image_name) DO UPDATE SET width = excluded.width, height = excluded.height,
+                   shape_count = excluded.shape_count, extra = excluded.extra, updated_at = excluded.updated_at,
+                   version = excluded.version""",
+            (image_name, document.get("width"), document.get("height"), len(bboxes),
+             json.dumps(extra, ensure_ascii=False) if extra else None, time.time(), current_version + 1))
+        conn.execute("DELETE FROM shapes WHERE image_name = ?", (image_name,))
+        conn.executemany(
+            """INSERT INTO shapes (image_name, idx, class_id, class_name, annotation_type, x, y, width, height,
+                                   angle, confidence, points, keypoints, color, extra)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [_shape_row(image_name, idx, bbox) for idx, bbox in enumerate(bboxes)])
+
+        counts = _class_counts(bboxes)
+        self._write_image_classes(conn, image_name, counts, old_classes)
+        return current_version + 1
+
+    @staticmethod
+    def _image_classes(conn, image_name: str) -> Dict[str, int]:
+        return {row[0]: row[1] for row in conn.execute(
+            "SELECT class_name, count FROM image_classes WHERE image_name = ?", (image_name,))}
+
+    @staticmethod
+    def _write_image_classes(conn, image_name: str, counts: Dict[str, int], old_classes: Dict[str, int]):
+        """更新图片目录索引中的标注统计，并按差值更新受影响类别的计数（不重新统计整个类别）"""
+        conn.execute("DELETE FROM image_classes WHERE image_name = ?", (image_name,))
+        conn.executemany("INSERT INTO image_classes (image_name, class_name, count) VALUES (?, ?, ?)",
+                         [(image_name, name, count) for name, count in counts.items()])
+        conn.execute("UPDATE images SET annotation_count = ? WHERE name = ?", (sum(counts.values()), image_name))
+        for class_name in set(old_classes) | set(counts):
+            shape_delta = counts.get(class_name, 0) - old_classes.get(class_name, 0)
+            image_delta = (class_name in counts) - (class_name in old_classes)
+            if not shape_delta and not image_delta:
+                continue
+            conn.execute(
+                """INSERT INTO classes (name, shape_count, image_count) VALUES (?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET shape_count = shape_count + excluded.shape_count,
+                       image_count = image_count + excluded.image_count""",
+                (class_name, shape_delta, image_delta))
+            conn.execute("DELETE FROM classes WHERE name = ? AND shape_count <= 0", (class_name,))
+
+    def save(self, image_name: str, document: Dict[str, Any], expected_version: Optional[int] = None) -> int:
+        """
+        保存一张图片的完整标注（替换原有标注框），返回新的版本号
+
+        Args:
+            image_name: 图片名称
+            document: {"image_name", "width", "height", "bboxes": [...], 其它字段原样保存}
+            expected_version: 读取时的版本号，不一致时抛出 AnnotationConflict；None 表示直接覆盖
+        """
+        self._ensure_ready()
+        with self.lock(image_name), self.db.transaction() as conn:
+            return self._write(conn, image_name, document, expected_version)
+
+    def save_many(self, documents: Dict[str, Dict[str, Any]],
+                  expected_versions: Optional[Dict[str, int]] = None) -> int:
+        """
+        在一个事务中保存多张图片的标注（任何一张失败或版本冲突时全部回滚），返回写入的图片数
+
+        Args:
+            expected_versions: 图片名称 -> 读取时的版本号，只校验其中列出的图片
+        """
+        self._ensure_ready()
+        expected_versions = expected_versions or {}
+        with self.lock(*documents), self.db.transaction() as conn:
+            for image_name, document in documents.items():
+                self._write(conn, image_name, document, expected_versions.get(image_name))
+        return len(documents)
+
+    def append(self, image_name: str, bboxes: List[Dict[str, Any]], width: Optional[int] = None,
+               height: Optional[int] = None) -> int:
+        """在已有标注后追加标注框（批量检测任务使用），返回追加后的标注框数量"""
+        self._ensure_ready()
+        with self.lock(image_name), self.db.transaction() as conn:
+            document = self._read(conn, image_name) or {"image_name": image_name, "bboxes": []}
+            if width is not None and not document.get("width"):
+                document["width"], document["height"] = width, height
+            document["bboxes"] = list(document.get("bboxes", [])) + list(bboxes)
+            self._write(conn, image_name, document)
+            return len(document["bboxes"])
+
+    def delete(self, image_name: str) -> bool:
+        self._ensure_ready()
+        with self.lock(image_name), self.db.transaction() as conn:
+            old_classes = self._image_classes(conn, image_name)
+            conn.execute("DELETE FROM shapes WHERE image_name = ?", (image_name,))
+            deleted = conn.execute("DELETE FROM annotations WHERE image_name = ?", (image_name,)).rowcount
+            self._write_image_classes(conn, image_name, {}, old_classes)
+        return deleted > 0
+
+    # ==================== 读取 ====================
+
+    @staticmethod
+    def _document(header, shapes: List[Dict[str, Any]]) -> Dict[str, Any]:
+        document: Dict[str, Any] = {"image_name": header["image_name"]}
+        # 没有记录宽高的标注（例如旧版批量检测生成的）不返回这两个字段，与原 JSON 文件一致
+        if header["width"] is not None:
+            document["width"] = header["width"]
+        if header["height"] is not None:
+            document["height"] = header["height"]
+        document["bboxes"] = shapes
+        if header["extra"]:
+            document.update(json.loads(header["extra"]))
+        document["version"] = header["version"]
+        return document
+
+    def _read(self, conn, image_name: str) -> Optional[Dict[str, Any]]:
+        header = conn.execute("SELECT * FROM annotations WHERE image_name = ?", (image_name,)).fetchone()
+        if header is None:
+            return None
+        shapes = [_shape_dict(row) for row in conn.execute(
+            "SELECT * FROM shapes WHERE image_name = ? ORDER BY idx", (image_name,))]
+        return self._document(header, shapes)
+
+    def get(self, image_name: str) -> Optional[Dict[str, Any]]:
+        """读取一张图片的标注，没有标注时返回 None"""
+        self._ensure_ready()
+        return self._read(self.db.connection(), image_name)
+
+    def iter_documents(self, image_names: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        按图片名称顺序遍历标注 (image_name, document)
+
+        每批图片的标注头和标注框各用一次查询读取，全量遍历时不会把所有标注同时载入内存。
+        每批都在当前线程的连接上读取完毕后再产出，生成器可以被 StreamingResponse 在不同的线程中继续迭代。
+        """
+        self._ensure_ready()
+        if image_names is None:
+            names = self.image_names()
+        else:
+            names = list(image_names)
+        for start in range(0, len(names), QUERY_CHUNK):
+            chunk = names[start:start + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            conn = self.db.connection()
+            headers = {row["image_name"]: row for row in conn.execute(
+                f"SELECT * FROM annotations WHERE image_name IN ({placeholders})", chunk)}
+            shapes: Dict[str, List[Dict[str, Any]]] = {}
+            for row in conn.execute(
+                    f"SELECT * FROM shapes WHERE image_name IN ({placeholders}) ORDER BY image_name, idx", chunk):
+                shapes.setdefault(row["image_name"], []).append(_shape_dict(row))
+            documents = [(name, self._document(headers[name], shapes.get(name, []))) for name in chunk if name in headers]
+            yield from documents
+
+    def image_names(self, class_name: Optional[str] = None) -> List[str]:
+        """有标注记录的图片名称，指定 class_name 时只返回包含该类别的图片"""
+        self._ensure_ready()
+        conn = self.db.connection()
+        if class_name:
+            return [row[0] for row in conn.execute(
+                "SELECT image_name FROM image_classes WHERE class_name = ? ORDER BY image_name", (class_name,))]
+        return [row[0] for row in conn.execute("SELECT image_name FROM annotations ORDER BY image_name")]
+
+    def image_class_map(self) -> Dict[str, List[str]]:
+        """每张已标注图片包含的类别（没有标注框的图片对应空列表），只读类别汇总表，不读取标注框"""
+        self._ensure_ready()
+        conn = self.db.connection()
+        result: Dict[str, List[str]] = {name: [] for name in self.image_names()}
+        for image_name, class_name in conn.execute(
+                "SELECT image_name, class_name FROM image_classes ORDER BY image_name, class_name"):
+            if image_name in result:
+                result[image_name].append(class_name)
+        return result
+
+    def fingerprint(self) -> List[Any]:
+        """
+        标注和对应图片的汇总（数量、版本号之和、最后修改时间、图片大小和修改时间）
+
+        任何一张图片的标注被修改、增删，或者已标注的图片文件被替换，结果都会变化；用于判断派生数据（训练集）是否需要重建。
+        """
+        self._ensure_ready()
+        conn = self.db.connection()
+        annotations = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(version), 0), COALESCE(MAX(updated_at), 0) FROM annotations").fetchone()
+        images = conn.execute(
+            """SELECT COUNT(*), COALESCE(SUM(i.size), 0), COALESCE(MAX(i.mtime_ns), 0)
+               FROM annotations a JOIN images i ON i.name = a.image_name""").fetchone()
+        return [*annotations, *images]
+
+    def count(self) -> int:
+        self._ensure_ready()
+        return self.db.connection().execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+
+    def class_names(self) -> List[str]:
+        """所有类别名称（按字母排序）"""
+        self._ensure_ready()
+        return [row[0] for row in self.db.connection().execute("SELECT name FROM classes ORDER BY name")]
+
+    def class_counts(self) -> Dict[str, Dict[str, int]]:
+        """每个类别的标注框数量和图片数量"""
+        self._ensure_ready()
+        return {row["name"]: {"annotations": row["shape_count"], "images": row["image_count"]}
+                for row in self.db.connection().execute("SELECT * FROM classes ORDER BY name")}
+
+    def stats(self) -> Dict[str, Any]:
+        self._ensure_ready()
+        conn = self.db.connection()
+        return {
+            "annotated_images": conn.execute("SELECT COUNT(*) FROM annotations").fetchone()[0],
+            "shapes": conn.execute("SELECT COUNT(*) FROM shapes").fetchone()[0],
+            "classes": conn.execute("SELECT COUNT(*) FROM classes").fetchone()[0],
+            "database": str(self.db.path),
+        }
+
+    # ==================== JSON 导入导出 ====================
+
+    def import_json(self, directory: Optional[Path] = None, overwrite: bool = False, job=None) -> Dict[str, int]:
+        """
+        从 JSON 目录（每张图片一个 <图片名>.json）导入标注
+
+        Args:
+            directory: JSON 目录，默认 annotations 目录
+            overwrite: 是否覆盖数据库中已有的标注
+            job: jobs.Job，作为后台任务运行时上报进度
+        """
+        directory = Path(directory or self.annotations_dir)
+        files = sorted(directory.glob("*.json")) if directory.exists() else []
+        if job is not None:
+            job.update(total=len(files))
+        conn = self.db.connection()
+        existing = set() if overwrite else {row[0] for row in conn.execute("SELECT image_name FROM annotations")}
+
+        imported = skipped = failed = 0
+        for start in range(0, len(files), QUERY_CHUNK):
+            documents = {}
+            for ann_file in files[start:start + QUERY_CHUNK]:
+                image_name = ann_file.name[:-len(".json")]
+                if image_name in existing:
+                    skipped += 1
+                    continue
+                try:
+                    with ann_file.open("r", encoding="utf-8") as f:
+                        documents[image_name] = json.load(f)
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"读取标注文件失败 {ann_file.name}: {e}")
+            with self.lock(*documents), self.db.transaction() as conn:
+                for image_name, document in documents.items():
+                    self._write(conn, image_name, document)
+            imported += len(documents)
+            if job is not None:
+                job.update(done=min(start + QUERY_CHUNK, len(files)), failed=failed)
+                job.check_cancelled()
+        return {"files": len(files), "imported": imported, "skipped": skipped, "failed": failed}
+
+    def export_json(self, directory: Optional[Path] = None, job=None) -> Dict[str, int]:
+        """将所有标注导出为 JSON 目录（与旧版 annotations 目录格式相同）"""
+        directory = Path(directory or self.annotations_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        if job is not None:
+            job.update(total=self.count())
+        exported = 0
+        for image_name, document in self.iter_documents():
+            document.pop("version", None)
+            _write_file_atomic(directory / f"{image_name}.json", json.dumps(document, indent=2, ensure_ascii=False))
+            exported += 1
+            if job is not None and exported % QUERY_CHUNK == 0:
+                job.update(done=exported)
+                job.check_cancelled()
+        if job is not None:
+            job.update(done=exported)
+        return {"exported": exported, "directory": str(directory)}
+
+
+# 全局标注存储（旧版 JSON 目录与 main.ANNOTATIONS_DIR 相同）
+annotation_store = AnnotationStore(BASE_DIR / "annotations")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("import", "export"):
+        print("用法: python annotation_store.py import|export [目录]")
+        sys.exit(1)
+    target = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+    if sys.argv[1] == "import":
+        annotation_store._ready = True  # 显式导入，跳过自动导入
+        print(annotation_store.import_json(target, overwrite=True))
+    else:
+        print(annotation_store.export_json(target))
@@ -4,22 +4,33 @@ API 扩展 - 模型管理和批量推理相关的 API 端点
 from fastapi import BackgroundTasks
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-import json
 import cv2
 import asyncio
 
-# from models.model_manager import model_manager
-# 注意：model_manager 模块暂未实现，相关功能将被禁用
 from main import BASE_DIR, IMAGES_DIR, ANNOTATIONS_DIR
+from model_manager import model_manager
+from inference_executor import inference_executor, InferenceBusyError
+from micro_batcher import micro_batcher
+import inference_backends
+from model_index import model_index
+from annotation_store import annotation_store
+from request_logging import get_logger
+
+logger = get_logger("extensions")
 
 
 # ==================== 模型管理 API ====================
 
 async def get_available_models(task_type: Optional[str] = None):
-    """获取可用模型列表"""
+    """获取可用模型列表（内置模型目录 + 训练得到的模型）"""
     try:
         models = model_manager.get_available_models(task_type)
-        return {"success": True, "models": models}
+        return {
+            "success": True,
+            "models": models,
+            "trained_models": model_index.list_runs(),
+            "active_model": model_index.active_info()
+        }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -34,10 +45,10 @@ async def get_model_info(model_name: str):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-async def load_model_api(model_name: str, device: str = "cpu"):
-    """加载模型"""
+async def load_model_api(model_name: str, device: str = "cpu", precision: str = "fp32"):
+    """加载模型（常驻缓存，直到显式卸载）"""
     try:
-        model = await model_manager.load_model(model_name, device)
+        model = await model_manager.load_model(model_name, device, precision, pin=True)
         if model:
             return {"success": True, "message": f"模型 {model_name} 加载成功"}
         else:
@@ -48,7 +59,9 @@ async def load_model_api(model_name: str, device: str = "cpu"):
 async def unload_model_api(model_name: str):
     """卸载模型"""
     try:
-        model_manager.unload_model(model_name)
+        count = model_manager.unload_model(model_name)
+        if count == 0:
+            return {"success": False, "error": f"模型 {model_name} 未加载"}
         return {"success": True, "message": f"模型 {model_name} 已卸载"}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -56,8 +69,8 @@ async def unload_model_api(model_name: str):
 async def preload_models_api(device: str = "cpu"):
     """预加载标记为预加载的模型"""
     try:
-        await model_manager.preload_models(device)
-        return {"success": True, "message": "模型预加载完成"}
+        loaded = await model_manager.preload_models(device)
+        return {"success": True, "message": "模型预加载完成", "models": loaded}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -69,6 +82,31 @@ async def unload_all_models_api():
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+async def get_model_cache_info():
+    """获取模型缓存状态"""
+    return model_manager.cache_info()
+
+async def get_inference_status():
+    """获取推理执行器状态（队列深度、并发数、平均等待/执行时间）"""
+    return inference_executor.status()
+
+async def get_backend_status():
+    """获取推理后端状态（可用的运行时、调优参数、各后端的调用次数和每张图片耗时）"""
+    return inference_backends.status()
+
+class BatchingConfigRequest(BaseModel):
+    window_ms: Optional[float] = Field(None, ge=0, le=1000, description="收集窗口（毫秒）")
+    max_batch_size: Optional[int] = Field(None, ge=1, le=256, description="单个批次的最大图片数")
+
+async def get_batching_status():
+    """获取动态批处理配置与指标（实际批次大小、排队增加的延迟）"""
+    return micro_batcher.status()
+
+async def update_batching_config(request: BatchingConfigRequest):
+    """调整动态批处理的收集窗口和最大批次大小"""
+    micro_batcher.configure(window_ms=request.window_ms, max_batch_size=request.max_batch_size)
+    return {"success": True, **micro_batcher.status()}
+
 
 # ==================== 批量推理 API ====================
 
@@ -102,84 +140,48 @@ async def batch_detect(request: BatchDetectRequest, background_tasks: Background
 def _run_batch_detection(image_names: List[str], model_name: str, conf_threshold: float, 
                          iou_threshold: float, device: str):
     """执行批量检测（后台任务）"""
+    model = None
     try:
-        print(f"[BATCH] 开始批量检测，模型: {model_name}, 图片数量: {len(image_names)}")
+        logger.info(f"开始批量检测，模型: {model_name}, 图片数量: {len(image_names)}")
         
-        # 加载模型
-        model = asyncio.run(model_manager.load_model(model_name, device))
+        # 加载模型（与在线推理共享同一个缓存），整个批次期间持有引用，避免被淘汰
+        model = model_manager.acquire_by_name(model_name, device)
         if not model:
-            print(f"[BATCH] 模型加载失败: {model_name}")
+            logger.error(f"批量检测模型加载失败: {model_name}")
             return
         
         # 逐张检测
-        for i, image_name in enumerate(image_names):
+        for image_name in image_names:
             try:
-                print(f"[BATCH] 处理图片 {i+1}/{len(image_names)}: {image_name}")
-                
                 # 读取图片
                 image_path = IMAGES_DIR / image_name
                 if not image_path.exists():
-                    print(f"[BATCH] 图片不存在: {image_path}")
+                    logger.warning(f"图片不存在: {image_path}")
                     continue
                 
                 image = cv2.imread(str(image_path))
                 if image is None:
-                    print(f"[BATCH] 图片读取失败: {image_name}")
+                    logger.warning(f"图片读取失败: {image_name}")
                     continue
                 
                 # 执行检测
                 result = model.predict(image, conf_threshold=conf_threshold, iou_threshold=iou_threshold)
                 detections = result.get("detections", [])
                 
-                print(f"[BATCH] 检测到 {len(detections)} 个目标")
-                
-                # 保存检测结果到标注文件
-                annotation_path = ANNOTATIONS_DIR / f"{image_name}.json"
-                
-                # 读取现有标注（如果存在）
-                if annotation_path.exists():
-                    with annotation_path.open("r", encoding="utf-8") as f:
-                        annotation_data = json.load(f)
-                else:
-                    annotation_data = {
-                        "version": "5.5.0",
-                        "shapes": [],
-                        "image_name": image_name,
-                        "width": image.shape[1],
-                        "height": image.shape[0]
-                    }
-                
-                # 添加检测结果
-                for det in detections:
-                    annotation_data["shapes"].append({
-                        "label": det.get("class_name", "unknown"),
-                        "score": det.get("confidence", 0.0),
-                        "points": det.get("points", []),
-                        "group_id": None,
-                        "description": None,
-                        "difficult": False,
-                        "shape_type": det.get("annotation_type", "bbox"),
-                        "flags": None,
-                        "attributes": {}
-                    })
-                
-                # 保存标注
-                with annotation_path.open("w", encoding="utf-8") as f:
-                    json.dump(annotation_data, f, indent=2, ensure_ascii=False)
-                
-                print(f"[BATCH] 标注已保存: {annotation_path}")
+                # 追加检测结果到标注存储（与 /api/annotations 使用相同的 bboxes 格式）
+                shape_count = annotation_store.append(image_name, detections, image.shape[1], image.shape[0])
+                logger.debug("批量检测标注已保存", extra={"fields": {"image_name": image_name, "detections": len(detections), "bboxes": shape_count}})
                 
             except Exception as e:
-                print(f"[BATCH] 处理图片失败 {image_name}: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception(f"处理图片失败 {image_name}: {e}")
         
-        print(f"[BATCH] 批量检测完成")
+        logger.info(f"批量检测完成: {len(image_names)} 张图片")
         
     except Exception as e:
-        print(f"[BATCH] 批量检测失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"批量检测失败: {e}")
+    finally:
+        if model is not None:
+            model_manager.release(model)
 
 
 # ==================== AI 标注 API ====================
@@ -192,11 +194,10 @@ class AIAnnotationRequest(BaseModel):
 
 async def ai_annotate(request: AIAnnotationRequest):
     """AI标注 - 单张图片"""
+    model = None
     try:
-        print(f"[AI_ANNOTATE] 开始AI标注，模型: {request.model_name}, 图片: {request.image_path}")
-        
         # 加载模型
-        model = await model_manager.load_model(request.model_name)
+        model = await model_manager.acquire_model(request.model_name)
         if not model:
             return {"success": False, "error": f"模型加载失败: {request.model_name}"}
         
@@ -210,27 +211,32 @@ async def ai_annotate(request: AIAnnotationRequest):
             return {"success": False, "error": "图片读取失败"}
         
         # 执行检测
-        result = model.predict(
+        result = await inference_executor.run(
+            model.predict,
             image,
             conf_threshold=request.conf_threshold,
-            iou_threshold=request.iou_threshold
+            iou_threshold=request.iou_threshold,
+            model_key=model.name
         )
         
         # 提取检测结果
         detections = result.get("detections", [])
         
-        print(f"[AI_ANNOTATE] 检测到 {len(detections)} 个目标")
+        logger.debug("AI标注完成", extra={"fields": {"model": request.model_name, "image": request.image_path, "detections": len(detections)}})
         
         return {
             "success": True,
             "annotations": detections,
             "count": len(detections)
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
-        print(f"[AI_ANNOTATE] AI标注失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"AI标注失败: {e}")
         return {"success": False, "error": str(e)}
+    finally:
+        if model is not None:
+            model_manager.release(model)
 
 
 # ==================== OCR 识别 API ====================
@@ -242,9 +248,10 @@ class OCRRequest(BaseModel):
 
 async def ocr_detect(request: OCRRequest):
     """OCR 文字识别"""
+    model = None
     try:
         # 加载 OCR 模型
-        model = await model_manager.load_model(request.model_name, request.device)
+        model = await model_manager.acquire_model(request.model_name, request.device)
         if not model:
             return {"success": False, "error": f"OCR 模型加载失败: {request.model_name}"}
         
@@ -258,15 +265,20 @@ async def ocr_detect(request: OCRRequest):
             return {"success": False, "error": "图片读取失败"}
         
         # 执行 OCR 识别
-        result = model.predict(image)
+        result = await inference_executor.run(model.predict, image, model_key=model.name)
         
         return {
             "success": True,
             "detections": result.get("detections", []),
             "texts": result.get("texts", [])
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return {"success": False, "error": str(e)}
+    finally:
+        if model is not None:
+            model_manager.release(model)
 
 
 # ==================== SAM 分割 API ====================
@@ -314,11 +326,10 @@ async def sam_segment(request: SAMRequest):
         ]
     }
     """
+    model = None
     try:
-        print(f"[SAM] 开始分割，图片: {request.image_name}, 模型: {request.model_name}")
-        
         # 加载 SAM 模型
-        model = await model_manager.load_model(request.model_name, request.device)
+        model = await model_manager.acquire_model(request.model_name, request.device)
         if not model:
             return {"success": False, "error": f"SAM 模型加载失败: {request.model_name}"}
         
@@ -347,19 +358,20 @@ async def sam_segment(request: SAMRequest):
                     prompt_data["x2"] = prompt.x2
                     prompt_data["y2"] = prompt.y2
                 prompts_dict.append(prompt_data)
-            
-            print(f"[SAM] 提示词: {prompts_dict}")
         
         # 执行分割
-        result = model.predict(
-            image, 
-            prompts=prompts_dict, 
+        result = await inference_executor.run(
+            model.predict,
+            image,
+            prompts=prompts_dict,
             auto_segment=request.auto_segment,
-            multimask_output=request.multimask_output
+            multimask_output=request.multimask_output,
+            model_key=model.name
         )
         
         detections = result.get("detections", [])
-        print(f"[SAM] 分割完成，生成 {len(detections)} 个掩码")
+        logger.debug("SAM 分割完成", extra={"fields": {"image_name": request.image_name, "model": request.model_name,
+                                                 "prompts": len(prompts_dict or []), "masks": len(detections)}})
         
         return {
             "success": True,
@@ -367,11 +379,14 @@ async def sam_segment(request: SAMRequest):
             "count": len(detections),
             "task_type": "segmentation"
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
-        print(f"[SAM] 分割失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"SAM 分割失败: {e}")
         return {"success": False, "error": str(e)}
+    finally:
+        if model is not None:
+            model_manager.release(model)
 
 
 # ==================== RT-DETR 检测 API ====================
@@ -385,9 +400,10 @@ class RTDETRDetectRequest(BaseModel):
 
 async def rtdetr_detect(request: RTDETRDetectRequest):
     """RT-DETR 目标检测"""
+    model = None
     try:
         # 加载 RT-DETR 模型
-        model = await model_manager.load_model(request.model_name, request.device)
+        model = await model_manager.acquire_model(request.model_name, request.device)
         if not model:
             return {"success": False, "error": f"RT-DETR 模型加载失败: {request.model_name}"}
         
@@ -401,14 +417,23 @@ async def rtdetr_detect(request: RTDETRDetectRequest):
             return {"success": False, "error": "图片读取失败"}
         
         # 执行检测
-        result = model.predict(image, conf_threshold=request.conf_threshold, iou_threshold=request.iou_threshold)
+        result = await inference_executor.run(
+            model.predict, image,
+            conf_threshold=request.conf_threshold, iou_threshold=request.iou_threshold,
+            model_key=model.name
+        )
         
         return {
             "success": True,
             "detections": result.get("detections", [])
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return {"success": False, "error": str(e)}
+    finally:
+        if model is not None:
+            model_manager.release(model)
 
 
 # ==================== 格式导出 API ====================
@@ -429,7 +454,7 @@ async def export_annotations(request: ExportRequest, background_tasks: Backgroun
             background_tasks.add_task(
                 export_all_formats,
                 IMAGES_DIR,
-                ANNOTATIONS_DIR,
+                annotation_store,
                 output_dir
             )
             return {
@@ -439,7 +464,7 @@ async def export_annotations(request: ExportRequest, background_tasks: Backgroun
             }
         else:
             # 导出指定格式
-            exporter = AnnotationExporter(IMAGES_DIR, ANNOTATIONS_DIR, output_dir)
+            exporter = AnnotationExporter(IMAGES_DIR, annotation_store, output_dir)
             
             if request.format == "yolo":
                 exporter.export_yolo(request.subset)
@@ -472,9 +497,10 @@ class ClassificationRequest(BaseModel):
 
 async def classify_image(request: ClassificationRequest):
     """图像分类"""
+    model = None
     try:
         # 加载分类模型
-        model = await model_manager.load_model(request.model_name, request.device)
+        model = await model_manager.acquire_model(request.model_name, request.device)
         if not model:
             return {"success": False, "error": f"分类模型加载失败: {request.model_name}"}
         
@@ -488,15 +514,20 @@ async def classify_image(request: ClassificationRequest):
             return {"success": False, "error": "图片读取失败"}
         
         # 执行分类
-        result = model.predict(image, top_k=request.top_k)
+        result = await inference_executor.run(model.predict, image, top_k=request.top_k, model_key=model.name)
         
         return {
             "success": True,
             "predictions": result.get("predictions", []),
             "class_names": result.get("class_names", [])
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return {"success": False, "error": str(e)}
+    finally:
+        if model is not None:
+            model_manager.release(model)
 
 
 # ==================== 跟踪 API ====================
@@ -510,9 +541,10 @@ class TrackingRequest(BaseModel):
 
 async def track_objects(request: TrackingRequest):
     """目标跟踪"""
+    tracker = None
     try:
         # 加载跟踪器
-        tracker = await model_manager.load_model(request.tracker_name, request.device)
+        tracker = await model_manager.acquire_model(request.tracker_name, request.device)
         if not tracker:
             return {"success": False, "error": f"跟踪器加载失败: {request.tracker_name}"}
         
@@ -530,14 +562,19 @@ async def track_objects(request: TrackingRequest):
             return {"success": False, "error": "图片读取失败"}
         
         # 更新跟踪
-        tracked_results = tracker.update(image, request.detections)
+        tracked_results = await inference_executor.run(tracker.update, image, request.detections, model_key=tracker.name)
 
         return {
             "success": True,
             "tracked_objects": tracked_results
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return {"success": False, "error": str(e)}
+    finally:
+        if tracker is not None:
+            model_manager.release(tracker)
 
 
 # ==================== GroundingDINO 文本提示检测 API ====================
@@ -576,12 +613,14 @@ async def grounding_dino_detect(request: GroundingDINORequest):
         image = Image.open(image_path).convert("RGB")
         
         # 执行检测
-        results = detect_with_text(
+        results = await inference_executor.run(
+            detect_with_text,
             image=image,
             text_prompt=request.text_prompt,
             model_name=request.model_name,
             box_threshold=request.box_threshold,
-            text_threshold=request.text_threshold
+            text_threshold=request.text_threshold,
+            model_key=request.model_name
         )
         
         # 转换结果格式为标注格式
@@ -616,6 +655,8 @@ async def grounding_dino_detect(request: GroundingDINORequest):
             "success": False,
             "error": "GroundingDINO 未安装，请运行: pip install groundingdino-py"
         }
+    except InferenceBusyError:
+        raise
     except Exception as e:
         import traceback
         return {
@@ -670,11 +711,13 @@ async def batch_grounding_dino_detect(request: BatchGroundingDINORequest):
                 image = Image.open(image_path).convert("RGB")
                 
                 # 执行检测
-                detections = model.predict(
+                detections = await inference_executor.run(
+                    model.predict,
                     image=image,
                     text_prompt=request.text_prompt,
                     box_threshold=request.box_threshold,
-                    text_threshold=request.text_threshold
+                    text_threshold=request.text_threshold,
+                    model_key=request.model_name
                 )
                 
                 # 转换结果格式
@@ -698,24 +741,8 @@ async def batch_grounding_dino_detect(request: BatchGroundingDINORequest):
                 
                 # 保存标注
                 if request.save_annotations and bboxes:
-                    annotation_path = ANNOTATIONS_DIR / f"{os.path.splitext(image_name)[0]}.json"
-                    
-                    # 读取现有标注
-                    if os.path.exists(annotation_path):
-                        with open(annotation_path, 'r', encoding='utf-8') as f:
-                            annotation_data = json.load(f)
-                    else:
-                        annotation_data = {
-                            "image_name": image_name,
-                            "bboxes": []
-                        }
-                    
-                    # 添加新标注
-                    annotation_data["bboxes"].extend(bboxes)
-                    
-                    # 保存
-                    with open(annotation_path, 'w', encoding='utf-8') as f:
-                        json.dump(annotation_data, f, ensure_ascii=False, indent=2)
+                    # 追加到已有标注
+                    await asyncio.to_thread(annotation_store.append, image_name, bboxes, image.width, image.height)
                 
                 results.append({
                     "image_name": image_name,
@@ -725,6 +752,8 @@ async def batch_grounding_dino_detect(request: BatchGroundingDINORequest):
                 })
                 success_count += 1
                 
+            except InferenceBusyError:
+                raise
             except Exception as e:
                 results.append({
                     "image_name": image_name,
@@ -740,6 +769,8 @@ async def batch_grounding_dino_detect(request: BatchGroundingDINORequest):
             "prompt": request.text_prompt
         }
         
+    except InferenceBusyError:
+        raise
     except Exception as e:
         import traceback
         return {
@@ -0,0 +1,112 @@
+"""
+批量推理引擎 - 预取解码 + 固定大小批次推理
+
+图片在线程池中提前解码（每张只解码一次），按 batch_size 组成批次后一次性送入模型，
+ultralytics 会将同一批次的图片 letterbox 到统一的 imgsz 并堆叠为一个张量。
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# 默认批次大小、推理尺寸和预取解码线程数
+DEFAULT_BATCH_SIZE = int(os.environ.get("YOLO_BATCH_SIZE", "8"))
+DEFAULT_IMGSZ = int(os.environ.get("YOLO_BATCH_IMGSZ", "640"))
+PREFETCH_WORKERS = int(os.environ.get("YOLO_PREFETCH_WORKERS", str(min(8, (os.cpu_count() or 4)))))
+
+
+def decode_image(image_path: Path) -> np.ndarray:
+    """
+    解码图片为 BGR 数组
+
+    使用 np.fromfile + cv2.imdecode，避免 cv2.imread 在 Windows 上无法读取中文路径。
+    """
+    data = np.fromfile(str(image_path), dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"图片解码失败: {Path(image_path).name}")
+    return image
+
+
+class BatchInferenceEngine:
+    """批量推理引擎"""
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, imgsz: int = DEFAULT_IMGSZ,
+                 prefetch_workers: int = PREFETCH_WORKERS):
+        """
+        Args:
+            batch_size: 每次前向推理的图片数量
+            imgsz: 统一的推理尺寸（letterbox 后的边长）
+            prefetch_workers: 解码线程数
+        """
+        self.batch_size = max(1, batch_size)
+        self.imgsz = imgsz
+        self.prefetch_workers = max(1, prefetch_workers)
+
+    @staticmethod
+    def _decode(image_path: Path) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        if not Path(image_path).exists():
+            return None, "图片不存在"
+        try:
+            return decode_image(image_path), None
+        except Exception as e:
+            return None, str(e)
+
+    def iter_batches(self, image_paths: Sequence[Path]) -> Iterator[List[Tuple[Path, Optional[np.ndarray], Optional[str]]]]:
+        """
+        按顺序产出解码好的批次，每项为 (路径, 图像, 错误信息)
+
+        解码在线程池中进行，最多提前两个批次，内存占用有上限。
+        """
+        lookahead = self.batch_size * 2
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="decode") as pool:
+            pending = deque()
+            paths = iter(image_paths)
+            batch = []
+
+            def fill():
+                while len(pending) < lookahead:
+                    path = next(paths, None)
+                    if path is None:
+                        return
+                    pending.append((path, pool.submit(self._decode, path)))
+
+            fill()
+            while pending:
+                path, future = pending.popleft()
+                image, error = future.result()
+                batch.append((path, image, error))
+                fill()
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def run(self, model_entry, image_paths: Sequence[Path], **infer_kwargs) -> Iterator[Tuple[Path, Any, Optional[str]]]:
+        """
+        对所有图片执行批量推理，按输入顺序产出 (路径, 推理结果, 错误信息)
+
+        Args:
+            model_entry: model_manager 返回的模型条目
+            image_paths: 图片路径列表
+            infer_kwargs: 透传给模型的推理参数（conf、iou 等）
+        """
+        for batch in self.iter_batches(image_paths):
+            valid = [(index, image) for index, (_, image, error) in enumerate(batch) if error is None]
+            # 解码失败的图片保留在批次中的原位置，推理结果按下标填回，保证输出顺序与输入一致
+            outputs = [(path, None, error) for path, _, error in batch]
+            if valid:
+                try:
+                    results = model_entry.infer([image for _, image in valid], imgsz=self.imgsz, **infer_kwargs)
+                except Exception as e:
+                    for index, _ in valid:
+                        outputs[index] = (batch[index][0], None, f"推理失败: {e}")
+                else:
+                    for (index, _), result in zip(valid, results):
+                        outputs[index] = (batch[index][0], result, None)
+            yield from outputs
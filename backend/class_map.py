@@ -0,0 +1,67 @@
+"""
+类别映射缓存 - data.yaml 中的类别名称
+
+data.yaml 按 (mtime, size) 缓存解析结果，文件未变化时不再重复解析。
+标注中的类别由 annotation_store 的 classes 表维护。
+"""
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from request_logging import get_logger
+
+logger = get_logger("class_map")
+
+
+def _file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def names_to_list(names) -> List[str]:
+    """names 可能是字典 {0: 'cat', 1: 'dog'} 或列表 ['cat', 'dog']，统一为按 ID 排序的列表"""
+    if isinstance(names, dict):
+        return [names[i] for i in sorted(names.keys())]
+    if isinstance(names, list):
+        return list(names)
+    return []
+
+
+class ClassMapCache:
+    """类别映射缓存"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._yaml_cache: Dict[Path, Tuple[Tuple[int, int], List[str]]] = {}
+
+    def dataset_classes(self, data_yaml: Path) -> List[str]:
+        """读取 data.yaml 中的类别列表，文件不存在时返回空列表"""
+        signature = _file_signature(data_yaml)
+        if signature is None:
+            return []
+        with self._lock:
+            cached = self._yaml_cache.get(data_yaml)
+            if cached is not None and cached[0] == signature:
+                return list(cached[1])
+
+        with data_yaml.open("r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        classes = names_to_list(data.get("names", {}))
+        logger.info(f"已解析 {data_yaml.name}: {len(classes)} 个类别")
+
+        with self._lock:
+            self._yaml_cache[data_yaml] = (signature, classes)
+        return list(classes)
+
+    def clear(self):
+        with self._lock:
+            self._yaml_cache.clear()
+
+
+# 全局类别映射缓存
+class_map_cache = ClassMapCache()
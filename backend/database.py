@@ -0,0 +1,192 @@
+"""
+数据库 - 嵌入式 SQLite（WAL 模式）连接与表结构迁移
+
+图片目录索引、标注存储等模块共享同一个数据库文件。每个线程持有自己的连接，
+WAL 模式下读操作不会被写操作阻塞；写事务使用 BEGIN IMMEDIATE，避免并发升级锁时报错。
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List
+
+from request_logging import get_logger
+
+logger = get_logger("database")
+
+BASE_DIR = Path(__file__).parent
+
+DB_PATH = Path(os.environ.get("YOLO_DB_PATH", str(BASE_DIR / "annotator.db")))
+# 写锁冲突时的等待时间（毫秒）
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("YOLO_DB_BUSY_TIMEOUT_MS", "5000"))
+# FULL：每次提交都同步 WAL 到磁盘，断电也不会丢失已提交的标注；NORMAL 只保证进程崩溃时不丢失，写入更快
+DB_SYNCHRONOUS = os.environ.get("YOLO_DB_SYNCHRONOUS", "FULL").upper()
+
+# 表结构迁移，按顺序执行，PRAGMA user_version 记录已执行到的版本
+MIGRATIONS: List[str] = [
+    # 1: 图片目录索引
+    """
+    CREATE TABLE IF NOT EXISTS images (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL DEFAULT 0,
+        width INTEGER,
+        height INTEGER,
+        mtime REAL NOT NULL DEFAULT 0,
+        mtime_ns INTEGER NOT NULL DEFAULT 0,
+        content_hash TEXT,
+        annotation_count INTEGER NOT NULL DEFAULT 0,
+        annotation_mtime_ns INTEGER NOT NULL DEFAULT 0,
+        indexed_at REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_images_mtime ON images (mtime, name);
+    CREATE INDEX IF NOT EXISTS idx_images_size ON images (size, name);
+    CREATE INDEX IF NOT EXISTS idx_images_annotation_count ON images (annotation_count, name);
+    CREATE INDEX IF NOT EXISTS idx_images_hash ON images (content_hash);
+    CREATE TABLE IF NOT EXISTS image_classes (
+        image_name TEXT NOT NULL,
+        class_name TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (image_name, class_name)
+    );
+    CREATE INDEX IF NOT EXISTS idx_image_classes_class ON image_classes (class_name, image_name);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    # 2: 标注存储（标注头、标注框、类别计数）
+    """
+    CREATE TABLE IF NOT EXISTS annotations (
+        image_name TEXT PRIMARY KEY,
+        width INTEGER,
+        height INTEGER,
+        shape_count INTEGER NOT NULL DEFAULT 0,
+        extra TEXT,
+        updated_at REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS shapes (
+        id INTEGER PRIMARY KEY,
+        image_name TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        class_id INTEGER NOT NULL DEFAULT 0,
+        class_name TEXT NOT NULL DEFAULT '',
+        annotation_type TEXT NOT NULL DEFAULT 'bbox',
+        x REAL NOT NULL DEFAULT 0,
+        y REAL NOT NULL DEFAULT 0,
+        width REAL NOT NULL DEFAULT 0,
+        height REAL NOT NULL DEFAULT 0,
+        angle REAL NOT NULL DEFAULT 0,
+        confidence REAL NOT NULL DEFAULT 0,
+        points TEXT,
+        keypoints TEXT,
+        color TEXT,
+        extra TEXT
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_shapes_image ON shapes (image_name, idx);
+    CREATE INDEX IF NOT EXISTS idx_shapes_class ON shapes (class_name, image_name);
+    CREATE TABLE IF NOT EXISTS classes (
+        name TEXT PRIMARY KEY,
+        shape_count INTEGER NOT NULL DEFAULT 0,
+        image_count INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # 3: 标注版本号（乐观并发控制）
+    """
+    ALTER TABLE annotations ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    """,
+    # 4: 训练任务队列
+    """
+    CREATE TABLE IF NOT EXISTS training_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        params TEXT NOT NULL,
+        run_name TEXT NOT NULL,
+        resume INTEGER NOT NULL DEFAULT 0,
+        prepare_job_id TEXT,
+        epoch INTEGER NOT NULL DEFAULT 0,
+        epochs INTEGER NOT NULL DEFAULT 0,
+        metrics TEXT,
+        history TEXT,
+        message TEXT,
+        error TEXT,
+        pid INTEGER,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_training_jobs_status ON training_jobs (status, created_at);
+    """,
+]
+
+
+class Database:
+    """SQLite 连接管理（每线程一个连接）"""
+
+    def __init__(self, path: Path = DB_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._migrate_lock = threading.Lock()
+        self._migrated = False
+
+    def _open(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None：由 transaction() 显式控制事务
+        conn = sqlite3.connect(str(self.path), timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS if DB_SYNCHRONOUS in ('OFF', 'NORMAL', 'FULL', 'EXTRA') else 'FULL'}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        with self._migrate_lock:
+            if self._migrated:
+                return
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for statement in script.split(";"):
+                        if statement.strip():
+                            conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version={number}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                logger.info(f"已迁移到版本 {number}")
+            self._migrated = True
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时创建并执行迁移）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._migrate(conn)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务：成功时提交，异常时回滚"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_meta(self, key: str, default: str = None) -> str:
+        row = self.connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def set_meta(self, key: str, value: str):
+        self.connection().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+# 全局数据库
+database = Database()
@@ -0,0 +1,303 @@
+"""
+数据集构建 - 增量生成 YOLO 训练数据集（datasets/train|val|test）
+
+每次准备数据集时对照上次的清单（manifest.json）只处理变化的部分：标签内容按哈希比较，未变化的标签文件
+不重写；图片以硬链接（不支持时为符号链接，再不行才复制）放入数据集目录，源图片未变化时不再处理；
+已删除的标注、换了子集的图片以及旧版本留下的文件都会被清理。标注存储、已标注图片和划分设置都没有变化时
+（annotation_store.fingerprint 相同）直接复用上次的结果，不读取任何标注。train/val/test 划分由 dataset_split 维护。
+需要处理的图片按批交给线程池并行转换标签和链接文件，作为后台任务运行时按批上报进度并响应取消。
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from annotation_store import annotation_store, AnnotationStore
+from dataset_split import DatasetSplitter, parse_ratios, SPLIT_NAMES, SPLIT_FILE_NAME
+from request_logging import get_logger
+
+logger = get_logger("dataset_builder")
+
+BASE_DIR = Path(__file__).parent
+
+# ==================== 配置 ====================
+
+DATASETS_DIR = BASE_DIR / "datasets"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# 图片放入数据集的方式：hardlink / symlink / copy（前两种失败时依次退回）
+DATASET_LINK_MODE = os.environ.get("YOLO_DATASET_LINK", "hardlink").lower()
+# 并行转换标签、链接图片的线程数（主要是文件系统 I/O）
+DATASET_WORKERS = int(os.environ.get("YOLO_DATASET_WORKERS", str(min(16, (os.cpu_count() or 4) * 2))))
+# 每批提交给线程池的图片数（同时也是进度更新和取消检查的间隔）
+DATASET_CHUNK = 256
+
+
+def _task_key(task_type: str) -> str:
+    return "segment" if task_type == "segmentation" else ("obb" if task_type == "obb" else "detect")
+
+
+def label_lines(bboxes: List[Dict[str, Any]], class_to_id: Dict[str, int], task_type: str) -> List[str]:
+    """标注框转换为 YOLO 标签行（坐标已是 0-1 相对值）"""
+    lines = []
+    for bbox in bboxes:
+        class_name = (bbox.get("class_name") or "").strip()
+        if class_name not in class_to_id:
+            continue
+        class_id = class_to_id[class_name]
+        if task_type == "segmentation" and bbox.get("annotation_type") == "polygon":
+            # 分割任务: class_id x1 y1 x2 y2 ... xn yn
+            points = bbox.get("points") or []
+            if len(points) >= 3:
+                lines.append(f"{class_id} " + " ".join(f"{p[0]:.6f} {p[1]:.6f}" for p in points))
+            else:
+                logger.warning(f"多边形点数不足: {len(points)}")
+        elif task_type == "obb" and bbox.get("annotation_type") == "obb":
+            # OBB 任务: class_id x_center y_center width height angle（弧度）
+            lines.append(f"{class_id} {bbox['x']:.6f} {bbox['y']:.6f} {bbox['width']:.6f} {bbox['height']:.6f} "
+                         f"{bbox.get('angle', 0.0):.6f}")
+        else:
+            lines.append(f"{class_id} {bbox['x']:.6f} {bbox['y']:.6f} {bbox['width']:.6f} {bbox['height']:.6f}")
+    return lines
+
+
+def _chunks(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _remove(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _write_text_atomic(path: Path, text: str):
+    tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class DatasetBuilder:
+    """增量构建 YOLO 数据集目录"""
+
+    def __init__(self, images_dir: Path, datasets_dir: Path = DATASETS_DIR, store: AnnotationStore = annotation_store,
+                 link_mode: str = DATASET_LINK_MODE, workers: int = DATASET_WORKERS):
+        self.images_dir = Path(images_dir)
+        self.datasets_dir = Path(datasets_dir)
+        self.store = store
+        self.link_mode = link_mode
+        self.workers = max(1, workers)
+        self.splitter = DatasetSplitter(self.datasets_dir / SPLIT_FILE_NAME)
+        # 同一时间只允许一个准备过程修改数据集目录
+        self._lock = threading.Lock()
+
+    # ==================== 清单 ====================
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.datasets_dir / MANIFEST_NAME
+
+    def load_manifest(self) -> Dict[str, Any]:
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+        except (FileNotFoundError, ValueError):
+            pass
+        return {"version": MANIFEST_VERSION, "items": {}}
+
+    def _paths(self, split: str, image_name: str, suffix: str) -> Tuple[Path, Path]:
+        # 文件名保留原图片名称（含扩展名），不同扩展名的同名图片不会冲突
+        return (self.datasets_dir / split / "images" / f"{image_name}{suffix}",
+                self.datasets_dir / split / "labels" / f"{image_name}.txt")
+
+    def _link(self, source: Path, target: Path) -> str:
+        """把源图片放入数据集目录，返回实际使用的方式"""
+        _remove(target)
+        modes = {"hardlink": ("hardlink", "symlink", "copy"), "symlink": ("symlink", "copy")}.get(self.link_mode, ("copy",))
+        for mode in modes:
+            try:
+                if mode == "hardlink":
+                    os.link(source, target)
+                elif mode == "symlink":
+                    os.symlink(source.resolve(), target)
+                else:
+                    shutil.copy2(source, target)
+                return mode
+            except OSError:
+                continue
+        raise OSError(f"无法把图片放入数据集目录: {source}")
+
+    # ==================== 准备 ====================
+
+    def prepare(self, task_type: str = "detection", job=None, split_ratios: Optional[Sequence[float]] = None,
+                split_seed: Optional[str] = None) -> Path:
+        """
+        准备数据集并返回数据集目录（data.yaml 所在目录）
+
+        Args:
+            task_type: detection / segmentation / obb，决定标签格式
+            job: jobs.Job，作为后台任务运行时上报进度
+            split_ratios: train/val/test 比例，默认使用 YOLO_SPLIT_RATIOS
+            split_seed: 划分的哈希种子，默认使用 YOLO_SPLIT_SEED
+        """
+        with self._lock:
+            return self._prepare(task_type, job, split_ratios, split_seed)
+
+    def _prepare(self, task_type: str, job, split_ratios: Optional[Sequence[float]], split_seed: Optional[str]) -> Path:
+        ratios = list(self.splitter.ratios if split_ratios is None else parse_ratios(split_ratios))
+        seed = self.splitter.seed if split_seed is None else str(split_seed)
+        fingerprint = [task_type, ratios, seed, *self.store.fingerprint()]
+        manifest = self.load_manifest()
+        data_yaml = self.datasets_dir / "data.yaml"
+        if manifest.get("fingerprint") == fingerprint and data_yaml.exists() and self.splitter.path.exists():
+            logger.info(f"标注和图片均未变化，复用已有数据集 ({len(manifest['items'])} 张图片)")
+            if job is not None:
+                job.update(total=len(manifest["items"]), done=len(manifest["items"]), message="数据集未变化")
+            return self.datasets_dir
+
+        for split in SPLIT_NAMES:
+            for kind in ("images", "labels"):
+                (self.datasets_dir / split / kind).mkdir(parents=True, exist_ok=True)
+
+        image_classes = self.store.image_class_map()
+        names = list(image_classes)
+        # 类别来自标注存储的类别表（按名称排序编号），不需要为收集类别先遍历一遍标注
+        classes = sorted({name.strip() for name in self.store.class_names() if name.strip()})
+        class_to_id = {name: idx for idx, name in enumerate(classes)}
+        splits = self.splitter.assign(image_classes, ratios, seed)
+        old_items: Dict[str, Dict[str, Any]] = manifest.get("items", {})
+        items: Dict[str, Dict[str, Any]] = {}
+        stats = {"linked": 0, "labels_written": 0, "unchanged": 0, "removed": 0, "missing": 0}
+        link_modes = set()
+        if job is not None:
+            job.update(total=len(names), done=0, message="正在准备数据集")
+
+        def process(entry: Tuple[str, Dict[str, Any]]):
+            image_name, document = entry
+            return image_name, self._process_item(image_name, document, splits[image_name], old_items.get(image_name),
+                                                  class_to_id, task_type)
+
+        completed = False
+        try:
+            # 标签转换、哈希和文件链接/写入在线程池中并行执行；标注按批从数据库读取
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dataset") as pool:
+                for chunk in _chunks(self.store.iter_documents(names), DATASET_CHUNK):
+                    for image_name, (item, actions) in pool.map(process, chunk):
+                        if item is None:
+                            stats["missing"] += 1
+                            continue
+                        items[image_name] = item
+                        for action in actions:
+                            if action in stats:
+                                stats[action] += 1
+                            else:
+                                link_modes.add(action)
+                    if job is not None:
+                        job.update(done=len(items) + stats["missing"])
+                        job.check_cancelled()
+            completed = True
+        finally:
+            if not completed:
+                # 中途取消或失败：记录已处理的部分（不带指纹），下次准备时这些图片不需要重新处理
+                partial = {**{name: item for name, item in old_items.items() if name not in items}, **items}
+                _write_text_atomic(self.manifest_path, json.dumps(
+                    {"version": MANIFEST_VERSION, "fingerprint": None, "items": partial}, ensure_ascii=False))
+
+        stats["removed"] = self._prune(items)
+        split_counts = {split: 0 for split in SPLIT_NAMES}
+        for item in items.values():
+            split_counts[item["split"]] += 1
+        self._write_data_yaml(classes, task_type, split_counts)
+        manifest = {"version": MANIFEST_VERSION, "fingerprint": fingerprint, "task_type": task_type,
+                    "classes": classes, "items": items}
+        _write_text_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False))
+        if job is not None:
+            job.update(done=len(names), message=f"数据集已准备: {stats}")
+        logger.info(f"数据集已准备: {len(items)} 张图片 {split_counts}, {len(classes)} 个类别, "
+              f"链接方式 {','.join(sorted(link_modes)) or '-'}, {stats}")
+        return self.datasets_dir
+
+    def _process_item(self, image_name: str, document: Dict[str, Any], split: str, old: Optional[Dict[str, Any]],
+                      class_to_id: Dict[str, int], task_type: str) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """
+        转换一张图片的标签并更新数据集中的文件（在工作线程中执行，各图片的文件互不相同）
+
+        Returns:
+            (清单项, 执行的操作)；源图片不存在时清单项为 None
+        """
+        source = self.images_dir / image_name
+        try:
+            stat = source.stat()
+        except FileNotFoundError:
+            logger.warning(f"图片不存在: {source}")
+            return None, []
+        text = "\n".join(label_lines(document.get("bboxes", []), class_to_id, task_type))
+        item = {"split": split, "suffix": source.suffix,
+                "source": [stat.st_mtime_ns, stat.st_size],
+                "label_hash": hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()}
+        image_path, label_path = self._paths(split, image_name, source.suffix)
+
+        if old is not None and (old["split"] != split or old["suffix"] != source.suffix):
+            for path in self._paths(old["split"], image_name, old["suffix"]):
+                _remove(path)
+            old = None
+        actions = []
+        if old is None or old["source"] != item["source"] or not image_path.exists():
+            actions += ["linked", self._link(source, image_path)]
+        if old is None or old["label_hash"] != item["label_hash"] or not label_path.exists():
+            _write_text_atomic(label_path, text)
+            actions.append("labels_written")
+        return item, actions or ["unchanged"]
+
+    def _prune(self, items: Dict[str, Dict[str, Any]]) -> int:
+        """删除不属于当前数据集的文件（已删除的标注、旧版本留下的文件）"""
+        expected = set()
+        for image_name, item in items.items():
+            expected.update(self._paths(item["split"], image_name, item["suffix"]))
+        removed = 0
+        for split in SPLIT_NAMES:
+            for kind in ("images", "labels"):
+                directory = self.datasets_dir / split / kind
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        path = Path(entry.path)
+                        if not entry.is_dir(follow_symlinks=False) and path not in expected:
+                            path.unlink()
+                            removed += 1
+        return removed
+
+    def _write_data_yaml(self, classes: List[str], task_type: str, split_counts: Dict[str, int]):
+        names_dict = {i: name for i, name in enumerate(classes)}
+        val_has_images = split_counts["val"] > 0
+        if not val_has_images:
+            logger.warning("验证集为空，将训练集作为验证集（不推荐用于实际生产环境）")
+        content = f"""path: {self.datasets_dir.absolute()}
+train: train/images
+val: {'val' if val_has_images else 'train'}/images
+"""
+        if split_counts["test"]:
+            content += "test: test/images\n"
+        content += f"""nc: {len(classes)}
+names: {names_dict}
+task: {_task_key(task_type)}
+"""
+        data_yaml = self.datasets_dir / "data.yaml"
+        if not data_yaml.exists() or data_yaml.read_text(encoding="utf-8") != content:
+            _write_text_atomic(data_yaml, content)
+
+
+# 全局数据集构建（与 main.IMAGES_DIR / DATASETS_DIR 相同）
+dataset_builder = DatasetBuilder(BASE_DIR / "images")
@@ -0,0 +1,513 @@
+"""
+数据集导入 - 从服务器上的目录、zip 或 tar 包批量导入图片和已有标注（YOLO / COCO / VOC）
+
+导入分两步：先遍历来源，收集图片列表并读入标签文件（标签文件很小），再把图片按顺序分块，在线程池中
+并行写入图片目录（复用 image_upload 的流式写入、内容哈希去重和文件头校验；tar 包只能顺序读取，逐个成员
+写入），每块图片的标注用一个事务写入标注存储。每块完成后在 meta 表中记录进度，任务取消或进程中断后再次
+导入同一来源时从断点继续；已完成的导入再次提交时从头处理。
+
+标签识别规则：
+    YOLO: 与图片同名的 .txt（images/ 对应 labels/ 目录，或与图片同目录），类别名称来自 data.yaml / classes.txt
+    COCO: 包含 images / annotations / categories 的 .json，按 file_name 匹配图片
+    VOC: 根节点为 annotation 的 .xml，按 filename（或 xml 文件名）匹配图片，类别 ID 优先使用
+         classes.txt / data.yaml 中的编号，其余类别按名称排序后依次编号
+"""
+import os
+import json
+import tarfile
+import zipfile
+import hashlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+from annotation_store import annotation_store, AnnotationStore
+from database import database, Database
+from image_catalog import IMAGE_EXTENSIONS
+from image_upload import image_uploader, ImageUploader
+from request_logging import get_logger
+
+logger = get_logger("dataset_import")
+
+# ==================== 配置 ====================
+
+# 并行导入的线程数
+IMPORT_WORKERS = int(os.environ.get("YOLO_IMPORT_WORKERS", str(min(8, (os.cpu_count() or 4)))))
+# 每块的图片数量（进度检查点的粒度）
+IMPORT_CHUNK = 256
+
+LABEL_EXTENSIONS = {".txt", ".json", ".xml", ".yaml", ".yml"}
+CLASS_NAME_FILES = {"classes.txt", "obj.names", "classes.names"}
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# meta 表中保存导入进度的键前缀
+META_PREFIX = "dataset_import:"
+
+
+class ImportSourceError(ValueError):
+    """导入来源不存在或格式不支持"""
+
+
+def _skip(rel: str) -> bool:
+    """隐藏文件和 macOS 压缩包附带的元数据"""
+    parts = PurePosixPath(rel).parts
+    return any(part.startswith(".") or part == "__MACOSX" for part in parts)
+
+
+# ==================== 导入来源 ====================
+
+class _DirectorySource:
+    sequential = False
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def signature(self) -> Optional[List[int]]:
+        # 目录没有整体的修改标记，断点续传时按图片数量校验
+        return None
+
+    def scan(self) -> List[str]:
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".") and name != "__MACOSX"]
+            rel_dir = Path(dirpath).relative_to(self.root).as_posix()
+            for name in filenames:
+                if not name.startswith("."):
+                    files.append(name if rel_dir == "." else f"{rel_dir}/{name}")
+        return sorted(files)
+
+    def read_bytes(self, rel: str) -> bytes:
+        return (self.root / rel).read_bytes()
+
+    def openers(self, rels: List[str]) -> List[Callable[[], BinaryIO]]:
+        return [lambda rel=rel: (self.root / rel).open("rb") for rel in rels]
+
+    def close(self):
+        pass
+
+
+class _ZipSource:
+    sequential = False
+
+    def __init__(self, path: Path):
+        self.path = path
+        # ZipFile 的读取在内部加锁，多个线程可以同时 open 不同的成员
+        self.archive = zipfile.ZipFile(path)
+
+    def signature(self) -> Optional[List[int]]:
+        stat = self.path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def scan(self) -> List[str]:
+        return sorted(info.filename for info in self.archive.infolist()
+                      if not info.is_dir() and not _skip(info.filename))
+
+    def read_bytes(self, rel: str) -> bytes:
+        return self.archive.read(rel)
+
+    def openers(self, rels: List[str]) -> List[Callable[[], BinaryIO]]:
+        return [lambda rel=rel: self.archive.open(rel) for rel in rels]
+
+    def close(self):
+        self.archive.close()
+
+
+class _TarSource:
+    """tar 包（可压缩）只能顺序读取：在任务线程中按包内顺序逐个成员流式写入，不把整块内容读入内存"""
+
+    sequential = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.archive = tarfile.open(path, "r:*")
+        self._members: Dict[str, tarfile.TarInfo] = {}
+
+    def signature(self) -> Optional[List[int]]:
+        stat = self.path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def scan(self) -> List[str]:
+        names = []
+        for member in self.archive.getmembers():
+            if member.isfile() and not _skip(member.name):
+                self._members[member.name] = member
+                names.append(member.name)
+        return names
+
+    def read_bytes(self, rel: str) -> bytes:
+        return self.archive.extractfile(self._members[rel]).read()
+
+    def openers(self, rels: List[str]) -> List[Callable[[], BinaryIO]]:
+        return [lambda rel=rel: self.archive.extractfile(self._members[rel]) for rel in rels]
+
+    def close(self):
+        self.archive.close()
+
+
+def open_source(path: Path):
+    """按路径类型打开导入来源（目录、zip 或 tar 包）"""
+    path = Path(path)
+    if path.is_dir():
+        return _DirectorySource(path)
+    if not path.is_file():
+        raise ImportSourceError(f"导入来源不存在: {path}")
+    name = path.name.lower()
+    if name.endswith(".zip") and zipfile.is_zipfile(path):
+        return _ZipSource(path)
+    if name.endswith(ARCHIVE_SUFFIXES) and tarfile.is_tarfile(path):
+        return _TarSource(path)
+    raise ImportSourceError(f"不支持的导入来源（应为目录、zip 或 tar 包）: {path}")
+
+
+# ==================== 标签解析 ====================
+
+def _bbox(class_id: int, class_name: str, x: float, y: float, width: float, height: float, **fields) -> Dict[str, Any]:
+    """标注存储使用的标注框格式（中心点和宽高均为 0-1 相对坐标）"""
+    return {"x": x, "y": y, "width": width, "height": height, "class_id": class_id,
+            "class_name": class_name, "annotation_type": "bbox", **fields}
+
+
+def _points_bbox(points: List[List[float]]) -> Tuple[float, float, float, float]:
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2, max(xs) - min(xs), max(ys) - min(ys)
+
+
+class LabelIndex:
+    """来源中所有标签文件的索引，按图片查找对应的标注"""
+
+    def __init__(self):
+        self.class_names: Dict[int, str] = {}
+        # data.yaml 中的 kpt_shape（关键点数, 每个关键点的值数），用于区分姿态标签和分割标签
+        self.kpt_shape: Optional[Tuple[int, int]] = None
+        # 图片文件名（不含目录）-> COCO 标注
+        self.coco: Dict[str, Dict[str, Any]] = {}
+        # 图片主文件名 -> VOC 标注
+        self.voc: Dict[str, Dict[str, Any]] = {}
+        # VOC 类别名称 -> 类别 ID（首次使用时生成）
+        self._voc_ids: Optional[Dict[str, int]] = None
+        # 主文件名 -> [标签文件路径]
+        self.yolo: Dict[str, List[str]] = {}
+        self.texts: Dict[str, str] = {}
+        self.formats = set()
+
+    def load(self, source, files: List[str]):
+        for rel in files:
+            path = PurePosixPath(rel)
+            suffix = path.suffix.lower()
+            if suffix not in LABEL_EXTENSIONS and path.name.lower() not in CLASS_NAME_FILES:
+                continue
+            try:
+                text = source.read_bytes(rel).decode("utf-8-sig")
+            except Exception as e:
+                logger.warning(f"读取标签文件失败 {rel}: {e}")
+                continue
+            try:
+                if path.name.lower() in CLASS_NAME_FILES:
+                    if not self.class_names:
+                        names = [line.strip() for line in text.splitlines() if line.strip()]
+                        self.class_names = dict(enumerate(names))
+                elif suffix in (".yaml", ".yml"):
+                    self._load_yaml(text)
+                elif suffix == ".json":
+                    self._load_coco(text)
+                elif suffix == ".xml":
+                    self._load_voc(text, path)
+                else:
+                    self.yolo.setdefault(path.stem, []).append(rel)
+                    self.texts[rel] = text
+                    if "yolo" not in self.formats and self._yolo_bboxes(text):
+                        self.formats.add("yolo")
+            except Exception as e:
+                logger.warning(f"解析标签文件失败 {rel}: {e}")
+
+    def _load_yaml(self, text: str):
+        data = yaml.safe_load(text)
+        names = data.get("names") if isinstance(data, dict) else None
+        if isinstance(names, list):
+            self.class_names = dict(enumerate(str(name) for name in names))
+        elif isinstance(names, dict):
+            self.class_names = {int(key): str(value) for key, value in names.items()}
+        kpt_shape = data.get("kpt_shape") if isinstance(data, dict) else None
+        if isinstance(kpt_shape, (list, tuple)) and len(kpt_shape) == 2 and int(kpt_shape[1]) in (2, 3):
+            self.kpt_shape = (int(kpt_shape[0]), int(kpt_shape[1]))
+
+    def _load_coco(self, text: str):
+        data = json.loads(text)
+        if not (isinstance(data, dict) and {"images", "annotations", "categories"} <= set(data)):
+            return
+        categories = {category["id"]: category["name"] for category in data["categories"]}
+        images = {}
+        for image in data["images"]:
+            entry = {"width": image.get("width"), "height": image.get("height"), "objects": []}
+            images[image["id"]] = entry
+            self.coco[PurePosixPath(str(image["file_name"]).replace("\\", "/")).name] = entry
+        for annotation in data["annotations"]:
+            entry = images.get(annotation.get("image_id"))
+            if entry is not None and annotation.get("category_id") in categories:
+                entry["objects"].append((annotation["category_id"], categories[annotation["category_id"]],
+                                         annotation.get("bbox"), annotation.get("segmentation")))
+        self.formats.add("coco")
+
+    def _load_voc(self, text: str, path: PurePosixPath):
+        root = ET.fromstring(text)
+        if root.tag != "annotation":
+            return
+        size = root.find("size")
+        entry = {
+            "width": int(float(size.findtext("width", "0"))) if size is not None else 0,
+            "height": int(float(size.findtext("height", "0"))) if size is not None else 0,
+            "objects": [],
+        }
+        for obj in root.iter("object"):
+            box = obj.find("bndbox")
+            if box is None:
+                continue
+            entry["objects"].append((obj.findtext("name", "").strip(),
+                                     *(float(box.findtext(key, "0")) for key in ("xmin", "ymin", "xmax", "ymax"))))
+        filename = root.findtext("filename")
+        self.voc[PurePosixPath(filename).stem if filename else path.stem] = entry
+        self.formats.add("voc")
+
+    def _class_name(self, class_id: int) -> str:
+        return self.class_names.get(class_id, f"class_{class_id}")
+
+    def _voc_class_id(self, class_name: str) -> int:
+        """VOC 只有类别名称：已知类别使用 classes.txt / data.yaml 中的 ID，其余按名称排序后接着编号"""
+        if self._voc_ids is None:
+            self._voc_ids = {name: class_id for class_id, name in self.class_names.items()}
+            names = {obj[0] for entry in self.voc.values() for obj in entry["objects"] if obj[0]}
+            next_id = max(self.class_names, default=-1) + 1
+            for offset, name in enumerate(sorted(names - set(self._voc_ids))):
+                self._voc_ids[name] = next_id + offset
+        return self._voc_ids[class_name]
+
+    def _yolo_label(self, image_rel: str) -> Optional[str]:
+        image_path = PurePosixPath(image_rel)
+        candidates = self.yolo.get(image_path.stem)
+        if not candidates:
+            return None
+        parts = list(image_path.with_suffix(".txt").parts)
+        # 标准布局 .../images/<子目录>/x.jpg 对应 .../labels/<子目录>/x.txt
+        if "images" in parts:
+            index = len(parts) - 1 - parts[::-1].index("images")
+            expected = "/".join(parts[:index] + ["labels"] + parts[index + 1:])
+            if expected in candidates:
+                return expected
+        same_dir = image_path.with_suffix(".txt").as_posix()
+        if same_dir in candidates:
+            return same_dir
+        return candidates[0] if len(candidates) == 1 else None
+
+    def _yolo_bboxes(self, text: str) -> List[Dict[str, Any]]:
+        bboxes = []
+        for line in text.splitlines():
+            values = line.split()
+            if len(values) < 5:
+                continue
+            try:
+                class_id = int(float(values[0]))
+                numbers = [float(value) for value in values[1:]]
+            except ValueError:
+                continue
+            class_name = self._class_name(class_id)
+            if self.kpt_shape and len(numbers) == 4 + self.kpt_shape[0] * self.kpt_shape[1]:
+                # 姿态（按 data.yaml 的 kpt_shape）: 边界框 + 关键点，只保留坐标
+                step = self.kpt_shape[1]
+                keypoints = [numbers[i:i + 2] for i in range(4, len(numbers), step)]
+                bboxes.append(_bbox(class_id, class_name, *numbers[:4], annotation_type="keypoints", keypoints=keypoints))
+            elif len(numbers) == 5:
+                # 旋转框: 中心点、宽高、角度（弧度）
+                bboxes.append(_bbox(class_id, class_name, *numbers[:4], annotation_type="obb", angle=numbers[4]))
+            elif len(numbers) >= 6 and len(numbers) % 2 == 0 and (self.kpt_shape or not self._looks_like_pose(numbers)):
+                # 分割多边形: x1 y1 x2 y2 ...
+                points = [numbers[i:i + 2] for i in range(0, len(numbers), 2)]
+                bboxes.append(_bbox(class_id, class_name, *_points_bbox(points), annotation_type="polygon", points=points))
+            elif len(numbers) > 4:
+                # 姿态: 边界框 + 关键点（每个关键点 2 或 3 个值，只保留坐标）
+                rest = numbers[4:]
+                step = 3 if len(rest) % 3 == 0 else 2
+                keypoints = [rest[i:i + 2] for i in range(0, len(rest), step)]
+                bboxes.append(_bbox(class_id, class_name, *numbers[:4], annotation_type="keypoints", keypoints=keypoints))
+            else:
+                bboxes.append(_bbox(class_id, class_name, *numbers))
+        return bboxes
+
+    @staticmethod
+    def _looks_like_pose(numbers: List[float]) -> bool:
+        """没有 kpt_shape 时按内容猜测：分割多边形的坐标都在 0~1 内，关键点的可见性标记为 0/1/2"""
+        return any(value > 1.0 for value in numbers) and len(numbers) > 4 and (len(numbers) - 4) % 3 == 0 \
+            and all(value in (0.0, 1.0, 2.0) for value in numbers[6::3])
+
+    def document(self, image_rel: str, image_name: str, width: int, height: int) -> Optional[Dict[str, Any]]:
+        """图片对应的标注（标注存储格式），没有标签时返回 None"""
+        bboxes = None
+        label_rel = self._yolo_label(image_rel)
+        image_path = PurePosixPath(image_rel)
+        if label_rel is not None:
+            bboxes = self._yolo_bboxes(self.texts[label_rel])
+        elif image_path.name in self.coco:
+            entry = self.coco[image_path.name]
+            w, h = entry.get("width") or width, entry.get("height") or height
+            bboxes = []
+            for class_id, class_name, box, segmentation in entry["objects"]:
+                if not box or not w or not h:
+                    continue
+                x, y, bw, bh = box
+                fields = {}
+                if isinstance(segmentation, list) and segmentation and isinstance(segmentation[0], list) \
+                        and len(segmentation[0]) >= 6:
+                    polygon = segmentation[0]
+                    fields = {"annotation_type": "polygon",
+                              "points": [[polygon[i] / w, polygon[i + 1] / h] for i in range(0, len(polygon) - 1, 2)]}
+                bboxes.append(_bbox(class_id, class_name, (x + bw / 2) / w, (y + bh / 2) / h, bw / w, bh / h, **fields))
+        elif image_path.stem in self.voc:
+            entry = self.voc[image_path.stem]
+            w, h = entry["width"] or width, entry["height"] or height
+            bboxes = [_bbox(self._voc_class_id(name), name, (x1 + x2) / 2 / w, (y1 + y2) / 2 / h, (x2 - x1) / w, (y2 - y1) / h)
+                      for name, x1, y1, x2, y2 in entry["objects"] if name and w and h]
+        if bboxes is None:
+            return None
+        return {"image_name": image_name, "width": width, "height": height, "bboxes": bboxes}
+
+
+# ==================== 导入任务 ====================
+
+def _target_names(image_rels: List[str]) -> List[str]:
+    """导入后的图片名称：默认使用文件名，同一来源中重名的图片加上所在目录名作为前缀"""
+    used = set()
+    names = []
+    for rel in image_rels:
+        path = PurePosixPath(rel)
+        name = path.name
+        if name in used:
+            prefix = path.parent.name or "import"
+            name = f"{prefix}_{path.name}"
+            index = 1
+            while name in used:
+                name = f"{prefix}_{index}_{path.name}"
+                index += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+class DatasetImporter:
+    """批量导入图片和标注"""
+
+    def __init__(self, uploader: ImageUploader = image_uploader, store: AnnotationStore = annotation_store,
+                 db: Database = database, workers: int = IMPORT_WORKERS):
+        self.uploader = uploader
+        self.store = store
+        self.db = db
+        self.workers = max(1, workers)
+
+    @staticmethod
+    def validate_source(source: str) -> Path:
+        """检查导入来源，返回绝对路径（提交任务前调用，以便直接返回 400）"""
+        path = Path(source).expanduser().resolve()
+        open_source(path).close()
+        return path
+
+    def _state_key(self, path: Path) -> str:
+        return META_PREFIX + hashlib.blake2b(str(path).encode("utf-8"), digest_size=8).hexdigest()
+
+    def _import_image(self, opener: Callable[[], BinaryIO], target: str) -> Dict[str, Any]:
+        try:
+            with opener() as f:
+                # 不替换图片目录中已有的同名图片（内容不同时改名保存）
+                return {"success": True, **self.uploader.save_file(target, f, overwrite=False)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def run(self, job, source: str, overwrite_annotations: bool = False, restart: bool = False) -> Dict[str, Any]:
+        """
+        导入任务函数（在 jobs 线程池中运行）
+
+        Args:
+            job: jobs.Job，用于上报进度和检查取消
+            source: 服务器上的目录、zip 或 tar 包路径
+            overwrite_annotations: 图片已有标注时是否用导入的标签覆盖（默认保留已有标注）
+            restart: 忽略上次的进度，从头导入
+        """
+        path = Path(source).expanduser().resolve()
+        source_reader = open_source(path)
+        try:
+            job.update(message="正在读取来源")
+            files = source_reader.scan()
+            image_rels = [rel for rel in files if PurePosixPath(rel).suffix.lower() in IMAGE_EXTENSIONS]
+            labels = LabelIndex()
+            labels.load(source_reader, files)
+            targets = _target_names(image_rels)
+
+            key = self._state_key(path)
+            signature = source_reader.signature()
+            state = json.loads(self.db.get_meta(key) or "{}")
+            summary = {"images": len(image_rels), "imported": 0, "deduplicated": 0, "failed": 0,
+                       "renamed": 0, "annotated": 0, "annotations_skipped": 0}
+            start = 0
+            # 只续传未完成的导入；已完成的来源再次导入时重新处理（标签或图片可能已更新）
+            if not restart and not state.get("completed") and state.get("signature") == signature \
+                    and state.get("images") == len(image_rels):
+                start = state.get("next_index", 0)
+                summary.update(state.get("summary", {}))
+                if start:
+                    logger.info(f"从断点继续导入 {path}: {start}/{len(image_rels)}")
+            job.update(total=len(image_rels), done=start, failed=summary["failed"],
+                       message=f"标签格式: {', '.join(sorted(labels.formats)) or '无'}")
+
+            annotated = set(self.store.image_names())
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="import") as pool:
+                for chunk_start in range(start, len(image_rels), IMPORT_CHUNK):
+                    job.check_cancelled()
+                    chunk = list(range(chunk_start, min(chunk_start + IMPORT_CHUNK, len(image_rels))))
+                    openers = source_reader.openers([image_rels[i] for i in chunk])
+                    names = [targets[i] for i in chunk]
+                    if source_reader.sequential:
+                        results = [self._import_image(opener, name) for opener, name in zip(openers, names)]
+                    else:
+                        results = list(pool.map(self._import_image, openers, names))
+
+                    documents = {}
+                    for i, result in zip(chunk, results):
+                        if not result["success"]:
+                            summary["failed"] += 1
+                            logger.warning(f"导入失败 {image_rels[i]}: {result['error']}")
+                            continue
+                        summary["deduplicated" if result["deduplicated"] else "imported"] += 1
+                        if result["renamed_from"]:
+                            summary["renamed"] += 1
+                        document = labels.document(image_rels[i], result["filename"], result["width"], result["height"])
+                        if document is None:
+                            continue
+                        if result["filename"] in annotated and not overwrite_annotations:
+                            summary["annotations_skipped"] += 1
+                            continue
+                        documents[result["filename"]] = document
+                    if documents:
+                        self.store.save_many(documents)
+                        annotated.update(documents)
+                        summary["annotated"] += len(documents)
+
+                    next_index = chunk[-1] + 1
+                    self.db.set_meta(key, json.dumps({"source": str(path), "signature": signature,
+                                                      "images": len(image_rels), "next_index": next_index,
+                                                      "summary": summary}))
+                    job.update(done=next_index, failed=summary["failed"])
+            self.db.set_meta(key, json.dumps({"source": str(path), "signature": signature,
+                                              "images": len(image_rels), "completed": True,
+                                              "summary": summary}))
+        finally:
+            source_reader.close()
+
+        summary["source"] = str(path)
+        summary["label_formats"] = sorted(labels.formats)
+        summary["resumed_from"] = start
+        logger.info(f"导入完成 {path}: {summary}")
+        return summary
+
+
+# 全局数据集导入
+dataset_importer = DatasetImporter()
@@ -0,0 +1,176 @@
+"""
+数据集划分 - 按图片名称哈希的稳定划分，按类别分层，支持 train/val/test 比例
+
+每张图片一旦分配到某个子集就记录在划分文件（datasets/splits.json）中，之后的准备过程直接复用，
+新增图片不会让已有图片换到别的子集（不会出现一张图片这次训练、下次验证的情况）。
+新图片按名称哈希（加种子）排序后依次分配：按所含图片最少的类别分层，放到该层最缺图片的子集（相同时看全局），
+使每个类别在各子集中的比例接近设定比例。比例或种子改变时重新划分。
+"""
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from request_logging import get_logger
+
+logger = get_logger("dataset_split")
+
+# ==================== 配置 ====================
+
+SPLIT_NAMES = ("train", "val", "test")
+SPLIT_FILE_NAME = "splits.json"
+SPLIT_FILE_VERSION = 1
+# 背景图片（没有标注框）所在的分层
+BACKGROUND_STRATUM = ""
+
+
+def parse_ratios(value: Any) -> Tuple[float, float, float]:
+    """
+    解析划分比例（"0.8,0.2"、"0.7,0.2,0.1" 或数字列表），归一化为 (train, val, test)
+
+    Raises:
+        ValueError: 比例格式错误、为负数或训练集比例为 0
+    """
+    if isinstance(value, str):
+        parts = [part.strip() for part in value.split(",") if part.strip()]
+        ratios = [float(part) for part in parts]
+    else:
+        ratios = [float(part) for part in value]
+    if not 1 <= len(ratios) <= 3:
+        raise ValueError("划分比例应为 1~3 个数字（train, val, test）")
+    ratios = (ratios + [0.0, 0.0])[:3]
+    if any(ratio < 0 for ratio in ratios) or ratios[0] <= 0:
+        raise ValueError("划分比例不能为负数，且训练集比例必须大于 0")
+    total = sum(ratios)
+    return tuple(round(ratio / total, 6) for ratio in ratios)
+
+
+SPLIT_RATIOS = parse_ratios(os.environ.get("YOLO_SPLIT_RATIOS", "0.8,0.2,0"))
+SPLIT_SEED = os.environ.get("YOLO_SPLIT_SEED", "0")
+
+
+def stable_key(name: str, seed: str) -> str:
+    """图片名称的稳定哈希（与文件系统遍历顺序、图片数量无关）"""
+    return hashlib.blake2b(f"{seed}:{name}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+class DatasetSplitter:
+    """维护划分文件，为图片分配 train/val/test"""
+
+    def __init__(self, path: Path, ratios: Sequence[float] = SPLIT_RATIOS, seed: str = SPLIT_SEED):
+        self.path = Path(path)
+        self.ratios = parse_ratios(ratios)
+        self.seed = str(seed)
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("version") == SPLIT_FILE_VERSION:
+                return data
+        except (FileNotFoundError, ValueError):
+            pass
+        return {"version": SPLIT_FILE_VERSION, "ratios": None, "seed": None, "assignments": {}}
+
+    def _save(self, data: Dict[str, Any]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False, sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def assign(self, image_classes: Dict[str, List[str]], ratios: Optional[Sequence[float]] = None,
+               seed: Optional[str] = None, reset: bool = False) -> Dict[str, str]:
+        """
+        返回当前图片的划分 {image_name: split}
+
+        Args:
+            image_classes: {image_name: [包含的类别]}，即 annotation_store.image_class_map()
+            ratios: 划分比例，默认使用 YOLO_SPLIT_RATIOS
+            seed: 哈希种子，默认使用 YOLO_SPLIT_SEED
+            reset: 忽略已有的划分文件，全部重新分配
+        """
+        ratios = parse_ratios(ratios) if ratios is not None else self.ratios
+        seed = str(seed) if seed is not None else self.seed
+        with self._lock:
+            data = self.load()
+            if reset or data["ratios"] != list(ratios) or data["seed"] != seed:
+                if data["assignments"]:
+                    reason = "按请求重置" if reset else f"比例或种子已改变 {data['ratios']}, {data['seed']} -> {list(ratios)}, {seed}"
+                    logger.info(f"重新划分（{reason}）")
+                data = {"version": SPLIT_FILE_VERSION, "ratios": list(ratios), "seed": seed, "assignments": {}}
+            # 已删除图片的划分也保留：重新加入时仍回到原来的子集
+            assignments: Dict[str, str] = data["assignments"]
+            new_names = [name for name in image_classes if name not in assignments]
+            if new_names:
+                self._assign_new(assignments, image_classes, new_names, ratios, seed)
+                self._save(data)
+                logger.info(f"新分配 {len(new_names)} 张图片，划分文件: {self.path}")
+            return {name: assignments[name] for name in image_classes}
+
+    def _assign_new(self, assignments: Dict[str, str], image_classes: Dict[str, List[str]], new_names: List[str],
+                    ratios: Tuple[float, float, float], seed: str):
+        # 类别的图片数量（分层时取图片所含最少见的类别，保证稀有类别也分到各个子集）
+        class_images: Dict[str, int] = {}
+        for classes in image_classes.values():
+            for class_name in classes:
+                class_images[class_name] = class_images.get(class_name, 0) + 1
+
+        def stratum(name: str) -> str:
+            classes = image_classes.get(name) or []
+            return min(classes, key=lambda c: (class_images[c], c)) if classes else BACKGROUND_STRATUM
+
+        strata: Dict[str, List[int]] = {}
+        totals = [0, 0, 0]
+        for name, split in assignments.items():
+            if name in image_classes:
+                index = SPLIT_NAMES.index(split)
+                strata.setdefault(stratum(name), [0, 0, 0])[index] += 1
+                totals[index] += 1
+
+        for name in sorted(new_names, key=lambda n: (stable_key(n, seed), n)):
+            counts = strata.setdefault(stratum(name), [0, 0, 0])
+            index = self._choose(counts, totals, ratios)
+            counts[index] += 1
+            totals[index] += 1
+            assignments[name] = SPLIT_NAMES[index]
+
+    @staticmethod
+    def _choose(counts: List[int], totals: List[int], ratios: Tuple[float, float, float]) -> int:
+        # 比例大于 0 的验证集/测试集为空时先补上一张，小数据集也能得到非空的验证集
+        if totals[0] > 0:
+            for index in (1, 2):
+                if ratios[index] > 0 and totals[index] == 0:
+                    return index
+        layer_total = sum(counts) + 1
+        grand_total = sum(totals) + 1
+        # 优先补该层（类别）最缺的子集，相同时看全局
+        candidates = [i for i in range(3) if ratios[i] > 0]
+        return max(candidates, key=lambda i: (round(ratios[i] * layer_total - counts[i], 6),
+                                              round(ratios[i] * grand_total - totals[i], 6), -i))
+
+    def summary(self, image_classes: Dict[str, List[str]]) -> Dict[str, Any]:
+        """划分文件的配置，以及当前图片在各子集的数量和每个类别在各子集的图片数量"""
+        data = self.load()
+        assignments = data["assignments"]
+        splits = {split: 0 for split in SPLIT_NAMES}
+        classes: Dict[str, Dict[str, int]] = {}
+        unassigned = 0
+        for name, image_class_names in image_classes.items():
+            split = assignments.get(name)
+            if split is None:
+                unassigned += 1
+                continue
+            splits[split] += 1
+            for class_name in image_class_names:
+                classes.setdefault(class_name, {s: 0 for s in SPLIT_NAMES})[split] += 1
+        return {
+            "path": str(self.path),
+            "ratios": data["ratios"],
+            "seed": data["seed"],
+            "recorded": len(assignments),
+            "unassigned": unassigned,
+            "splits": splits,
+            "classes": classes,
+        }
@@ -1,32 +1,98 @@
 """
 格式导出工具 - 支持多种标注格式导出
+
+标注从 annotation_store 读取，每个导出器只读取一次，导出多种格式时共享。
+标注存储的 bboxes（归一化坐标）先转换为像素坐标的 shapes，旧版 LabelMe 格式的 shapes 原样使用。
 """
 import json
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import shutil
 import numpy as np
 from PIL import Image
 import cv2  # 添加 cv2 导入
 
+from request_logging import get_logger
+
+logger = get_logger("export")
+
+
+def bboxes_to_shapes(data: Dict[str, Any], width: Optional[float] = None,
+                     height: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    标注数据转换为像素坐标的 shapes（label、shape_type、points）
+
+    Args:
+        data: 标注存储的文档（bboxes: class_name、归一化中心点 x/y 和宽高、多边形 points、旋转框 angle），
+              或旧版 LabelMe 格式（shapes）
+        width: 图片宽度，默认使用标注中记录的宽度
+        height: 图片高度，默认使用标注中记录的高度
+
+    Returns:
+        矩形为 [[x1, y1], [x2, y2]]，多边形和旋转框为各顶点
+    """
+    if "bboxes" not in data:
+        return data.get("shapes", [])
+    width = width or data.get("width") or 1
+    height = height or data.get("height") or 1
+    shapes = []
+    for bbox in data["bboxes"]:
+        label = bbox.get("class_name") or ""
+        points = bbox.get("points") or []
+        if bbox.get("annotation_type") == "polygon" and len(points) >= 3:
+            shapes.append({"label": label, "shape_type": "polygon",
+                           "points": [[p[0] * width, p[1] * height] for p in points]})
+            continue
+        cx, cy = bbox.get("x", 0.0) * width, bbox.get("y", 0.0) * height
+        half_w, half_h = bbox.get("width", 0.0) * width / 2, bbox.get("height", 0.0) * height / 2
+        angle = bbox.get("angle") or 0.0
+        if bbox.get("annotation_type") == "obb" and angle:
+            # 旋转框（角度为弧度）转换为四个顶点
+            cos_a, sin_a = np.cos(angle), np.sin(angle)
+            corners = [(-half_w, -half_h), (half_w, -half_h), (half_w, half_h), (-half_w, half_h)]
+            shapes.append({"label": label, "shape_type": "polygon",
+                           "points": [[cx + dx * cos_a - dy * sin_a, cy + dx * sin_a + dy * cos_a]
+                                      for dx, dy in corners]})
+        else:
+            shapes.append({"label": label, "shape_type": "rectangle",
+                           "points": [[cx - half_w, cy - half_h], [cx + half_w, cy + half_h]]})
+    return shapes
+
 
 class AnnotationExporter:
     """标注格式导出器"""
     
-    def __init__(self, images_dir: Path, annotations_dir: Path, output_dir: Path):
+    def __init__(self, images_dir: Path, store, output_dir: Path):
         """
         初始化导出器
         
         Args:
             images_dir: 图片目录
-            annotations_dir: 标注目录
+            store: 标注存储（annotation_store.AnnotationStore）
             output_dir: 输出目录
         """
         self.images_dir = images_dir
-        self.annotations_dir = annotations_dir
+        self.store = store
         self.output_dir = output_dir
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._documents: Optional[List[Tuple[str, Dict[str, Any]]]] = None
+    
+    def _annotations(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """所有标注 (图片名称, 标注数据)，首次调用时从标注存储读取"""
+        if self._documents is None:
+            self._documents = list(self.store.iter_documents())
+        return self._documents
+    
+    def _class_to_id(self) -> Dict[str, int]:
+        """提取所有类别，按名称排序编号"""
+        all_classes = set()
+        for _, data in self._annotations():
+            for shape in bboxes_to_shapes(data):
+                label = shape.get("label", "")
+                if label:
+                    all_classes.add(label)
+        return {name: idx for idx, name in enumerate(sorted(all_classes))}
     
     def export_yolo(self, subset: str = "train"):
         """
@@ -35,7 +101,7 @@ class AnnotationExporter:
         Args:
             subset: 数据集子集 (train, val, test)
         """
-        print(f"[EXPORT] 导出 YOLO 格式: {subset}")
+        logger.info(f"导出 YOLO 格式: {subset}")
         
         # 创建 YOLO 目录结构
         yolo_dir = self.output_dir / "yolo"
@@ -45,24 +111,11 @@ class AnnotationExporter:
         images_dir.mkdir(parents=True, exist_ok=True)
         labels_dir.mkdir(parents=True, exist_ok=True)
         
-        # 获取所有标注文件
-        annotation_files = list(self.annotations_dir.glob("*.json"))
-        
         # 提取所有类别
-        all_classes = set()
-        for ann_file in annotation_files:
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-                for shape in data.get("shapes", []):
-                    label = shape.get("label", "")
-                    if label:
-                        all_classes.add(label)
-        
-        class_to_id = {name: idx for idx, name in enumerate(sorted(all_classes))}
+        class_to_id = self._class_to_id()
         
         # 转换标注
-        for ann_file in annotation_files:
-            image_name = ann_file.stem
+        for image_name, data in self._annotations():
             image_path = self.images_dir / image_name
             
             if not image_path.exists():
@@ -71,15 +124,11 @@ class AnnotationExporter:
             # 复制图片
             shutil.copy(image_path, images_dir / image_path.name)
             
-            # 转换标注
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-            
             yolo_labels = []
-            img_width = data.get("width", 1)
-            img_height = data.get("height", 1)
+            img_width = data.get("width") or 1
+            img_height = data.get("height") or 1
             
-            for shape in data.get("shapes", []):
+            for shape in bboxes_to_shapes(data, img_width, img_height):
                 label = shape.get("label", "")
                 shape_type = shape.get("shape_type", "rectangle")
                 
@@ -108,7 +157,7 @@ class AnnotationExporter:
                         yolo_labels.append(f"{class_id} {points_str}")
             
             # 保存标签文件
-            label_file = labels_dir / f"{image_name}.txt"
+            label_file = labels_dir / f"{image_path.stem}.txt"
             label_file.write_text("\n".join(yolo_labels))
         
         # 创建 data.yaml
@@ -122,13 +171,13 @@ names: {names_dict}
 """
         data_yaml.write_text(yaml_content, encoding="utf-8")
         
-        print(f"[EXPORT] YOLO 格式导出完成: {yolo_dir}")
+        logger.info(f"YOLO 格式导出完成: {yolo_dir}")
     
     def export_voc(self):
         """
         导出 VOC 格式 (XML)
         """
-        print(f"[EXPORT] 导出 VOC 格式")
+        logger.info("导出 VOC 格式")
         
         # 创建 VOC 目录结构
         voc_dir = self.output_dir / "VOCdevkit" / "VOC2007"
@@ -138,22 +187,8 @@ names: {names_dict}
         images_dir.mkdir(parents=True, exist_ok=True)
         annotations_dir.mkdir(parents=True, exist_ok=True)
         
-        # 获取所有标注文件
-        annotation_files = list(self.annotations_dir.glob("*.json"))
-        
-        # 提取所有类别
-        all_classes = set()
-        for ann_file in annotation_files:
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-                for shape in data.get("shapes", []):
-                    label = shape.get("label", "")
-                    if label:
-                        all_classes.add(label)
-        
         # 转换标注
-        for ann_file in annotation_files:
-            image_name = ann_file.stem
+        for image_name, data in self._annotations():
             image_path = self.images_dir / image_name
             
             if not image_path.exists():
@@ -166,15 +201,11 @@ names: {names_dict}
             with Image.open(image_path) as img:
                 width, height = img.size
             
-            # 读取标注
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-            
             # 创建 XML 根元素
             annotation = ET.Element("annotation")
             
             # 添加基本信息
-            ET.SubElement(annotation, "filename").text = image_name + image_path.suffix
+            ET.SubElement(annotation, "filename").text = image_path.name
             ET.SubElement(annotation, "folder").text = "VOC2007"
             
             size = ET.SubElement(annotation, "size")
@@ -183,7 +214,7 @@ names: {names_dict}
             ET.SubElement(size, "depth").text = "3"
             
             # 添加对象
-            for shape in data.get("shapes", []):
+            for shape in bboxes_to_shapes(data, width, height):
                 label = shape.get("label", "")
                 shape_type = shape.get("shape_type", "rectangle")
                 
@@ -206,33 +237,21 @@ names: {names_dict}
                     ET.SubElement(bndbox, "ymax").text = str(int(max(y1, y2)))
             
             # 保存 XML 文件
-            xml_file = annotations_dir / f"{image_name}.xml"
+            xml_file = annotations_dir / f"{image_path.stem}.xml"
             tree = ET.ElementTree(annotation)
             ET.indent(tree, space="  ")
             tree.write(xml_file, encoding="utf-8", xml_declaration=True)
         
-        print(f"[EXPORT] VOC 格式导出完成: {voc_dir}")
+        logger.info(f"VOC 格式导出完成: {voc_dir}")
     
     def export_coco(self):
         """
         导出 COCO 格式 (JSON)
         """
-        print(f"[EXPORT] 导出 COCO 格式")
-        
-        # 获取所有标注文件
-        annotation_files = list(self.annotations_dir.glob("*.json"))
+        logger.info("导出 COCO 格式")
         
         # 提取所有类别
-        all_classes = set()
-        for ann_file in annotation_files:
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-                for shape in data.get("shapes", []):
-                    label = shape.get("label", "")
-                    if label:
-                        all_classes.add(label)
-        
-        class_to_id = {name: idx for idx, name in enumerate(sorted(all_classes))}
+        class_to_id = self._class_to_id()
         
         # 创建 COCO 数据结构
         coco_data = {
@@ -244,8 +263,7 @@ names: {names_dict}
         annotation_id = 1
         
         # 转换标注
-        for image_id, ann_file in enumerate(annotation_files, start=1):
-            image_name = ann_file.stem
+        for image_id, (image_name, data) in enumerate(self._annotations(), start=1):
             image_path = self.images_dir / image_name
             
             if not image_path.exists():
@@ -258,17 +276,13 @@ names: {names_dict}
             # 添加图像信息
             coco_data["images"].append({
                 "id": image_id,
-                "file_name": image_name + image_path.suffix,
+                "file_name": image_path.name,
                 "width": width,
                 "height": height
             })
             
-            # 读取标注
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-            
             # 添加标注
-            for shape in data.get("shapes", []):
+            for shape in bboxes_to_shapes(data, width, height):
                 label = shape.get("label", "")
                 shape_type = shape.get("shape_type", "rectangle")
                 
@@ -306,13 +320,13 @@ names: {names_dict}
         with coco_file.open("w", encoding="utf-8") as f:
             json.dump(coco_data, f, indent=2, ensure_ascii=False)
         
-        print(f"[EXPORT] COCO 格式导出完成: {coco_file}")
+        logger.info(f"COCO 格式导出完成: {coco_file}")
     
     def export_dota(self):
         """
         导出 DOTA 格式（旋转框）
         """
-        print(f"[EXPORT] 导出 DOTA 格式")
+        logger.info("导出 DOTA 格式")
         
         # 创建 DOTA 目录
         dota_dir = self.output_dir / "DOTA"
@@ -322,12 +336,8 @@ names: {names_dict}
         images_dir.mkdir(parents=True, exist_ok=True)
         labels_dir.mkdir(parents=True, exist_ok=True)
         
-        # 获取所有标注文件
-        annotation_files = list(self.annotations_dir.glob("*.json"))
-        
         # 转换标注
-        for ann_file in annotation_files:
-            image_name = ann_file.stem
+        for image_name, data in self._annotations():
             image_path = self.images_dir / image_name
             
             if not image_path.exists():
@@ -336,17 +346,10 @@ names: {names_dict}
             # 复制图片
             shutil.copy(image_path, images_dir / image_path.name)
             
-            # 读取标注
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            img_width = data.get("width", 1)
-            img_height = data.get("height", 1)
-            
             # DOTA 格式每行一个对象: x1 y1 x2 y2 x3 y3 x4 y4 class difficulty
             label_lines = []
             
-            for shape in data.get("shapes", []):
+            for shape in bboxes_to_shapes(data):
                 label = shape.get("label", "")
                 shape_type = shape.get("shape_type", "rectangle")
                 
@@ -375,39 +378,26 @@ names: {names_dict}
                         label_lines.append(f"{' '.join(map(str, coords))} {label} 0")
             
             # 保存标签文件
-            label_file = labels_dir / f"{image_name}.txt"
+            label_file = labels_dir / f"{image_path.stem}.txt"
             label_file.write_text("\n".join(label_lines))
         
-        print(f"[EXPORT] DOTA 格式导出完成: {dota_dir}")
+        logger.info(f"DOTA 格式导出完成: {dota_dir}")
     
     def export_mask(self):
         """
         导出 Mask 格式（PNG 掩码）
         """
-        print(f"[EXPORT] 导出 Mask 格式")
+        logger.info("导出 Mask 格式")
         
         # 创建 Mask 目录
         mask_dir = self.output_dir / "masks"
         mask_dir.mkdir(parents=True, exist_ok=True)
         
-        # 获取所有标注文件
-        annotation_files = list(self.annotations_dir.glob("*.json"))
-        
         # 提取所有类别
-        all_classes = set()
-        for ann_file in annotation_files:
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-                for shape in data.get("shapes", []):
-                    label = shape.get("label", "")
-                    if label:
-                        all_classes.add(label)
-        
-        class_to_id = {name: idx for idx, name in enumerate(sorted(all_classes))}
+        class_to_id = self._class_to_id()
         
         # 转换标注
-        for ann_file in annotation_files:
-            image_name = ann_file.stem
+        for image_name, data in self._annotations():
             image_path = self.images_dir / image_name
             
             if not image_path.exists():
@@ -417,15 +407,11 @@ names: {names_dict}
             with Image.open(image_path) as img:
                 width, height = img.size
             
-            # 读取标注
-            with ann_file.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-            
             # 创建空白掩码
             mask = np.zeros((height, width), dtype=np.uint8)
             
             # 绘制掩码
-            for shape in data.get("shapes", []):
+            for shape in bboxes_to_shapes(data, width, height):
                 label = shape.get("label", "")
                 shape_type = shape.get("shape_type", "rectangle")
                 
@@ -453,23 +439,23 @@ names: {names_dict}
                         mask = np.maximum(mask, poly_mask)
             
             # 保存掩码
-            mask_file = mask_dir / f"{image_name}.png"
+            mask_file = mask_dir / f"{image_path.stem}.png"
             mask_image = Image.fromarray(mask)
             mask_image.save(mask_file)
         
-        print(f"[EXPORT] Mask 格式导出完成: {mask_dir}")
+        logger.info(f"Mask 格式导出完成: {mask_dir}")
 
 
-def export_all_formats(images_dir: Path, annotations_dir: Path, output_dir: Path):
+def export_all_formats(images_dir: Path, store, output_dir: Path):
     """
     导出所有支持的格式
     
     Args:
         images_dir: 图片目录
-        annotations_dir: 标注目录
+        store: 标注存储
         output_dir: 输出目录
     """
-    exporter = AnnotationExporter(images_dir, annotations_dir, output_dir)
+    exporter = AnnotationExporter(images_dir, store, output_dir)
     
     # 导出各种格式
     exporter.export_yolo()
@@ -478,14 +464,15 @@ def export_all_formats(images_dir: Path, annotations_dir: Path, output_dir: Path
     exporter.export_dota()
     exporter.export_mask()
     
-    print(f"[EXPORT] 所有格式导出完成: {output_dir}")
+    logger.info(f"所有格式导出完成: {output_dir}")
 
 
 if __name__ == "__main__":
     # 测试导出功能
+    from annotation_store import annotation_store
+    
     base_dir = Path(__file__).parent
     images_dir = base_dir / "images"
-    annotations_dir = base_dir / "annotations"
     output_dir = base_dir / "export"
     
-    export_all_formats(images_dir, annotations_dir, output_dir)
+    export_all_formats(images_dir, annotation_store, output_dir)
@@ -0,0 +1,323 @@
+"""
+图片目录索引 - 图片元数据（大小、尺寸、修改时间、内容哈希、标注数量和类别）
+
+元数据保存在 SQLite 中，上传和删除时增量更新，目录扫描只处理修改过的文件；标注数量和类别
+由标注存储（annotation_store）在同一个数据库中维护。列表接口基于索引做游标分页、过滤和排序，
+不再每次请求 glob 整个目录。
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from database import database, Database
+from request_logging import get_logger
+
+logger = get_logger("image_catalog")
+
+BASE_DIR = Path(__file__).parent
+
+# 目录扫描时读取图片头和计算哈希的线程数
+CATALOG_WORKERS = int(os.environ.get("YOLO_CATALOG_WORKERS", str(min(8, (os.cpu_count() or 4)))))
+# 每批写入数据库的行数
+CATALOG_WRITE_BATCH = 500
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+SORT_COLUMNS = {"name": "name", "mtime": "mtime", "size": "size", "annotations": "annotation_count"}
+MAX_PAGE_SIZE = 1000
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(path: Path) -> str:
+    """文件内容哈希（blake2b-128，与缩略图缓存使用相同的算法）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_dimensions(path: Path) -> Tuple[Optional[int], Optional[int]]:
+    """只读取图片头获取尺寸，不解码像素"""
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+def _encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        if isinstance(values, list) and len(values) == 2:
+            return values
+    except Exception:
+        pass
+    raise ValueError("无效的分页游标")
+
+
+class ImageCatalog:
+    """图片目录索引"""
+
+    def __init__(self, images_dir: Path, db: Database = database):
+        self.images_dir = Path(images_dir)
+        self.db = db
+
+    @property
+    def scanned(self) -> bool:
+        return self.db.get_meta("catalog_scanned_at") is not None
+
+    # ==================== 增量更新 ====================
+
+    def _describe(self, path: Path, stat: os.stat_result, compute_hash: bool = True) -> Dict[str, Any]:
+        width, height = image_dimensions(path)
+        return {
+            "name": path.name,
+            "size": stat.st_size,
+            "width": width,
+            "height": height,
+            "mtime": stat.st_mtime,
+            "mtime_ns": stat.st_mtime_ns,
+            "content_hash": content_hash(path) if compute_hash else None,
+            "indexed_at": time.time(),
+        }
+
+    @staticmethod
+    def _write_images(conn, rows: Iterable[Dict[str, Any]]):
+        # 新图片从标注统计中取标注数量，已有图片保留标注统计，只更新文件元数据
+        conn.executemany(
+            """INSERT INTO images (name, size, width, height, mtime, mtime_ns, content_hash, indexed_at, annotation_count)
+               VALUES (:name, :size, :width, :height, :mtime, :mtime_ns, :content_hash, :indexed_at,
+                       (SELECT COALESCE(SUM(count), 0) FROM image_classes WHERE image_name = :name))
+               ON CONFLICT(name) DO UPDATE SET size = excluded.size, width = excluded.width,
+                   height = excluded.height, mtime = excluded.mtime, mtime_ns = excluded.mtime_ns,
+                   content_hash = CASE
+                       WHEN excluded.content_hash IS NOT NULL THEN excluded.content_hash
+                       WHEN images.mtime_ns = excluded.mtime_ns AND images.size = excluded.size THEN images.content_hash
+                   END,
+                   indexed_at = excluded.indexed_at""",
+            list(rows))
+
+    def upsert_image(self, path: Path, content_hash_value: Optional[str] = None,
+                     dimensions: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        """
+        上传或覆盖图片后更新索引
+
+        Args:
+            path: 图片路径
+            content_hash_value: 调用方已经计算好的内容哈希（例如上传时边写边算）
+            dimensions: 调用方已经读取的 (宽, 高)
+        """
+        path = Path(path)
+        stat = path.stat()
+        row = self._describe(path, stat, compute_hash=content_hash_value is None)
+        if content_hash_value is not None:
+            row["content_hash"] = content_hash_value
+        if dimensions is not None:
+            row["width"], row["height"] = dimensions
+        with self.db.transaction() as conn:
+            self._write_images(conn, [row])
+        return self.get(path.name)
+
+    def remove_image(self, image_name: str):
+        """删除图片后从索引中移除（标注由 annotation_store.delete 删除）"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM images WHERE name = ?", (image_name,))
+
+    # ==================== 目录扫描 ====================
+
+    def scan(self, job=None, compute_hashes: bool = True) -> Dict[str, int]:
+        """
+        将索引与图片目录同步（只重新读取修改过的文件）
+
+        Args:
+            job: jobs.Job，作为后台任务运行时上报进度
+            compute_hashes: 是否计算内容哈希；快速扫描时跳过，稍后由后台扫描补全
+        """
+        conn = self.db.connection()
+        known = {row["name"]: (row["mtime_ns"], row["size"], row["content_hash"])
+                 for row in conn.execute("SELECT name, mtime_ns, size, content_hash FROM images")}
+
+        present: Dict[str, Tuple[Path, os.stat_result]] = {}
+        if self.images_dir.exists():
+            with os.scandir(self.images_dir) as entries:
+                for entry in entries:
+                    if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        present[entry.name] = (Path(entry.path), entry.stat())
+
+        changed = []
+        for name, (path, stat) in present.items():
+            previous = known.get(name)
+            if (previous is None or previous[0] != stat.st_mtime_ns or previous[1] != stat.st_size
+                    or (compute_hashes and previous[2] is None)):
+                changed.append((path, stat))
+        removed = [name for name in known if name not in present]
+        if job is not None:
+            job.update(total=len(changed), message=f"{len(present)} 张图片, {len(changed)} 张需要更新")
+
+        with self.db.transaction() as conn:
+            for start in range(0, len(removed), CATALOG_WRITE_BATCH):
+                chunk = [(name,) for name in removed[start:start + CATALOG_WRITE_BATCH]]
+                conn.executemany("DELETE FROM images WHERE name = ?", chunk)
+
+        # 读取图片头和计算哈希在线程池中进行，按批写入数据库（每批之间检查取消）
+        with ThreadPoolExecutor(max_workers=max(1, CATALOG_WORKERS), thread_name_prefix="catalog") as pool:
+            for start in range(0, len(changed), CATALOG_WRITE_BATCH):
+                if job is not None:
+                    job.check_cancelled()
+                chunk = changed[start:start + CATALOG_WRITE_BATCH]
+                rows = list(pool.map(lambda item: self._describe(item[0], item[1], compute_hashes), chunk))
+                with self.db.transaction() as conn:
+                    self._write_images(conn, rows)
+                if job is not None:
+                    job.advance(len(rows))
+
+        self.db.set_meta("catalog_scanned_at", str(time.time()))
+        summary = {"images": len(present), "updated": len(changed), "removed": len(removed)}
+        logger.info(f"扫描完成: {summary}")
+        return summary
+
+    # ==================== 查询 ====================
+
+    @staticmethod
+    def _row_to_dict(row, classes: Optional[List[str]] = None) -> Dict[str, Any]:
+        return {
+            "name": row["name"],
+            "size": row["size"],
+            "width": row["width"],
+            "height": row["height"],
+            "mtime": row["mtime"],
+            "content_hash": row["content_hash"],
+            "annotation_count": row["annotation_count"],
+            "annotated": row["annotation_count"] > 0,
+            "classes": classes or [],
+        }
+
+    def _classes_for(self, names: List[str]) -> Dict[str, List[str]]:
+        if not names:
+            return {}
+        placeholders = ",".join("?" * len(names))
+        result: Dict[str, List[str]] = {}
+        for row in self.db.connection().execute(
+                f"SELECT image_name, class_name FROM image_classes WHERE image_name IN ({placeholders}) "
+                f"ORDER BY class_name", names):
+            result.setdefault(row["image_name"], []).append(row["class_name"])
+        return result
+
+    def get(self, image_name: str) -> Optional[Dict[str, Any]]:
+        row = self.db.connection().execute("SELECT * FROM images WHERE name = ?", (image_name,)).fetchone()
+        if row is None:
+            return None
+        return self._row_to_dict(row, self._classes_for([image_name]).get(image_name))
+
+    def names(self) -> List[str]:
+        """所有图片名称（按名称排序）"""
+        return [row[0] for row in self.db.connection().execute("SELECT name FROM images ORDER BY name")]
+
+    def cached_hash(self, path: Path, stat: Optional[os.stat_result] = None) -> Optional[str]:
+        """索引中记录的内容哈希；图片不在索引中、尚未计算哈希或 mtime/大小已变化时返回 None"""
+        path = Path(path)
+        if path.parent.resolve() != self.images_dir.resolve():
+            return None
+        stat = stat or path.stat()
+        row = self.db.connection().execute(
+            "SELECT content_hash FROM images WHERE name = ? AND mtime_ns = ? AND size = ?",
+            (path.name, stat.st_mtime_ns, stat.st_size)).fetchone()
+        return row["content_hash"] if row is not None else None
+
+    def find_by_hash(self, content_hash_value: str) -> List[str]:
+        """内容哈希相同的图片名称（尚未计算哈希的图片不会被找到）"""
+        return [row[0] for row in self.db.connection().execute(
+            "SELECT name FROM images WHERE content_hash = ? ORDER BY name", (content_hash_value,))]
+
+    def query(self, limit: int = 100, cursor: Optional[str] = None, sort: str = "name", order: str = "asc",
+              status: Optional[str] = None, class_name: Optional[str] = None,
+              search: Optional[str] = None) -> Dict[str, Any]:
+        """
+        分页查询图片列表
+
+        Args:
+            limit: 每页数量（最多 MAX_PAGE_SIZE）
+            cursor: 上一页返回的 next_cursor
+            sort: name / mtime / size / annotations
+            order: asc / desc
+            status: annotated / unannotated
+            class_name: 只返回包含该类别标注的图片
+            search: 名称包含的文本
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {sort}，可选: {', '.join(SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order 只能是 asc 或 desc")
+        column = SORT_COLUMNS[sort]
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        where, params = [], []
+        if status == "annotated":
+            where.append("annotation_count > 0")
+        elif status == "unannotated":
+            where.append("annotation_count = 0")
+        elif status:
+            raise ValueError("status 只能是 annotated 或 unannotated")
+        if class_name:
+            where.append("name IN (SELECT image_name FROM image_classes WHERE class_name = ?)")
+            params.append(class_name)
+        if search:
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append("%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+
+        conn = self.db.connection()
+        filter_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        total = conn.execute(f"SELECT COUNT(*) FROM images {filter_sql}", params).fetchone()[0]
+
+        page_where, page_params = list(where), list(params)
+        if cursor:
+            last_value, last_name = _decode_cursor(cursor)
+            comparison = ">" if order == "asc" else "<"
+            if column == "name":
+                page_where.append(f"name {comparison} ?")
+                page_params.append(last_name)
+            else:
+                page_where.append(f"({column}, name) {comparison} (?, ?)")
+                page_params.extend([last_value, last_name])
+        page_sql = f"WHERE {' AND '.join(page_where)}" if page_where else ""
+        direction = "ASC" if order == "asc" else "DESC"
+        order_sql = "name " + direction if column == "name" else f"{column} {direction}, name {direction}"
+        rows = conn.execute(f"SELECT * FROM images {page_sql} ORDER BY {order_sql} LIMIT ?",
+                            page_params + [limit + 1]).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        classes = self._classes_for([row["name"] for row in rows])
+        items = [self._row_to_dict(row, classes.get(row["name"])) for row in rows]
+        next_cursor = _encode_cursor([rows[-1][column], rows[-1]["name"]]) if has_more and rows else None
+        return {"items": items, "next_cursor": next_cursor, "total": total}
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.db.connection().execute(
+            "SELECT COUNT(*) AS images, COALESCE(SUM(annotation_count > 0), 0) AS annotated, "
+            "COALESCE(SUM(size), 0) AS total_bytes, COALESCE(SUM(content_hash IS NULL), 0) AS pending_hashes "
+            "FROM images").fetchone()
+        scanned_at = self.db.get_meta("catalog_scanned_at")
+        return {
+            "images": row["images"],
+            "annotated": row["annotated"],
+            "unannotated": row["images"] - row["annotated"],
+            "total_mb": round(row["total_bytes"] / 1024 / 1024, 2),
+            "pending_hashes": row["pending_hashes"],
+            "scanned_at": float(scanned_at) if scanned_at else None,
+        }
+
+
+# 全局图片目录索引（与 main.IMAGES_DIR / ANNOTATIONS_DIR 为同一目录）
+image_catalog = ImageCatalog(BASE_DIR / "images")
@@ -0,0 +1,150 @@
+"""
+图片二进制传输 - 原始字节流、条件请求与 Range 分段下载
+
+替代 base64-in-JSON：按块从磁盘流式读取，带正确的 Content-Type、ETag / Last-Modified，
+支持 If-None-Match / If-Modified-Since 返回 304，以及单区间 Range 请求返回 206。
+"""
+import os
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 256 * 1024
+
+# Windows 上 mimetypes 可能缺少部分图片类型
+_EXTRA_TYPES = {".webp": "image/webp", ".bmp": "image/bmp", ".jpeg": "image/jpeg", ".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif"}
+
+
+def resolve_image_path(images_dir: Path, image_name: str) -> Path:
+    """解析图片路径，拒绝目录穿越，不存在时返回 404"""
+    file_path = (images_dir / image_name).resolve()
+    if file_path.parent != images_dir.resolve() or not file_path.is_file():
+        raise HTTPException(status_code=404, detail="图片不存在")
+    return file_path
+
+
+def media_type_for(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix in _EXTRA_TYPES:
+        return _EXTRA_TYPES[suffix]
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """由修改时间和大小构成的强 ETag（文件内容被覆盖时随之变化）"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    # If-None-Match 使用弱比较
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """判断条件请求是否可以返回 304"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= int(parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单区间 Range 头，返回闭区间 (start, end)
+
+    多区间请求返回 None（按规范可以忽略 Range 返回完整内容），区间不可满足时抛出 416。
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, _, end_text = ranges.strip().partition("-")
+    try:
+        if start_text == "":
+            # 后缀区间：最后 N 个字节
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            start, end = max(0, file_size - length), file_size - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+            end = min(end, file_size - 1)
+    except ValueError:
+        return None
+    if start >= file_size or start > end:
+        raise HTTPException(status_code=416, detail="请求的范围无效",
+                            headers={"Content-Range": f"bytes */{file_size}"})
+    return start, end
+
+
+def iter_file(path: Path, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """按块读取文件的 [start, end] 区间（同步生成器，由 Starlette 在线程池中迭代）"""
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: Path, media_type: Optional[str] = None,
+                  cache_control: str = "private, no-cache") -> Response:
+    """
+    以原始字节流返回文件，处理条件请求和 Range
+
+    Args:
+        request: 当前请求（读取 If-None-Match / If-Modified-Since / Range / If-Range）
+        path: 文件路径
+        media_type: Content-Type，默认按扩展名推断
+        cache_control: 默认 no-cache，客户端每次用 ETag 验证，文件被覆盖时立即生效
+    """
+    stat = path.stat()
+    etag = file_etag(stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control,
+    }
+    media_type = media_type or media_type_for(path)
+
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    file_size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and file_size > 0:
+        # If-Range 与当前版本不一致时忽略 Range，返回完整的新内容
+        if_range = request.headers.get("if-range")
+        if if_range is None or if_range.strip() in (etag, headers["Last-Modified"]):
+            byte_range = parse_range(range_header, file_size)
+
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(file_size)
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(iter_file(path, 0, file_size - 1), headers=headers, media_type=media_type)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file(path, start, end), status_code=206, headers=headers, media_type=media_type)
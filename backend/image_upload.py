@@ -0,0 +1,219 @@
+"""
+图片上传 - 流式写入临时文件、边写边计算内容哈希、按内容去重、读取文件头校验格式
+
+上传内容以固定大小的块写入图片目录下的临时目录（与图片目录在同一文件系统，最后原子重命名），
+每个上传只占用一个块的内存。写入完成后只读取图片头判断真实格式和尺寸（不解码像素），
+与已有图片内容相同时不再保存第二份，直接返回已有的图片名称；尺寸和哈希在上传时写入图片目录索引。
+"""
+import os
+import time
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from PIL import Image
+
+from image_catalog import image_catalog, ImageCatalog, IMAGE_EXTENSIONS
+from request_logging import get_logger
+
+logger = get_logger("image_upload")
+
+# ==================== 配置 ====================
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 单个文件的大小上限
+UPLOAD_MAX_BYTES = int(os.environ.get("YOLO_UPLOAD_MAX_MB", "512")) * 1024 * 1024
+# 批量上传时同时处理的文件数
+UPLOAD_WORKERS = int(os.environ.get("YOLO_UPLOAD_WORKERS", "4"))
+# 内容相同的图片是否只保存一份
+UPLOAD_DEDUP = os.environ.get("YOLO_UPLOAD_DEDUP", "1").lower() in ("1", "true", "yes")
+
+# 文件头识别出的格式 -> 允许的扩展名
+IMAGE_FORMATS = {
+    "JPEG": {".jpg", ".jpeg"},
+    "PNG": {".png"},
+    "BMP": {".bmp"},
+    "GIF": {".gif"},
+    "WEBP": {".webp"},
+}
+
+
+class UploadError(ValueError):
+    """文件名、格式或大小不符合要求"""
+
+
+def decode_filename(filename: Optional[str]) -> str:
+    """解码 MIME 编码的文件名（RFC 2047），并去掉路径部分"""
+    filename = filename or ""
+    if filename.startswith("=?"):
+        try:
+            import email.header
+            decoded = email.header.decode_header(filename)[0][0]
+            filename = decoded.decode("utf-8") if isinstance(decoded, bytes) else decoded
+        except Exception as e:
+            logger.warning(f"解码文件名失败，使用原始文件名: {e}")
+    # 客户端可能传入完整路径（Windows 或 POSIX）
+    filename = filename.replace("\\", "/").rsplit("/", 1)[-1].strip()
+    if not filename or filename in (".", ".."):
+        raise UploadError("文件名为空")
+    if Path(filename).suffix.lower() not in IMAGE_EXTENSIONS:
+        raise UploadError(f"只支持图片文件格式: {', '.join(sorted(IMAGE_EXTENSIONS))}")
+    return filename
+
+
+def sniff_image(path: Path) -> Tuple[str, Tuple[int, int]]:
+    """只读取文件头，返回 (格式, (宽, 高))；不是支持的图片时抛出 UploadError"""
+    try:
+        with Image.open(path) as image:
+            image_format, size = image.format, image.size
+    except Exception:
+        raise UploadError("文件内容不是有效的图片")
+    if image_format not in IMAGE_FORMATS:
+        raise UploadError(f"不支持的图片格式: {image_format}")
+    return image_format, size
+
+
+class PendingUpload:
+    """正在写入的临时文件（分块写入，同时计算哈希）"""
+
+    def __init__(self, temp_dir: Path, max_bytes: int = UPLOAD_MAX_BYTES):
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        self.path = temp_dir / f"{uuid.uuid4().hex}.part"
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._file: Optional[BinaryIO] = self.path.open("wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadError(f"文件超过大小上限 {self.max_bytes // 1024 // 1024} MB")
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def copy_from(self, source: BinaryIO):
+        """从文件对象分块复制（multipart 上传的临时文件）"""
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            self.write(chunk)
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    @property
+    def content_hash(self) -> str:
+        """与 image_catalog.content_hash 相同的算法（blake2b-128）"""
+        return self._digest.hexdigest()
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path.exists():
+            self.path.unlink()
+
+
+class ImageUploader:
+    """保存上传的图片并更新图片目录索引"""
+
+    def __init__(self, images_dir: Path, catalog: ImageCatalog = image_catalog, dedup: bool = UPLOAD_DEDUP):
+        self.images_dir = Path(images_dir)
+        # 放在图片目录下的隐藏子目录：与图片同一文件系统（可以原子重命名），且不会被目录扫描当作图片
+        self.temp_dir = self.images_dir / ".uploads"
+        self.catalog = catalog
+        self.dedup = dedup
+        # 去重检查和重命名需要原子执行，避免两个相同内容的并发上传都被保存
+        self._commit_lock = threading.Lock()
+        self.stats = {"uploaded": 0, "deduplicated": 0, "rejected": 0, "bytes": 0}
+
+    def begin(self) -> PendingUpload:
+        return PendingUpload(self.temp_dir)
+
+    def save_file(self, filename: str, source: BinaryIO, overwrite: bool = True) -> Dict[str, Any]:
+        """从文件对象保存一张图片（同步阻塞，应在线程池中调用），overwrite 的含义见 commit"""
+        filename = decode_filename(filename)
+        pending = self.begin()
+        try:
+            pending.copy_from(source)
+        except Exception:
+            pending.discard()
+            self.stats["rejected"] += 1
+            raise
+        return self.commit(pending, filename, overwrite)
+
+    def commit(self, pending: PendingUpload, filename: str, overwrite: bool = True) -> Dict[str, Any]:
+        """
+        校验并保存已写完的临时文件（同步阻塞，应在线程池中调用）
+
+        Args:
+            overwrite: 同名图片内容不同时是否替换；为 False 时改用 "import_<序号>_<文件名>" 保存，
+                       不会替换已有图片（批量导入使用）
+
+        Returns:
+            {"filename", "size", "width", "height", "format", "content_hash", "deduplicated", "duplicate_of",
+             "renamed_from"}
+        """
+        try:
+            pending.close()
+            if pending.size == 0:
+                raise UploadError("文件内容为空")
+            image_format, (width, height) = sniff_image(pending.path)
+            if Path(filename).suffix.lower() not in IMAGE_FORMATS[image_format]:
+                logger.warning(f"扩展名与实际格式不一致: {filename} 实际为 {image_format}")
+        except Exception:
+            pending.discard()
+            self.stats["rejected"] += 1
+            raise
+
+        digest = pending.content_hash
+        result = {"filename": filename, "size": pending.size, "width": width, "height": height,
+                  "format": image_format, "content_hash": digest, "deduplicated": False, "duplicate_of": None,
+                  "renamed_from": None}
+        target = self.images_dir / filename
+        with self._commit_lock:
+            if self.dedup:
+                duplicates = [name for name in self.catalog.find_by_hash(digest) if (self.images_dir / name).exists()]
+                if duplicates:
+                    pending.discard()
+                    existing = filename if filename in duplicates else duplicates[0]
+                    self.stats["deduplicated"] += 1
+                    return {**result, "filename": existing, "deduplicated": True, "duplicate_of": existing}
+            if not overwrite and target.exists() and filename not in self.catalog.find_by_hash(digest):
+                target = self._free_target(filename)
+                result.update(filename=target.name, renamed_from=filename)
+                logger.info(f"已存在内容不同的同名图片，改名保存: {filename} -> {target.name}")
+            os.replace(pending.path, target)
+            self.catalog.upsert_image(target, digest, (width, height))
+        self.stats["uploaded"] += 1
+        self.stats["bytes"] += pending.size
+        return result
+
+    def _free_target(self, filename: str) -> Path:
+        """图片目录中尚未使用的 "import_<序号>_<文件名>"（需在 _commit_lock 内调用）"""
+        index = 1
+        while (self.images_dir / f"import_{index}_{filename}").exists():
+            index += 1
+        return self.images_dir / f"import_{index}_{filename}"
+
+    def cleanup(self, max_age_seconds: float = 3600) -> int:
+        """删除中断的上传留下的临时文件（超过 max_age_seconds 未修改），返回删除的文件数"""
+        removed = 0
+        if self.temp_dir.exists():
+            cutoff = time.time() - max_age_seconds
+            for path in self.temp_dir.glob("*.part"):
+                try:
+                    if path.stat().st_mtime < cutoff:
+                        path.unlink()
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+# 全局图片上传（与 main.IMAGES_DIR 相同）
+image_uploader = ImageUploader(Path(__file__).parent / "images")
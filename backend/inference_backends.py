@@ -0,0 +1,347 @@
+"""
+推理后端 - 按权重格式选择 PyTorch / ONNX Runtime / OpenVINO，并应用各后端的 CPU 调优参数
+
+ultralytics 根据权重格式选择运行时（.pt 使用 PyTorch，.onnx 使用 ONNX Runtime，*_openvino_model 使用 OpenVINO），
+但会话参数都是默认值。模型加载后第一次推理建立 ultralytics 的预测器，之后由本模块按配置重建 ONNX Runtime 会话
+（线程数、图优化级别、内存池、线程绑定）或重新编译 OpenVINO 模型（性能模式、线程数、流数、CPU 绑定）；
+PyTorch 的线程数和进程的 CPU 亲和性在第一次加载模型时设置。每次推理按后端统计调用次数、图片数和耗时。
+"""
+import os
+import threading
+import importlib.util
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from request_logging import get_logger
+
+logger = get_logger("inference_backends")
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """解析 CPU 列表（"0-3,8,10-11"）"""
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+# ==================== 配置 ====================
+
+# 推理进程绑定的 CPU（如 "0-7"），空表示不限制；设置后各后端的默认线程数等于 CPU 数
+INFERENCE_CPUS = parse_cpu_list(os.environ.get("YOLO_INFERENCE_CPUS", ""))
+# 模型加载后的预热推理次数（第一次同时建立预测器和调优后的会话）
+WARMUP_RUNS = int(os.environ.get("YOLO_WARMUP_RUNS", "2"))
+
+# PyTorch 线程数（0 表示默认）
+TORCH_THREADS = int(os.environ.get("YOLO_TORCH_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.environ.get("YOLO_TORCH_INTEROP_THREADS", "0"))
+
+# ONNX Runtime 会话参数
+ORT_INTRA_THREADS = int(os.environ.get("YOLO_ORT_INTRA_THREADS", "0"))
+ORT_INTER_THREADS = int(os.environ.get("YOLO_ORT_INTER_THREADS", "0"))
+ORT_GRAPH_OPTIMIZATION = os.environ.get("YOLO_ORT_GRAPH_OPTIMIZATION", "all").lower()  # disable|basic|extended|all
+ORT_EXECUTION_MODE = os.environ.get("YOLO_ORT_EXECUTION_MODE", "sequential").lower()  # sequential|parallel
+ORT_CPU_MEM_ARENA = _env_flag("YOLO_ORT_CPU_MEM_ARENA", "1")
+ORT_MEM_PATTERN = _env_flag("YOLO_ORT_MEM_PATTERN", "1")
+# 空闲时工作线程是否自旋等待（降低延迟，但空闲时占用 CPU）
+ORT_SPINNING = _env_flag("YOLO_ORT_SPINNING", "1")
+# 把 intra-op 工作线程逐个绑定到 YOLO_INFERENCE_CPUS 中的 CPU
+ORT_PIN_THREADS = _env_flag("YOLO_ORT_PIN_THREADS", "1")
+
+# OpenVINO 编译参数
+OV_PERFORMANCE_HINT = os.environ.get("YOLO_OV_PERFORMANCE_HINT", "LATENCY").upper()  # LATENCY|THROUGHPUT
+OV_THREADS = int(os.environ.get("YOLO_OV_THREADS", "0"))
+OV_STREAMS = os.environ.get("YOLO_OV_STREAMS", "")  # 空表示由性能模式决定
+OV_CPU_PINNING = _env_flag("YOLO_OV_CPU_PINNING", "1")
+
+_ORT_GRAPH_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+# ==================== 进程级设置 ====================
+
+_process_lock = threading.Lock()
+_process_configured = False
+
+
+def configure_process():
+    """设置 CPU 亲和性和 PyTorch 线程数（只执行一次，在第一次加载模型时调用）"""
+    global _process_configured
+    with _process_lock:
+        if _process_configured:
+            return
+        _process_configured = True
+        if INFERENCE_CPUS:
+            if hasattr(os, "sched_setaffinity"):
+                try:
+                    os.sched_setaffinity(0, INFERENCE_CPUS)
+                    logger.info(f"推理进程绑定到 CPU: {INFERENCE_CPUS}")
+                except OSError as e:
+                    logger.warning(f"设置 CPU 亲和性失败: {e}")
+            else:
+                logger.warning("当前平台不支持设置 CPU 亲和性，忽略 YOLO_INFERENCE_CPUS")
+        try:
+            import torch
+        except ImportError:
+            return
+        _apply_torch_threads()
+        if TORCH_INTEROP_THREADS:
+            try:
+                torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+            except RuntimeError as e:
+                # 只能在第一次并行计算之前设置
+                logger.warning(f"设置 PyTorch inter-op 线程数失败: {e}")
+
+
+def _apply_torch_threads():
+    """设置 PyTorch intra-op 线程数（ultralytics 建立预测器时会重设为它自己的默认值，之后需要重新设置）"""
+    threads = TORCH_THREADS or len(INFERENCE_CPUS)
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def _runtime_of(model: Any) -> Any:
+    """ultralytics 预测器内部的运行时对象（AutoBackend.backend），预测器尚未建立时返回 None"""
+    predictor = getattr(model, "predictor", None)
+    return getattr(getattr(predictor, "model", None), "backend", None)
+
+
+# ==================== 后端 ====================
+
+class InferenceBackend:
+    """推理后端：由权重格式决定，模型加载后调整运行时参数"""
+
+    name = "ultralytics"
+    formats: Tuple[str, ...] = ()
+    module: Optional[str] = None
+
+    def available(self) -> bool:
+        return self.module is None or importlib.util.find_spec(self.module) is not None
+
+    def version(self) -> Optional[str]:
+        if not self.module or not self.available():
+            return None
+        try:
+            return getattr(__import__(self.module), "__version__", None)
+        except Exception:
+            return None
+
+    def options(self) -> Dict[str, Any]:
+        """当前生效的调优参数"""
+        return {}
+
+    def ensure_tuned(self, model: Any, weights: str) -> bool:
+        """
+        预测器建立（或重建）后应用调优参数，已调优时直接返回
+
+        Returns:
+            本次是否重新调优
+        """
+        runtime = _runtime_of(model)
+        if runtime is None or getattr(runtime, "_yolo_tuned", False):
+            return False
+        try:
+            _apply_torch_threads()
+            self._tune(runtime, weights)
+        except Exception as e:
+            logger.warning(f"{self.name} 调优失败，使用 ultralytics 默认参数: {e}")
+        runtime._yolo_tuned = True
+        return True
+
+    def _tune(self, runtime: Any, weights: str):
+        pass
+
+    def info(self) -> Dict[str, Any]:
+        return {"name": self.name, "formats": list(self.formats), "available": self.available(),
+                "version": self.version(), "options": self.options()}
+
+
+class TorchBackend(InferenceBackend):
+    """PyTorch（线程数在进程级设置）"""
+
+    name = "torch"
+    formats = ("pt", "torchscript")
+    module = "torch"
+
+    def options(self) -> Dict[str, Any]:
+        try:
+            import torch
+            return {"threads": torch.get_num_threads(), "interop_threads": torch.get_num_interop_threads()}
+        except ImportError:
+            return {}
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime：按配置重建 CPU 会话"""
+
+    name = "onnxruntime"
+    formats = ("onnx",)
+    module = "onnxruntime"
+
+    def _intra_threads(self) -> int:
+        return ORT_INTRA_THREADS or len(INFERENCE_CPUS)
+
+    def options(self) -> Dict[str, Any]:
+        return {
+            "intra_op_threads": self._intra_threads() or "auto",
+            "inter_op_threads": ORT_INTER_THREADS or "auto",
+            "graph_optimization": ORT_GRAPH_OPTIMIZATION,
+            "execution_mode": ORT_EXECUTION_MODE,
+            "cpu_mem_arena": ORT_CPU_MEM_ARENA,
+            "mem_pattern": ORT_MEM_PATTERN,
+            "spinning": ORT_SPINNING,
+            "pinned_cpus": INFERENCE_CPUS if ORT_PIN_THREADS else [],
+        }
+
+    def session_options(self):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        intra_threads = self._intra_threads()
+        if intra_threads:
+            options.intra_op_num_threads = intra_threads
+        if ORT_INTER_THREADS:
+            options.inter_op_num_threads = ORT_INTER_THREADS
+        level = _ORT_GRAPH_LEVELS.get(ORT_GRAPH_OPTIMIZATION, "ORT_ENABLE_ALL")
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+        options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if ORT_EXECUTION_MODE == "parallel"
+                                  else ort.ExecutionMode.ORT_SEQUENTIAL)
+        options.enable_cpu_mem_arena = ORT_CPU_MEM_ARENA
+        options.enable_mem_pattern = ORT_MEM_PATTERN
+        options.add_session_config_entry("session.intra_op.allow_spinning", "1" if ORT_SPINNING else "0")
+        options.add_session_config_entry("session.inter_op.allow_spinning", "1" if ORT_SPINNING else "0")
+        if ORT_PIN_THREADS and INFERENCE_CPUS and intra_threads > 1:
+            # 主线程之外的每个工作线程绑定一个 CPU（ONNX Runtime 的 CPU 编号从 1 开始）
+            cpus = [INFERENCE_CPUS[i % len(INFERENCE_CPUS)] for i in range(1, intra_threads)]
+            options.add_session_config_entry("session.intra_op_thread_affinities",
+                                             ";".join(str(cpu + 1) for cpu in cpus))
+        return options
+
+    def _tune(self, runtime: Any, weights: str):
+        if getattr(runtime, "format", "onnx") != "onnx" or getattr(runtime, "use_io_binding", False):
+            return  # OpenCV DNN 或 GPU IO 绑定的会话保持不变
+        import onnxruntime as ort
+        session = runtime.session
+        providers = session.get_providers()
+        if providers[0] != "CPUExecutionProvider":
+            return
+        runtime.session = ort.InferenceSession(weights, self.session_options(), providers=providers)
+        runtime.session_options = runtime.session.get_session_options()
+        logger.info(f"ONNX Runtime 会话已按配置重建: {Path(weights).name} {self.options()}")
+
+
+class OpenVinoBackend(InferenceBackend):
+    """OpenVINO：按配置重新编译 CPU 模型"""
+
+    name = "openvino"
+    formats = ("openvino",)
+    module = "openvino"
+
+    def config(self) -> Dict[str, Any]:
+        config: Dict[str, Any] = {"PERFORMANCE_HINT": OV_PERFORMANCE_HINT, "ENABLE_CPU_PINNING": OV_CPU_PINNING}
+        threads = OV_THREADS or len(INFERENCE_CPUS)
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        if OV_STREAMS:
+            config["NUM_STREAMS"] = OV_STREAMS
+        return config
+
+    def options(self) -> Dict[str, Any]:
+        return self.config()
+
+    def _tune(self, runtime: Any, weights: str):
+        compiled = runtime.ov_compiled_model
+        if list(compiled.get_property("EXECUTION_DEVICES")) != ["CPU"]:
+            return
+        ov = runtime.ov
+        path = Path(weights)
+        xml = path if path.is_file() else next(path.glob("*.xml"))
+        core = ov.Core()
+        runtime.compile_model = partial(core.compile_model, device_name="CPU", config=self.config())
+        ov_model = core.read_model(model=str(xml), weights=xml.with_suffix(".bin"))
+        if getattr(runtime, "read_model", None) is not None:
+            # 动态形状的 INT8 模型按输入形状重新编译（见 ultralytics OpenVINOBackend），保留当前形状
+            ov_model.reshape(compiled.input().get_partial_shape())
+        runtime.ov_compiled_model = runtime.compile_model(ov_model)
+        logger.info(f"OpenVINO 模型已按配置重新编译: {path.name} {self.config()}")
+
+
+BACKENDS: Dict[str, InferenceBackend] = {backend.name: backend for backend in
+                                         (TorchBackend(), OnnxRuntimeBackend(), OpenVinoBackend())}
+# 其他格式（TensorRT engine 等）使用 ultralytics 的默认设置
+GENERIC_BACKEND = InferenceBackend()
+
+
+def weights_format(weights: str) -> str:
+    """权重格式：pt / onnx / openvino / engine / torchscript ..."""
+    path = Path(str(weights))
+    if path.name.endswith("_openvino_model") or path.suffix.lower() == ".xml":
+        return "openvino"
+    return path.suffix.lower().lstrip(".") or "pt"
+
+
+def backend_for(weights: str) -> InferenceBackend:
+    """根据权重格式选择推理后端"""
+    fmt = weights_format(weights)
+    for backend in BACKENDS.values():
+        if fmt in backend.formats:
+            return backend
+    return GENERIC_BACKEND
+
+
+# ==================== 统计 ====================
+
+class BackendStats:
+    """按后端统计推理调用次数、图片数和耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, backend: str, images: int, seconds: float):
+        with self._lock:
+            stats = self._stats.setdefault(backend, {"calls": 0, "images": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["images"] += images
+            stats["seconds"] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "calls": int(stats["calls"]),
+                    "images": int(stats["images"]),
+                    "avg_ms_per_image": round(stats["seconds"] / stats["images"] * 1000, 2) if stats["images"] else 0.0,
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+backend_stats = BackendStats()
+
+
+def status() -> Dict[str, Any]:
+    """各后端的可用性、版本、调优参数和推理统计"""
+    stats = backend_stats.snapshot()
+    return {
+        "inference_cpus": INFERENCE_CPUS,
+        "warmup_runs": WARMUP_RUNS,
+        "backends": [dict(backend.info(), stats=stats.get(backend.name, {})) for backend in BACKENDS.values()],
+        "other": stats.get(GENERIC_BACKEND.name, {}),
+    }
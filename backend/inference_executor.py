@@ -0,0 +1,149 @@
+"""
+推理执行器 - 将阻塞的推理与 OpenCV 处理移出 asyncio 事件循环
+
+所有推理端点通过 inference_executor.run() 把同步函数提交到独立的有界线程池，
+并按模型限制并发数；排队的请求超过上限时直接返回 503，而不是拖住事件循环。
+"""
+import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from request_logging import get_logger
+
+logger = get_logger("inference_executor")
+
+# 推理线程池大小
+INFERENCE_WORKERS = int(os.environ.get("YOLO_INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 排队 + 执行中的请求上限，超过时返回 503
+INFERENCE_QUEUE_DEPTH = int(os.environ.get("YOLO_INFERENCE_QUEUE_DEPTH", "32"))
+# 每个模型的默认并发数（ultralytics 模型对象不是线程安全的，默认串行）
+MODEL_CONCURRENCY = int(os.environ.get("YOLO_MODEL_CONCURRENCY", "1"))
+
+
+def _parse_overrides(value: str) -> Dict[str, int]:
+    """解析 "yolo26n=2,opencv=4" 形式的按模型并发配置"""
+    overrides = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            try:
+                overrides[name.strip()] = max(1, int(limit))
+            except ValueError:
+                logger.warning(f"忽略无效的并发配置: {item}")
+    return overrides
+
+
+MODEL_CONCURRENCY_OVERRIDES = _parse_overrides(os.environ.get("YOLO_MODEL_CONCURRENCY_OVERRIDES", ""))
+
+
+class InferenceBusyError(HTTPException):
+    """推理队列已满"""
+
+    def __init__(self, queue_depth: int):
+        super().__init__(
+            status_code=503,
+            detail=f"推理服务繁忙，当前排队 {queue_depth} 个请求，请稍后重试",
+            headers={"Retry-After": "1"}
+        )
+
+
+class InferenceExecutor:
+    """有界推理线程池 + 按模型并发限制 + 队列深度限制"""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, max_queue_depth: int = INFERENCE_QUEUE_DEPTH,
+                 default_concurrency: int = MODEL_CONCURRENCY, overrides: Optional[Dict[str, int]] = None):
+        self.workers = max(1, workers)
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.default_concurrency = max(1, default_concurrency)
+        self.overrides = dict(overrides or {})
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.pending = 0
+        self.running = 0
+        self.stats = {"completed": 0, "failed": 0, "rejected": 0, "total_wait": 0.0, "total_run": 0.0}
+
+    def concurrency_for(self, model_key: str) -> int:
+        return self.overrides.get(model_key, self.default_concurrency)
+
+    def set_model_concurrency(self, model_key: str, limit: int):
+        """设置某个模型的并发数（对之后新建的信号量生效）"""
+        self.overrides[model_key] = max(1, limit)
+        self._semaphores.pop(model_key, None)
+
+    def _semaphore(self, model_key: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(model_key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.concurrency_for(model_key))
+            self._semaphores[model_key] = semaphore
+        return semaphore
+
+    def _run_timed(self, fn: Callable, args, kwargs):
+        with self._lock:
+            self.running += 1
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.stats["total_run"] += time.time() - start
+
+    async def run(self, fn: Callable, *args, model_key: str = "default", **kwargs) -> Any:
+        """
+        在推理线程池中执行同步函数
+
+        Args:
+            fn: 同步函数（推理、OpenCV 处理等）
+            model_key: 用于并发限制的模型标识，同一标识的调用受同一个信号量约束
+        """
+        with self._lock:
+            if self.pending >= self.max_queue_depth:
+                self.stats["rejected"] += 1
+                raise InferenceBusyError(self.pending)
+            self.pending += 1
+
+        enqueued = time.time()
+        try:
+            async with self._semaphore(model_key):
+                with self._lock:
+                    self.stats["total_wait"] += time.time() - enqueued
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._pool, functools.partial(self._run_timed, fn, args, kwargs))
+            self.stats["completed"] += 1
+            return result
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def status(self) -> Dict[str, Any]:
+        finished = self.stats["completed"] + self.stats["failed"]
+        return {
+            "workers": self.workers,
+            "max_queue_depth": self.max_queue_depth,
+            "pending": self.pending,
+            "running": self.running,
+            "default_concurrency": self.default_concurrency,
+            "model_concurrency": {key: self.concurrency_for(key) for key in self._semaphores},
+            "completed": self.stats["completed"],
+            "failed": self.stats["failed"],
+            "rejected": self.stats["rejected"],
+            "avg_wait_ms": round(self.stats["total_wait"] / finished * 1000, 2) if finished else 0.0,
+            "avg_run_ms": round(self.stats["total_run"] / finished * 1000, 2) if finished else 0.0,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局推理执行器
+inference_executor = InferenceExecutor(overrides=MODEL_CONCURRENCY_OVERRIDES)
@@ -0,0 +1,199 @@
+"""
+后台任务 - 长时间运行的任务注册表（缩略图预生成、批量导入等）
+
+任务在独立的线程池中执行，不占用推理执行器和 API 线程。每个任务有唯一 ID、状态、进度和结果，
+客户端通过 /api/jobs/{job_id} 轮询，并可以请求取消（任务函数在处理每一项之间检查 cancelled）。
+"""
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from request_logging import get_logger
+
+logger = get_logger("jobs")
+
+# 同时运行的后台任务数量，以及内存中保留的已结束任务数量
+JOB_WORKERS = int(os.environ.get("YOLO_JOB_WORKERS", "2"))
+JOB_HISTORY = int(os.environ.get("YOLO_JOB_HISTORY", "100"))
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = {COMPLETED, FAILED, CANCELLED}
+
+
+class JobCancelled(Exception):
+    """任务函数检测到取消请求时抛出"""
+
+
+class Job:
+    """单个后台任务的状态"""
+
+    def __init__(self, kind: str, params: Optional[Dict[str, Any]] = None, total: int = 0):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = PENDING
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.message = ""
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """在处理每一项之间调用，收到取消请求时中止任务"""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def update(self, done: Optional[int] = None, total: Optional[int] = None,
+               failed: Optional[int] = None, message: Optional[str] = None):
+        """更新进度（线程安全，可从任务内部的工作线程调用）"""
+        with self._lock:
+            if done is not None:
+                self.done = done
+            if total is not None:
+                self.total = total
+            if failed is not None:
+                self.failed = failed
+            if message is not None:
+                self.message = message
+
+    def advance(self, count: int = 1, failed: int = 0):
+        """完成 count 项（其中 failed 项失败）"""
+        with self._lock:
+            self.done += count
+            self.failed += failed
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.finished_at or time.time()
+            elapsed = finished - self.started_at if self.started_at else 0.0
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "params": self.params,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "progress": round(self.done / self.total, 4) if self.total else (1.0 if self.status == COMPLETED else 0.0),
+                "message": self.message,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "elapsed_seconds": round(elapsed, 3),
+                "items_per_second": round(self.done / elapsed, 2) if elapsed > 0 else 0.0,
+            }
+
+
+class JobManager:
+    """后台任务注册表"""
+
+    def __init__(self, max_workers: int = JOB_WORKERS, history: int = JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.history = history
+        # 专用执行通道：名称 -> 单线程执行器（不与共享线程池中的导入、缩略图等长任务排队）
+        self._lanes: Dict[str, ThreadPoolExecutor] = {}
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, params: Optional[Dict[str, Any]] = None,
+               total: int = 0, lane: Optional[str] = None, **kwargs) -> Job:
+        """
+        提交后台任务
+
+        Args:
+            kind: 任务类型（thumbnails、import 等）
+            fn: 任务函数，第一个参数为 Job，返回值作为任务结果
+            params: 任务参数（原样返回给客户端）
+            total: 预计处理的项数（可在任务内部通过 job.update 修正）
+            lane: 专用执行通道名称，为 None 时在共享线程池中执行
+        """
+        job = Job(kind, params, total)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+            if lane is None:
+                executor = self._executor
+            else:
+                executor = self._lanes.get(lane)
+                if executor is None:
+                    executor = self._lanes[lane] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"job-{lane}")
+        executor.submit(self._run, job, fn, args, kwargs)
+        logger.info(f"已提交任务 {job.id} ({kind})")
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs):
+        if job.cancelled:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = CANCELLED if job.cancelled else COMPLETED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            logger.exception(f"任务 {job.id} ({job.kind}) 失败: {e}")
+        finally:
+            job.finished_at = time.time()
+            logger.info(f"任务 {job.id} ({job.kind}) 结束: {job.status}, "
+                  f"{job.done}/{job.total}, 耗时 {job.finished_at - job.started_at:.1f}s")
+
+    def _trim(self):
+        """只保留最近 history 个已结束的任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in reversed(jobs) if kind is None or job.kind == kind]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """请求取消任务（排队中的任务直接取消，运行中的任务在下一项之前停止）"""
+        job = self.get(job_id)
+        if job is not None and job.status not in FINISHED_STATES:
+            job._cancel_event.set()
+            job.message = "正在取消"
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job._cancel_event.set()
+            lanes = list(self._lanes.values())
+        self._executor.shutdown(wait=False)
+        for executor in lanes:
+            executor.shutdown(wait=False)
+
+
+# 全局后台任务注册表
+job_manager = JobManager()
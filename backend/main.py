@@ -1,8 +1,8 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request, Response, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ConfigDict, Field, AliasChoices
-from typing import List, Optional, Dict, Any
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, AliasChoices, ValidationError
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 import os
 import json
 import base64
@@ -14,11 +14,30 @@ from pathlib import Path
 import httpx
 import asyncio
 import time
-from ultralytics import YOLO
 
-# 导入模型管理器
-# from models.model_manager import model_manager
-# 注意：model_manager 模块暂未实现，相关功能将被禁用
+# 导入模型管理器（所有推理端点共享的模型缓存）
+from model_manager import model_manager
+from batch_inference import BatchInferenceEngine, DEFAULT_BATCH_SIZE, DEFAULT_IMGSZ
+# 导入推理执行器（阻塞的推理在独立线程池中执行，不占用事件循环）
+from inference_executor import inference_executor, InferenceBusyError
+from micro_batcher import micro_batcher
+from result_decoding import decode_result, to_detections, results_to_detections
+from class_map import class_map_cache
+from model_index import model_index
+from image_transfer import resolve_image_path, file_response
+from thumbnails import thumbnail_service, ThumbnailError
+from jobs import job_manager
+from image_catalog import image_catalog
+from annotation_store import annotation_store, AnnotationConflict
+from image_upload import image_uploader, decode_filename, UploadError, UPLOAD_CHUNK_SIZE, UPLOAD_WORKERS
+from dataset_import import dataset_importer, ImportSourceError
+from dataset_builder import dataset_builder
+from dataset_split import parse_ratios
+from model_export import parse_variants, run_export_job, EXPORT_VARIANTS, EXPORT_FORMATS, EXPORT_DYNAMIC, EXPORT_VALIDATE
+from model_quantization import CALIBRATION_IMAGES, CALIBRATION_SEED
+from video_stream import video_sessions, VideoSessionError, VIDEO_JPEG_QUALITY, END as VIDEO_END
+from training_queue import training_queue, TrainingJobError, FINISHED_STATES as TRAINING_FINISHED_STATES
+from request_logging import RequestLoggingMiddleware, request_metrics, get_logger, payload_logging_enabled
 
 # ==================== 目录结构 ====================
 BASE_DIR = Path(__file__).parent
@@ -32,21 +51,7 @@ import api_extensions
 
 app = FastAPI(title="YOLO Annotator Backend")
 
-# 添加请求日志中间件
-@app.middleware("http")
-async def log_requests(request, call_next):
-    # 只对 POST 请求打印请求体
-    if request.method == "POST":
-        body = await request.body()
-        if body:
-            print(f"[DEBUG] {request.method} {request.url.path}")
-            try:
-                import json
-                print(f"[DEBUG] 请求体: {body.decode('utf-8')[:500]}")  # 只打印前500字符
-            except:
-                print(f"[DEBUG] 请求体 (无法解码): {len(body)} bytes")
-    response = await call_next(request)
-    return response
+logger = get_logger("api")
 
 # 允许跨域
 app.add_middleware(
@@ -57,16 +62,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求 ID、采样访问日志和按路由的延迟统计（最外层，不读取请求体）
+app.add_middleware(RequestLoggingMiddleware)
+
 # ==================== 注册 API 扩展端点 ====================
 
 # 模型管理 API
 app.get("/api/models")(api_extensions.get_available_models)
+app.get("/api/models/cache")(api_extensions.get_model_cache_info)
 app.get("/api/models/{model_name}/info")(api_extensions.get_model_info)
 app.post("/api/models/{model_name}/load")(api_extensions.load_model_api)
 app.post("/api/models/{model_name}/unload")(api_extensions.unload_model_api)
 app.post("/api/models/preload")(api_extensions.preload_models_api)
 app.post("/api/models/unload-all")(api_extensions.unload_all_models_api)
 
+# 推理执行器状态
+app.get("/api/inference/status")(api_extensions.get_inference_status)
+app.get("/api/inference/batching")(api_extensions.get_batching_status)
+app.get("/api/inference/backends")(api_extensions.get_backend_status)
+app.post("/api/inference/batching")(api_extensions.update_batching_config)
+
 # 批量推理 API
 app.post("/api/batch/detect")(api_extensions.batch_detect)
 
@@ -100,23 +115,10 @@ app.post("/api/grounding-dino/batch-detect")(api_extensions.batch_grounding_dino
 
 
 
-# 全局模型变量
-
-current_model = None
-
-pose_model = None  # 姿态估计模型
-
-segmentation_model = None  # 分割模型
-
-license_plate_model = None  # 车牌检测模型
-
 # 创建必要目录
 for dir_path in [IMAGES_DIR, ANNOTATIONS_DIR, MODELS_DIR, DATASETS_DIR]:
     dir_path.mkdir(exist_ok=True)
 
-# 全局变量
-current_model = None
-
 # ==================== 健康检查 ====================
 
 @app.get("/health")
@@ -158,6 +160,7 @@ class Annotation(BaseModel):
     width: int
     height: int
     bboxes: List[BoundingBox]
+    version: Optional[int] = None  # 读取时的版本号，保存时校验（乐观并发），不传则直接覆盖
 
 class TrainRequest(BaseModel):
     # 基础训练参数
@@ -200,6 +203,10 @@ class TrainRequest(BaseModel):
     close_mosaic: int = 10  # 在最后 N 个 epoch 关闭 mosaic 增强
     amp: bool = True      # 自动混合精度训练
     fraction: float = 1.0  # 使用数据集的比例
+    split_ratios: Optional[List[float]] = None  # train/val/test 划分比例，默认 YOLO_SPLIT_RATIOS
+    split_seed: Optional[str] = None  # 划分的哈希种子，默认 YOLO_SPLIT_SEED
+    export_formats: Optional[List[str]] = None  # 训练后导出的变体（onnx, openvino-int8 等），默认 YOLO_EXPORT_FORMATS
+    export_dynamic: Optional[bool] = None  # 导出为动态 batch，默认 YOLO_EXPORT_DYNAMIC
     
     # 损失权重
     box: float = 7.5      # 边界框损失权重
@@ -217,77 +224,205 @@ class DetectionResult(BaseModel):
 async def root():
     return {"message": "YOLO Annotator Backend API", "version": "1.0.0"}
 
-@app.get("/api/images")
-async def list_images():
-    """获取所有图片列表"""
+def list_image_paths() -> List[Path]:
+    """图片目录中的所有图片文件"""
     images = []
     for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
         images.extend(IMAGES_DIR.glob(ext))
-    return {"images": [img.name for img in images]}
+    return images
 
-@app.post("/api/images/upload")
-async def upload_image(file: UploadFile = File(...)):
-    """上传图片"""
-    print(f"[DEBUG] 收到上传请求, 原始文件名: {file.filename}, content_type: {file.content_type}")
+def _catalog_hash_job_running() -> bool:
+    return any(job["status"] in ("pending", "running") for job in job_manager.list("catalog-scan"))
 
-    try:
-        # 安全的文件名处理
-        filename = file.filename
+def refresh_image_catalog(full: bool = False):
+    """
+    同步图片目录索引
 
-        # 解码 MIME 编码的文件名 (RFC 2047)
-        if filename.startswith("=?"):
-            try:
-                import email.header
-                decoded = email.header.decode_header(filename)
-                filename = decoded[0][0]
-                if isinstance(filename, bytes):
-                    filename = filename.decode('utf-8')
-                print(f"[DEBUG] 解码后的文件名: {filename}")
-            except Exception as e:
-                print(f"[DEBUG] 解码文件名失败，使用原始文件名: {e}")
+    首次使用或图片目录有文件增删（目录修改时间变化）时做一次快速扫描（只读文件头），
+    内容哈希由后台任务补全；full=True 时直接提交完整扫描任务。
+    """
+    if full:
+        if not _catalog_hash_job_running():
+            return job_manager.submit("catalog-scan", image_catalog.scan)
+        return None
+    dir_mtime = str(IMAGES_DIR.stat().st_mtime_ns) if IMAGES_DIR.exists() else "0"
+    if image_catalog.scanned and image_catalog.db.get_meta("catalog_dir_mtime_ns") == dir_mtime:
+        return None
+    image_catalog.scan(compute_hashes=False)
+    image_catalog.db.set_meta("catalog_dir_mtime_ns", dir_mtime)
+    if image_catalog.stats()["pending_hashes"] and not _catalog_hash_job_running():
+        return job_manager.submit("catalog-scan", image_catalog.scan)
+    return None
 
-        if not filename:
-            print("[DEBUG] 文件名为空")
-            raise HTTPException(status_code=400, detail="文件名为空")
+@app.get("/api/images")
+async def list_images(limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+                      sort: str = "name", order: str = "asc", status: Optional[str] = None,
+                      class_name: Optional[str] = None, search: Optional[str] = None):
+    """
+    获取图片列表
 
-        # 使用文件扩展名验证
-        allowed_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
-        file_ext = Path(filename).suffix.lower()
+    不带 limit 时与旧版本兼容，只返回全部图片名称；带 limit 时按游标分页返回元数据
+    （尺寸、大小、修改时间、内容哈希、标注数量和类别），支持过滤和排序。
 
-        print(f"[DEBUG] 文件扩展名: {file_ext}, 允许的扩展名: {allowed_extensions}")
+    Args:
+        limit: 每页数量
+        cursor: 上一页返回的 next_cursor
+        sort: name / mtime / size / annotations
+        order: asc / desc
+        status: annotated / unannotated
+        class_name: 只返回包含该类别标注的图片
+        search: 名称包含的文本
+    """
+    await asyncio.to_thread(refresh_image_catalog)
+    if limit is None and not any([cursor, status, class_name, search]):
+        return {"images": await asyncio.to_thread(image_catalog.names)}
+    try:
+        page = await asyncio.to_thread(image_catalog.query, limit or 100, cursor, sort, order,
+                                       status, class_name, search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"images": [item["name"] for item in page["items"]], **page}
+
+@app.get("/api/images/catalog/status")
+async def get_image_catalog_status():
+    """图片目录索引状态（图片数、已标注数、待计算哈希数）以及各类别的标注数量"""
+    stats = await asyncio.to_thread(image_catalog.stats)
+    return {**stats, "classes": await asyncio.to_thread(annotation_store.class_counts)}
+
+@app.post("/api/images/rescan")
+async def rescan_images():
+    """重新扫描图片和标注目录（后台任务），用于文件被外部工具修改之后"""
+    removed = await asyncio.to_thread(image_uploader.cleanup)
+    if removed:
+        logger.info(f"已删除 {removed} 个中断上传的临时文件")
+    job = refresh_image_catalog(full=True)
+    if job is None:
+        return {"success": True, "message": "扫描任务已在运行"}
+    return {"success": True, "job_id": job.id}
 
-        if file_ext not in allowed_extensions:
-            print(f"[DEBUG] 不支持的文件扩展名: {file_ext}")
-            raise HTTPException(status_code=400, detail=f"只支持图片文件格式: {', '.join(allowed_extensions)}")
+@app.post("/api/images/upload")
+async def upload_image(file: UploadFile = File(...)):
+    """
+    上传图片（multipart）
 
-        print(f"[DEBUG] 文件名验证通过: {filename}, 扩展名: {file_ext}")
+    分块写入临时文件并计算内容哈希，按文件头校验格式；与已有图片内容相同时不重复保存，
+    返回的 filename 为已有图片的名称（deduplicated=true）。
+    """
+    logger.debug("收到上传请求", extra={"fields": {"filename": file.filename, "content_type": file.content_type}})
+    try:
+        result = await asyncio.to_thread(image_uploader.save_file, file.filename, file.file)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        error_detail = f"上传失败: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_detail)
+        raise HTTPException(status_code=500, detail=error_detail)
+    logger.info("图片已上传", extra={"fields": {"filename": result["filename"], "bytes": result["size"],
+                                               "deduplicated": result["deduplicated"]}})
+    return {"message": "上传成功", **result}
 
-        # 保存图片
-        file_path = IMAGES_DIR / filename
-        print(f"保存路径: {file_path}")
+@app.put("/api/images/upload/{filename}")
+async def upload_image_stream(filename: str, request: Request):
+    """
+    流式上传图片（请求体为图片原始字节，不经过 multipart 解析和缓冲）
 
-        content = await file.read()
-        print(f"读取到 {len(content)} 字节")
+    适合大尺寸扫描图：边接收边写入临时文件，内存占用与文件大小无关。
+    """
+    try:
+        filename = decode_filename(filename)
+        pending = await asyncio.to_thread(image_uploader.begin)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer.extend(chunk)
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(pending.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(pending.write, bytes(buffer))
+        result = await asyncio.to_thread(image_uploader.commit, pending, filename)
+    except UploadError as e:
+        pending.discard()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        pending.discard()
+        logger.error(f"流式上传失败 {filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+    logger.info("图片已上传", extra={"fields": {"filename": result["filename"], "bytes": result["size"],
+                                               "deduplicated": result["deduplicated"]}})
+    return {"message": "上传成功", **result}
+
+@app.post("/api/images/upload/batch")
+async def upload_images(files: List[UploadFile] = File(...)):
+    """
+    一次请求上传多张图片（同时处理 UPLOAD_WORKERS 张），单张失败不影响其它图片
 
-        if len(content) == 0:
-            raise HTTPException(status_code=400, detail="文件内容为空")
+    Returns:
+        uploaded / deduplicated / failed 数量，results 中按请求顺序给出每张图片的结果或错误
+    """
+    semaphore = asyncio.Semaphore(max(1, UPLOAD_WORKERS))
 
-        with file_path.open("wb") as f:
-            f.write(content)
+    async def save(file: UploadFile) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return {"success": True, **await asyncio.to_thread(image_uploader.save_file, file.filename, file.file)}
+            except UploadError as e:
+                return {"success": False, "filename": file.filename, "error": str(e)}
+            except Exception as e:
+                logger.error(f"批量上传失败 {file.filename}: {e}")
+                return {"success": False, "filename": file.filename, "error": str(e)}
+            finally:
+                await file.close()
+
+    results = await asyncio.gather(*(save(file) for file in files))
+    summary = {
+        "uploaded": sum(1 for r in results if r["success"] and not r["deduplicated"]),
+        "deduplicated": sum(1 for r in results if r["success"] and r["deduplicated"]),
+        "failed": sum(1 for r in results if not r["success"]),
+    }
+    logger.info("批量上传完成", extra={"fields": {"files": len(files), **summary}})
+    return {"success": summary["failed"] == 0, **summary, "results": results}
+
+@app.api_route("/api/images/{image_name}/raw", methods=["GET", "HEAD"])
+async def get_image_raw(image_name: str, request: Request):
+    """获取图片原始字节（流式传输，支持 ETag / Last-Modified 条件请求和 Range 分段）"""
+    file_path = resolve_image_path(IMAGES_DIR, image_name)
+    return file_response(request, file_path)
+
+@app.api_route("/api/images/{image_name}/thumbnail", methods=["GET", "HEAD"])
+async def get_image_thumbnail(image_name: str, request: Request, size: Optional[str] = None,
+                              format: Optional[str] = None):
+    """
+    获取图片缩略图（首次请求时生成并缓存）
 
-        print(f"文件保存成功: {filename}")
-        return {"message": "上传成功", "filename": filename}
-    except HTTPException:
-        raise
+    Args:
+        size: 尺寸名称（small/medium/large）或对应的像素值
+        format: jpeg 或 webp
+    """
+    file_path = resolve_image_path(IMAGES_DIR, image_name)
+    try:
+        thumbnail_path = await asyncio.to_thread(thumbnail_service.get, file_path, size, format)
+    except ThumbnailError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        import traceback
-        error_detail = f"上传失败: {str(e)}\n{traceback.format_exc()}"
-        print(error_detail)
-        raise HTTPException(status_code=500, detail=error_detail)
+        logger.error(f"缩略图生成失败 {image_name}: {e}")
+        raise HTTPException(status_code=500, detail=f"缩略图生成失败: {e}")
+    return file_response(request, thumbnail_path, thumbnail_service.media_type(thumbnail_service.resolve_format(format)))
+
+@app.get("/api/images/{image_name}/info")
+async def get_image_info(image_name: str):
+    """获取单张图片的元数据"""
+    info = await asyncio.to_thread(image_catalog.get, image_name)
+    if info is None:
+        raise HTTPException(status_code=404, detail="图片不存在")
+    return info
 
 @app.get("/api/images/{image_name}")
 async def get_image(image_name: str):
-    """获取图片（base64 编码）"""
+    """获取图片（base64 编码，保留用于兼容旧客户端，新代码请使用 /raw）"""
     file_path = IMAGES_DIR / image_name
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="图片不存在")
@@ -297,75 +432,375 @@ async def get_image(image_name: str):
 
     return {"image": img_data, "name": image_name}
 
+# ==================== 缩略图与后台任务 ====================
+
+class ThumbnailGenerateRequest(BaseModel):
+    image_names: Optional[List[str]] = None  # 为空时处理所有图片
+    sizes: Optional[List[str]] = None        # 为空时生成所有配置的尺寸
+    format: Optional[str] = None
+
+@app.post("/api/thumbnails/generate")
+async def generate_thumbnails(request: ThumbnailGenerateRequest):
+    """批量预生成缩略图（后台任务），返回任务 ID"""
+    try:
+        sizes = [thumbnail_service.resolve_size(size)[0] for size in (request.sizes or list(thumbnail_service.sizes))]
+        fmt = thumbnail_service.resolve_format(request.format)
+    except ThumbnailError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if request.image_names:
+        image_paths = [IMAGES_DIR / name for name in request.image_names if (IMAGES_DIR / name).is_file()]
+    else:
+        image_paths = list_image_paths()
+
+    job = job_manager.submit("thumbnails", thumbnail_service.pregenerate, image_paths, sizes, fmt,
+                             params={"sizes": sizes, "format": fmt}, total=len(image_paths))
+    return {"success": True, "job_id": job.id, "total": len(image_paths)}
+
+@app.get("/api/thumbnails/status")
+async def get_thumbnail_status():
+    """缩略图缓存状态（文件数、占用空间、命中/生成次数）"""
+    return await asyncio.to_thread(thumbnail_service.cache_info)
+
+@app.delete("/api/thumbnails")
+async def clear_thumbnails():
+    """清空缩略图缓存"""
+    removed = await asyncio.to_thread(thumbnail_service.clear)
+    return {"success": True, "removed": removed}
+
+@app.get("/api/jobs")
+async def list_jobs(kind: Optional[str] = None):
+    """后台任务列表（最新的在前）"""
+    return {"jobs": job_manager.list(kind)}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """后台任务状态和进度"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.to_dict()
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消后台任务"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.to_dict()
+
 @app.delete("/api/images/{image_name}")
 async def delete_image(image_name: str):
     """删除图片"""
     file_path = IMAGES_DIR / image_name
-    annotation_path = ANNOTATIONS_DIR / f"{image_name}.json"
 
     if file_path.exists():
         file_path.unlink()
-    if annotation_path.exists():
-        annotation_path.unlink()
+    await asyncio.to_thread(annotation_store.delete, image_name)
+    await asyncio.to_thread(image_catalog.remove_image, image_name)
 
     return {"message": "删除成功"}
 
-@app.get("/api/annotations/{image_name}")
-async def get_annotation(image_name: str):
-    """获取图片的标注"""
-    annotation_path = ANNOTATIONS_DIR / f"{image_name}.json"
-    if not annotation_path.exists():
-        return {"bboxes": []}
+# ==================== 请求统计 ====================
+
+@app.get("/api/requests/metrics")
+async def get_request_metrics():
+    """按路由统计的请求数量、错误数和延迟分布（p50/p95/p99 为所在直方图桶的上限）"""
+    return {
+        "since": request_metrics.started_at,
+        "logging": RequestLoggingMiddleware.config(),
+        "routes": request_metrics.snapshot(),
+    }
 
-    with annotation_path.open("r", encoding='utf-8') as f:
-        data = json.load(f)
+@app.delete("/api/requests/metrics")
+async def reset_request_metrics():
+    """清空请求延迟统计"""
+    request_metrics.reset()
+    return {"success": True}
+
+# ==================== 标注存储 ====================
+
+class AnnotationJsonRequest(BaseModel):
+    directory: Optional[str] = None  # JSON 目录，默认 annotations 目录
+    overwrite: bool = False          # 导入时是否覆盖已有标注
+
+@app.get("/api/annotation-store/status")
+async def get_annotation_store_status():
+    """标注存储状态（已标注图片数、标注框数、各类别数量）"""
+    stats = await asyncio.to_thread(annotation_store.stats)
+    return {**stats, "class_counts": await asyncio.to_thread(annotation_store.class_counts)}
+
+@app.post("/api/annotation-store/import")
+async def import_annotation_json(request: AnnotationJsonRequest):
+    """从 JSON 目录（每张图片一个 <图片名>.json）导入标注（后台任务）"""
+    directory = Path(request.directory) if request.directory else ANNOTATIONS_DIR
+    if not directory.is_dir():
+        raise HTTPException(status_code=400, detail=f"目录不存在: {directory}")
+    job = job_manager.submit("annotation-import", lambda job: annotation_store.import_json(directory, request.overwrite, job),
+                             params={"directory": str(directory), "overwrite": request.overwrite})
+    return {"success": True, "job_id": job.id}
+
+@app.post("/api/annotation-store/export")
+async def export_annotation_json(request: AnnotationJsonRequest):
+    """将标注导出为旧版 JSON 目录格式（后台任务）"""
+    directory = Path(request.directory) if request.directory else ANNOTATIONS_DIR
+    job = job_manager.submit("annotation-export", lambda job: annotation_store.export_json(directory, job),
+                             params={"directory": str(directory)})
+    return {"success": True, "job_id": job.id}
+
+def _annotation_etag(version: int) -> str:
+    return f'"{version}"'
+
+def _parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """If-Match 头中的版本号（"*" 或未提供时不校验）"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的 If-Match: {if_match}")
+
+def _conflict_error(e: AnnotationConflict, **extra) -> HTTPException:
+    return HTTPException(status_code=409, detail={
+        "message": str(e),
+        "image_name": e.image_name,
+        "expected_version": e.expected_version,
+        "current_version": e.current_version,
+        **extra,
+    })
+
+# ==================== 数据集导入 ====================
+
+class DatasetImportRequest(BaseModel):
+    source: str  # 服务器上的目录、zip 或 tar 包路径
+    overwrite_annotations: bool = False  # 图片已有标注时是否用导入的标签覆盖
+    restart: bool = False  # 忽略上次的进度，从头导入
+
+@app.post("/api/datasets/import")
+async def import_dataset(request: DatasetImportRequest):
+    """
+    从服务器上的目录、zip 或 tar 包批量导入图片和 YOLO / COCO / VOC 标签（后台任务）
 
-    print(f"[DEBUG] 加载到的标注数据:")
-    print(json.dumps(data, ensure_ascii=False, indent=2)[:1000])  # 只打印前 1000 个字符
-    
+    通过 /api/jobs/{job_id} 查询进度；任务取消或中断后再次提交同一来源会从上次完成的位置继续。
+    """
+    try:
+        source = await asyncio.to_thread(dataset_importer.validate_source, request.source)
+    except ImportSourceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = job_manager.submit("dataset-import", dataset_importer.run, str(source),
+                             request.overwrite_annotations, request.restart,
+                             params={"source": str(source), "overwrite_annotations": request.overwrite_annotations})
+    return {"success": True, "job_id": job.id}
+
+class DatasetSplitRequest(BaseModel):
+    ratios: Optional[List[float]] = None  # train/val/test，默认 YOLO_SPLIT_RATIOS
+    seed: Optional[str] = None
+    reset: bool = False  # 丢弃已有的划分文件，全部重新分配
+
+@app.get("/api/datasets/split")
+async def get_dataset_split():
+    """训练数据集划分：比例、种子，以及各子集和每个类别在各子集中的图片数量"""
+    image_classes = await asyncio.to_thread(annotation_store.image_class_map)
+    return dataset_builder.splitter.summary(image_classes)
+
+@app.post("/api/datasets/split")
+async def update_dataset_split(request: DatasetSplitRequest):
+    """
+    为尚未分配的图片分配子集；比例或种子改变，或 reset=true 时重新划分
+
+    已分配的图片保持原来的子集，下次准备数据集时直接使用划分文件。
+    """
+    try:
+        ratios = parse_ratios(request.ratios) if request.ratios is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    image_classes = await asyncio.to_thread(annotation_store.image_class_map)
+    await asyncio.to_thread(dataset_builder.splitter.assign, image_classes, ratios, request.seed, request.reset)
+    return dataset_builder.splitter.summary(image_classes)
+
+@app.get("/api/annotations/{image_name}")
+async def get_annotation(image_name: str, response: Response):
+    """获取图片的标注（ETag 为版本号，保存时通过 If-Match 或 version 字段校验）"""
+    data = await asyncio.to_thread(annotation_store.get, image_name)
+    if data is None:
+        response.headers["ETag"] = _annotation_etag(0)
+        return {"bboxes": []}
+    response.headers["ETag"] = _annotation_etag(data["version"])
+    if payload_logging_enabled():
+        logger.debug("读取标注", extra={"fields": {"image_name": image_name, "annotation": json.dumps(data, ensure_ascii=False)[:1000]}})
     return data
 
 @app.post("/api/annotations/{image_name}")
-async def save_annotation(image_name: str, annotation: Annotation):
-    """保存标注"""
-    try:
-        print(f"[DEBUG] ========== 保存标注开始 ==========")
-        print(f"[DEBUG] 图片={image_name}, 边界框数量={len(annotation.bboxes)}")
-        print(f"[DEBUG] 接收到的标注数据: 宽度={annotation.width}, 高度={annotation.height}")
-        print(f"[DEBUG] 边界框详情:")
-        for i, bbox in enumerate(annotation.bboxes):
-            print(f"  [{i}] class_id={bbox.class_id}, class_name='{bbox.class_name}', x={bbox.x}, y={bbox.y}")
-            print(f"       annotation_type={bbox.annotation_type}, confidence={bbox.confidence}")
-
-        # 过滤掉类别名称为空的标注框
-        valid_bboxes = [bbox for bbox in annotation.bboxes if bbox.class_name and bbox.class_name.strip()]
-        if len(valid_bboxes) != len(annotation.bboxes):
-            print(f"[WARNING] 过滤掉了 {len(annotation.bboxes) - len(valid_bboxes)} 个类别名称为空的标注框")
-            print(f"[DEBUG] 过滤后的标注框数量: {len(valid_bboxes)}")
-
-        annotation_path = ANNOTATIONS_DIR / f"{image_name}.json"
-
-        # 确保目录存在
-        ANNOTATIONS_DIR.mkdir(parents=True, exist_ok=True)
-
-        # 使用 Pydantic 的 model_dump_json() 方法序列化
-        json_str = annotation.model_dump_json(indent=2, ensure_ascii=False)
-        
-        print(f"[DEBUG] 即将保存的 JSON 数据 (前 1500 字符):")
-        print(json_str[:1500])
-        
-        with annotation_path.open("w", encoding='utf-8') as f:
-            f.write(json_str)
+async def save_annotation(image_name: str, annotation: Annotation, response: Response,
+                          if_match: Optional[str] = Header(None)):
+    """
+    保存标注
 
-        print(f"[DEBUG] 标注保存成功: {annotation_path}")
-        print(f"[DEBUG] ========== 保存标注结束 ==========")
-        return {"message": "保存成功"}
+    请求体中的 version 或 If-Match 头为读取时的版本号，与当前版本不一致时返回 409（标注已被其他人或后台任务修改），
+    都不提供时直接覆盖。
+    """
+    expected_version = annotation.version if annotation.version is not None else _parse_if_match(if_match)
+    try:
+        # 类别名称为空的标注框不计入类别统计，也不会进入训练集
+        empty_count = sum(1 for bbox in annotation.bboxes if not (bbox.class_name and bbox.class_name.strip()))
+        if empty_count:
+            logger.warning("标注包含类别名称为空的标注框", extra={"fields": {"image_name": image_name, "count": empty_count}})
+
+        # 使用 Pydantic 的 model_dump() 方法序列化（字段名与原 JSON 文件一致）
+        document = annotation.model_dump(by_alias=True)
+        if payload_logging_enabled():
+            logger.debug("保存标注", extra={"fields": {"image_name": image_name, "annotation": json.dumps(document, ensure_ascii=False)[:1500]}})
+
+        # 单个事务内替换该图片的标注框，并更新类别计数和版本号
+        version = await asyncio.to_thread(annotation_store.save, image_name, document, expected_version)
+
+        logger.debug("标注已保存", extra={"fields": {"image_name": image_name, "bboxes": len(document["bboxes"]), "version": version}})
+        response.headers["ETag"] = _annotation_etag(version)
+        return {"message": "保存成功", "version": version}
+    except AnnotationConflict as e:
+        logger.info("标注版本冲突", extra={"fields": {"image_name": image_name, "expected": e.expected_version, "current": e.current_version}})
+        raise _conflict_error(e)
     except Exception as e:
         import traceback
         error_detail = f"保存标注失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
+# ==================== 批量标注读写 ====================
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# NDJSON 响应每块的大致字节数（逐行输出时每行都要切换一次线程）
+NDJSON_CHUNK_BYTES = 64 * 1024
+
+class BulkAnnotationQuery(BaseModel):
+    image_names: List[str]
+    format: Optional[str] = None  # json / ndjson，默认按 Accept 头判断
+
+def _wants_ndjson(request: Request, format: Optional[str]) -> bool:
+    if format:
+        if format not in ("json", "ndjson"):
+            raise HTTPException(status_code=400, detail="format 只能是 json 或 ndjson")
+        return format == "ndjson"
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def _bulk_documents(image_names: Optional[List[str]], class_name: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    按顺序产出 (图片名称, 标注)
+
+    指定了图片列表时每张图片都会产出一项，没有标注的图片返回空 bboxes（与单张 GET 一致）。
+    """
+    if image_names is None:
+        yield from annotation_store.iter_documents(annotation_store.image_names(class_name))
+        return
+    documents = annotation_store.iter_documents(image_names)
+    pending = next(documents, None)
+    for image_name in image_names:
+        if pending is not None and pending[0] == image_name:
+            yield pending
+            pending = next(documents, None)
+        else:
+            yield image_name, {"image_name": image_name, "bboxes": []}
+
+def _ndjson_stream(documents: Iterator[Tuple[str, Dict[str, Any]]]) -> Iterator[bytes]:
+    """每行一张图片的标注，按约 NDJSON_CHUNK_BYTES 合并输出"""
+    buffer = []
+    size = 0
+    for _, document in documents:
+        line = (json.dumps(document, ensure_ascii=False) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        if size >= NDJSON_CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+async def _bulk_annotation_response(request: Request, image_names: Optional[List[str]],
+                                    format: Optional[str], class_name: Optional[str] = None):
+    if _wants_ndjson(request, format):
+        return StreamingResponse(_ndjson_stream(_bulk_documents(image_names, class_name)), media_type=NDJSON_MEDIA_TYPE)
+    documents = await asyncio.to_thread(lambda: [document for _, document in _bulk_documents(image_names, class_name)])
+    return {"annotations": documents, "count": len(documents)}
+
+@app.get("/api/batch/annotations")
+async def bulk_get_all_annotations(request: Request, format: Optional[str] = None, class_name: Optional[str] = None):
+    """
+    读取所有标注（一次请求代替逐张 GET）
+
+    Args:
+        format: json（默认）或 ndjson（流式输出，每行一张图片）；也可以通过 Accept: application/x-ndjson 指定
+        class_name: 只返回包含该类别的图片
+    """
+    return await _bulk_annotation_response(request, None, format, class_name)
+
+@app.post("/api/batch/annotations/query")
+async def bulk_get_annotations(query: BulkAnnotationQuery, request: Request):
+    """按图片名称列表读取标注，结果顺序与请求一致"""
+    return await _bulk_annotation_response(request, query.image_names, query.format)
+
+@app.post("/api/batch/annotations")
+async def bulk_save_annotations(request: Request):
+    """
+    批量保存标注（单个事务，任何一张校验或写入失败时全部不保存）
+
+    请求体可以是 {"annotations": [...]}、标注数组，或 NDJSON（Content-Type: application/x-ndjson，每行一张图片）。
+    每张图片的标注格式与 POST /api/annotations/{image_name} 相同，按 image_name 替换原有标注；
+    带 version 字段的项会校验版本号，任何一项冲突时返回 409 并且全部不保存。
+    """
+    documents: Dict[str, Dict[str, Any]] = {}
+    expected_versions: Dict[str, int] = {}
+    shape_count = 0
+
+    def add(index: int, item: Any):
+        nonlocal shape_count
+        try:
+            annotation = Annotation.model_validate(item)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"index": index, "errors": e.errors(include_url=False)})
+        documents[annotation.image_name] = annotation.model_dump(by_alias=True)
+        if annotation.version is not None:
+            expected_versions[annotation.image_name] = annotation.version
+        shape_count += len(annotation.bboxes)
+
+    try:
+        if NDJSON_MEDIA_TYPE in request.headers.get("content-type", ""):
+            # 边接收边解析，不需要先缓冲整个请求体
+            index = 0
+            remainder = b""
+            async for chunk in request.stream():
+                lines = (remainder + chunk).split(b"\n")
+                remainder = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        add(index, json.loads(line))
+                        index += 1
+            if remainder.strip():
+                add(index, json.loads(remainder))
+        else:
+            payload = json.loads(await request.body())
+            items = payload.get("annotations", []) if isinstance(payload, dict) else payload
+            if not isinstance(items, list):
+                raise HTTPException(status_code=400, detail="请求体应为标注数组或 {\"annotations\": [...]}")
+            for index, item in enumerate(items):
+                add(index, item)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"JSON 解析失败: {e}")
+
+    try:
+        saved = await asyncio.to_thread(annotation_store.save_many, documents, expected_versions)
+    except AnnotationConflict as e:
+        logger.info(f"批量保存版本冲突: {e}")
+        raise _conflict_error(e, saved=0)
+    except Exception as e:
+        logger.exception(f"批量保存标注失败: {e}")
+        raise HTTPException(status_code=500, detail=f"批量保存标注失败: {e}")
+    logger.info("批量保存标注", extra={"fields": {"images": saved, "bboxes": shape_count}})
+    return {"success": True, "saved": saved, "shapes": shape_count}
+
 @app.get("/api/check-cuda")
 async def check_cuda():
     """检查CUDA是否可用，并提供详细的诊断信息"""
@@ -442,9 +877,7 @@ async def check_cuda():
                 "reason": "; ".join(reasons)
             }
     except Exception as e:
-        import traceback
-        print(f"[ERROR] 检查CUDA失败: {e}")
-        print(f"[ERROR] 详细错误: {traceback.format_exc()}")
+        logger.exception(f"检查CUDA失败: {e}")
         return {
             "available": False,
             "pytorch_version": "Unknown",
@@ -460,542 +893,195 @@ async def check_cuda():
         }
 
 @app.post("/api/train")
-async def train_model(request: TrainRequest, background_tasks: BackgroundTasks):
-    """开始训练模型"""
+async def train_model(request: TrainRequest):
+    """
+    开始训练模型（加入训练队列）
+
+    立即返回训练任务 ID；任务按提交顺序依次执行（先在后台任务中准备数据集，再在独立进程中训练），
+    通过 /api/training/jobs/{job_id} 查询或 /api/training/jobs/{job_id}/events 订阅进度。
+    """
     # 检查是否有标注数据
-    annotation_files = list(ANNOTATIONS_DIR.glob("*.json"))
-    if not annotation_files:
+    annotation_count = annotation_store.count()
+    if not annotation_count:
         raise HTTPException(status_code=400, detail="没有标注数据，请先标注图片")
 
     # 如果只有 1 个标注文件，给用户警告
-    if len(annotation_files) == 1:
-        print("[WARNING] 只有 1 个标注文件，将全部用于训练，没有验证集。建议至少标注 2 张图片。")
-
-    # 准备 YOLO 数据集格式（传入所有类别和任务类型）
-    dataset_path = prepare_yolo_dataset(request.classes, request.task_type)
-
-    # 开始训练（后台任务）- 传入完整的 request 对象
-    background_tasks.add_task(run_training, dataset_path, request)
-
-    return {"message": "训练已开始", "dataset_path": str(dataset_path)}
-
-def prepare_yolo_dataset(all_classes: List[str] = None, task_type: str = "detection"):
-    """准备 YOLO 格式的数据集"""
-    print(f"[DEBUG] 开始准备 YOLO 数据集，任务类型: {task_type}...")
-
-    # 创建数据集目录
-    train_images = DATASETS_DIR / "train" / "images"
-    train_labels = DATASETS_DIR / "train" / "labels"
-    val_images = DATASETS_DIR / "val" / "images"
-    val_labels = DATASETS_DIR / "val" / "labels"
-
-    for path in [train_images, train_labels, val_images, val_labels]:
-        path.mkdir(parents=True, exist_ok=True)
-
-    # 复制图片和标签（简单起见，80% 训练，20% 验证）
-    annotations = list(ANNOTATIONS_DIR.glob("*.json"))
-    if not annotations:
-        print("[WARNING] 没有找到标注文件")
-        return DATASETS_DIR
+    if annotation_count == 1:
+        logger.warning("只有 1 个标注文件，将全部用于训练，没有验证集。建议至少标注 2 张图片。")
 
-    # 如果只有 1 个标注文件，全部放入训练集
-    if len(annotations) == 1:
-        train_count = 1
-    else:
-        train_count = int(len(annotations) * 0.8)
-    print(f"[DEBUG] 找到 {len(annotations)} 个标注文件，训练集: {train_count}, 验证集: {len(annotations) - train_count}")
-
-    # 强制从标注中提取类别（支持中文等非英文类别）
-    # 收集所有类别
-    class_names = set()
-    # 保存原始标注数据，用于后续重新映射
-    original_annotations = {}
-
-    for i, ann_file in enumerate(annotations):
-        image_name = ann_file.stem
-        image_path = IMAGES_DIR / image_name
-        if not image_path.exists():
-            print(f"[WARNING] 图片不存在: {image_path}")
-            continue
-
-        with ann_file.open("r", encoding='utf-8') as f:
-            ann_data = json.load(f)
-
-        # 保存原始标注
-        original_annotations[image_name] = ann_data.get("bboxes", [])
-
-        # 收集类别名称
-        for bbox in ann_data.get("bboxes", []):
-            class_name = bbox.get("class_name", "").strip()
-            # 过滤掉空字符串和空白字符
-            if class_name:
-                class_names.add(class_name)
-
-    # 按类别名称排序，创建类别映射
-    sorted_classes = sorted([name for name in class_names if name.strip()])
-    class_to_id = {name: idx for idx, name in enumerate(sorted_classes)}
-    num_classes = len(sorted_classes)
-    print(f"[DEBUG] 从标注提取的类别: {sorted_classes}")
-    print(f"[DEBUG] 类别映射: {class_to_id}")
-    print(f"[DEBUG] 类别数量: {num_classes}")
-
-    # 使用新的类别映射转换标注
-    for i, ann_file in enumerate(annotations):
-        image_name = ann_file.stem
-        if image_name not in original_annotations:
-            continue
-
-        image_path = IMAGES_DIR / image_name
-        if not image_path.exists():
-            continue
-
-        # 转换标注格式为 YOLO 格式，使用新的 class_id
-        yolo_labels = []
-        for bbox in original_annotations[image_name]:
-            class_name = bbox.get("class_name", f"class_{bbox['class_id']}")
-            new_class_id = class_to_id.get(class_name, 0)
-            
-            # 检查 class_id 是否超出范围
-            if new_class_id >= num_classes:
-                print(f"[WARNING] 类别 '{class_name}' 的 ID {new_class_id} 超出范围，将使用 0")
-                new_class_id = 0
-            
-            # 根据任务类型生成不同的标签格式
-            if task_type == "segmentation" and bbox.get("annotation_type") == "polygon":
-                # 分割任务：多边形格式
-                # YOLO 分割格式: class_id x1 y1 x2 y2 ... xn yn (归一化坐标)
-                points = bbox.get("points", [])
-                if len(points) >= 3:
-                    points_str = " ".join([f"{p[0]:.6f} {p[1]:.6f}" for p in points])
-                    yolo_labels.append(f"{new_class_id} {points_str}")
-                else:
-                    # 多边形点数不足，跳过
-                    print(f"[WARNING] 多边形点数不足: {len(points)}")
-            elif task_type == "obb" and bbox.get("annotation_type") == "obb":
-                # OBB 任务：旋转框格式
-                # YOLO OBB 格式: class_id x_center y_center width height angle (弧度)
-                angle = bbox.get("angle", 0.0)
-                yolo_labels.append(f"{new_class_id} {bbox['x']:.6f} {bbox['y']:.6f} {bbox['width']:.6f} {bbox['height']:.6f} {angle:.6f}")
-            else:
-                # 检测任务（默认）：边界框格式
-                yolo_labels.append(f"{new_class_id} {bbox['x']:.6f} {bbox['y']:.6f} {bbox['width']:.6f} {bbox['height']:.6f}")
-
-        # 复制到训练集或验证集
-        if i < train_count:
-            dest_img = train_images / f"{image_name}{image_path.suffix}"
-            dest_lbl = train_labels / f"{image_name}.txt"
-        else:
-            dest_img = val_images / f"{image_name}{image_path.suffix}"
-            dest_lbl = val_labels / f"{image_name}.txt"
-
-        import shutil
-        shutil.copy(image_path, dest_img)
-        dest_lbl.write_text("\n".join(yolo_labels))
-
-    # 检查哪些类别没有标注数据
-    used_classes = set()
-    for bbox_list in original_annotations.values():
-        for bbox in bbox_list:
-            used_classes.add(bbox.get("class_name", ""))
-    
-    unused_classes = set(sorted_classes) - used_classes
-    if unused_classes:
-        print(f"[WARNING] 以下类别没有标注数据: {sorted(unused_classes)}")
-        print(f"[WARNING] 模型将无法检测这些类别，建议为每个类别至少标注 5-10 张图片")
-
-    # 检查验证集是否为空
-    val_has_images = len(list(val_images.glob("*.jpg"))) + len(list(val_images.glob("*.jpeg"))) + len(list(val_images.glob("*.png"))) > 0
-
-    # 创建 data.yaml
-    data_yaml = DATASETS_DIR / "data.yaml"
-    # 构建 YAML 格式的类别映射
-    names_dict = {i: name for i, name in enumerate(sorted_classes)}
-    
-    # 根据任务类型设置不同的 YAML 配置
-    task_key = "segment" if task_type == "segmentation" else ("obb" if task_type == "obb" else "detect")
-    
-    if val_has_images:
-        # 有验证集，正常配置
-        yaml_content = f"""path: {DATASETS_DIR.absolute()}
-train: train/images
-val: val/images
-nc: {num_classes}
-names: {names_dict}
-task: {task_key}
-"""
-        print(f"[DEBUG] 验证集非空，使用正常配置")
-    else:
-        # 没有验证集，val 指向训练集
-        yaml_content = f"""path: {DATASETS_DIR.absolute()}
-train: train/images
-val: train/images
-nc: {num_classes}
-names: {names_dict}
-task: {task_key}
-"""
-        print(f"[WARNING] 验证集为空，将训练集作为验证集（不推荐用于实际生产环境）")
-
-    data_yaml.write_text(yaml_content, encoding='utf-8')
-    print(f"[DEBUG] data.yaml 已创建: {data_yaml}")
-    print(f"[DEBUG] data.yaml 内容:\n{yaml_content}")
-
-    return DATASETS_DIR
-
-def run_training(dataset_path: Path, request: TrainRequest):
+    try:
+        if request.split_ratios is not None:
+            parse_ratios(request.split_ratios)
+        parse_variants(request.export_formats)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    training_queue.start(_prepare_training_dataset)
+    job = await asyncio.to_thread(training_queue.submit, request.model_dump())
+    return {"message": "训练已加入队列", "job_id": job["id"], "run_dir": job["run_dir"], "dataset_path": str(DATASETS_DIR)}
+
+def _prepare_training_dataset(job, params: Dict[str, Any]):
+    """后台任务：为训练任务准备数据集"""
+    dataset_path = prepare_yolo_dataset(params.get("classes"), params.get("task_type", "detection"),
+                                        params.get("split_ratios"), params.get("split_seed"), job=job)
+    return {"dataset_path": str(dataset_path)}
+
+def prepare_yolo_dataset(all_classes: List[str] = None, task_type: str = "detection",
+                         split_ratios: Optional[List[float]] = None, split_seed: Optional[str] = None, job=None):
     """
-    执行训练
-    
-    Args:
-        dataset_path: 数据集路径
-        request: 训练请求对象，包含所有训练参数
+    准备 YOLO 格式的数据集（增量：只处理变化的标注和图片，见 dataset_builder）
+
+    类别从标注中提取并按名称排序（支持中文等非英文类别），all_classes 仅为兼容保留。
+    train/val/test 划分按图片名称哈希分层分配并记录在 datasets/splits.json 中（见 dataset_split）。
     """
+    logger.info(f"开始准备 YOLO 数据集，任务类型: {task_type}")
+    # 图片目录索引提供已标注图片的大小和修改时间，用于判断数据集是否需要更新
+    refresh_image_catalog()
+    return dataset_builder.prepare(task_type, job=job, split_ratios=split_ratios, split_seed=split_seed)
+
+@app.on_event("startup")
+async def start_training_queue():
+    """启动训练调度线程：继续执行上次排队中的任务"""
+    training_queue.start(_prepare_training_dataset)
+
+@app.get("/api/training/jobs")
+async def list_training_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """训练任务列表（最近的在前，排队中的任务带 queue_position）"""
+    return {"jobs": await asyncio.to_thread(training_queue.list, status, limit)}
+
+@app.get("/api/training/jobs/{job_id}")
+async def get_training_job(job_id: str):
+    """训练任务状态、最新指标和逐 epoch 历史"""
+    job = await asyncio.to_thread(training_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="训练任务不存在")
+    return job
+
+@app.post("/api/training/jobs/{job_id}/cancel")
+async def cancel_training_job(job_id: str):
+    """取消训练任务（训练中的任务在保存检查点后停止，之后可以继续）"""
     try:
-        # 检查 CUDA 是否可用
-        import torch
-        
-        # 转换设备参数
-        if request.device == "cpu":
-            device_param = "cpu"
-            print(f"[DEBUG] 使用 CPU 训练")
-        else:
-            # device 应该是 "0" 或类似 "cuda:0"
-            # 尝试转换为 CUDA 格式
-            if request.device == "0":
-                device_param = 0  # 整数0表示第一个GPU
-            elif request.device.startswith("cuda:"):
-                device_param = request.device
-            else:
-                # 尝试转换为整数
-                try:
-                    device_param = int(request.device)
-                except ValueError:
-                    device_param = 0  # 默认使用第一个GPU
-            
-            # 验证 CUDA 是否可用
-            if not torch.cuda.is_available():
-                print(f"[WARNING] CUDA 不可用，自动切换到 CPU 训练")
-                device_param = "cpu"
-            else:
-                print(f"[DEBUG] CUDA 可用，使用设备: {device_param} (类型: {type(device_param)})")
-                # 显示 GPU 信息
-                print(f"[DEBUG] GPU 设备名称: {torch.cuda.get_device_name(0)}")
-                print(f"[DEBUG] GPU 数量: {torch.cuda.device_count()}")
-
-        print(f"[DEBUG] 开始训练模型...")
-        print(f"[DEBUG] 数据集路径: {dataset_path}")
-        print(f"[DEBUG] 训练参数:")
-        print(f"  - epochs={request.epochs}, batch={request.batch_size}, imgsz={request.image_size}")
-        print(f"  - device={device_param}, model_type={request.model_type}, task_type={request.task_type}")
-        print(f"  - patience={request.patience} (早停)")
-        print(f"  - lr0={request.lr0}, lrf={request.lrf}, momentum={request.momentum}")
-        print(f"  - 数据增强: hsv_h={request.hsv_h}, hsv_s={request.hsv_s}, hsv_v={request.hsv_v}")
-        print(f"  - 数据增强: degrees={request.degrees}, translate={request.translate}, scale={request.scale}")
-        print(f"  - 数据增强: fliplr={request.fliplr}, mosaic={request.mosaic}, mixup={request.mixup}")
-
-        # 根据任务类型确定模型文件名
-        if request.weights_path:
-            model_name = request.weights_path
-        else:
-            # 根据任务类型选择对应的模型
-            model_base = request.model_type
-            if request.task_type == "segmentation":
-                model_name = f"{model_base}-seg.pt"
-            elif request.task_type == "obb":
-                model_name = f"{model_base}-obb.pt"
-            else:
-                model_name = f"{model_base}.pt"
-            print(f"[DEBUG] 使用默认模型: {model_name}")
-
-        print(f"[DEBUG] 加载模型: {model_name}")
-        model = YOLO(model_name)
-
-        # 开始训练 - 使用完整的参数配置
-        print(f"[DEBUG] 开始训练...")
-        results = model.train(
-            # 基础参数
-            data=str(dataset_path / "data.yaml"),
-            epochs=request.epochs,
-            batch=request.batch_size,
-            imgsz=request.image_size,
-            device=device_param,
-            project=str(MODELS_DIR),
-            name='yolo_model',
-            exist_ok=True,
-            
-            # 早停机制
-            patience=request.patience,
-            
-            # 数据增强参数
-            hsv_h=request.hsv_h,
-            hsv_s=request.hsv_s,
-            hsv_v=request.hsv_v,
-            degrees=request.degrees,
-            translate=request.translate,
-            scale=request.scale,
-            shear=request.shear,
-            perspective=request.perspective,
-            flipud=request.flipud,
-            fliplr=request.fliplr,
-            mosaic=request.mosaic,
-            mixup=request.mixup,
-            copy_paste=request.copy_paste if request.task_type == "segmentation" else 0.0,
-            
-            # 学习率参数
-            lr0=request.lr0,
-            lrf=request.lrf,
-            momentum=request.momentum,
-            weight_decay=request.weight_decay,
-            warmup_epochs=request.warmup_epochs,
-            
-            # 其他训练参数
-            cos_lr=request.cos_lr,
-            close_mosaic=request.close_mosaic,
-            amp=request.amp,
-            fraction=request.fraction,
-            
-            # 损失权重
-            box=request.box,
-            cls=request.cls,
-            dfl=request.dfl,
-            
-            # 保存和验证
-            save=True,
-            val=True,
-            plots=True,
-            verbose=True
-        )
-
-        print(f"[DEBUG] 训练完成！")
-        print(f"[DEBUG] 模型保存在: {MODELS_DIR / 'yolo_model'}")
-        print(f"[DEBUG] 最佳模型: {MODELS_DIR / 'yolo_model' / 'weights' / 'best.pt'}")
-        
-        # 打印训练结果摘要
-        if results:
-            print(f"[DEBUG] 训练结果摘要:")
-            print(f"  - 最终 mAP50: {results.results_dict.get('metrics/mAP50(B)', 'N/A')}")
-            print(f"  - 最终 mAP50-95: {results.results_dict.get('metrics/mAP50-95(B)', 'N/A')}")
-        
-        # 可选：导出为 ONNX 格式（如果需要）
-        # try:
-        #     print(f"[DEBUG] 开始导出模型为 ONNX 格式...")
-        #     model.export(format='onnx')
-        #     print(f"[DEBUG] 模型已导出为 ONNX 格式")
-        # except Exception as export_error:
-        #     print(f"[WARNING] ONNX 导出失败: {export_error}")
-        #     print(f"[INFO] 可以继续使用 .pt 模型进行推理")
+        job = await asyncio.to_thread(training_queue.cancel, job_id)
+    except TrainingJobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="训练任务不存在")
+    return job
+
+@app.post("/api/training/jobs/{job_id}/resume")
+async def resume_training_job(job_id: str):
+    """从检查点继续已取消、失败或中断的训练任务（重新加入队列）"""
+    training_queue.start(_prepare_training_dataset)
+    try:
+        job = await asyncio.to_thread(training_queue.resume, job_id)
+    except TrainingJobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="训练任务不存在")
+    return job
+
+TRAINING_EVENTS_INTERVAL = 0.5
+TRAINING_EVENTS_KEEPALIVE = 15.0
+
+@app.get("/api/training/jobs/{job_id}/events")
+async def training_job_events(job_id: str, request: Request):
+    """
+    训练进度推送（Server-Sent Events）
 
-    except Exception as e:
-        import traceback
-        print(f"[ERROR] 训练失败: {e}")
-        print(f"[ERROR] 详细错误:\n{traceback.format_exc()}")
+    第一条 progress 事件包含完整的逐 epoch 历史，之后任务有变化时推送最新状态（不含历史），任务结束后发送 end 事件并关闭。
+    """
+    job = await asyncio.to_thread(training_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="训练任务不存在")
+
+    async def stream():
+        current = job
+        last_seq = current["seq"]
+        last_sent = time.monotonic()
+        yield f"event: progress\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+        while current["status"] not in TRAINING_FINISHED_STATES:
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(TRAINING_EVENTS_INTERVAL)
+            if training_queue.seq(job_id) != last_seq:
+                current = await asyncio.to_thread(training_queue.get, job_id, False)
+                last_seq = current["seq"]
+                last_sent = time.monotonic()
+                yield f"event: progress\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+            elif time.monotonic() - last_sent >= TRAINING_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+        yield f"event: end\ndata: {json.dumps({'id': job_id, 'status': current['status']})}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/model-classes")
 async def get_model_classes():
     """获取模型使用的类别映射"""
     try:
-        # 优先从 data.yaml 文件读取（训练后的类别）
-        data_yaml = DATASETS_DIR / "data.yaml"
-        if data_yaml.exists():
-            import yaml
-            with data_yaml.open("r", encoding='utf-8') as f:
-                data = yaml.safe_load(f)
-            
-            names = data.get("names", {})
-            print(f"[DEBUG] data.yaml 中的 names: {names}")
-            
-            # names 可能是字典 {0: 'cat', 1: 'dog'} 或列表 ['cat', 'dog']
-            if isinstance(names, dict):
-                # 如果是字典，按ID排序返回类别列表
-                classes = [names[i] for i in sorted(names.keys())]
-            elif isinstance(names, list):
-                # 如果是列表，直接使用
-                classes = names
-            else:
-                classes = []
-            
-            if classes:
-                print(f"[DEBUG] 从 data.yaml 读取到 {len(classes)} 个类别: {classes}")
-                return {"classes": classes}
-        
-        # 如果 data.yaml 不存在，尝试从标注文件中提取类别
-        print(f"[DEBUG] data.yaml 不存在，尝试从标注文件提取类别")
-        classes = set()
-        for ann_file in ANNOTATIONS_DIR.glob("*.json"):
-            try:
-                with ann_file.open("r", encoding='utf-8') as f:
-                    ann_data = json.load(f)
-                for bbox in ann_data.get("bboxes", []):
-                    class_name = bbox.get("class_name", "")
-                    if class_name:
-                        classes.add(class_name)
-            except Exception as e:
-                print(f"[WARNING] 读取标注文件失败 {ann_file}: {e}")
-        
+        # 优先从 data.yaml 文件读取（训练后的类别，按修改时间缓存）
+        classes = class_map_cache.dataset_classes(DATASETS_DIR / "data.yaml")
         if classes:
-            # 按字母顺序排序，确保顺序一致
-            sorted_classes = sorted(list(classes))
-            print(f"[DEBUG] 从标注文件提取到 {len(sorted_classes)} 个类别: {sorted_classes}")
+            return {"classes": classes}
+        
+        # 如果 data.yaml 不存在，从标注存储的类别表读取
+        sorted_classes = annotation_store.class_names()
+        if sorted_classes:
             return {"classes": sorted_classes}
         
-        print(f"[WARNING] 没有找到任何类别信息")
         return {"classes": [], "error": "没有找到类别信息，请先标注图片或训练模型"}
     except Exception as e:
-        import traceback
-        print(f"[ERROR] 获取模型类别失败: {e}\n{traceback.format_exc()}")
+        logger.exception(f"获取模型类别失败: {e}")
         return {"classes": [], "error": str(e)}
 
+def model_class_names(model_entry) -> Dict[int, str]:
+    """
+    获取训练模型的类别映射
+
+    优先使用模型内嵌的类别名称（缓存在模型条目上），没有时回退到 data.yaml（按修改时间缓存）。
+    """
+    if model_entry.names:
+        return model_entry.names
+    return dict(enumerate(class_map_cache.dataset_classes(DATASETS_DIR / "data.yaml")))
+
 @app.get("/api/detect")
-async def detect_objects(image_name: str = Query(...), end2end: bool = True):
-    """使用训练好的模型进行检测"""
-    global current_model
-
-    # 查找最新的模型文件（递归查找 weights 目录中的模型）
-    model_files = list(MODELS_DIR.glob("**/best.onnx"))
-    if not model_files:
-        pt_files = list(MODELS_DIR.glob("**/best.pt"))
-        if not pt_files:
-            raise HTTPException(status_code=400, detail="没有训练好的模型，请先训练")
-        model_path = pt_files[-1]
-        print(f"[DEBUG] 使用 PyTorch 模型: {model_path}")
-    else:
-        model_path = model_files[-1]
-        print(f"[DEBUG] 使用 ONNX 模型: {model_path}")
+async def detect_objects(response: Response, image_name: str = Query(...), end2end: bool = True):
+    """
+    使用训练好的模型进行检测
 
-    # 加载模型（如果还没加载）
-    if current_model is None:
-        try:
-            current_model = YOLO(str(model_path))
-            print(f"[DEBUG] 模型加载成功")
-        except Exception as e:
-            print(f"[ERROR] 模型加载失败: {e}")
-            raise HTTPException(status_code=500, detail=f"模型加载失败: {str(e)}")
+    同一模型的并发请求由 micro_batcher 在短时间窗口内合并为一次批量推理。
+    返回值和 X-Inference-Backend 响应头中带有执行推理的后端（torch / onnxruntime / openvino）。
+    """
+    # 从模型索引获取当前使用的模型（优先 ONNX）
+    model_path = model_index.active_weights()
+    if model_path is None:
+        raise HTTPException(status_code=400, detail="没有训练好的模型，请先训练")
 
     # 读取图片
     image_path = IMAGES_DIR / image_name
     if not image_path.exists():
         raise HTTPException(status_code=404, detail="图片不存在")
 
-    print(f"[DEBUG] 开始检测图片: {image_path}, end2end={end2end}")
-
-    # 获取模型类别映射
-    model_classes = []
-    try:
-        data_yaml = DATASETS_DIR / "data.yaml"
-        if data_yaml.exists():
-            import yaml
-            with data_yaml.open("r", encoding='utf-8') as f:
-                data = yaml.safe_load(f)
-            names = data.get("names", {})
-            if isinstance(names, dict):
-                model_classes = [names[i] for i in sorted(names.keys())]
-            elif isinstance(names, list):
-                model_classes = names
-        print(f"[DEBUG] 模型类别: {model_classes}")
-    except Exception as e:
-        print(f"[WARNING] 获取模型类别失败: {e}")
-
     # 进行推理（设置 NMS 参数，根据 end2end 决定是否使用 NMS）
     # 官方默认值：conf=0.25, iou=0.7
-    results = current_model(str(image_path), conf=0.25, iou=0.7)
-
-    # 解析结果
-    detections = []
-    for result in results:
-        # 检查是否是分割模型
-        if hasattr(result, 'masks') and result.masks is not None:
-            # 分割模型
-            masks = result.masks
-            boxes = result.boxes
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                x_center = (x1 + x2) / 2 / result.orig_shape[1]
-                y_center = (y1 + y2) / 2 / result.orig_shape[0]
-                width = (x2 - x1) / result.orig_shape[1]
-                height = (y2 - y1) / result.orig_shape[0]
-                class_id = int(box.cls[0])
-
-                # 获取多边形点（归一化坐标）
-                points = []
-                if i < len(masks.xy):
-                    mask_points = masks.xy[i].tolist()  # 原始像素坐标
-                    for px, py in mask_points:
-                        points.append([px / result.orig_shape[1], py / result.orig_shape[0]])
-
-                # 根据 class_id 获取类别名称
-                class_name = ""
-                if 0 <= class_id < len(model_classes):
-                    class_name = model_classes[class_id]
-
-                detections.append({
-                    "x": x_center,
-                    "y": y_center,
-                    "width": width,
-                    "height": height,
-                    "class_id": class_id,
-                    "class_name": class_name,
-                    "confidence": float(box.conf[0]),
-                    "annotation_type": "polygon",
-                    "points": points
-                })
-        elif hasattr(result, 'obb') and result.obb is not None:
-            # OBB 模型
-            obb_boxes = result.obb
-            for box in obb_boxes:
-                # OBB 格式: x_center, y_center, width, height, angle (弧度)
-                x_center, y_center, width, height, angle = box.xywhr[0].tolist()
-                class_id = int(box.cls[0])
-
-                # 归一化坐标
-                x_center = x_center / result.orig_shape[1]
-                y_center = y_center / result.orig_shape[0]
-                width = width / result.orig_shape[1]
-                height = height / result.orig_shape[0]
-
-                # 根据 class_id 获取类别名称
-                class_name = ""
-                if 0 <= class_id < len(model_classes):
-                    class_name = model_classes[class_id]
-
-                detections.append({
-                    "x": x_center,
-                    "y": y_center,
-                    "width": width,
-                    "height": height,
-                    "class_id": class_id,
-                    "class_name": class_name,
-                    "confidence": float(box.conf[0]),
-                    "annotation_type": "obb",
-                    "angle": angle
-                })
-        else:
-            # 检测模型
-            boxes = result.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                x_center = (x1 + x2) / 2 / result.orig_shape[1]
-                y_center = (y1 + y2) / 2 / result.orig_shape[0]
-                width = (x2 - x1) / result.orig_shape[1]
-                height = (y2 - y1) / result.orig_shape[0]
-                class_id = int(box.cls[0])
-
-                # 根据 class_id 获取类别名称
-                class_name = ""
-                if 0 <= class_id < len(model_classes):
-                    class_name = model_classes[class_id]
-
-                detections.append({
-                    "x": x_center,
-                    "y": y_center,
-                    "width": width,
-                    "height": height,
-                    "class_id": class_id,
-                    "class_name": class_name,
-                    "confidence": float(box.conf[0]),
-                    "annotation_type": "bbox"
-                })
+    try:
+        (detections, backend), _ = await micro_batcher.submit(
+            str(model_path), image_path,
+            postprocess=lambda result, entry: (
+                to_detections(result, model_class_names(entry), include_keypoints=False), entry.backend_name),
+            conf=0.25, iou=0.7
+        )
+    except InferenceBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"检测失败: {e}")
+        raise HTTPException(status_code=500, detail=f"检测失败: {str(e)}")
 
-    print(f"[DEBUG] 检测到 {len(detections)} 个物体")
-    return {"detections": detections}
+    logger.debug("检测完成", extra={"fields": {"image_name": image_name, "model": model_path.name,
+                                              "backend": backend, "detections": len(detections)}})
+    response.headers["X-Inference-Backend"] = backend or ""
+    return {"detections": detections, "backend": backend}
 
 # ==================== 高级检测功能 ====================
 
@@ -1006,50 +1092,40 @@ class PoseDetectRequest(BaseModel):
 @app.post("/api/detect/pose")
 async def detect_pose(request: PoseDetectRequest):
     """人体姿态估计"""
-    global pose_model
-
-    # 检查是否存在姿态模型
-    pose_model_path = BASE_DIR / "yolov8n-pose.pt"
-    if not pose_model_path.exists():
-        # 尝试下载预训练模型
-        try:
-            print("[DEBUG] 正在下载 YOLOv8-pose 模型...")
-            from ultralytics import YOLO
-            pose_model = YOLO("yolov8n-pose.pt")
-            pose_model.save(str(pose_model_path))
-            print("[DEBUG] 姿态模型下载成功")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"姿态模型加载失败: {str(e)}")
-
-    # 加载模型
-    if pose_model is None:
-        from ultralytics import YOLO
-        pose_model = YOLO(str(pose_model_path))
+    return await inference_executor.run(_detect_pose_sync, request, model_key="yolov8n-pose")
 
+def _detect_pose_sync(request: PoseDetectRequest):
+    """姿态估计推理（在推理线程池中执行）"""
     # 读取图片
     image_path = IMAGES_DIR / request.image_name
     if not image_path.exists():
         raise HTTPException(status_code=404, detail="图片不存在")
 
+    # 本地没有姿态模型时由 ultralytics 自动下载
+    pose_model_path = BASE_DIR / "yolov8n-pose.pt"
+    weights = str(pose_model_path) if pose_model_path.exists() else "yolov8n-pose.pt"
+    try:
+        pose_entry = model_manager.acquire(weights, task="pose")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"姿态模型加载失败: {str(e)}")
+
     # 进行推理
-    results = pose_model(str(image_path), conf=request.conf)
+    try:
+        results = pose_entry.infer(str(image_path), conf=request.conf)
+    finally:
+        model_manager.release(pose_entry)
 
-    # 解析姿态估计结果
+    # 解析姿态估计结果（关键点整体归一化）
     poses = []
     for result in results:
-        if result.keypoints is not None:
-            keypoints = result.keypoints
-            for kp in keypoints.xy:
-                # 归一化关键点坐标
-                normalized_kp = []
-                for i in range(len(kp)):
-                    x = float(kp[i][0]) / result.orig_shape[1]
-                    y = float(kp[i][1]) / result.orig_shape[0]
-                    normalized_kp.append([x, y])
-                poses.append({
-                    "keypoints": normalized_kp,
-                    "confidence": float(keypoints.conf[0]) if hasattr(keypoints, 'conf') else 1.0
-                })
+        decoded = decode_result(result)
+        if decoded["keypoints"] is None:
+            continue
+        for keypoints, confidence in zip(decoded["keypoints"].tolist(), decoded["confidences"].tolist()):
+            poses.append({
+                "keypoints": keypoints,
+                "confidence": confidence
+            })
 
     return {"poses": poses, "count": len(poses)}
 
@@ -1060,63 +1136,50 @@ class SegmentDetectRequest(BaseModel):
 @app.post("/api/detect/segment")
 async def detect_segmentation(request: SegmentDetectRequest):
     """人体分割/轮廓检测"""
-    global segmentation_model
-
-    # 检查是否存在分割模型
-    seg_model_path = BASE_DIR / "yolov8n-seg.pt"
-    if not seg_model_path.exists():
-        try:
-            print("[DEBUG] 正在下载 YOLOv8-seg 模型...")
-            from ultralytics import YOLO
-            segmentation_model = YOLO("yolov8n-seg.pt")
-            segmentation_model.save(str(seg_model_path))
-            print("[DEBUG] 分割模型下载成功")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"分割模型加载失败: {str(e)}")
-
-    # 加载模型
-    if segmentation_model is None:
-        from ultralytics import YOLO
-        segmentation_model = YOLO(str(seg_model_path))
+    return await inference_executor.run(_detect_segmentation_sync, request, model_key="yolov8n-seg")
 
+def _detect_segmentation_sync(request: SegmentDetectRequest):
+    """分割推理（在推理线程池中执行）"""
     # 读取图片
     image_path = IMAGES_DIR / request.image_name
     if not image_path.exists():
         raise HTTPException(status_code=404, detail="图片不存在")
 
+    # 本地没有分割模型时由 ultralytics 自动下载
+    seg_model_path = BASE_DIR / "yolov8n-seg.pt"
+    weights = str(seg_model_path) if seg_model_path.exists() else "yolov8n-seg.pt"
+    try:
+        seg_entry = model_manager.acquire(weights, task="segmentation")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"分割模型加载失败: {str(e)}")
+
     # 进行推理
-    results = segmentation_model(str(image_path), conf=request.conf)
+    try:
+        results = seg_entry.infer(str(image_path), conf=request.conf)
+    finally:
+        model_manager.release(seg_entry)
 
-    # 解析分割结果
+    # 解析分割结果（框与多边形整体归一化）
     segments = []
     for result in results:
-        if result.masks is not None:
-            masks = result.masks
-            boxes = result.boxes
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                class_id = int(box.cls[0])
-                confidence = float(box.conf[0])
-
-                # 获取分割多边形点
-                points = []
-                if i < len(masks.xy):
-                    mask_points = masks.xy[i].tolist()
-                    for px, py in mask_points:
-                        points.append([px / result.orig_shape[1], py / result.orig_shape[0]])
-
-                segments.append({
-                    "class_id": class_id,
-                    "class_name": ["person", "car", "dog", "cat"][class_id] if class_id < 4 else f"class_{class_id}",
-                    "confidence": confidence,
-                    "bbox": {
-                        "x": (x1 + x2) / 2 / result.orig_shape[1],
-                        "y": (y1 + y2) / 2 / result.orig_shape[0],
-                        "width": (x2 - x1) / result.orig_shape[1],
-                        "height": (y2 - y1) / result.orig_shape[0]
-                    },
-                    "segmentation": points
-                })
+        decoded = decode_result(result, include_keypoints=False)
+        if decoded["polygons"] is None:
+            continue
+        polygons = decoded["polygons"]
+        for i, ((x, y, width, height), class_id, confidence) in enumerate(
+                zip(decoded["boxes"].tolist(), decoded["class_ids"].tolist(), decoded["confidences"].tolist())):
+            segments.append({
+                "class_id": class_id,
+                "class_name": ["person", "car", "dog", "cat"][class_id] if class_id < 4 else f"class_{class_id}",
+                "confidence": confidence,
+                "bbox": {
+                    "x": x,
+                    "y": y,
+                    "width": width,
+                    "height": height
+                },
+                "segmentation": polygons[i].tolist() if i < len(polygons) else []
+            })
 
     return {"segments": segments, "count": len(segments)}
 
@@ -1127,26 +1190,24 @@ class LicensePlateRequest(BaseModel):
 @app.post("/api/detect/license-plate")
 async def detect_license_plate(request: LicensePlateRequest):
     """车牌检测"""
-    global license_plate_model
-
-    # 使用通用的 YOLOv8 模型检测车辆
-    if current_model is None:
-        model_files = list(MODELS_DIR.glob("**/best.onnx"))
-        if not model_files:
-            pt_files = list(MODELS_DIR.glob("**/best.pt"))
-            if pt_files:
-                current_model = YOLO(str(pt_files[-1]))
-            else:
-                # 使用预训练的 YOLOv8n 模型
-                current_model = YOLO("yolov8n.pt")
+    return await inference_executor.run(_detect_license_plate_sync, request, model_key="trained")
 
+def _detect_license_plate_sync(request: LicensePlateRequest):
+    """车牌检测推理（在推理线程池中执行）"""
     # 读取图片
     image_path = IMAGES_DIR / request.image_name
     if not image_path.exists():
         raise HTTPException(status_code=404, detail="图片不存在")
 
+    # 使用通用的 YOLOv8 模型检测车辆
+    # 没有训练好的模型时使用预训练的 YOLOv8n 模型
+    active_weights = model_index.active_weights()
+    weights = str(active_weights) if active_weights else "yolov8n.pt"
+
     # 进行推理
-    results = current_model(str(image_path), conf=request.conf, classes=[2, 3, 5, 7])  # 检测车辆类别
+    with model_manager.use(weights) as model_entry:
+        results = model_entry.infer(str(image_path), conf=request.conf, classes=[2, 3, 5, 7])  # 检测车辆类别
+        backend = model_entry.backend_name
 
     # 解析结果
     plates = []
@@ -1174,7 +1235,7 @@ async def detect_license_plate(request: LicensePlateRequest):
                 "confidence": confidence
             })
 
-    return {"plates": plates, "count": len(plates)}
+    return {"plates": plates, "count": len(plates), "backend": backend}
 
 # ==================== OpenCV 更多功能 ====================
 
@@ -1186,6 +1247,10 @@ class FaceDetectRequest(BaseModel):
 @app.post("/api/opencv/face-detect")
 async def opencv_face_detect(request: FaceDetectRequest):
     """使用OpenCV Haar级联分类器进行人脸检测"""
+    return await inference_executor.run(_opencv_face_detect_sync, request, model_key="opencv")
+
+def _opencv_face_detect_sync(request: FaceDetectRequest):
+    """人脸检测（在推理线程池中执行）"""
     try:
         # 读取图片
         image_path = IMAGES_DIR / request.image_name
@@ -1243,7 +1308,7 @@ async def opencv_face_detect(request: FaceDetectRequest):
     except Exception as e:
         import traceback
         error_detail = f"人脸检测失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
 class BackgroundSubtractRequest(BaseModel):
@@ -1268,6 +1333,10 @@ class LaneDetectRequest(BaseModel):
 @app.post("/api/realtime/lane-detect")
 async def lane_detection(request: LaneDetectRequest):
     """车道线检测"""
+    return await inference_executor.run(_lane_detection_sync, request, model_key="opencv")
+
+def _lane_detection_sync(request: LaneDetectRequest):
+    """车道线检测（在推理线程池中执行）"""
     try:
         # 读取图片
         image_path = IMAGES_DIR / request.image_name
@@ -1329,7 +1398,7 @@ async def lane_detection(request: LaneDetectRequest):
     except Exception as e:
         import traceback
         error_detail = f"车道线检测失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
 class HandDetectRequest(BaseModel):
@@ -1338,6 +1407,10 @@ class HandDetectRequest(BaseModel):
 @app.post("/api/realtime/hand-detect")
 async def hand_detection(request: HandDetectRequest):
     """手部检测（使用皮肤颜色检测）"""
+    return await inference_executor.run(_hand_detection_sync, request, model_key="opencv")
+
+def _hand_detection_sync(request: HandDetectRequest):
+    """手部检测（在推理线程池中执行）"""
     try:
         # 读取图片
         image_path = IMAGES_DIR / request.image_name
@@ -1409,7 +1482,7 @@ async def hand_detection(request: HandDetectRequest):
     except Exception as e:
         import traceback
         error_detail = f"手部检测失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
 # ==================== 摄像头支持 ====================
@@ -1439,6 +1512,10 @@ class CameraFrameRequest(BaseModel):
 @app.post("/api/camera/init")
 async def init_camera(request: CameraInitRequest):
     """初始化摄像头"""
+    return await inference_executor.run(_init_camera_sync, request, model_key="camera")
+
+def _init_camera_sync(request: CameraInitRequest):
+    """打开摄像头（在推理线程池中执行，与取帧串行）"""
     global camera_capture, camera_active
     
     try:
@@ -1475,13 +1552,17 @@ async def init_camera(request: CameraInitRequest):
     except Exception as e:
         import traceback
         error_detail = f"摄像头初始化失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         camera_active = False
         raise HTTPException(status_code=500, detail=error_detail)
 
 @app.post("/api/camera/frame")
 async def get_camera_frame(request: CameraFrameRequest):
     """获取摄像头帧并执行操作"""
+    return await inference_executor.run(_get_camera_frame_sync, request, model_key="camera")
+
+def _get_camera_frame_sync(request: CameraFrameRequest):
+    """读取并处理摄像头帧（在推理线程池中执行）"""
     global camera_capture, camera_active
     
     try:
@@ -1641,12 +1722,16 @@ async def get_camera_frame(request: CameraFrameRequest):
     except Exception as e:
         import traceback
         error_detail = f"摄像头帧处理失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
 @app.post("/api/camera/stop")
 async def stop_camera():
     """关闭摄像头"""
+    return await inference_executor.run(_stop_camera_sync, model_key="camera")
+
+def _stop_camera_sync():
+    """释放摄像头（与取帧串行，避免读取中途被释放）"""
     global camera_capture, camera_active
     
     try:
@@ -1664,7 +1749,7 @@ async def stop_camera():
     except Exception as e:
         import traceback
         error_detail = f"关闭摄像头失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
 @app.delete("/api/training-data")
@@ -1676,13 +1761,17 @@ async def delete_training_data():
         deleted_models = []
         deleted_datasets = []
 
+        # 先卸载缓存中来自训练目录的模型，避免文件被占用
+        model_manager.unload_weights_under(MODELS_DIR)
+
         # 删除模型目录
         if MODELS_DIR.exists():
             for model_dir in MODELS_DIR.iterdir():
                 if model_dir.is_dir():
                     shutil.rmtree(model_dir)
                     deleted_models.append(model_dir.name)
-            print(f"[DEBUG] 已删除模型: {deleted_models}")
+            logger.info(f"已删除模型: {deleted_models}")
+        model_index.clear()
 
         # 删除数据集目录
         if DATASETS_DIR.exists():
@@ -1690,10 +1779,6 @@ async def delete_training_data():
             DATASETS_DIR.mkdir(parents=True, exist_ok=True)
             deleted_datasets.append("datasets")
 
-        # 重置全局模型
-        global current_model
-        current_model = None
-
         return {
             "message": "训练数据删除成功",
             "deleted_models": deleted_models,
@@ -1702,32 +1787,134 @@ async def delete_training_data():
     except Exception as e:
         import traceback
         error_detail = f"删除训练数据失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
 @app.post("/api/reload-model")
 async def reload_model():
     """重新加载模型"""
-    global current_model
-    current_model = None
-    return {"message": "模型已重置，下次检测时将重新加载"}
+    model_manager.unload_weights_under(MODELS_DIR)
+    # 重新扫描训练目录，发现手动放入或删除的模型
+    model_index.scan()
+    return {"message": "模型已重置，下次检测时将重新加载", "active_model": model_index.active_info()}
 
-@app.get("/api/models")
+@app.get("/api/models/trained")
 async def list_models():
-    """列出所有训练好的模型"""
-    models = []
-    for model_dir in MODELS_DIR.iterdir():
-        if model_dir.is_dir():
-            best_pt = model_dir / "best.pt"
-            best_onnx = model_dir / "best.onnx"
-            model_info = {"name": model_dir.name, "path": str(model_dir)}
-            if best_pt.exists():
-                model_info["pt"] = str(best_pt)
-            if best_onnx.exists():
-                model_info["onnx"] = str(best_onnx)
-            models.append(model_info)
-
-    return {"models": models}
+    """列出所有训练好的模型（权重文件、修改时间、评估指标）"""
+    return {"models": model_index.list_runs(), "active_model": model_index.active_info()}
+
+@app.post("/api/models/trained/{run_name:path}/activate")
+async def activate_trained_model(run_name: str, weights_format: Optional[str] = Query(None, alias="format")):
+    """切换检测、视频和车牌检测使用的训练模型（format 指定权重格式，例如 onnx-int8，默认自动选择）"""
+    try:
+        run = model_index.set_active(run_name, weights_format)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"训练模型不存在: {run_name}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "active_model": model_index.active_info(), "run": run}
+
+class ModelExportRequest(BaseModel):
+    formats: Optional[List[str]] = None  # 导出的变体，默认 YOLO_EXPORT_FORMATS
+    dynamic: Optional[bool] = None  # 动态 batch，默认 YOLO_EXPORT_DYNAMIC
+    validate_accuracy: bool = Field(default=EXPORT_VALIDATE, validation_alias=AliasChoices("validate", "validate_accuracy"))
+
+@app.post("/api/models/trained/{run_name:path}/export")
+async def export_trained_model(run_name: str, request: ModelExportRequest):
+    """
+    把训练模型导出为 ONNX / OpenVINO 变体（后台任务，独立进程）
+
+    每个变体在当前数据集的验证集上评估，精度下降不超过 YOLO_EXPORT_MAX_MAP_DROP 的变体登记到模型索引，
+    纯 CPU 服务器自动使用其中延迟最低的一个。进度通过 /api/jobs/{job_id} 查询。
+    """
+    run = next((run for run in model_index.list_runs() if run["name"] == run_name), None)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"训练模型不存在: {run_name}")
+    if "pt" not in run["weights"]:
+        raise HTTPException(status_code=400, detail="该训练结果没有 best.pt，无法导出")
+    try:
+        variants = parse_variants(request.formats) if request.formats is not None else EXPORT_FORMATS
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not variants:
+        raise HTTPException(status_code=400, detail="没有指定导出格式")
+    data_yaml = DATASETS_DIR / "data.yaml"
+    if not data_yaml.exists():
+        raise HTTPException(status_code=400, detail="数据集尚未准备（验证和 INT8 校准需要 datasets/data.yaml）")
+
+    dynamic = request.dynamic if request.dynamic is not None else EXPORT_DYNAMIC
+    job = job_manager.submit("model-export", _export_trained_model, Path(run["path"]), data_yaml, variants, dynamic,
+                             request.validate_accuracy, params={"run": run_name, "formats": variants}, total=len(variants))
+    return {"success": True, "job_id": job.id, "run": run_name, "formats": variants}
+
+def _export_trained_model(job, run_dir: Path, data_yaml: Path, variants: List[str], dynamic: bool, validate: bool):
+    """后台任务：导出并校验，完成后刷新模型索引（不切换当前模型）"""
+    report = run_export_job(job, run_dir, str(data_yaml), variants, dynamic, validate)
+    model_index.register_run(run_dir, activate=False)
+    return {"variants": report.get("variants", {}), "baseline": report.get("baseline")}
+
+class ModelQuantizeRequest(BaseModel):
+    runtimes: List[str] = ["onnx"]  # onnx（ONNX Runtime 静态量化）/ openvino（NNCF）
+    calibration_images: int = Field(default=CALIBRATION_IMAGES, ge=1)  # 从训练集抽样的校准图片数量
+    seed: str = CALIBRATION_SEED  # 抽样种子
+    dynamic: Optional[bool] = None  # 动态 batch，默认 YOLO_EXPORT_DYNAMIC
+    activate: bool = False  # 通过精度校验后切换到该 INT8 模型
+
+@app.post("/api/models/trained/{run_name:path}/quantize")
+async def quantize_trained_model(run_name: str, request: ModelQuantizeRequest):
+    """
+    训练后 INT8 量化（后台任务，独立进程）
+
+    用 datasets/train 中抽样的图片校准 best.pt（或只有导出的 best.onnx 时直接量化 ONNX），生成静态 INT8 模型；
+    还没有导出的 FP32 变体一并导出，用于在验证集上比较 mAP 和延迟，比较结果在任务结果和 exports.json 的
+    quantization 中。进度通过 /api/jobs/{job_id} 查询。
+    """
+    run = next((run for run in model_index.list_runs() if run["name"] == run_name), None)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"训练模型不存在: {run_name}")
+    runtimes = list(dict.fromkeys(request.runtimes))
+    unknown = [runtime for runtime in runtimes if f"{runtime}-int8" not in EXPORT_VARIANTS]
+    if unknown or not runtimes:
+        raise HTTPException(status_code=400, detail=f"不支持的量化运行时: {', '.join(unknown) or '空'}（可选: onnx, openvino）")
+    if "pt" not in run["weights"]:
+        if "onnx" not in run["weights"]:
+            raise HTTPException(status_code=400, detail="该训练结果没有 best.pt 或 best.onnx，无法量化")
+        if runtimes != ["onnx"]:
+            raise HTTPException(status_code=400, detail="该训练结果只有 best.onnx，只能量化为 onnx-int8")
+    data_yaml = DATASETS_DIR / "data.yaml"
+    if not data_yaml.exists():
+        raise HTTPException(status_code=400, detail="数据集尚未准备（校准和验证需要 datasets/data.yaml）")
+
+    # 已经导出并评估过的 FP32 变体不再重复导出
+    exports = run.get("exports") or {}
+    variants = []
+    for runtime in runtimes:
+        if runtime not in exports or exports[runtime].get("map") is None:
+            if "pt" in run["weights"]:
+                variants.append(runtime)
+        variants.append(f"{runtime}-int8")
+    dynamic = request.dynamic if request.dynamic is not None else EXPORT_DYNAMIC
+    job = job_manager.submit("model-quantize", _quantize_trained_model, Path(run["path"]), run_name, data_yaml,
+                             variants, dynamic, request.calibration_images, request.seed, request.activate,
+                             params={"run": run_name, "formats": variants, "calibration_images": request.calibration_images,
+                                     "seed": request.seed},
+                             total=len(variants))
+    return {"success": True, "job_id": job.id, "run": run_name, "formats": variants}
+
+def _quantize_trained_model(job, run_dir: Path, run_name: str, data_yaml: Path, variants: List[str], dynamic: bool,
+                            calibration_images: int, seed: str, activate: bool):
+    """后台任务：校准量化并与 FP32 比较，完成后刷新模型索引，需要时切换到最快的可用 INT8 模型"""
+    report = run_export_job(job, run_dir, str(data_yaml), variants, dynamic, True, calibration_images, seed)
+    model_index.register_run(run_dir, activate=False)
+    int8 = {name: entry for name, entry in report.get("variants", {}).items()
+            if name in variants and EXPORT_VARIANTS[name]["precision"] == "int8"}
+    activated = None
+    accepted = {name: entry.get("latency_ms") or float("inf") for name, entry in int8.items() if entry.get("accepted")}
+    if activate and accepted:
+        activated = min(accepted, key=accepted.get)
+        model_index.set_active(run_name, activated)
+    return {"quantization": report.get("quantization"), "variants": int8, "baseline": report.get("baseline"),
+            "activated": activated}
 
 # ==================== 视频检测 ====================
 
@@ -1736,330 +1923,222 @@ class VideoDetectionRequest(BaseModel):
     source_type: str = "file"  # file, camera, rtsp
     model_type: str = "yolov8n"  # 模型类型
     confidence_threshold: float = 0.5  # 置信度阈值
+    end2end: bool = True
+    jpeg_quality: int = Field(default=VIDEO_JPEG_QUALITY, ge=10, le=100)
+
+class VideoControlRequest(BaseModel):
+    action: str  # pause, resume, seek, config
+    frame_pos: Optional[int] = None  # seek 的目标帧
+    confidence_threshold: Optional[float] = None  # config
+    end2end: Optional[bool] = None  # config
+
+def _open_video_capture(source: str, source_type: str):
+    """打开视频源（本地视频文件、摄像头或RTSP流）"""
+    if source_type == "camera":
+        # 本地摄像头
+        try:
+            camera_index = int(source)
+            return cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
+        except ValueError:
+            return cv2.VideoCapture(0, cv2.CAP_DSHOW)
+    if source_type == "rtsp":
+        # RTSP流 - 缓冲尽量小，解码线程持续取帧，画面不落后
+        capture = cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture
+    # 文件
+    file_path = Path(source)
+    if not file_path.exists():
+        # 尝试相对路径
+        file_path = IMAGES_DIR / source
+    return cv2.VideoCapture(str(file_path))
 
-class VideoDetectionResponse(BaseModel):
-    success: bool
-    message: str
-    frame_count: int = 0
-    video_info: Optional[Dict[str, Any]] = None
-
-# 全局视频检测状态
-video_detection_active = False
-video_capture = None
-
-@app.post("/api/video/detect/start")
-async def start_video_detection(request: VideoDetectionRequest):
-    """开始视频检测（支持本地视频文件、摄像头和RTSP流）"""
-    global video_detection_active, video_capture, current_model
-
-    if video_detection_active:
-        return VideoDetectionResponse(
-            success=False,
-            message="视频检测已在运行中"
-        )
+@app.post("/api/video/sessions")
+async def create_video_session(request: VideoDetectionRequest):
+    """
+    开始视频检测（支持本地视频文件、摄像头和RTSP流）
 
-    try:
-        print(f"[VIDEO] 收到视频检测请求")
-        print(f"[VIDEO] 源类型: {request.source_type}, 源地址: {request.source}")
-        print(f"[VIDEO] 模型类型: {request.model_type}, 置信度阈值: {request.confidence_threshold}")
-
-        # 查找模型文件
-        model_files = list(MODELS_DIR.glob("**/best.onnx"))
-        if not model_files:
-            pt_files = list(MODELS_DIR.glob("**/best.pt"))
-            if not pt_files:
-                # 使用默认预训练模型
-                model_path = f"{request.model_type}.pt"
-                print(f"[VIDEO] 使用默认预训练模型: {model_path}")
-            else:
-                model_path = pt_files[-1]
-                print(f"[VIDEO] 使用训练好的模型: {model_path}")
-        else:
-            model_path = model_files[-1]
-            print(f"[VIDEO] 使用训练好的模型: {model_path}")
+    创建一个持续运行的检测会话：解码、推理、JPEG 编码三个阶段并行，结果通过 WebSocket
+    （/api/video/sessions/{id}/ws）或 MJPEG（/api/video/sessions/{id}/mjpeg）推送，不再逐帧轮询。
+    """
+    return await inference_executor.run(_create_video_session_sync, request, model_key="video")
 
-        print(f"[VIDEO] 模型路径: {model_path}")
+def _create_video_session_sync(request: VideoDetectionRequest):
+    """加载模型并打开视频源（在推理线程池中执行）"""
 
-        # 加载模型
-        if current_model is None:
-            print(f"[VIDEO] 正在加载模型...")
-            current_model = YOLO(str(model_path))
-            print(f"[VIDEO] 模型加载成功")
+    # 从模型索引获取当前使用的模型
+    model_path = model_index.active_weights()
+    if model_path is None:
+        # 使用默认预训练模型
+        model_path = f"{request.model_type}.pt"
 
-        # 打开视频源
-        source = request.source
-        source_type = request.source_type
-        
-        print(f"[VIDEO] 正在打开视频源: type={source_type}, source={source}")
-        
-        if source_type == "camera":
-            # 本地摄像头
-            try:
-                camera_index = int(source)
-                video_capture = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-                print(f"[VIDEO] 尝试打开本地摄像头索引: {camera_index}")
-            except:
-                video_capture = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-                print(f"[VIDEO] 使用默认摄像头索引 0")
-        elif source_type == "rtsp":
-            # RTSP流 - 添加RTSP优化参数
-            rtsp_url = source
-            print(f"[VIDEO] 打开RTSP流: {rtsp_url}")
-            video_capture = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
-            # RTSP传输优化参数
-            video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 3)
-        else:
-            # 文件
-            file_path = Path(source)
-            if not file_path.exists():
-                # 尝试相对路径
-                file_path = IMAGES_DIR / source
-            print(f"[VIDEO] 打开视频文件: {file_path}")
-            video_capture = cv2.VideoCapture(str(file_path))
-
-        if not video_capture.isOpened():
-            error_msg = f"无法打开视频源: {source}"
-            print(f"[VIDEO] {error_msg}")
-            return VideoDetectionResponse(
-                success=False,
-                message=error_msg
-            )
-
-        print(f"[VIDEO] 视频源打开成功")
-
-        # 获取视频信息
-        fps = video_capture.get(cv2.CAP_PROP_FPS)
-        frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    # 会话期间持有模型引用，避免被缓存淘汰；会话结束时释放
+    entry = model_manager.acquire(str(model_path))
+    capture = None
+    try:
+        capture = _open_video_capture(request.source, request.source_type)
+        if not capture.isOpened():
+            raise HTTPException(status_code=400, detail=f"无法打开视频源: {request.source}")
 
+        fps = capture.get(cv2.CAP_PROP_FPS)
         video_info = {
             "fps": fps if fps > 0 else 30.0,
-            "frame_count": frame_count,
-            "width": width,
-            "height": height,
-            "source_type": source_type
+            "frame_count": int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "source_type": request.source_type
         }
+        logger.info("打开视频源", extra={"fields": {
+            "source_type": request.source_type, "source": request.source, "model": Path(model_path).name,
+            "fps": video_info["fps"], "frames": video_info["frame_count"],
+            "resolution": f"{video_info['width']}x{video_info['height']}"}})
+
+        def detect(frame: np.ndarray, conf: float, end2end: bool) -> List[Dict[str, Any]]:
+            results = entry.infer(frame, conf=conf, end2end=end2end)
+            return results_to_detections(results, model_class_names(entry), unknown_name="class_{}", include_keypoints=False)
+
+        session = video_sessions.create(
+            capture, request.source, request.source_type, detect, video_info,
+            confidence=request.confidence_threshold, end2end=request.end2end, jpeg_quality=request.jpeg_quality,
+            backend=entry.backend_name, on_close=lambda: model_manager.release(entry))
+    except VideoSessionError as e:
+        capture.release()
+        model_manager.release(entry)
+        raise HTTPException(status_code=503, detail=str(e))
+    except BaseException:
+        if capture is not None:
+            capture.release()
+        model_manager.release(entry)
+        raise
 
-        print(f"[VIDEO] 视频信息: fps={video_info['fps']}, frames={frame_count}, resolution={width}x{height}")
-
-        video_detection_active = True
-
-        return VideoDetectionResponse(
-            success=True,
-            message="视频检测已启动",
-            frame_count=frame_count,
-            video_info=video_info
-        )
-
-    except Exception as e:
-        import traceback
-        error_detail = f"启动视频检测失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
-        return VideoDetectionResponse(
-            success=False,
-            message=error_detail
-        )
-
-@app.post("/api/video/detect/stop")
-async def stop_video_detection():
-    """停止视频检测"""
-    global video_detection_active, video_capture
+    return {
+        "success": True,
+        "message": "视频检测已启动",
+        "session": session.info(),
+        "websocket": f"/api/video/sessions/{session.id}/ws",
+        "mjpeg": f"/api/video/sessions/{session.id}/mjpeg"
+    }
 
+def _get_video_session(session_id: str):
+    session = video_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"视频会话不存在: {session_id}")
+    return session
+
+@app.get("/api/video/sessions")
+async def list_video_sessions():
+    """运行中的视频会话（各阶段队列长度、丢帧数、帧率和端到端延迟）"""
+    return {"sessions": video_sessions.list()}
+
+@app.get("/api/video/sessions/{session_id}")
+async def get_video_session(session_id: str):
+    return _get_video_session(session_id).info()
+
+@app.delete("/api/video/sessions/{session_id}")
+async def stop_video_session(session_id: str):
+    """停止视频检测，释放视频源和模型"""
+    if not await asyncio.to_thread(video_sessions.stop, session_id):
+        raise HTTPException(status_code=404, detail=f"视频会话不存在: {session_id}")
+    return {"success": True, "message": "视频检测已停止"}
+
+@app.post("/api/video/sessions/{session_id}/control")
+async def control_video_session(session_id: str, request: VideoControlRequest):
+    """暂停、继续、跳转到指定帧（仅视频文件），或修改置信度阈值（WebSocket 中也可以发送同样的 JSON）"""
+    session = _get_video_session(session_id)
     try:
-        video_detection_active = False
-
-        if video_capture is not None:
-            video_capture.release()
-            video_capture = None
-            print(f"[DEBUG] 视频检测已停止")
+        return session.control(**request.model_dump())
+    except VideoSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        return {"success": True, "message": "视频检测已停止"}
-
-    except Exception as e:
-        import traceback
-        error_detail = f"停止视频检测失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
-        return {"success": False, "message": error_detail}
-
-@app.get("/api/video/detect/frame")
-async def get_video_frame(confidence_threshold: float = 0.5, end2end: bool = True):
-    """获取视频帧的检测结果"""
-    global video_detection_active, video_capture, current_model
-
-    if not video_detection_active or video_capture is None:
-        return {"success": False, "message": "视频检测未运行"}
+@app.websocket("/api/video/sessions/{session_id}/ws")
+async def video_session_websocket(websocket: WebSocket, session_id: str):
+    """
+    推送检测结果：每帧先发送一条 JSON 文本（type=frame，帧号、尺寸、检测结果、延迟），紧接着发送该帧的 JPEG 二进制
 
+    连接建立后先发送 type=session（会话信息），视频结束时发送 type=end；客户端可以随时发送控制消息
+    （{"action": "pause"} 等，与 /control 相同），回复 type=control。
+    """
+    session = video_sessions.get(session_id)
+    await websocket.accept()
+    if session is None:
+        await websocket.close(code=4404, reason="video session not found")
+        return
     try:
-        # 读取一帧
-        ret, frame = video_capture.read()
-
-        if not ret:
-            print(f"[VIDEO] 视频结束或读取失败")
-            return {"success": False, "message": "视频结束或读取失败"}
+        session.add_consumer()
+    except VideoSessionError:
+        await websocket.close(code=4409, reason="video session already has a consumer")
+        return
 
-        # 获取当前帧位置
-        frame_pos = int(video_capture.get(cv2.CAP_PROP_POS_FRAMES))
-        print(f"[VIDEO] 读取帧: {frame_pos}, end2end={end2end}")
-
-        # 获取模型类别映射
-        model_classes = []
-        try:
-            data_yaml = DATASETS_DIR / "data.yaml"
-            if data_yaml.exists():
-                import yaml
-                with data_yaml.open("r", encoding='utf-8') as f:
-                    data = yaml.safe_load(f)
-                names = data.get("names", {})
-                if isinstance(names, dict):
-                    model_classes = [names[i] for i in sorted(names.keys())]
-                elif isinstance(names, list):
-                    model_classes = names
-            print(f"[VIDEO] 模型类别: {model_classes}")
-        except Exception as e:
-            print(f"[VIDEO] 获取模型类别失败: {e}")
-
-        # 进行检测
-        detections = []
-        if current_model is not None:
+    async def receive_controls():
+        while True:
             try:
-                results = current_model(frame, conf=confidence_threshold, end2end=end2end)
-                for result in results:
-                    # 检查是否是分割模型
-                    if hasattr(result, 'masks') and result.masks is not None:
-                        # 分割模型
-                        masks = result.masks
-                        boxes = result.boxes
-                        for i, box in enumerate(boxes):
-                            x1, y1, x2, y2 = box.xyxy[0].tolist()
-                            x_center = (x1 + x2) / 2 / result.orig_shape[1]
-                            y_center = (y1 + y2) / 2 / result.orig_shape[0]
-                            width = (x2 - x1) / result.orig_shape[1]
-                            height = (y2 - y1) / result.orig_shape[0]
-                            class_id = int(box.cls[0])
-
-                            # 获取多边形点（归一化坐标）
-                            points = []
-                            if i < len(masks.xy):
-                                mask_points = masks.xy[i].tolist()  # 原始像素坐标
-                                for px, py in mask_points:
-                                    points.append([px / result.orig_shape[1], py / result.orig_shape[0]])
-
-                            # 根据 class_id 获取类别名称
-                            class_name = ""
-                            if 0 <= class_id < len(model_classes):
-                                class_name = model_classes[class_id]
-                            else:
-                                class_name = f"class_{class_id}"
-
-                            detections.append({
-                                "x": x_center,
-                                "y": y_center,
-                                "width": width,
-                                "height": height,
-                                "class_id": class_id,
-                                "class_name": class_name,
-                                "confidence": float(box.conf[0]),
-                                "annotation_type": "polygon",
-                                "points": points
-                            })
-                    elif hasattr(result, 'obb') and result.obb is not None:
-                        # OBB 模型
-                        obb_boxes = result.obb
-                        for box in obb_boxes:
-                            # OBB 格式: x_center, y_center, width, height, angle (弧度)
-                            x_center, y_center, width, height, angle = box.xywhr[0].tolist()
-                            class_id = int(box.cls[0])
-
-                            # 归一化坐标
-                            x_center = x_center / result.orig_shape[1]
-                            y_center = y_center / result.orig_shape[0]
-                            width = width / result.orig_shape[1]
-                            height = height / result.orig_shape[0]
-
-                            # 根据 class_id 获取类别名称
-                            class_name = ""
-                            if 0 <= class_id < len(model_classes):
-                                class_name = model_classes[class_id]
-                            else:
-                                class_name = f"class_{class_id}"
-
-                            detections.append({
-                                "x": x_center,
-                                "y": y_center,
-                                "width": width,
-                                "height": height,
-                                "class_id": class_id,
-                                "class_name": class_name,
-                                "confidence": float(box.conf[0]),
-                                "annotation_type": "obb",
-                                "angle": angle
-                            })
-                    else:
-                        # 检测模型
-                        boxes = result.boxes
-                        for box in boxes:
-                            x1, y1, x2, y2 = box.xyxy[0].tolist()
-                            x_center = (x1 + x2) / 2 / result.orig_shape[1]
-                            y_center = (y1 + y2) / 2 / result.orig_shape[0]
-                            width = (x2 - x1) / result.orig_shape[1]
-                            height = (y2 - y1) / result.orig_shape[0]
-                            class_id = int(box.cls[0])
-
-                            # 根据 class_id 获取类别名称
-                            class_name = ""
-                            if 0 <= class_id < len(model_classes):
-                                class_name = model_classes[class_id]
-                            else:
-                                class_name = f"class_{class_id}"
-
-                            detections.append({
-                                "x": x_center,
-                                "y": y_center,
-                                "width": width,
-                                "height": height,
-                                "class_id": class_id,
-                                "class_name": class_name,
-                                "confidence": float(box.conf[0]),
-                                "annotation_type": "bbox"
-                            })
-                print(f"[VIDEO] 帧 {frame_pos}: 检测到 {len(detections)} 个目标")
-            except Exception as e:
-                print(f"[VIDEO] 检测错误: {e}")
-        else:
-            print(f"[VIDEO] 模型未加载，跳过检测")
-
-        # 将帧编码为base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_base64 = base64.b64encode(buffer).decode()
-
-        return {
-            "success": True,
-            "frame": frame_base64,
-            "detections": detections,
-            "frame_pos": frame_pos
-        }
-
-    except Exception as e:
-        import traceback
-        error_detail = f"获取视频帧失败: {str(e)}\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
-        return {"success": False, "message": error_detail}
-
-@app.post("/api/video/detect/seek")
-async def seek_video_frame(frame_pos: int = 0):
-    """跳转到指定帧"""
-    global video_detection_active, video_capture
+                message = await websocket.receive_json()
+                reply = {"type": "control", "success": True, "session": session.control(**message)}
+            except (VideoSessionError, TypeError, ValueError) as e:
+                reply = {"type": "control", "success": False, "message": str(e)}
+            await websocket.send_json(reply)
 
-    if not video_detection_active or video_capture is None:
-        return {"success": False, "message": "视频检测未运行"}
+    receiver = asyncio.create_task(receive_controls())
+    try:
+        await websocket.send_json({"type": "session", **session.info()})
+        while not receiver.done():
+            item = await asyncio.to_thread(session.next_frame, 0.5)
+            if item is None:
+                if session.stopped:
+                    break
+                continue
+            if item is VIDEO_END:
+                await websocket.send_json({"type": "end", "message": "视频结束或读取失败", "error": session.error})
+                if session.realtime:
+                    break  # 实时流已断开；视频文件保留连接，跳转后继续推送
+                continue
+            await websocket.send_json({"type": "frame", **item["meta"]})
+            await websocket.send_bytes(item["jpeg"])
+        if session.stopped or session.ended:
+            await websocket.close(code=1000)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        if not receiver.cancel():
+            receiver.exception()  # 客户端断开（WebSocketDisconnect），不再记录为未处理的异常
+        session.remove_consumer()
+
+MJPEG_BOUNDARY = "frame"
+
+@app.get("/api/video/sessions/{session_id}/mjpeg")
+async def video_session_mjpeg(session_id: str, request: Request):
+    """
+    以 multipart/x-mixed-replace（MJPEG）推送检测画面，可以直接在浏览器或播放器中打开
 
+    每个分段的 X-Frame-Pos / X-Detections 头带有帧号和检测结果（JSON）。
+    """
+    session = _get_video_session(session_id)
     try:
-        video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
-        return {"success": True, "message": f"已跳转到帧 {frame_pos}"}
+        session.add_consumer()
+    except VideoSessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    except Exception as e:
-        return {"success": False, "message": f"跳转失败: {str(e)}"}
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                item = await asyncio.to_thread(session.next_frame, 0.5)
+                if item is None:
+                    if session.stopped:
+                        return
+                    continue
+                if item is VIDEO_END:
+                    if session.realtime:
+                        return
+                    continue
+                meta = item["meta"]
+                headers = (f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(item['jpeg'])}\r\n"
+                           f"X-Frame-Pos: {meta['frame_pos']}\r\nX-Detections: {json.dumps(meta['detections'])}\r\n\r\n")
+                yield headers.encode("utf-8") + item["jpeg"] + b"\r\n"
+        finally:
+            session.remove_consumer()
+
+    return StreamingResponse(stream(), media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == "__main__":
     import uvicorn
@@ -2068,6 +2147,17 @@ if __name__ == "__main__":
 
 # ==================== 预训练模型自动标注 API ====================
 
+def get_pretrained_model_name(model_size: str, task_type: str) -> str:
+    """根据模型大小和任务类型构建预训练模型文件名"""
+    model_base = f"yolo26{model_size}"
+    if task_type == "segmentation":
+        return f"{model_base}-seg.pt"
+    elif task_type == "pose":
+        return f"{model_base}-pose.pt"
+    elif task_type == "obb":
+        return f"{model_base}-obb.pt"
+    return f"{model_base}.pt"
+
 class PretrainedModelRequest(BaseModel):
     """预训练模型推理请求"""
     image_name: str
@@ -2088,165 +2178,38 @@ async def pretrained_annotate(request: PretrainedModelRequest):
     - obb: 旋转框检测 (yolo26n-obb.pt)
     """
     try:
-        print(f"[PRETRAINED] 开始自动标注: {request.image_name}, 任务={request.task_type}, 模型={request.model_size}")
-        
-        # 构建模型名称
-        model_base = f"yolo26{request.model_size}"
-        if request.task_type == "segmentation":
-            model_name = f"{model_base}-seg.pt"
-        elif request.task_type == "pose":
-            model_name = f"{model_base}-pose.pt"
-        elif request.task_type == "obb":
-            model_name = f"{model_base}-obb.pt"
-        else:
-            model_name = f"{model_base}.pt"
-        
-        print(f"[PRETRAINED] 加载模型: {model_name}")
-        
-        # 加载预训练模型
-        model = YOLO(model_name)
-        
         # 读取图片
         image_path = IMAGES_DIR / request.image_name
         if not image_path.exists():
             raise HTTPException(status_code=404, detail="图片不存在")
         
-        # 进行推理
-        results = model(str(image_path), conf=request.conf_threshold, iou=request.iou_threshold, verbose=False)
-        
-        # 解析结果
-        detections = []
-        for result in results:
-            img_height, img_width = result.orig_shape
-            
-            # 姿态估计
-            if hasattr(result, 'keypoints') and result.keypoints is not None:
-                keypoints_data = result.keypoints
-                boxes = result.boxes
-                
-                for i, box in enumerate(boxes):
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    x_center = (x1 + x2) / 2 / img_width
-                    y_center = (y1 + y2) / 2 / img_height
-                    width = (x2 - x1) / img_width
-                    height = (y2 - y1) / img_height
-                    class_id = int(box.cls[0])
-                    
-                    # 获取关键点（归一化坐标）
-                    keypoints = []
-                    if i < len(keypoints_data.xy):
-                        kpts = keypoints_data.xy[i].tolist()  # [[x, y], ...]
-                        for kpt in kpts:
-                            keypoints.append([kpt[0] / img_width, kpt[1] / img_height])
-                    
-                    detections.append({
-                        "x": x_center,
-                        "y": y_center,
-                        "width": width,
-                        "height": height,
-                        "class_id": class_id,
-                        "class_name": model.names[class_id],
-                        "confidence": float(box.conf[0]),
-                        "annotation_type": "keypoints",
-                        "keypoints": keypoints
-                    })
-            
-            # 实例分割
-            elif hasattr(result, 'masks') and result.masks is not None:
-                masks = result.masks
-                boxes = result.boxes
-                
-                for i, box in enumerate(boxes):
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    x_center = (x1 + x2) / 2 / img_width
-                    y_center = (y1 + y2) / 2 / img_height
-                    width = (x2 - x1) / img_width
-                    height = (y2 - y1) / img_height
-                    class_id = int(box.cls[0])
-                    
-                    # 获取多边形点（归一化坐标）
-                    points = []
-                    if i < len(masks.xy):
-                        mask_points = masks.xy[i].tolist()
-                        for px, py in mask_points:
-                            points.append([px / img_width, py / img_height])
-                    
-                    detections.append({
-                        "x": x_center,
-                        "y": y_center,
-                        "width": width,
-                        "height": height,
-                        "class_id": class_id,
-                        "class_name": model.names[class_id],
-                        "confidence": float(box.conf[0]),
-                        "annotation_type": "polygon",
-                        "points": points
-                    })
-            
-            # 旋转框检测
-            elif hasattr(result, 'obb') and result.obb is not None:
-                obb_boxes = result.obb
-                
-                for box in obb_boxes:
-                    x_center, y_center, width, height, angle = box.xywhr[0].tolist()
-                    class_id = int(box.cls[0])
-                    
-                    # 归一化坐标
-                    x_center = x_center / img_width
-                    y_center = y_center / img_height
-                    width = width / img_width
-                    height = height / img_height
-                    
-                    detections.append({
-                        "x": x_center,
-                        "y": y_center,
-                        "width": width,
-                        "height": height,
-                        "class_id": class_id,
-                        "class_name": model.names[class_id],
-                        "confidence": float(box.conf[0]),
-                        "annotation_type": "obb",
-                        "angle": angle
-                    })
-            
-            # 目标检测（默认）
-            else:
-                boxes = result.boxes
-                
-                for box in boxes:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    x_center = (x1 + x2) / 2 / img_width
-                    y_center = (y1 + y2) / 2 / img_height
-                    width = (x2 - x1) / img_width
-                    height = (y2 - y1) / img_height
-                    class_id = int(box.cls[0])
-                    
-                    detections.append({
-                        "x": x_center,
-                        "y": y_center,
-                        "width": width,
-                        "height": height,
-                        "class_id": class_id,
-                        "class_name": model.names[class_id],
-                        "confidence": float(box.conf[0]),
-                        "annotation_type": "bbox"
-                    })
-        
-        print(f"[PRETRAINED] 检测到 {len(detections)} 个目标")
+        # 从共享缓存获取预训练模型：按 (model_size, task_type) 只加载并预热一次
+        model_name = get_pretrained_model_name(request.model_size, request.task_type)
+        # 并发请求在 micro_batcher 中按 (模型, 阈值) 合并为批量推理
+        (detections, backend), cache_hit = await micro_batcher.submit(
+            model_name, image_path, task=request.task_type, warmup=True,
+            postprocess=lambda result, entry: (to_detections(result, entry.names), entry.backend_name),
+            conf=request.conf_threshold, iou=request.iou_threshold
+        )
+        logger.debug("预训练模型标注完成", extra={"fields": {
+            "image_name": request.image_name, "task_type": request.task_type, "model": model_name,
+            "model_cache": "warm" if cache_hit else "cold", "detections": len(detections)}})
         
         return {
             "success": True,
             "image_name": request.image_name,
             "task_type": request.task_type,
             "model": model_name,
+            "model_cache": "warm" if cache_hit else "cold",
+            "backend": backend,
             "detections": detections,
             "count": len(detections)
         }
         
+    except InferenceBusyError:
+        raise
     except Exception as e:
-        import traceback
-        print(f"[ERROR] 预训练模型标注失败: {e}")
-        print(f"[ERROR] 详细错误:\n{traceback.format_exc()}")
+        logger.exception(f"预训练模型标注失败: {e}")
         return {
             "success": False,
             "error": str(e)
@@ -2261,46 +2224,55 @@ class BatchPretrainedRequest(BaseModel):
     conf_threshold: float = 0.25
     iou_threshold: float = 0.7
     save_annotations: bool = True
+    batch_size: int = Field(DEFAULT_BATCH_SIZE, ge=1, le=256, description="每次前向推理的图片数量")
+    imgsz: int = Field(DEFAULT_IMGSZ, ge=32, description="统一的推理尺寸")
 
 @app.post("/api/pretrained/batch-annotate")
 async def batch_pretrained_annotate(request: BatchPretrainedRequest):
     """
     批量使用预训练模型自动标注
+
+    图片在线程池中预取解码，按 batch_size 组成批次一次性推理；
+    每张图片只解码一次，宽高取自推理结果的 orig_shape。
     """
+    model_name = get_pretrained_model_name(request.model_size, request.task_type)
+    return await inference_executor.run(_batch_pretrained_annotate_sync, request, model_name, model_key=model_name)
+
+def _batch_pretrained_annotate_sync(request: BatchPretrainedRequest, model_name: str):
+    """批量标注（在推理线程池中执行，整个批次占用同一个模型并发槽位）"""
     try:
-        print(f"[BATCH_PRETRAINED] 开始批量标注: {len(request.image_names)} 张图片, 任务={request.task_type}")
+        start_time = time.time()
         
         results_list = []
         success_count = 0
         failed_count = 0
         
-        # 对每张图片调用单张标注逻辑
-        for idx, image_name in enumerate(request.image_names):
-            try:
-                print(f"[BATCH_PRETRAINED] 处理 {idx+1}/{len(request.image_names)}: {image_name}")
-                
-                # 创建单张图片的请求
-                single_request = PretrainedModelRequest(
-                    image_name=image_name,
-                    task_type=request.task_type,
-                    model_size=request.model_size,
-                    conf_threshold=request.conf_threshold,
-                    iou_threshold=request.iou_threshold
-                )
-                
-                # 调用单张标注接口
-                result = await pretrained_annotate(single_request)
+        model, cache_hit = model_manager.acquire(model_name, task=request.task_type, warmup=True, with_status=True)
+        
+        try:
+            engine = BatchInferenceEngine(batch_size=request.batch_size, imgsz=request.imgsz)
+            image_paths = [IMAGES_DIR / image_name for image_name in request.image_names]
+            outputs = engine.run(model, image_paths, conf=request.conf_threshold, iou=request.iou_threshold)
+            
+            for image_path, result, error in outputs:
+                image_name = image_path.name
+                if error is not None:
+                    results_list.append({
+                        "image_name": image_name,
+                        "success": False,
+                        "detection_count": 0,
+                        "error": error
+                    })
+                    failed_count += 1
+                    logger.debug("批量标注失败", extra={"fields": {"image_name": image_name, "error": error}})
+                    continue
                 
-                if result and "detections" in result:
-                    detections = result["detections"]
-                    detection_count = len(detections)
+                try:
+                    detections = to_detections(result, model.names)
                     
                     # 如果需要保存标注
                     if request.save_annotations and detections:
-                        image_path = IMAGES_DIR / image_name
-                        img = cv2.imread(str(image_path))
-                        height, width = img.shape[:2]
-                        
+                        height, width = result.orig_shape[:2]
                         annotation_data = {
                             "image_name": image_name,
                             "width": width,
@@ -2308,49 +2280,44 @@ async def batch_pretrained_annotate(request: BatchPretrainedRequest):
                             "bboxes": detections
                         }
                         
-                        annotation_path = ANNOTATIONS_DIR / f"{image_name}.json"
-                        with annotation_path.open("w", encoding="utf-8") as f:
-                            json.dump(annotation_data, f, indent=2, ensure_ascii=False)
+                        annotation_store.save(image_name, annotation_data)
                     
                     results_list.append({
                         "image_name": image_name,
                         "success": True,
-                        "detection_count": detection_count,
+                        "detection_count": len(detections),
                         "error": None
                     })
                     success_count += 1
-                    print(f"[BATCH_PRETRAINED] ✓ {image_name}: {detection_count} 个目标")
-                else:
+                except Exception as e:
                     results_list.append({
                         "image_name": image_name,
-                        "success": True,
+                        "success": False,
                         "detection_count": 0,
-                        "error": None
+                        "error": str(e)
                     })
-                    success_count += 1
-                    print(f"[BATCH_PRETRAINED] ✓ {image_name}: 0 个目标")
-                
-            except Exception as e:
-                results_list.append({
-                    "image_name": image_name,
-                    "success": False,
-                    "detection_count": 0,
-                    "error": str(e)
-                })
-                failed_count += 1
-                print(f"[BATCH_PRETRAINED] ✗ {image_name}: {str(e)}")
+                    failed_count += 1
+                    logger.debug("批量标注失败", extra={"fields": {"image_name": image_name, "error": str(e)}})
+        finally:
+            model_manager.release(model)
         
-        print(f"[BATCH_PRETRAINED] 完成: 成功 {success_count}, 失败 {failed_count}, 总计 {len(request.image_names)}")
+        elapsed = time.time() - start_time
+        images_per_second = len(request.image_names) / elapsed if elapsed > 0 else 0.0
+        logger.info("批量标注完成", extra={"fields": {
+            "task_type": request.task_type, "model": model_name, "batch_size": request.batch_size,
+            "success": success_count, "failed": failed_count, "images_per_second": round(images_per_second, 1)}})
         
         return {
             "total_count": len(request.image_names),
             "success_count": success_count,
             "failed_count": failed_count,
+            "model": model_name,
+            "model_cache": "warm" if cache_hit else "cold",
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(images_per_second, 2),
             "results": results_list
         }
         
     except Exception as e:
-        import traceback
-        print(f"[ERROR] 批量预训练模型标注失败: {e}")
-        print(f"[ERROR] 详细错误:\n{traceback.format_exc()}")
+        logger.exception(f"批量预训练模型标注失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,213 @@
+"""
+动态批处理调度器 - 将同一模型的并发单图请求合并为一次批量推理
+
+同一时间窗口内（YOLO_BATCH_WINDOW_MS）到达的、模型和推理参数相同的请求被收集到一起，
+凑满 YOLO_BATCH_MAX_SIZE 张或窗口到期后一次性送入模型，结果再分发回各个等待的调用方。
+批次通过 inference_executor 执行，仍受按模型并发与队列深度限制。
+"""
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from model_manager import model_manager
+from batch_inference import decode_image
+from inference_executor import inference_executor, InferenceBusyError
+from request_logging import get_logger
+
+logger = get_logger("micro_batcher")
+
+# 收集窗口（毫秒），0 表示不等待、只合并已经在排队的请求
+BATCH_WINDOW_MS = float(os.environ.get("YOLO_BATCH_WINDOW_MS", "10"))
+# 单个批次的最大图片数
+BATCH_MAX_SIZE = int(os.environ.get("YOLO_BATCH_MAX_SIZE", "8"))
+
+
+class _PendingRequest:
+    """等待批处理的单个请求"""
+
+    def __init__(self, image_path: Path, postprocess: Optional[Callable], future: asyncio.Future):
+        self.image_path = image_path
+        self.postprocess = postprocess
+        self.future = future
+        self.submitted_at = time.time()
+
+
+class _Group:
+    """相同模型、相同推理参数的待处理请求"""
+
+    def __init__(self, weights: str, task: Optional[str], infer_kwargs: Dict[str, Any]):
+        self.weights = weights
+        self.task = task
+        self.infer_kwargs = infer_kwargs
+        self.warmup = False
+        self.requests: List[_PendingRequest] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """动态批处理调度器"""
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = BATCH_MAX_SIZE):
+        self.window_ms = max(0.0, window_ms)
+        self.max_batch_size = max(1, max_batch_size)
+        self._groups: Dict[Tuple, _Group] = {}
+        # 正在执行的批次任务（保留引用，避免任务在完成前被垃圾回收）
+        self._tasks: Set[asyncio.Task] = set()
+        self.waiting = 0
+        self.stats = {
+            "batches": 0,
+            "requests": 0,
+            "failed_batches": 0,
+            "batch_sizes": {},
+            "total_queue_latency": 0.0,
+            "max_queue_latency": 0.0,
+            "total_batch_time": 0.0,
+        }
+
+    def configure(self, window_ms: Optional[float] = None, max_batch_size: Optional[int] = None):
+        """运行时调整收集窗口和批次大小（对之后的请求生效）"""
+        if window_ms is not None:
+            self.window_ms = max(0.0, window_ms)
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, max_batch_size)
+
+    async def submit(self, weights: str, image_path: Path, task: Optional[str] = None, warmup: bool = False,
+                     postprocess: Optional[Callable] = None, **infer_kwargs) -> Tuple[Any, bool]:
+        """
+        提交单张图片，等待所在批次推理完成
+
+        Args:
+            weights: 模型权重（同 model_manager.acquire）
+            image_path: 图片路径，在推理线程中解码
+            task: 任务类型
+            warmup: 首次加载时是否预热
+            postprocess: 在推理线程中对单张结果执行的后处理 postprocess(result, model_entry)
+            infer_kwargs: 推理参数（conf、iou 等），参数不同的请求不会合并
+
+        Returns:
+            (后处理结果, 模型是否命中缓存)
+        """
+        if self.waiting >= inference_executor.max_queue_depth:
+            inference_executor.stats["rejected"] += 1
+            raise InferenceBusyError(self.waiting)
+
+        key = (weights, task, tuple(sorted(infer_kwargs.items())))
+        group = self._groups.get(key)
+        if group is None:
+            group = _Group(weights, task, infer_kwargs)
+            self._groups[key] = group
+
+        loop = asyncio.get_running_loop()
+        request = _PendingRequest(Path(image_path), postprocess, loop.create_future())
+        group.requests.append(request)
+        group.warmup = group.warmup or warmup
+        self.waiting += 1
+
+        if len(group.requests) >= self.max_batch_size:
+            self._flush(key)
+        elif group.timer is None:
+            group.timer = loop.call_later(self.window_ms / 1000, self._flush, key)
+
+        return await request.future
+
+    def _flush(self, key: Tuple):
+        """取出当前分组并在后台执行批次"""
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group.timer is not None:
+            group.timer.cancel()
+        self.waiting -= len(group.requests)
+        task = asyncio.get_running_loop().create_task(self._execute(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("批次任务异常", exc_info=task.exception())
+
+    async def _execute(self, group: _Group):
+        dispatched = time.time()
+        size = len(group.requests)
+        for request in group.requests:
+            latency = dispatched - request.submitted_at
+            self.stats["total_queue_latency"] += latency
+            self.stats["max_queue_latency"] = max(self.stats["max_queue_latency"], latency)
+        self.stats["requests"] += size
+        self.stats["batches"] += 1
+        self.stats["batch_sizes"][size] = self.stats["batch_sizes"].get(size, 0) + 1
+
+        try:
+            outputs, cache_hit = await inference_executor.run(self._run_batch, group, model_key=group.weights)
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            for request in group.requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self.stats["total_batch_time"] += time.time() - dispatched
+
+        for request, (value, error) in zip(group.requests, outputs):
+            if request.future.done():
+                continue  # 调用方已断开
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result((value, cache_hit))
+
+    @staticmethod
+    def _run_batch(group: _Group):
+        """在推理线程中执行：解码、批量推理、逐张后处理"""
+        model_entry, cache_hit = model_manager.acquire(
+            group.weights, task=group.task, warmup=group.warmup, with_status=True
+        )
+        try:
+            outputs: List[Tuple[Any, Optional[Exception]]] = [(None, None)] * len(group.requests)
+            images, indices = [], []
+            for i, request in enumerate(group.requests):
+                if not request.image_path.exists():
+                    outputs[i] = (None, FileNotFoundError(f"图片不存在: {request.image_path.name}"))
+                    continue
+                try:
+                    images.append(decode_image(request.image_path))
+                    indices.append(i)
+                except Exception as e:
+                    outputs[i] = (None, e)
+
+            if images:
+                results = model_entry.infer(images, **group.infer_kwargs)
+                for i, result in zip(indices, results):
+                    request = group.requests[i]
+                    try:
+                        value = request.postprocess(result, model_entry) if request.postprocess else result
+                        outputs[i] = (value, None)
+                    except Exception as e:
+                        outputs[i] = (None, e)
+            return outputs, cache_hit
+        finally:
+            model_manager.release(model_entry)
+
+    def status(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        requests = self.stats["requests"]
+        return {
+            "window_ms": self.window_ms,
+            "max_batch_size": self.max_batch_size,
+            "waiting": self.waiting,
+            "batches": batches,
+            "requests": requests,
+            "failed_batches": self.stats["failed_batches"],
+            "avg_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.stats["batch_sizes"].items())),
+            "avg_queue_latency_ms": round(self.stats["total_queue_latency"] / requests * 1000, 2) if requests else 0.0,
+            "max_queue_latency_ms": round(self.stats["max_queue_latency"] * 1000, 2),
+            "avg_batch_time_ms": round(self.stats["total_batch_time"] / batches * 1000, 2) if batches else 0.0,
+        }
+
+
+# 全局批处理调度器
+micro_batcher = MicroBatcher()
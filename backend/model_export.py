@@ -0,0 +1,328 @@
+"""
+模型导出 - 把训练得到的 best.pt 导出为 ONNX / OpenVINO（FP32、FP16、INT8），并在验证集上校验精度、测量 CPU 延迟
+
+每个导出变体都用与 best.pt 相同的参数在验证集上评估，mAP 比 best.pt 下降超过 YOLO_EXPORT_MAX_MAP_DROP 的变体
+标记为不可用。结果写入 weights/exports.json，模型索引据此登记可用的变体，并默认选择 CPU 延迟最低的一个。
+INT8 变体用训练集中抽样的图片校准（见 model_quantization），报告的 quantization 部分记录 INT8 与 FP32 的比较。
+训练进程在训练结束后直接调用 export_run；对已有的训练结果导出时由后台任务以独立进程运行本模块：
+python model_export.py <任务描述 JSON 文件>
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from model_quantization import CALIBRATION_IMAGES, CALIBRATION_SEED, compare, quantize_onnx, write_calibration_data
+from request_logging import get_logger
+
+logger = get_logger("model_export")
+
+# ==================== 配置 ====================
+
+# 变体名称 -> 导出格式、精度和输出文件名（位于 weights/ 下；OpenVINO 模型是以 _openvino_model 结尾的目录）
+EXPORT_VARIANTS: Dict[str, Dict[str, str]] = {
+    "onnx": {"format": "onnx", "precision": "fp32", "filename": "best.onnx"},
+    "onnx-fp16": {"format": "onnx", "precision": "fp16", "filename": "best-fp16.onnx"},
+    "onnx-int8": {"format": "onnx", "precision": "int8", "filename": "best-int8.onnx"},
+    "openvino": {"format": "openvino", "precision": "fp32", "filename": "best_openvino_model"},
+    "openvino-fp16": {"format": "openvino", "precision": "fp16", "filename": "best_fp16_openvino_model"},
+    "openvino-int8": {"format": "openvino", "precision": "int8", "filename": "best_int8_openvino_model"},
+}
+EXPORT_REPORT = "exports.json"
+
+
+def parse_variants(value: Any) -> List[str]:
+    """
+    解析导出变体列表（"onnx,openvino-int8" 或列表），空值表示不导出
+
+    Raises:
+        ValueError: 未知的变体名称
+    """
+    if value is None:
+        return []
+    names = [part.strip() for part in value.split(",")] if isinstance(value, str) else [str(part).strip() for part in value]
+    names = [name for name in names if name]
+    unknown = [name for name in names if name not in EXPORT_VARIANTS]
+    if unknown:
+        raise ValueError(f"未知的导出格式: {', '.join(unknown)}（可选: {', '.join(EXPORT_VARIANTS)}）")
+    return list(dict.fromkeys(names))
+
+
+# 训练结束后自动导出的变体（逗号分隔，空字符串表示不导出）
+EXPORT_FORMATS = parse_variants(os.environ.get("YOLO_EXPORT_FORMATS", "onnx"))
+# ONNX / OpenVINO 是否导出为动态输入（可变 batch，micro_batcher 合并请求时需要）
+EXPORT_DYNAMIC = os.environ.get("YOLO_EXPORT_DYNAMIC", "1").lower() in ("1", "true", "yes")
+# 是否在验证集上校验导出结果
+EXPORT_VALIDATE = os.environ.get("YOLO_EXPORT_VALIDATE", "1").lower() in ("1", "true", "yes")
+# 允许的 mAP50-95 最大下降（绝对值），超过时该变体不参与模型选择
+EXPORT_MAX_MAP_DROP = float(os.environ.get("YOLO_EXPORT_MAX_MAP_DROP", "0.02"))
+# 运行导出进程的 Python 解释器（与训练进程相同）
+EXPORT_PYTHON = os.environ.get("YOLO_TRAIN_PYTHON", sys.executable)
+EXPORT_SPEC_NAME = "export_job.json"
+# 导出时的临时目录（位于 weights/ 下）
+EXPORT_STAGING = ".export"
+
+
+class ExportError(RuntimeError):
+    """导出条件不满足（缺少依赖、需要 GPU 等）"""
+
+
+def variant_path(weights_dir: Path, variant: str) -> Path:
+    return Path(weights_dir) / EXPORT_VARIANTS[variant]["filename"]
+
+
+def load_report(weights_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((Path(weights_dir) / EXPORT_REPORT).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {"baseline": None, "variants": {}}
+
+
+def _save_report(weights_dir: Path, report: Dict[str, Any]):
+    path = Path(weights_dir) / EXPORT_REPORT
+    tmp_path = path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _size_bytes(path: Path) -> int:
+    if path.is_dir():
+        return sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+    return path.stat().st_size
+
+
+def primary_metric(task: str) -> str:
+    """用于比较精度的指标（分割模型比较掩码 mAP）"""
+    return "metrics/mAP50-95(M)" if task == "segment" else "metrics/mAP50-95(B)"
+
+
+def evaluate(weights: Path, data: str, imgsz: int, task: str) -> Dict[str, Any]:
+    """
+    在验证集上评估模型（CPU，batch=1，便于比较单张图片延迟）
+
+    Returns:
+        {"metrics": {...}, "map": 主要指标, "latency_ms": 每张图片推理耗时, "total_ms": 含前后处理}
+    """
+    from ultralytics import YOLO
+    model = YOLO(str(weights), task=task)
+    results = model.val(data=data, imgsz=imgsz, batch=1, device="cpu", plots=False, verbose=False)
+    metrics = {}
+    for key, value in (getattr(results, "results_dict", None) or {}).items():
+        try:
+            metrics[key] = round(float(value), 6)
+        except (TypeError, ValueError):
+            pass
+    speed = getattr(results, "speed", None) or {}
+    return {
+        "metrics": metrics,
+        "map": metrics.get(primary_metric(task)),
+        "latency_ms": round(float(speed.get("inference", 0.0)), 3),
+        "total_ms": round(sum(float(value) for value in speed.values()), 3),
+    }
+
+
+def _export_variant(source: Path, weights_dir: Path, variant: str, data: str, imgsz: int, dynamic: bool,
+                    calibration: Optional[Dict[str, Any]] = None) -> Path:
+    """
+    导出一个变体到 weights/ 下
+
+    Args:
+        source: best.pt，或没有 best.pt 时已导出的 best.onnx（只能量化为 onnx-int8）
+        calibration: INT8 校准数据（write_calibration_data 的返回值）
+    """
+    from ultralytics import YOLO
+    spec = EXPORT_VARIANTS[variant]
+    target = variant_path(weights_dir, variant)
+    if spec["precision"] == "int8" and calibration is None:
+        raise ExportError(f"{variant} 需要校准数据")
+    if source.suffix == ".onnx":
+        if variant != "onnx-int8":
+            raise ExportError(f"没有 best.pt，无法导出 {variant}")
+        return quantize_onnx(source, target, calibration["images"], imgsz)
+
+    kwargs: Dict[str, Any] = {"format": spec["format"], "imgsz": imgsz, "device": "cpu", "dynamic": dynamic}
+    if spec["format"] == "onnx":
+        kwargs["simplify"] = True
+    if spec["precision"] == "fp16":
+        kwargs["quantize"] = 16
+    elif spec["precision"] == "int8":
+        # 静态 INT8（ONNX Runtime / NNCF），用训练集中抽样的图片校准，验证集只用于评估
+        kwargs.update(quantize=8, data=str(calibration["yaml"]), split="train")
+
+    # 在临时目录中导出：ultralytics 把结果写在权重文件旁边，INT8 / FP16 ONNX 的中间文件同样叫 best.onnx，
+    # 直接在 weights/ 下导出会覆盖已有的 FP32 变体
+    staging = Path(weights_dir) / EXPORT_STAGING
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    try:
+        shutil.copy2(source, staging / source.name)
+        # 每个变体使用新加载的模型（导出会修改模型，例如融合 Conv+BN）
+        exported = Path(YOLO(str(staging / source.name)).export(**kwargs))
+        if target.is_dir():
+            shutil.rmtree(target)
+        elif target.exists():
+            target.unlink()
+        os.replace(exported, target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return target
+
+
+def export_run(run_dir: Path, data: str, variants: Sequence[str], imgsz: Optional[int] = None,
+               dynamic: bool = EXPORT_DYNAMIC, validate: bool = EXPORT_VALIDATE,
+               progress: Optional[Callable[..., None]] = None, calibration_images: int = CALIBRATION_IMAGES,
+               calibration_seed: str = CALIBRATION_SEED) -> Dict[str, Any]:
+    """
+    导出训练结果的各个变体并写入 weights/exports.json
+
+    Args:
+        run_dir: 训练输出目录（包含 weights/best.pt，或只有导出的 weights/best.onnx）
+        data: 数据集 data.yaml（验证；INT8 校准图片从其中的训练集抽样）
+        variants: 要导出的变体，见 EXPORT_VARIANTS
+        imgsz: 输入尺寸，默认使用训练时的尺寸
+        progress: 进度回调 progress(event, **fields)
+        calibration_images: INT8 校准图片数量
+        calibration_seed: 校准图片抽样种子
+    """
+    from ultralytics import YOLO
+
+    progress = progress or (lambda event, **fields: None)
+    weights_dir = Path(run_dir) / "weights"
+    source = weights_dir / "best.pt"
+    if not source.exists():
+        source = variant_path(weights_dir, "onnx")
+    if not source.exists():
+        raise ExportError(f"训练结果中没有 best.pt 或 best.onnx: {run_dir}")
+    source_format = "pt" if source.suffix == ".pt" else "onnx"
+    model = YOLO(str(source))
+    task = model.task
+    imgsz = int(imgsz or (getattr(model, "ckpt", None) or {}).get("train_args", {}).get("imgsz") or 640)
+    del model
+
+    report = load_report(weights_dir)
+    report.update({"task": task, "imgsz": imgsz, "dynamic": dynamic, "data": str(data),
+                   "max_map_drop": EXPORT_MAX_MAP_DROP, "validated": validate})
+    if validate:
+        progress("export", variant=source_format, message=f"评估 {source.name}")
+        report["baseline"] = {"variant": source_format, "path": str(source), "size_bytes": _size_bytes(source),
+                              **evaluate(source, data, imgsz, task)}
+    baseline_map = (report.get("baseline") or {}).get("map")
+
+    calibration = None
+    if any(EXPORT_VARIANTS[variant]["precision"] == "int8" for variant in variants):
+        progress("export", variant=None, message="抽样 INT8 校准图片")
+        calibration = write_calibration_data(Path(data), weights_dir, calibration_images, calibration_seed)
+        report["quantization"] = {"calibration_images": len(calibration["images"]), "seed": calibration["seed"],
+                                  "calibration_list": str(calibration["list"]), "comparisons": []}
+
+    for variant in variants:
+        progress("export", variant=variant, message=f"正在导出 {variant}")
+        spec = EXPORT_VARIANTS[variant]
+        entry: Dict[str, Any] = {"variant": variant, "format": spec["format"], "precision": spec["precision"],
+                                 "path": None, "accepted": False, "error": None, "exported_at": time.time()}
+        started = time.perf_counter()
+        try:
+            target = _export_variant(source, weights_dir, variant, str(data), imgsz, dynamic, calibration)
+            entry.update(path=str(target), size_bytes=_size_bytes(target),
+                         export_seconds=round(time.perf_counter() - started, 2))
+            if validate:
+                entry.update(evaluate(target, data, imgsz, task))
+                if baseline_map is not None and entry["map"] is not None:
+                    entry["map_drop"] = round(baseline_map - entry["map"], 6)
+                    entry["accepted"] = entry["map_drop"] <= EXPORT_MAX_MAP_DROP
+                else:
+                    entry["accepted"] = entry["map"] is not None
+            else:
+                entry["accepted"] = True
+        except Exception as e:
+            entry["error"] = str(e)
+            logger.error(f"导出 {variant} 失败: {e}")
+        report["variants"][variant] = entry
+        _save_report(weights_dir, report)
+        progress("exported", **{key: entry.get(key) for key in
+                                ("variant", "accepted", "error", "map", "map_drop", "latency_ms", "size_bytes")})
+    if calibration is not None:
+        report["quantization"]["comparisons"] = compare(report)
+        for item in report["quantization"]["comparisons"]:
+            logger.info(f"{item['int8']} vs {item['fp32']}: mAP {item['map_fp32']} -> {item['map_int8']}, "
+                        f"延迟 {item['latency_fp32_ms']}ms -> {item['latency_int8_ms']}ms")
+    _save_report(weights_dir, report)
+    return report
+
+
+def run_export_job(job, run_dir: Path, data: str, variants: Sequence[str], dynamic: bool = EXPORT_DYNAMIC,
+                   validate: bool = EXPORT_VALIDATE, calibration_images: int = CALIBRATION_IMAGES,
+                   calibration_seed: str = CALIBRATION_SEED) -> Dict[str, Any]:
+    """
+    后台任务：在独立进程中导出已有的训练结果（导出和验证会占用大量 CPU 和内存，不在 API 进程中执行）
+
+    Returns:
+        exports.json 的内容
+    """
+    from training_worker import PROGRESS_PREFIX
+    weights_dir = Path(run_dir) / "weights"
+    spec_path = weights_dir / EXPORT_SPEC_NAME
+    spec = {"run_dir": str(run_dir), "data": str(data), "variants": list(variants), "dynamic": dynamic,
+            "validate": validate, "calibration_images": calibration_images, "calibration_seed": calibration_seed}
+    spec_path.write_text(json.dumps(spec, ensure_ascii=False, indent=2), encoding="utf-8")
+    job.update(done=0, total=len(variants), message="正在启动导出进程")
+    process = subprocess.Popen(
+        [EXPORT_PYTHON, str(Path(__file__)), str(spec_path)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace",
+        env={**os.environ, "PYTHONUNBUFFERED": "1", "PYTHONIOENCODING": "utf-8"})
+    error = None
+    try:
+        for line in process.stdout:
+            if job.cancelled:
+                process.terminate()
+                break
+            if not line.startswith(PROGRESS_PREFIX):
+                if line.strip():
+                    logger.info(line.rstrip())
+                continue
+            try:
+                event = json.loads(line[len(PROGRESS_PREFIX):])
+            except ValueError:
+                continue
+            kind = event.get("event")
+            if kind == "export":
+                job.update(message=event.get("message"))
+            elif kind == "exported":
+                job.advance(failed=0 if event.get("accepted") else 1)
+            elif kind == "error":
+                error = event.get("error")
+        code = process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+    job.check_cancelled()
+    if code != 0:
+        raise RuntimeError(error or f"导出进程退出码 {code}")
+    return load_report(weights_dir)
+
+
+def main(spec_path: str) -> int:
+    from training_worker import emit
+    spec = json.loads(Path(spec_path).read_text(encoding="utf-8"))
+    try:
+        report = export_run(Path(spec["run_dir"]), spec["data"], parse_variants(spec["variants"]), spec.get("imgsz"),
+                            spec.get("dynamic", EXPORT_DYNAMIC), spec.get("validate", EXPORT_VALIDATE), progress=emit,
+                            calibration_images=spec.get("calibration_images", CALIBRATION_IMAGES),
+                            calibration_seed=spec.get("calibration_seed", CALIBRATION_SEED))
+    except Exception as e:
+        logger.exception(f"导出失败: {e}")
+        emit("error", error=str(e))
+        return 1
+    emit("done", variants={name: entry["accepted"] for name, entry in report["variants"].items()})
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python model_export.py <任务描述 JSON 文件>", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(main(sys.argv[1]))
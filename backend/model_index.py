@@ -0,0 +1,319 @@
+"""
+模型索引 - 记录训练产出的模型及其权重文件、修改时间和评估指标
+
+索引在首次使用时扫描一次 models 目录（并从 model_index.json 恢复当前模型），训练或导出结束时更新，
+推理端点通过 active_weights() 以常数时间取得当前使用的模型，不再每次请求递归 glob。
+导出的 ONNX / OpenVINO 变体（model_export）也登记在训练结果中；只有 CUDA 不可用时（纯 CPU 推理服务器），
+按 exports.json 中测得的 CPU 延迟选择通过精度校验的最快变体，否则按格式优先级选择。
+切换模型时也可以指定格式（例如量化得到的 onnx-int8），指定的格式优先于自动选择。
+"""
+import os
+import csv
+import json
+import time
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from model_export import EXPORT_VARIANTS, load_report
+from request_logging import get_logger
+
+logger = get_logger("model_index")
+
+BASE_DIR = Path(__file__).parent
+
+# 权重格式的优先顺序（与原先 "有 ONNX 优先使用 ONNX" 的行为一致）
+FORMAT_PREFERENCE = [fmt.strip() for fmt in os.environ.get("YOLO_MODEL_FORMAT_PREFERENCE", "onnx,openvino,pt,engine").split(",") if fmt.strip()]
+WEIGHT_SUFFIXES = {".pt": "pt", ".onnx": "onnx", ".engine": "engine"}
+INDEX_FILENAME = "model_index.json"
+# 权重选择方式：auto（没有 CUDA 时选 CPU 延迟最低的变体）、fastest（总是按延迟）、preference（总是按格式优先级）
+MODEL_SELECT = os.environ.get("YOLO_MODEL_SELECT", "auto").lower()
+
+
+@lru_cache(maxsize=1)
+def _cpu_only() -> bool:
+    try:
+        import torch
+        return not torch.cuda.is_available()
+    except Exception:
+        return True
+
+
+def _read_metrics(run_dir: Path) -> Dict[str, float]:
+    """从 ultralytics 的 results.csv 最后一行读取评估指标"""
+    results_csv = run_dir / "results.csv"
+    if not results_csv.exists():
+        return {}
+    try:
+        with results_csv.open("r", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    except Exception as e:
+        logger.warning(f"读取训练结果失败 {results_csv}: {e}")
+        return {}
+    if not rows:
+        return {}
+    metrics = {}
+    for key, value in rows[-1].items():
+        key = (key or "").strip()
+        if key.startswith("metrics/") or key == "epoch":
+            try:
+                metrics[key] = float(value)
+            except (TypeError, ValueError):
+                pass
+    return metrics
+
+
+class ModelIndex:
+    """训练模型索引"""
+
+    def __init__(self, models_dir: Path):
+        self.models_dir = Path(models_dir)
+        self.index_file = self.models_dir / INDEX_FILENAME
+        self._lock = threading.RLock()
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self.active: Optional[str] = None
+        self.active_format: Optional[str] = None  # 手动指定的权重格式，None 表示自动选择
+        self._active_weights: Optional[Path] = None
+        self._loaded = False
+
+    # ==================== 扫描与持久化 ====================
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            # 先恢复上次选择的模型和指标，再扫描一次目录以发现手动放入或删除的模型
+            self._load()
+            self.scan()
+
+    def _load(self) -> bool:
+        if not self.index_file.exists():
+            return False
+        try:
+            data = json.loads(self.index_file.read_text(encoding="utf-8"))
+            self.runs = data.get("runs", {})
+            self.active = data.get("active")
+            self.active_format = data.get("active_format")
+            self._refresh_active()
+            logger.info(f"已加载模型索引: {len(self.runs)} 个训练结果, 当前模型: {self.active}")
+            return True
+        except Exception as e:
+            logger.warning(f"模型索引损坏，重新扫描: {e}")
+            return False
+
+    def _save(self):
+        if not self.models_dir.exists():
+            return
+        data = {"active": self.active, "active_format": self.active_format, "runs": self.runs, "updated_at": time.time()}
+        tmp_file = self.index_file.with_suffix(".json.tmp")
+        tmp_file.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_file, self.index_file)
+
+    @staticmethod
+    def _run_dir_of(weights_file: Path) -> Path:
+        """best.pt 位于 <run>/weights/ 或直接位于 <run>/ 下"""
+        parent = weights_file.parent
+        return parent.parent if parent.name == "weights" else parent
+
+    def _describe_run(self, run_dir: Path, metrics: Optional[Dict[str, float]] = None) -> Optional[Dict[str, Any]]:
+        weights = {}
+        for folder in (run_dir / "weights", run_dir):
+            for suffix, fmt in WEIGHT_SUFFIXES.items():
+                candidate = folder / f"best{suffix}"
+                if fmt not in weights and candidate.exists():
+                    weights[fmt] = str(candidate)
+        if not weights:
+            return None
+        # 导出的变体（best.onnx 已作为 onnx 登记）
+        for variant in EXPORT_VARIANTS:
+            candidate = run_dir / "weights" / EXPORT_VARIANTS[variant]["filename"]
+            if variant not in weights and candidate.exists():
+                weights[variant] = str(candidate)
+        mtime = max(Path(path).stat().st_mtime for path in weights.values())
+        run_dir = run_dir.resolve()
+        try:
+            name = run_dir.relative_to(self.models_dir.resolve()).as_posix()
+        except ValueError:
+            name = run_dir.name  # 不在 models 目录下的训练结果
+        return {
+            "name": name,
+            "path": str(run_dir),
+            "weights": weights,
+            "mtime": mtime,
+            "metrics": metrics if metrics is not None else _read_metrics(run_dir),
+            "exports": self._describe_exports(run_dir, weights),
+        }
+
+    @staticmethod
+    def _describe_exports(run_dir: Path, weights: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """exports.json 中各权重格式的校验结果（基准为导出前的 best.pt，或量化前的 best.onnx）"""
+        report = load_report(run_dir / "weights")
+        entries = dict(report.get("variants") or {})
+        if report.get("baseline"):
+            entries[report["baseline"].get("variant", "pt")] = {**report["baseline"], "accepted": True}
+        exports = {}
+        for fmt, entry in entries.items():
+            if fmt not in weights:
+                continue
+            exports[fmt] = {key: entry.get(key) for key in
+                            ("precision", "accepted", "error", "map", "map_drop", "latency_ms", "total_ms", "size_bytes")}
+        return exports
+
+    def scan(self) -> List[Dict[str, Any]]:
+        """完整扫描 models 目录重建索引（启动、重新加载或文件被外部修改时调用）"""
+        with self._lock:
+            runs = {}
+            if self.models_dir.exists():
+                run_dirs = {self._run_dir_of(path) for suffix in WEIGHT_SUFFIXES
+                            for path in self.models_dir.glob(f"**/best{suffix}")}
+                for run_dir in run_dirs:
+                    info = self._describe_run(run_dir)
+                    if info:
+                        previous = self.runs.get(info["name"])
+                        if not info["metrics"] and previous:
+                            info["metrics"] = previous.get("metrics", {})
+                        runs[info["name"]] = info
+            self.runs = runs
+            if self.active not in self.runs:
+                self.active = self._latest_run()
+                self.active_format = None
+            self._refresh_active()
+            self._loaded = True
+            self._save()
+            logger.info(f"扫描完成: {len(self.runs)} 个训练结果, 当前模型: {self.active}")
+            return self.list_runs()
+
+    def _latest_run(self) -> Optional[str]:
+        if not self.runs:
+            return None
+        return max(self.runs.values(), key=lambda run: run["mtime"])["name"]
+
+    def _refresh_active(self):
+        """确定当前模型使用的权重文件：手动指定的格式优先，纯 CPU 时选校验通过且延迟最低的格式，否则按格式优先级"""
+        self._active_weights = None
+        run = self.runs.get(self.active) if self.active else None
+        if run is None:
+            return
+        if self.active_format in run["weights"]:
+            self._active_weights = Path(run["weights"][self.active_format])
+            return
+        if MODEL_SELECT == "fastest" or (MODEL_SELECT == "auto" and _cpu_only()):
+            measured = {fmt: entry["latency_ms"] for fmt, entry in (run.get("exports") or {}).items()
+                        if entry.get("accepted") and entry.get("latency_ms") and fmt in run["weights"]}
+            if measured:
+                self._active_weights = Path(run["weights"][min(measured, key=measured.get)])
+                return
+        rejected = {fmt for fmt, entry in (run.get("exports") or {}).items() if entry.get("accepted") is False}
+        for fmt in FORMAT_PREFERENCE:
+            if fmt in rejected:
+                continue
+            if fmt in run["weights"]:
+                self._active_weights = Path(run["weights"][fmt])
+                return
+        self._active_weights = Path(run["weights"]["pt"]) if "pt" in run["weights"] else None
+
+    # ==================== 更新 ====================
+
+    def register_run(self, run_dir: Path, metrics: Optional[Dict[str, Any]] = None, activate: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        训练或导出完成后登记（或刷新）一个训练结果
+
+        Args:
+            run_dir: 训练输出目录（包含 weights/best.pt）
+            metrics: 训练返回的指标（results.results_dict），为空时从 results.csv 读取
+            activate: 是否设为当前使用的模型
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if metrics:
+                numeric = {}
+                for key, value in metrics.items():
+                    try:
+                        numeric[key] = float(value)
+                    except (TypeError, ValueError):
+                        pass
+                metrics = numeric
+            info = self._describe_run(Path(run_dir), metrics or None)
+            if info is None:
+                logger.warning(f"训练目录中没有模型文件: {run_dir}")
+                return None
+            self.runs[info["name"]] = info
+            if activate or self.active is None:
+                if self.active != info["name"]:
+                    self.active_format = None
+                self.active = info["name"]
+            self._refresh_active()
+            self._save()
+            logger.info(f"已登记模型: {info['name']} ({', '.join(info['weights'])})")
+            return info
+
+    def set_active(self, name: str, fmt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        切换当前使用的模型
+
+        Args:
+            name: 训练结果名称
+            fmt: 使用的权重格式（例如 onnx-int8），None 表示自动选择
+
+        Raises:
+            KeyError: 训练结果不存在
+            ValueError: 训练结果中没有该格式的权重
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if name not in self.runs:
+                raise KeyError(name)
+            if fmt is not None and fmt not in self.runs[name]["weights"]:
+                raise ValueError(f"训练模型 {name} 没有 {fmt} 格式的权重（可选: {', '.join(self.runs[name]['weights'])}）")
+            self.active = name
+            self.active_format = fmt
+            self._refresh_active()
+            self._save()
+            return self.runs[name]
+
+    def clear(self):
+        """清空索引（删除训练数据后调用）"""
+        with self._lock:
+            self.runs = {}
+            self.active = None
+            self.active_format = None
+            self._active_weights = None
+            self._loaded = True
+            self._save()
+
+    # ==================== 查询 ====================
+
+    def active_weights(self) -> Optional[Path]:
+        """
+        当前使用的模型权重路径，没有训练模型时返回 None
+
+        只检查一次文件是否存在；文件被外部删除时重新扫描。
+        """
+        self._ensure_loaded()
+        weights = self._active_weights
+        if weights is not None and not weights.exists():
+            logger.warning(f"模型文件已不存在，重新扫描: {weights}")
+            self.scan()
+            weights = self._active_weights
+        return weights
+
+    def active_info(self) -> Optional[Dict[str, Any]]:
+        self._ensure_loaded()
+        run = self.runs.get(self.active) if self.active else None
+        if run is None:
+            return None
+        return {**run, "active_weights": str(self._active_weights) if self._active_weights else None,
+                "active_format": self.active_format}
+
+    def list_runs(self) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        with self._lock:
+            runs = sorted(self.runs.values(), key=lambda run: run["mtime"], reverse=True)
+            return [{**run, "active": run["name"] == self.active} for run in runs]
+
+
+# 全局模型索引（与 main.MODELS_DIR 为同一目录）
+model_index = ModelIndex(BASE_DIR / "models")
@@ -0,0 +1,759 @@
+"""
+模型管理器 - 模型注册表与 LRU 模型缓存
+
+所有推理端点共享同一个 ModelManager 实例。缓存以 (权重, 任务, 设备, 精度) 为键，
+总占用受内存上限约束，超出时按 LRU 顺序淘汰未被使用的模型。
+推理后端（PyTorch / ONNX Runtime / OpenVINO）由权重格式决定，加载后按 inference_backends 的配置调优并预热。
+"""
+import os
+import gc
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from result_decoding import results_to_detections
+from inference_backends import InferenceBackend, backend_for, backend_stats, configure_process, WARMUP_RUNS
+from request_logging import get_logger
+
+logger = get_logger("model_manager")
+
+BASE_DIR = Path(__file__).parent
+
+# ==================== 缓存配置 ====================
+
+# 模型缓存的内存上限（MB），以及最多缓存的模型数量
+MODEL_CACHE_MAX_MB = float(os.environ.get("YOLO_MODEL_CACHE_MB", "4096"))
+MODEL_CACHE_MAX_ENTRIES = int(os.environ.get("YOLO_MODEL_CACHE_ENTRIES", "8"))
+# 默认设备，留空表示自动选择（有 CUDA 时使用 cuda:0）
+DEFAULT_DEVICE = os.environ.get("YOLO_DEVICE", "")
+# 模型加载后预热推理使用的图像尺寸
+WARMUP_IMGSZ = int(os.environ.get("YOLO_WARMUP_IMGSZ", "640"))
+# 模型加载后是否立即预热（否则只在调用方要求时预热）
+WARMUP_ON_LOAD = os.environ.get("YOLO_WARMUP_ON_LOAD", "1").lower() in ("1", "true", "yes")
+# 逗号分隔的预加载模型名称，会与目录中标记 preload 的模型合并
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("YOLO_PRELOAD_MODELS", "").split(",") if name.strip()]
+
+
+# ==================== 模型目录 ====================
+
+def _build_catalog() -> Dict[str, Dict[str, Any]]:
+    """构建内置模型目录：名称 -> 权重文件、任务类型、模型家族"""
+    catalog = {
+        "yolov8n": {"weights": "yolov8n.pt", "task_type": "detection", "family": "yolo"},
+        "yolov8x": {"weights": "yolov8x.pt", "task_type": "detection", "family": "yolo"},
+        "yolov8n-seg": {"weights": "yolov8n-seg.pt", "task_type": "segmentation", "family": "yolo"},
+        "yolov8n-pose": {"weights": "yolov8n-pose.pt", "task_type": "pose", "family": "yolo"},
+        "yolov8n-cls": {"weights": "yolov8n-cls.pt", "task_type": "classification", "family": "yolo"},
+        "rtdetr-l": {"weights": "rtdetr-l.pt", "task_type": "detection", "family": "rtdetr"},
+        "rtdetr-x": {"weights": "rtdetr-x.pt", "task_type": "detection", "family": "rtdetr"},
+        "sam-b": {"weights": "sam_b.pt", "task_type": "segmentation", "family": "sam"},
+        "sam-l": {"weights": "sam_l.pt", "task_type": "segmentation", "family": "sam"},
+        "mobile-sam": {"weights": "mobile_sam.pt", "task_type": "segmentation", "family": "sam"},
+        "bytetrack": {"weights": "", "task_type": "tracking", "family": "tracker"},
+    }
+    suffixes = {"detection": "", "segmentation": "-seg", "pose": "-pose", "obb": "-obb", "classification": "-cls"}
+    for size in ["n", "s", "m", "l", "x"]:
+        for task_type, suffix in suffixes.items():
+            name = f"yolo26{size}{suffix}"
+            catalog[name] = {"weights": f"{name}.pt", "task_type": task_type, "family": "yolo"}
+    for info in catalog.values():
+        info.setdefault("preload", False)
+    return catalog
+
+
+MODEL_CATALOG = _build_catalog()
+
+# ultralytics 的任务名称
+ULTRALYTICS_TASKS = {
+    "detection": "detect",
+    "segmentation": "segment",
+    "pose": "pose",
+    "obb": "obb",
+    "classification": "classify",
+}
+
+
+class ModelKey(NamedTuple):
+    """模型缓存键"""
+    weights: str
+    task: str
+    device: str
+    precision: str
+
+
+def resolve_device(device: Optional[str] = None) -> str:
+    """将设备参数规范化为 cpu / cuda:N"""
+    device = (device if device is not None else DEFAULT_DEVICE).strip().lower()
+    if device in ("", "auto"):
+        try:
+            import torch
+            return "cuda:0" if torch.cuda.is_available() else "cpu"
+        except ImportError:
+            return "cpu"
+    if device.isdigit():
+        device = f"cuda:{device}"
+    if device.startswith("cuda"):
+        try:
+            import torch
+            if not torch.cuda.is_available():
+                logger.warning(f"CUDA 不可用，设备 {device} 回退到 CPU")
+                return "cpu"
+        except ImportError:
+            return "cpu"
+    return device
+
+
+def resolve_weights(weights: str) -> str:
+    """优先使用本地权重文件，否则保留名称交给 ultralytics 自动下载"""
+    if not weights:
+        return weights
+    path = Path(weights)
+    if path.is_absolute():
+        return str(path)
+    if path.exists():
+        return str(path.resolve())
+    local_path = BASE_DIR / weights
+    if local_path.exists():
+        return str(local_path)
+    return weights
+
+
+def _normalize_task(task: Optional[str]) -> str:
+    """将 detect/segment 等别名统一为 detection/segmentation 等任务名"""
+    if not task:
+        return "auto"
+    aliases = {v: k for k, v in ULTRALYTICS_TASKS.items()}
+    return aliases.get(task, task)
+
+
+# ==================== 缓存条目 ====================
+
+class ModelEntry:
+    """
+    已加载的模型
+
+    refcount 记录正在使用该模型的调用数量，pinned 表示通过 API 显式加载，
+    两者任一不为零时模型都不会被淘汰。
+    """
+
+    def __init__(self, key: ModelKey, model: Any, family: str, name: str, size_bytes: int):
+        self.key = key
+        self.model = model
+        self.family = family
+        self.name = name
+        self.size_bytes = size_bytes
+        self.refcount = 0
+        self.pinned = False
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.hits = 0
+        self.evict_on_release = False
+        self.warmed_up = False
+        self.warmup_time = 0.0
+        self._lock = threading.Lock()
+        # ultralytics 的 predictor 不是线程安全的，同一模型的前向推理串行执行
+        self._infer_lock = threading.Lock()
+        self._names: Dict[int, str] = {}
+        # 推理后端（跟踪器没有）
+        self.backend: Optional[InferenceBackend] = backend_for(key.weights) if family != "tracker" else None
+
+    @property
+    def backend_name(self) -> Optional[str]:
+        return self.backend.name if self.backend is not None else None
+
+    @property
+    def names(self) -> Dict[int, str]:
+        """模型内嵌的类别名称（首次读取后缓存在条目上）"""
+        if not self._names:
+            names = getattr(self.model, "names", None) or {}
+            if isinstance(names, list):
+                names = dict(enumerate(names))
+            self._names = dict(names)
+        return self._names
+
+    def _acquire(self):
+        with self._lock:
+            self.refcount += 1
+            self.hits += 1
+            self.last_used = time.time()
+
+    def _release(self):
+        with self._lock:
+            self.refcount = max(0, self.refcount - 1)
+
+    def infer(self, source, **kwargs):
+        """调用底层模型推理，自动带上缓存键中的设备与精度，并按后端记录耗时"""
+        self._acquire()
+        try:
+            start = time.perf_counter()
+            results = self._forward(source, **kwargs)
+            images = len(source) if isinstance(source, (list, tuple)) else 1
+            backend_stats.record(self.backend_name or "other", images, time.perf_counter() - start)
+            return results
+        finally:
+            self._release()
+            if self.evict_on_release and self.refcount == 0:
+                model_manager._evict_if_flagged(self)
+
+    def _forward(self, source, **kwargs):
+        if self.family in ("yolo", "rtdetr", "sam"):
+            kwargs.setdefault("device", self.key.device)
+            kwargs.setdefault("verbose", False)
+            if self.key.precision == "fp16" and self.key.device != "cpu":
+                kwargs.setdefault("half", True)
+        with self._infer_lock:
+            results = self.model(source, **kwargs)
+            # 第一次推理（或参数变化导致 ultralytics 重建预测器）后按后端配置调优，之后的推理使用调优后的会话
+            if self.backend is not None:
+                self.backend.ensure_tuned(self.model, self.key.weights)
+            return results
+
+    def warmup(self, imgsz: int = WARMUP_IMGSZ, runs: int = WARMUP_RUNS):
+        """
+        用空白图像执行几次推理，提前完成预测器建立、后端调优、CUDA 初始化、算子选择等一次性开销
+
+        导出的静态尺寸模型（ONNX / OpenVINO）使用导出时的输入尺寸，忽略 imgsz。
+        """
+        if self.warmed_up or self.family not in ("yolo", "rtdetr"):
+            return
+        start = time.time()
+        dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        for _ in range(max(1, runs)):
+            self._forward(dummy, imgsz=imgsz)
+        self.warmed_up = True
+        self.warmup_time = time.time() - start
+        logger.info(f"模型预热完成: {self.name} ({self.backend_name}), 耗时 {self.warmup_time:.2f}s")
+
+    def predict(self, image: np.ndarray, conf_threshold: float = 0.25, iou_threshold: float = 0.45,
+                top_k: int = 5, prompts: Optional[List[Dict[str, Any]]] = None,
+                auto_segment: bool = False, multimask_output: bool = True, **kwargs) -> Dict[str, Any]:
+        """
+        统一的推理接口，返回与扩展 API 约定一致的字典
+
+        Args:
+            image: BGR 图像
+            conf_threshold: 置信度阈值
+            iou_threshold: NMS IOU 阈值
+            top_k: 分类任务返回的前 K 个结果
+            prompts: SAM 提示词（归一化坐标）
+            auto_segment: SAM 是否自动分割整张图片
+            multimask_output: SAM 是否输出多个掩码
+        """
+        if self.family == "tracker":
+            raise RuntimeError("跟踪器不支持 predict，请使用 update")
+
+        if self.family == "sam":
+            return self._predict_sam(image, prompts, auto_segment, multimask_output)
+
+        results = self.infer(image, conf=conf_threshold, iou=iou_threshold)
+
+        if self.key.task == "classification":
+            return self._classification_output(results, top_k)
+
+        return {"detections": results_to_detections(results, self.names)}
+
+    def update(self, image: Optional[np.ndarray], detections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """跟踪器接口：用当前帧检测结果更新轨迹"""
+        if self.family != "tracker":
+            raise RuntimeError(f"模型 {self.name} 不是跟踪器")
+        self._acquire()
+        try:
+            return self.model.update(image, detections)
+        finally:
+            self._release()
+
+    def reset(self):
+        """跟踪器接口：清空轨迹"""
+        if self.family == "tracker":
+            self.model.reset()
+
+    def _classification_output(self, results, top_k: int) -> Dict[str, Any]:
+        names = self.names
+        predictions = []
+        for result in results:
+            probs = getattr(result, "probs", None)
+            if probs is None:
+                continue
+            data = probs.data.cpu().numpy() if hasattr(probs.data, "cpu") else np.asarray(probs.data)
+            for class_id in np.argsort(-data)[:top_k]:
+                predictions.append({
+                    "class_id": int(class_id),
+                    "class_name": names.get(int(class_id), f"class_{int(class_id)}"),
+                    "confidence": float(data[class_id])
+                })
+        return {"predictions": predictions, "class_names": [names[i] for i in sorted(names)]}
+
+    def _predict_sam(self, image: np.ndarray, prompts, auto_segment: bool, multimask_output: bool) -> Dict[str, Any]:
+        img_height, img_width = image.shape[:2]
+        kwargs = {"multimask_output": multimask_output}
+        if prompts and not auto_segment:
+            points, labels, boxes = [], [], []
+            for prompt in prompts:
+                if prompt.get("type") == "point":
+                    points.append([prompt["x"] * img_width, prompt["y"] * img_height])
+                    labels.append(int(prompt.get("label", 1)))
+                elif prompt.get("type") == "box":
+                    boxes.append([prompt["x1"] * img_width, prompt["y1"] * img_height,
+                                  prompt["x2"] * img_width, prompt["y2"] * img_height])
+            if points:
+                kwargs["points"] = [points]
+                kwargs["labels"] = [labels]
+            if boxes:
+                kwargs["bboxes"] = boxes
+        try:
+            results = self.infer(image, **kwargs)
+        except TypeError:
+            # 旧版 ultralytics 不支持 multimask_output 参数
+            kwargs.pop("multimask_output", None)
+            results = self.infer(image, **kwargs)
+
+        detections = results_to_detections(results, {})
+        for det in detections:
+            det["class_name"] = det["class_name"] or "object"
+        return {"detections": detections}
+
+
+# ==================== 跟踪器 ====================
+
+def _iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """计算两组 xyxy 框的 IoU 矩阵"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class SimpleByteTracker:
+    """
+    简化版 ByteTrack：先用高分检测框、再用低分检测框与已有轨迹做 IoU 贪心关联，
+    不包含卡尔曼滤波。输入输出均为归一化中心点坐标。
+    """
+
+    def __init__(self, high_thresh: float = 0.5, match_thresh: float = 0.3, track_buffer: int = 30):
+        self.high_thresh = high_thresh
+        self.match_thresh = match_thresh
+        self.track_buffer = track_buffer
+        self.reset()
+
+    def reset(self):
+        self.tracks: Dict[int, Dict[str, Any]] = {}
+        self.next_id = 1
+        self.frame_id = 0
+
+    def _associate(self, track_ids: List[int], det_indices: List[int], det_boxes: np.ndarray):
+        if not track_ids or not det_indices:
+            return [], track_ids, det_indices
+        track_boxes = np.array([self.tracks[t]["box"] for t in track_ids])
+        ious = _iou_matrix(track_boxes, det_boxes[det_indices])
+        matches = []
+        while ious.size and ious.max() >= self.match_thresh:
+            ti, di = np.unravel_index(np.argmax(ious), ious.shape)
+            matches.append((track_ids[ti], det_indices[di]))
+            ious[ti, :] = -1
+            ious[:, di] = -1
+        matched_tracks = {t for t, _ in matches}
+        matched_dets = {d for _, d in matches}
+        return (matches,
+                [t for t in track_ids if t not in matched_tracks],
+                [d for d in det_indices if d not in matched_dets])
+
+    def update(self, image: Optional[np.ndarray], detections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self.frame_id += 1
+        if detections:
+            xywh = np.array([[d.get("x", 0), d.get("y", 0), d.get("width", 0), d.get("height", 0)]
+                             for d in detections], dtype=float)
+            det_boxes = np.column_stack([xywh[:, 0] - xywh[:, 2] / 2, xywh[:, 1] - xywh[:, 3] / 2,
+                                         xywh[:, 0] + xywh[:, 2] / 2, xywh[:, 1] + xywh[:, 3] / 2])
+            scores = np.array([d.get("confidence", 1.0) for d in detections], dtype=float)
+        else:
+            det_boxes = np.zeros((0, 4))
+            scores = np.zeros(0)
+
+        high = [i for i in range(len(detections)) if scores[i] >= self.high_thresh]
+        low = [i for i in range(len(detections)) if scores[i] < self.high_thresh]
+
+        matches, remaining_tracks, unmatched_high = self._associate(list(self.tracks), high, det_boxes)
+        low_matches, _, _ = self._associate(remaining_tracks, low, det_boxes)
+        matches += low_matches
+
+        for track_id, det_index in matches:
+            self.tracks[track_id].update(box=det_boxes[det_index], last_frame=self.frame_id)
+        for det_index in unmatched_high:
+            matches.append((self.next_id, det_index))
+            self.tracks[self.next_id] = {"box": det_boxes[det_index], "last_frame": self.frame_id}
+            self.next_id += 1
+
+        # 清理长时间未匹配的轨迹
+        for track_id in [t for t, info in self.tracks.items()
+                         if self.frame_id - info["last_frame"] > self.track_buffer]:
+            del self.tracks[track_id]
+
+        return [dict(detections[det_index], track_id=track_id) for track_id, det_index in matches]
+
+
+# ==================== 模型管理器 ====================
+
+class ModelManager:
+    """模型注册表 + 受内存约束的 LRU 缓存"""
+
+    def __init__(self, max_cache_mb: float = MODEL_CACHE_MAX_MB, max_entries: int = MODEL_CACHE_MAX_ENTRIES):
+        self.max_cache_bytes = int(max_cache_mb * 1024 * 1024)
+        self.max_entries = max_entries
+        self.catalog = MODEL_CATALOG
+        self._cache: "OrderedDict[ModelKey, ModelEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading_locks: Dict[ModelKey, threading.Lock] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    # ---------- 键与加载 ----------
+
+    def make_key(self, weights: str, task: Optional[str] = None, device: Optional[str] = None,
+                 precision: str = "fp32") -> ModelKey:
+        return ModelKey(resolve_weights(weights), _normalize_task(task), resolve_device(device), precision)
+
+    def _load(self, key: ModelKey, family: str):
+        """实际加载模型（在调用方线程中执行，较慢）"""
+        if family == "tracker":
+            return SimpleByteTracker()
+        if family == "rtdetr":
+            from ultralytics import RTDETR
+            model = RTDETR(key.weights)
+        elif family == "sam":
+            from ultralytics import SAM
+            model = SAM(key.weights)
+        else:
+            from ultralytics import YOLO
+            task = ULTRALYTICS_TASKS.get(key.task)
+            model = YOLO(key.weights, task=task) if task else YOLO(key.weights)
+        if key.device != "cpu" and hasattr(model, "to") and Path(key.weights).suffix == ".pt":
+            model.to(key.device)
+        configure_process()
+        return model
+
+    @staticmethod
+    def _estimate_size(model: Any, weights: str) -> int:
+        """估算模型占用内存：优先统计参数与缓冲区字节数，否则使用权重文件大小"""
+        try:
+            module = getattr(model, "model", None)
+            if module is not None and hasattr(module, "parameters"):
+                size = sum(p.numel() * p.element_size() for p in module.parameters())
+                size += sum(b.numel() * b.element_size() for b in module.buffers())
+                if size > 0:
+                    return size
+        except Exception:
+            pass
+        try:
+            return Path(weights).stat().st_size
+        except OSError:
+            return 0
+
+    def _lookup(self, key: ModelKey, acquire: bool) -> Optional[ModelEntry]:
+        """在持有 self._lock 时查找缓存并更新 LRU 顺序"""
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            if acquire:
+                entry._acquire()
+        return entry
+
+    @staticmethod
+    def _warmup(entry: ModelEntry, acquire: bool):
+        """预热已缓存的模型；失败时归还本次调用增加的引用，避免条目永远无法淘汰"""
+        try:
+            entry.warmup()
+        except Exception:
+            if acquire:
+                entry._release()
+            raise
+
+    def get_or_load(self, weights: str, task: Optional[str] = None, device: Optional[str] = None,
+                    precision: str = "fp32", family: str = "yolo", name: Optional[str] = None,
+                    acquire: bool = False, warmup: bool = False, with_status: bool = False):
+        """
+        返回缓存中的模型，不存在时加载；同一个键只会加载一次
+
+        Args:
+            acquire: 是否同时增加引用计数（需与 release 配对）
+            warmup: 加载后是否执行一次预热推理（预热完成前其他调用方会等待）
+            with_status: 为 True 时返回 (entry, 是否命中缓存)
+        """
+        key = self.make_key(weights, task, device, precision)
+        with self._lock:
+            entry = self._lookup(key, acquire)
+            if entry is not None and (entry.warmed_up or not warmup):
+                return (entry, True) if with_status else entry
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+        if entry is not None:
+            # 已缓存但尚未预热：在加载锁内补做预热
+            with loading_lock:
+                try:
+                    self._warmup(entry, acquire)
+                finally:
+                    with self._lock:
+                        self._loading_locks.pop(key, None)
+            return (entry, True) if with_status else entry
+
+        with loading_lock:
+            try:
+                with self._lock:
+                    entry = self._lookup(key, acquire)
+                if entry is not None:
+                    if warmup:
+                        self._warmup(entry, acquire)
+                    return (entry, True) if with_status else entry
+
+                start = time.time()
+                logger.info(f"加载模型: {key.weights} (task={key.task}, device={key.device}, precision={key.precision})")
+                model = self._load(key, family)
+                size_bytes = self._estimate_size(model, key.weights)
+                entry = ModelEntry(key, model, family, name or Path(key.weights).stem, size_bytes)
+                logger.info(f"模型加载完成: {entry.name} ({entry.backend_name}), 约 {size_bytes / 1024 / 1024:.1f} MB, "
+                            f"耗时 {time.time() - start:.2f}s")
+                if warmup or WARMUP_ON_LOAD:
+                    entry.warmup()
+
+                with self._lock:
+                    self._cache[key] = entry
+                    self.stats["misses"] += 1
+                    if acquire:
+                        entry._acquire()
+                    self._enforce_budget(keep=key)
+                return (entry, False) if with_status else entry
+            finally:
+                # 加载失败（名称错误、权重损坏）时也移除加载锁，避免残留
+                with self._lock:
+                    self._loading_locks.pop(key, None)
+
+    @contextmanager
+    def use(self, weights: str, task: Optional[str] = None, device: Optional[str] = None,
+            precision: str = "fp32", family: str = "yolo"):
+        """在 with 块内持有模型引用，期间不会被淘汰"""
+        entry = self.acquire(weights, task, device, precision, family)
+        try:
+            yield entry
+        finally:
+            self.release(entry)
+
+    def acquire(self, weights: str, task: Optional[str] = None, device: Optional[str] = None,
+                precision: str = "fp32", family: str = "yolo", warmup: bool = False,
+                with_status: bool = False):
+        """获取模型并增加引用计数，需与 release 配对调用"""
+        return self.get_or_load(weights, task, device, precision, family, acquire=True,
+                                warmup=warmup, with_status=with_status)
+
+    def release(self, entry: ModelEntry):
+        """释放 acquire 获得的引用"""
+        entry._release()
+        if entry.refcount == 0:
+            self._evict_if_flagged(entry)
+
+    # ---------- 淘汰 ----------
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._cache.values())
+
+    def _enforce_budget(self, keep: Optional[ModelKey] = None):
+        """按 LRU 顺序淘汰空闲模型，直到满足内存与数量上限"""
+        for key in list(self._cache.keys()):
+            if self.total_bytes <= self.max_cache_bytes and len(self._cache) <= self.max_entries:
+                break
+            entry = self._cache[key]
+            if key == keep or entry.refcount > 0 or entry.pinned:
+                continue
+            self._remove(key, reason="LRU")
+        if self.total_bytes > self.max_cache_bytes:
+            logger.warning(f"模型缓存 {self.total_bytes / 1024 / 1024:.1f} MB 超过上限，所有模型均在使用中")
+
+    def _remove(self, key: ModelKey, reason: str = ""):
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            return
+        self.stats["evictions"] += 1
+        logger.info(f"卸载模型: {entry.name} ({key.device}) {reason}")
+        entry.model = None
+        gc.collect()
+        if key.device.startswith("cuda"):
+            try:
+                import torch
+                torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def _evict_if_flagged(self, entry: ModelEntry):
+        with self._lock:
+            if entry.evict_on_release and entry.refcount == 0:
+                self._remove(entry.key, reason="(释放后卸载)")
+
+    def _unload_entries(self, entries: List[ModelEntry]) -> int:
+        count = 0
+        with self._lock:
+            for entry in entries:
+                entry.pinned = False
+                if entry.refcount > 0:
+                    entry.evict_on_release = True
+                else:
+                    self._remove(entry.key, reason="(手动卸载)")
+                count += 1
+        return count
+
+    # ---------- 扩展 API 使用的接口 ----------
+
+    def resolve_name(self, model_name: str) -> Dict[str, Any]:
+        """根据模型名称查找目录信息；未登记的名称按权重路径处理"""
+        if model_name in self.catalog:
+            return dict(self.catalog[model_name], name=model_name)
+        stem = Path(model_name).stem
+        if stem in self.catalog:
+            return dict(self.catalog[stem], name=stem)
+        weights = model_name if Path(model_name).suffix else f"{model_name}.pt"
+        return {"weights": weights, "task_type": None, "family": "yolo", "preload": False, "name": stem}
+
+    def get_by_name(self, model_name: str, device: str = "cpu", precision: str = "fp32",
+                    pin: bool = False, warmup: bool = False, acquire: bool = False) -> Optional[ModelEntry]:
+        """按名称加载模型，失败时返回 None（acquire=True 时同时增加引用计数，需与 release 配对）"""
+        info = self.resolve_name(model_name)
+        try:
+            entry = self.get_or_load(info["weights"], info["task_type"], device,
+                                     precision, info["family"], info["name"], acquire=acquire, warmup=warmup)
+        except Exception as e:
+            logger.error(f"模型加载失败 {model_name}: {e}")
+            return None
+        if pin:
+            entry.pinned = True
+            entry.evict_on_release = False
+        return entry
+
+    async def load_model(self, model_name: str, device: str = "cpu", precision: str = "fp32",
+                         pin: bool = False, warmup: bool = False) -> Optional[ModelEntry]:
+        """按名称加载模型（在线程中执行，不阻塞事件循环），失败时返回 None"""
+        return await asyncio.to_thread(self.get_by_name, model_name, device, precision, pin, warmup)
+
+    def acquire_by_name(self, model_name: str, device: str = "cpu",
+                        precision: str = "fp32") -> Optional[ModelEntry]:
+        """按名称获取模型并持有引用（使用期间不会被淘汰），失败时返回 None；需与 release 配对调用"""
+        return self.get_by_name(model_name, device, precision, acquire=True)
+
+    async def acquire_model(self, model_name: str, device: str = "cpu",
+                            precision: str = "fp32") -> Optional[ModelEntry]:
+        """acquire_by_name 的异步版本（在线程中加载，不阻塞事件循环）"""
+        return await asyncio.to_thread(self.acquire_by_name, model_name, device, precision)
+
+    def unload_model(self, model_name: str) -> int:
+        """卸载指定名称的模型（所有设备与精度）"""
+        info = self.resolve_name(model_name)
+        weights = resolve_weights(info["weights"])
+        with self._lock:
+            entries = [e for e in self._cache.values() if e.name == info["name"] or e.key.weights == weights]
+        return self._unload_entries(entries)
+
+    def unload_weights_under(self, directory: Path) -> int:
+        """卸载权重位于指定目录下的所有模型（如训练目录被删除时）"""
+        prefix = str(Path(directory).resolve())
+        with self._lock:
+            entries = [e for e in self._cache.values()
+                       if e.key.weights and str(Path(e.key.weights).resolve()).startswith(prefix)]
+        return self._unload_entries(entries)
+
+    def unload_all_models(self) -> int:
+        with self._lock:
+            entries = list(self._cache.values())
+        return self._unload_entries(entries)
+
+    async def preload_models(self, device: str = "cpu") -> List[str]:
+        """预加载目录中标记 preload 的模型以及 YOLO_PRELOAD_MODELS 中列出的模型"""
+        names = [name for name, info in self.catalog.items() if info.get("preload")]
+        names += [name for name in PRELOAD_MODELS if name not in names]
+        loaded = []
+        for name in names:
+            if await self.load_model(name, device, pin=True, warmup=True) is not None:
+                loaded.append(name)
+        return loaded
+
+    def _cached_entries_for(self, name: str) -> List[ModelEntry]:
+        with self._lock:
+            return [e for e in self._cache.values() if e.name == name]
+
+    def get_model_info(self, model_name: str) -> Optional[Dict[str, Any]]:
+        if model_name not in self.catalog:
+            return None
+        info = self.catalog[model_name]
+        weights_path = resolve_weights(info["weights"])
+        entries = self._cached_entries_for(model_name)
+        return {
+            "name": model_name,
+            "task_type": info["task_type"],
+            "family": info["family"],
+            "weights": info["weights"],
+            "path": weights_path,
+            "downloaded": bool(weights_path) and Path(weights_path).exists(),
+            "preload": info.get("preload", False),
+            "is_loaded": bool(entries),
+            "instances": [self._entry_info(e) for e in entries],
+        }
+
+    def get_available_models(self, task_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        models = []
+        for name, info in self.catalog.items():
+            if task_type and info["task_type"] != task_type:
+                continue
+            weights_path = resolve_weights(info["weights"])
+            models.append({
+                "name": name,
+                "task_type": info["task_type"],
+                "family": info["family"],
+                "path": weights_path,
+                "downloaded": bool(weights_path) and Path(weights_path).exists(),
+                "is_loaded": bool(self._cached_entries_for(name)),
+            })
+        return models
+
+    @staticmethod
+    def _entry_info(entry: ModelEntry) -> Dict[str, Any]:
+        return {
+            "name": entry.name,
+            "weights": entry.key.weights,
+            "task": entry.key.task,
+            "device": entry.key.device,
+            "precision": entry.key.precision,
+            "backend": entry.backend_name,
+            "backend_options": entry.backend.options() if entry.backend is not None else {},
+            "size_mb": round(entry.size_bytes / 1024 / 1024, 2),
+            "refcount": entry.refcount,
+            "pinned": entry.pinned,
+            "hits": entry.hits,
+            "warmed_up": entry.warmed_up,
+            "loaded_at": entry.loaded_at,
+            "last_used": entry.last_used,
+        }
+
+    def cache_info(self) -> Dict[str, Any]:
+        """缓存状态（按 LRU 顺序，最近使用的在最后）"""
+        with self._lock:
+            entries = list(self._cache.values())
+        return {
+            "total_models": len(self.catalog),
+            "cached_models": len(entries),
+            "total_size_mb": round(sum(e.size_bytes for e in entries) / 1024 / 1024, 2),
+            "max_size_mb": round(self.max_cache_bytes / 1024 / 1024, 2),
+            "max_entries": self.max_entries,
+            "stats": dict(self.stats),
+            "models": [dict(self._entry_info(e), cached=True, path=e.key.weights) for e in entries],
+        }
+
+
+# 全局模型管理器实例
+model_manager = ModelManager()
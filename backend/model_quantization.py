@@ -0,0 +1,146 @@
+"""
+模型量化 - 用训练集中的标注图片校准，生成静态 INT8 模型，并与 FP32 模型比较精度和延迟
+
+校准图片按名称哈希（加种子）从 datasets/train/images 中稳定抽样（与 dataset_split 使用相同的哈希），
+同一数据集、同一种子每次得到同一组图片。列表写入 weights/calibration.txt，并生成 train 指向该列表的
+calibration.yaml，ultralytics 导出 onnx-int8（ONNX Runtime 静态量化）和 openvino-int8（NNCF）时
+用 split=train 读取这组图片。只有导出的 best.onnx（没有 best.pt）时由 quantize_onnx 直接量化。
+量化结果作为导出变体由 model_export 在验证集上评估，compare 给出 INT8 与对应 FP32 变体的比较。
+"""
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import cv2
+import numpy as np
+
+from dataset_split import stable_key
+from request_logging import get_logger
+
+logger = get_logger("model_quantization")
+
+# ==================== 配置 ====================
+
+# 校准图片数量（ultralytics 建议至少 300 张，训练集较小时全部使用）
+CALIBRATION_IMAGES = int(os.environ.get("YOLO_QUANT_CALIBRATION_IMAGES", "300"))
+# 抽样种子（修改后得到另一组校准图片）
+CALIBRATION_SEED = os.environ.get("YOLO_QUANT_SEED", "0")
+
+CALIBRATION_LIST = "calibration.txt"
+CALIBRATION_YAML = "calibration.yaml"
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+# INT8 变体 -> 比较基准（同一运行时的 FP32 变体，没有时与 best.pt 比较）
+INT8_BASELINES = {"onnx-int8": "onnx", "openvino-int8": "openvino"}
+
+
+def sample_calibration_images(image_dir: Path, count: int = CALIBRATION_IMAGES,
+                              seed: str = CALIBRATION_SEED) -> List[Path]:
+    """从训练集图片中按名称哈希稳定抽样"""
+    images = [path for path in Path(image_dir).iterdir() if path.suffix.lower() in IMAGE_SUFFIXES]
+    images.sort(key=lambda path: (stable_key(path.name, str(seed)), path.name))
+    return images[:max(1, count)]
+
+
+def write_calibration_data(data_yaml: Path, output_dir: Path, count: int = CALIBRATION_IMAGES,
+                           seed: str = CALIBRATION_SEED) -> Dict[str, Any]:
+    """
+    写入校准图片列表和对应的数据集描述（train 指向校准列表，其余与 data.yaml 相同）
+
+    Args:
+        data_yaml: dataset_builder 生成的 data.yaml
+        output_dir: 输出目录（训练结果的 weights/）
+        count: 校准图片数量
+        seed: 抽样种子
+
+    Returns:
+        {"yaml": 校准用 data.yaml, "list": 图片列表文件, "images": [图片路径], "seed": 种子}
+    """
+    import yaml
+    data = yaml.safe_load(Path(data_yaml).read_text(encoding="utf-8"))
+    root = Path(data.get("path") or Path(data_yaml).parent)
+    image_dir = root / data["train"]
+    images = sample_calibration_images(image_dir, count, seed) if image_dir.is_dir() else []
+    if not images:
+        raise ValueError(f"训练集中没有可用于校准的图片: {image_dir}")
+    list_path = Path(output_dir) / CALIBRATION_LIST
+    list_path.write_text("".join(f"{path.resolve()}\n" for path in images), encoding="utf-8")
+    yaml_path = Path(output_dir) / CALIBRATION_YAML
+    data = {**data, "path": str(root), "train": str(list_path.resolve())}
+    yaml_path.write_text(yaml.safe_dump(data, allow_unicode=True, sort_keys=False), encoding="utf-8")
+    logger.info(f"校准图片 {len(images)} 张（种子 {seed}）: {list_path}")
+    return {"yaml": yaml_path, "list": list_path, "images": images, "seed": str(seed)}
+
+
+def letterbox(image: np.ndarray, size: Sequence[int]) -> np.ndarray:
+    """与 ultralytics 推理相同的等比缩放 + 灰边填充，返回 1x3xHxW、0~1 的 float32 输入"""
+    height, width = size
+    scale = min(height / image.shape[0], width / image.shape[1])
+    resized_w, resized_h = int(round(image.shape[1] * scale)), int(round(image.shape[0] * scale))
+    if (resized_w, resized_h) != (image.shape[1], image.shape[0]):
+        image = cv2.resize(image, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+    top, left = (height - resized_h) // 2, (width - resized_w) // 2
+    canvas = np.full((height, width, 3), 114, dtype=np.uint8)
+    canvas[top:top + resized_h, left:left + resized_w] = image
+    tensor = canvas[:, :, ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+    return np.ascontiguousarray(tensor, dtype=np.float32)[None] / 255.0
+
+
+def quantize_onnx(fp32_path: Path, output_path: Path, images: List[Path], imgsz: int) -> Path:
+    """
+    直接对导出的 FP32 ONNX 模型做静态 INT8 量化（与 ultralytics 导出 INT8 ONNX 的方式相同）
+
+    Args:
+        fp32_path: FP32 ONNX 模型
+        output_path: 输出路径
+        images: 校准图片
+        imgsz: 动态输入模型的校准尺寸（静态模型使用模型自身的输入尺寸）
+    """
+    import onnx
+    from ultralytics.utils.export.onnx import onnx_int8_quantize
+
+    model_input = onnx.load(str(fp32_path), load_external_data=False).graph.input[0]
+    dims = [dim.dim_value for dim in model_input.type.tensor_type.shape.dim]
+    size = (dims[2], dims[3]) if len(dims) == 4 and dims[2] > 0 and dims[3] > 0 else (imgsz, imgsz)
+    samples = [path for path in images if path.exists()]
+    logger.info(f"ONNX 静态量化: {Path(fp32_path).name}, 输入 {size}, 校准 {len(samples)} 张")
+
+    def transform(path: Path) -> np.ndarray:
+        image = cv2.imread(str(path))
+        # 无法解码的图片用灰图代替，保证校准批次数量不变
+        return letterbox(image if image is not None else np.full((*size, 3), 114, dtype=np.uint8), size)
+
+    onnx_int8_quantize(str(fp32_path), str(output_path), samples, transform, input_name=model_input.name)
+    return Path(output_path)
+
+
+def compare(report: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """INT8 变体与同一运行时的 FP32 变体（没有时与基准模型）比较 mAP、延迟和文件大小"""
+    variants = report.get("variants") or {}
+    comparisons = []
+    for int8_name, fp32_name in INT8_BASELINES.items():
+        int8 = variants.get(int8_name)
+        if not int8 or int8.get("error") or int8.get("map") is None:
+            continue
+        fp32 = variants.get(fp32_name)
+        if not fp32 or fp32.get("error") or fp32.get("map") is None:
+            fp32 = report.get("baseline") or {}
+            if fp32.get("map") is None:
+                continue
+        comparison = {
+            "int8": int8_name,
+            "fp32": fp32.get("variant"),
+            "map_fp32": fp32["map"],
+            "map_int8": int8["map"],
+            "map_drop": round(fp32["map"] - int8["map"], 6),
+            "latency_fp32_ms": fp32.get("latency_ms"),
+            "latency_int8_ms": int8.get("latency_ms"),
+            "speedup": None,
+            "size_ratio": None,
+            "accepted": int8.get("accepted", False),
+        }
+        if fp32.get("latency_ms") and int8.get("latency_ms"):
+            comparison["speedup"] = round(fp32["latency_ms"] / int8["latency_ms"], 3)
+        if fp32.get("size_bytes") and int8.get("size_bytes"):
+            comparison["size_ratio"] = round(int8["size_bytes"] / fp32["size_bytes"], 3)
+        comparisons.append(comparison)
+    return comparisons
@@ -0,0 +1,270 @@
+"""
+请求日志 - 分级结构化日志、请求 ID、访问日志采样与按路由统计的延迟直方图
+
+日志记录由 QueueHandler 放入队列，由后台线程写到控制台，请求处理线程不会阻塞在控制台输出上。
+每个请求分配一个请求 ID（沿用客户端的 X-Request-ID，并写回响应头），同一请求内的所有日志都带有该 ID。
+成功且不慢的请求的访问日志按比例采样输出，错误和慢请求始终输出；延迟统计覆盖所有请求，不受采样影响。
+请求体只有在显式开启 YOLO_LOG_PAYLOADS 时才记录，并且只截取经过的前若干字节，不会额外缓冲整个请求体。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+# ==================== 配置 ====================
+
+LOG_LEVEL = os.environ.get("YOLO_LOG_LEVEL", "INFO").upper()
+# text: 单行 key=value；json: 每行一个 JSON 对象，便于日志系统采集
+LOG_FORMAT = os.environ.get("YOLO_LOG_FORMAT", "text").lower()
+# 成功请求的访问日志采样比例（0~1），错误和慢请求始终记录
+LOG_SAMPLE_RATE = float(os.environ.get("YOLO_LOG_SAMPLE_RATE", "0.1"))
+# 超过该耗时（毫秒）的请求始终记录
+LOG_SLOW_MS = float(os.environ.get("YOLO_LOG_SLOW_MS", "1000"))
+# 是否记录请求体（调试用），以及最多记录的字节数
+LOG_PAYLOADS = os.environ.get("YOLO_LOG_PAYLOADS", "0").lower() in ("1", "true", "yes")
+LOG_PAYLOAD_BYTES = int(os.environ.get("YOLO_LOG_PAYLOAD_BYTES", "500"))
+
+# 延迟直方图的桶上限（毫秒），最后一个桶为 +inf
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+REQUEST_ID_HEADER = "x-request-id"
+
+_request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+def current_request_id() -> str:
+    """当前请求的 ID（请求之外为 "-"）"""
+    return _request_id.get()
+
+
+def payload_logging_enabled() -> bool:
+    """是否允许记录请求/标注内容（调用方据此决定是否序列化大对象）"""
+    return LOG_PAYLOADS
+
+
+# ==================== 日志配置 ====================
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+
+class _TextFormatter(logging.Formatter):
+    """[时间] 级别 logger request_id=... 消息 key=value ..."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None)
+        line = (f"[{self.formatTime(record, '%H:%M:%S')}.{int(record.msecs):03d}] {record.levelname} "
+                f"{record.name} request_id={record.request_id} {record.getMessage()}")
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": record.request_id,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging():
+    """配置 yolo.* logger：队列异步输出到 stderr（重复调用无副作用）"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(_JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter())
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        # 请求 ID 必须在放入队列前（仍在请求的上下文中）写入记录
+        queue_handler.addFilter(_RequestIdFilter())
+
+        root = logging.getLogger("yolo")
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """模块 logger（yolo.<name>）；附加字段通过 extra={"fields": {...}} 传入"""
+    setup_logging()
+    return logging.getLogger(f"yolo.{name}")
+
+
+# ==================== 延迟直方图 ====================
+
+class LatencyHistogram:
+    """按 (方法, 路由模板) 统计请求数量、错误数和延迟分布"""
+
+    def __init__(self, buckets_ms: Tuple[float, ...] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self._routes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def observe(self, method: str, route: str, status: int, duration_ms: float):
+        key = (method, route)
+        index = len(self.buckets_ms)
+        for i, bound in enumerate(self.buckets_ms):
+            if duration_ms <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._routes.get(key)
+            if entry is None:
+                entry = self._routes[key] = {"count": 0, "errors": 0, "sum_ms": 0.0, "max_ms": 0.0,
+                                             "buckets": [0] * (len(self.buckets_ms) + 1)}
+            entry["count"] += 1
+            entry["sum_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["buckets"][index] += 1
+            if status >= 500:
+                entry["errors"] += 1
+
+    def _percentile(self, buckets: List[int], count: int, fraction: float) -> float:
+        """由桶计数估计分位数（取所在桶的上限）"""
+        target = count * fraction
+        seen = 0
+        for i, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets_ms[i] if i < len(self.buckets_ms) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            routes = {key: {**entry, "buckets": list(entry["buckets"])} for key, entry in self._routes.items()}
+        labels = [f"le_{bound:g}" for bound in self.buckets_ms] + ["le_inf"]
+        result = []
+        for (method, route), entry in sorted(routes.items(), key=lambda item: -item[1]["sum_ms"]):
+            count = entry["count"]
+            result.append({
+                "method": method,
+                "route": route,
+                "count": count,
+                "errors": entry["errors"],
+                "avg_ms": round(entry["sum_ms"] / count, 3) if count else 0.0,
+                "max_ms": round(entry["max_ms"], 3),
+                "p50_ms": self._percentile(entry["buckets"], count, 0.50),
+                "p95_ms": self._percentile(entry["buckets"], count, 0.95),
+                "p99_ms": self._percentile(entry["buckets"], count, 0.99),
+                "buckets": dict(zip(labels, entry["buckets"])),
+            })
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self.started_at = time.time()
+
+
+# ==================== ASGI 中间件 ====================
+
+class RequestLoggingMiddleware:
+    """
+    请求 ID、访问日志采样和延迟统计（纯 ASGI 中间件，不缓冲请求体，流式响应不受影响）
+    """
+
+    def __init__(self, app, histogram: Optional[LatencyHistogram] = None):
+        self.app = app
+        self.histogram = histogram or request_metrics
+        self.logger = get_logger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = _request_id.set(request_id)
+
+        status = 500
+        response_bytes = 0
+        payload = bytearray() if LOG_PAYLOADS else None
+        start = time.perf_counter()
+
+        async def receive_wrapper():
+            message = await receive()
+            # 只截取经过的前 LOG_PAYLOAD_BYTES 字节，不改变请求体的读取方式
+            if payload is not None and message["type"] == "http.request" and len(payload) < LOG_PAYLOAD_BYTES:
+                payload.extend(message.get("body", b"")[:LOG_PAYLOAD_BYTES - len(payload)])
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper if payload is not None else receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "<unmatched>"
+            method = scope.get("method", "")
+            self.histogram.observe(method, route_path, status, duration_ms)
+
+            if status >= 400 or duration_ms >= LOG_SLOW_MS or random.random() < LOG_SAMPLE_RATE:
+                fields = {"method": method, "path": scope.get("path", ""), "route": route_path, "status": status,
+                          "duration_ms": round(duration_ms, 2), "response_bytes": response_bytes}
+                if payload:
+                    fields["payload"] = bytes(payload).decode("utf-8", errors="replace")
+                level = logging.ERROR if status >= 500 else logging.WARNING if status >= 400 or duration_ms >= LOG_SLOW_MS else logging.INFO
+                self.logger.log(level, "request", extra={"fields": fields})
+            _request_id.reset(token)
+
+    @staticmethod
+    def config() -> Dict[str, Any]:
+        return {
+            "level": LOG_LEVEL,
+            "format": LOG_FORMAT,
+            "sample_rate": LOG_SAMPLE_RATE,
+            "slow_ms": LOG_SLOW_MS,
+            "payloads": LOG_PAYLOADS,
+            "payload_bytes": LOG_PAYLOAD_BYTES,
+        }
+
+
+# 全局请求延迟统计
+request_metrics = LatencyHistogram()
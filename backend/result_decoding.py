@@ -0,0 +1,152 @@
+"""
+推理结果解码 - 将 ultralytics 结果批量转换为归一化坐标
+
+框、类别、置信度、旋转框、关键点和分割多边形都以整块张量为单位做一次 NumPy 运算完成归一化，
+Python 层只按实例组装字典，不再逐个框、逐个点调用 .tolist() / int() / float()。
+"""
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+ClassNames = Union[Dict[int, str], Sequence[str], None]
+
+
+def _numpy(value) -> Optional[np.ndarray]:
+    """张量或数组统一转换为 NumPy 数组"""
+    if value is None:
+        return None
+    if hasattr(value, "cpu"):
+        value = value.cpu().numpy()
+    return np.asarray(value)
+
+
+def _class_name(class_names: ClassNames, class_id: int, unknown_name: str) -> str:
+    if isinstance(class_names, dict):
+        name = class_names.get(class_id)
+    elif class_names is not None and 0 <= class_id < len(class_names):
+        name = class_names[class_id]
+    else:
+        name = None
+    return name if name is not None else unknown_name.format(class_id)
+
+
+def decode_result(result, include_keypoints: bool = True) -> Dict[str, Any]:
+    """
+    将单张图片的推理结果解码为归一化数组
+
+    Args:
+        result: ultralytics Results 对象
+        include_keypoints: 是否解析关键点（关闭时姿态模型按普通检测框处理）
+
+    Returns:
+        annotation_type: bbox / obb / polygon / keypoints
+        boxes: (N, 4) 归一化的 中心x, 中心y, 宽, 高
+        angles: (N,) 旋转框角度（弧度），非 obb 时为 None
+        class_ids: (N,) 类别 ID
+        confidences: (N,) 置信度
+        polygons: 每个实例一个 (M_i, 2) 归一化多边形，非分割时为 None
+        keypoints: (N, K, 2) 归一化关键点，非姿态时为 None
+    """
+    img_height, img_width = result.orig_shape[:2]
+    scale = np.array([img_width, img_height], dtype=np.float64)
+    decoded = {
+        "annotation_type": "bbox",
+        "boxes": np.zeros((0, 4)),
+        "angles": None,
+        "class_ids": np.zeros(0, dtype=int),
+        "confidences": np.zeros(0),
+        "polygons": None,
+        "keypoints": None,
+    }
+
+    obb = getattr(result, "obb", None)
+    source = obb if obb is not None else getattr(result, "boxes", None)
+    if source is None or len(source) == 0:
+        return decoded
+
+    if obb is not None:
+        xywhr = _numpy(obb.xywhr).astype(np.float64).reshape(-1, 5)
+        decoded["annotation_type"] = "obb"
+        decoded["boxes"] = xywhr[:, :4] / np.tile(scale, 2)
+        decoded["angles"] = xywhr[:, 4]
+    else:
+        xyxy = _numpy(source.xyxy).astype(np.float64).reshape(-1, 4)
+        decoded["boxes"] = np.concatenate([
+            (xyxy[:, :2] + xyxy[:, 2:]) / 2 / scale,
+            (xyxy[:, 2:] - xyxy[:, :2]) / scale,
+        ], axis=1)
+
+    count = len(decoded["boxes"])
+    cls = _numpy(source.cls)
+    conf = _numpy(source.conf)
+    decoded["class_ids"] = cls.astype(int).reshape(-1) if cls is not None else np.zeros(count, dtype=int)
+    decoded["confidences"] = conf.astype(np.float64).reshape(-1) if conf is not None else np.ones(count)
+
+    keypoints = getattr(result, "keypoints", None) if include_keypoints else None
+    masks = getattr(result, "masks", None)
+    if obb is None and keypoints is not None:
+        decoded["annotation_type"] = "keypoints"
+        decoded["keypoints"] = _numpy(keypoints.xy).astype(np.float64) / scale
+    elif obb is None and masks is not None:
+        # 所有实例的多边形拼接后一次归一化，再按点数切分回各实例
+        polygons = masks.xy
+        decoded["annotation_type"] = "polygon"
+        if len(polygons):
+            lengths = np.array([len(p) for p in polygons])
+            flat = np.concatenate(polygons).astype(np.float64).reshape(-1, 2) / scale
+            decoded["polygons"] = np.split(flat, np.cumsum(lengths)[:-1])
+        else:
+            decoded["polygons"] = []
+
+    return decoded
+
+
+def to_detections(result, class_names: ClassNames = None, unknown_name: str = "",
+                  include_keypoints: bool = True) -> List[Dict[str, Any]]:
+    """
+    将单张图片的推理结果转换为标注字典列表
+
+    Args:
+        result: ultralytics Results 对象
+        class_names: 类别名称（字典或列表）
+        unknown_name: 类别不在 class_names 中时使用的名称，支持 "class_{}" 形式
+        include_keypoints: 是否输出关键点
+    """
+    decoded = decode_result(result, include_keypoints)
+    annotation_type = decoded["annotation_type"]
+    class_ids = decoded["class_ids"].tolist()
+    names = {class_id: _class_name(class_names, class_id, unknown_name) for class_id in set(class_ids)}
+    angles = decoded["angles"].tolist() if decoded["angles"] is not None else None
+    keypoints = decoded["keypoints"].tolist() if decoded["keypoints"] is not None else None
+    polygons = decoded["polygons"]
+
+    detections = []
+    for i, ((x, y, width, height), class_id, confidence) in enumerate(
+            zip(decoded["boxes"].tolist(), class_ids, decoded["confidences"].tolist())):
+        detection = {
+            "x": x,
+            "y": y,
+            "width": width,
+            "height": height,
+            "class_id": class_id,
+            "class_name": names[class_id],
+            "confidence": confidence,
+            "annotation_type": annotation_type,
+        }
+        if annotation_type == "obb":
+            detection["angle"] = angles[i]
+        elif annotation_type == "keypoints":
+            detection["keypoints"] = keypoints[i] if i < len(keypoints) else []
+        elif annotation_type == "polygon":
+            detection["points"] = polygons[i].tolist() if i < len(polygons) else []
+        detections.append(detection)
+    return detections
+
+
+def results_to_detections(results, class_names: ClassNames = None, unknown_name: str = "",
+                          include_keypoints: bool = True) -> List[Dict[str, Any]]:
+    """将多个推理结果（同一次推理的所有图片）转换为一个标注字典列表"""
+    detections = []
+    for result in results:
+        detections.extend(to_detections(result, class_names, unknown_name, include_keypoints))
+    return detections
@@ -0,0 +1,250 @@
+"""
+缩略图服务 - 多尺寸预览图的按需生成与磁盘缓存
+
+缩略图以原图内容哈希为键保存在缓存目录中（<hash[:2]>/<hash>_<尺寸>.<格式>），同一内容的图片
+改名或重复上传不会重复生成，原图被覆盖后哈希变化自动失效。内容哈希优先使用图片目录索引中已记录的值
+（mtime 和大小一致时），服务重启后不必重新读取原图计算。首次请求时生成（JPEG 使用 draft 模式
+按 1/2、1/4、1/8 直接解码，避免完整解码 2000 万像素的原图），也可以通过后台任务批量预生成。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+
+from image_catalog import image_catalog, ImageCatalog, content_hash
+from request_logging import get_logger
+
+logger = get_logger("thumbnails")
+
+BASE_DIR = Path(__file__).parent
+
+# ==================== 配置 ====================
+
+THUMBNAIL_DIR = Path(os.environ.get("YOLO_THUMBNAIL_DIR", str(BASE_DIR / "thumbnails")))
+
+
+def _parse_sizes(value: str) -> Dict[str, int]:
+    """解析 "small=128,medium=256,large=1024" 形式的尺寸配置"""
+    sizes = {}
+    for item in value.split(","):
+        name, _, edge = item.partition("=")
+        if name.strip() and edge.strip().isdigit():
+            sizes[name.strip()] = int(edge)
+    return sizes
+
+
+# 尺寸名称 -> 最长边像素
+THUMBNAIL_SIZES = _parse_sizes(os.environ.get("YOLO_THUMBNAIL_SIZES", "small=128,medium=256,large=1024"))
+DEFAULT_SIZE = "medium" if "medium" in THUMBNAIL_SIZES else next(iter(THUMBNAIL_SIZES))
+THUMBNAIL_FORMATS = {"jpeg": ("JPEG", ".jpg", "image/jpeg"), "webp": ("WEBP", ".webp", "image/webp")}
+DEFAULT_FORMAT = os.environ.get("YOLO_THUMBNAIL_FORMAT", "jpeg").lower()
+THUMBNAIL_QUALITY = int(os.environ.get("YOLO_THUMBNAIL_QUALITY", "82"))
+# 批量预生成的线程数
+THUMBNAIL_WORKERS = int(os.environ.get("YOLO_THUMBNAIL_WORKERS", str(min(8, (os.cpu_count() or 4)))))
+
+
+class ThumbnailError(ValueError):
+    """尺寸或格式参数无效"""
+
+
+class ThumbnailService:
+    """缩略图生成与缓存"""
+
+    def __init__(self, cache_dir: Path = THUMBNAIL_DIR, sizes: Optional[Dict[str, int]] = None,
+                 quality: int = THUMBNAIL_QUALITY, catalog: Optional[ImageCatalog] = image_catalog):
+        self.cache_dir = Path(cache_dir)
+        self.catalog = catalog
+        self.sizes = dict(sizes or THUMBNAIL_SIZES)
+        self.quality = quality
+        # 路径 -> (mtime_ns, 大小, 内容哈希)，文件未变化时不重复计算
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+        # 每个缓存文件一把锁，避免并发请求重复生成同一张缩略图
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.stats = {"hits": 0, "generated": 0, "errors": 0}
+
+    # ==================== 参数与缓存路径 ====================
+
+    def resolve_size(self, size: Optional[str]) -> Tuple[str, int]:
+        """尺寸名称（small/medium/large）或像素值，返回 (名称, 最长边)"""
+        size = size or DEFAULT_SIZE
+        if size in self.sizes:
+            return size, self.sizes[size]
+        if size.isdigit() and int(size) in self.sizes.values():
+            edge = int(size)
+            return next(name for name, value in self.sizes.items() if value == edge), edge
+        raise ThumbnailError(f"不支持的缩略图尺寸: {size}，可选: {', '.join(self.sizes)}")
+
+    @staticmethod
+    def resolve_format(fmt: Optional[str]) -> str:
+        fmt = (fmt or DEFAULT_FORMAT).lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in THUMBNAIL_FORMATS:
+            raise ThumbnailError(f"不支持的缩略图格式: {fmt}，可选: {', '.join(THUMBNAIL_FORMATS)}")
+        return fmt
+
+    @staticmethod
+    def media_type(fmt: str) -> str:
+        return THUMBNAIL_FORMATS[fmt][2]
+
+    def content_hash(self, image_path: Path) -> str:
+        """原图内容哈希（按 mtime 和大小缓存，优先使用图片目录索引中的哈希）"""
+        stat = image_path.stat()
+        path = str(image_path)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        value = self.catalog.cached_hash(image_path, stat) if self.catalog is not None else None
+        if value is None:
+            # 索引中没有记录（或图片已变化）时才读取原图计算
+            value = content_hash(image_path)
+        with self._lock:
+            # 同一路径只保留最新版本的哈希
+            self._hashes[path] = (stat.st_mtime_ns, stat.st_size, value)
+        return value
+
+    def cache_path(self, content_hash: str, size_name: str, fmt: str) -> Path:
+        return self.cache_dir / content_hash[:2] / f"{content_hash}_{size_name}{THUMBNAIL_FORMATS[fmt][1]}"
+
+    # ==================== 生成 ====================
+
+    def get(self, image_path: Path, size: Optional[str] = None, fmt: Optional[str] = None) -> Path:
+        """
+        返回缩略图文件路径，缓存中没有时生成（同步阻塞，应在线程池中调用）
+
+        Args:
+            image_path: 原图路径
+            size: 尺寸名称或像素值，默认 medium
+            fmt: jpeg 或 webp
+        """
+        size_name, edge = self.resolve_size(size)
+        fmt = self.resolve_format(fmt)
+        target = self.cache_path(self.content_hash(image_path), size_name, fmt)
+        if target.exists():
+            self.stats["hits"] += 1
+            return target
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(str(target), threading.Lock())
+        with key_lock:
+            if not target.exists():
+                try:
+                    self._generate(image_path, target, edge, fmt)
+                    self.stats["generated"] += 1
+                except Exception:
+                    self.stats["errors"] += 1
+                    raise
+            else:
+                self.stats["hits"] += 1
+        with self._lock:
+            self._key_locks.pop(str(target), None)
+        return target
+
+    def _generate(self, image_path: Path, target: Path, edge: int, fmt: str):
+        with Image.open(image_path) as image:
+            # JPEG 在解码阶段按 2 的幂缩小（DCT 缩放），大图解码耗时和内存都大幅下降
+            image.draft("RGB", (edge, edge))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            if fmt == "jpeg" and image.mode != "RGB":
+                image = image.convert("RGB")
+            elif fmt == "webp" and image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            pil_format = THUMBNAIL_FORMATS[fmt][0]
+            tmp_path = target.with_name(f".{target.name}.{threading.get_ident()}.tmp")
+            options = {"quality": self.quality}
+            if fmt == "jpeg":
+                options.update(optimize=True, progressive=True)
+            else:
+                options.update(method=4)
+            try:
+                image.save(tmp_path, pil_format, **options)
+                os.replace(tmp_path, target)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+    def pregenerate(self, job, image_paths: Sequence[Path], sizes: Optional[List[str]] = None,
+                    fmt: Optional[str] = None, workers: int = THUMBNAIL_WORKERS) -> Dict[str, int]:
+        """
+        批量预生成缩略图（后台任务函数）
+
+        Args:
+            job: jobs.Job，用于上报进度和检查取消
+            image_paths: 原图路径列表
+            sizes: 尺寸名称列表，默认所有配置的尺寸
+            fmt: jpeg 或 webp
+        """
+        sizes = [self.resolve_size(size)[0] for size in (sizes or list(self.sizes))]
+        fmt = self.resolve_format(fmt)
+        job.update(total=len(image_paths), message=f"尺寸: {', '.join(sizes)}, 格式: {fmt}")
+        generated_before = self.stats["generated"]
+
+        def process(path: Path):
+            if job.cancelled:
+                return
+            for size in sizes:
+                self.get(path, size, fmt)
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="thumbnail") as pool:
+            futures = {pool.submit(process, path): path for path in image_paths}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    job.advance()
+                except Exception as e:
+                    failed += 1
+                    job.advance(failed=1)
+                    logger.warning(f"生成失败 {futures[future].name}: {e}")
+                if job.cancelled:
+                    for pending in futures:
+                        pending.cancel()
+        job.check_cancelled()
+        return {"images": len(image_paths), "generated": self.stats["generated"] - generated_before, "failed": failed}
+
+    # ==================== 缓存管理 ====================
+
+    def cache_info(self) -> Dict[str, object]:
+        files = 0
+        total_bytes = 0
+        if self.cache_dir.exists():
+            for path in self.cache_dir.glob("*/*"):
+                if path.is_file():
+                    files += 1
+                    total_bytes += path.stat().st_size
+        return {
+            "cache_dir": str(self.cache_dir),
+            "sizes": self.sizes,
+            "formats": list(THUMBNAIL_FORMATS),
+            "default_size": DEFAULT_SIZE,
+            "default_format": DEFAULT_FORMAT,
+            "files": files,
+            "total_mb": round(total_bytes / 1024 / 1024, 2),
+            **self.stats,
+        }
+
+    def clear(self) -> int:
+        """删除所有缓存的缩略图，返回删除的文件数"""
+        removed = 0
+        if self.cache_dir.exists():
+            for path in self.cache_dir.glob("*/*"):
+                if path.is_file():
+                    path.unlink()
+                    removed += 1
+        with self._lock:
+            self._hashes.clear()
+        return removed
+
+
+# 全局缩略图服务
+thumbnail_service = ThumbnailService()
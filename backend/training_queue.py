@@ -0,0 +1,359 @@
+"""
+训练队列 - 持久化的训练任务队列，每个任务在独立进程中训练
+
+训练任务记录在数据库中（服务重启后排队中的任务继续执行，执行中的任务标记为中断，可以从检查点继续）。
+调度线程按提交顺序一次执行一个任务：先在后台任务中增量准备数据集，再启动 training_worker 子进程训练，
+每个任务使用自己的输出目录（models/train_<时间>_<ID>），不会再有两个训练写同一个目录。
+子进程通过 ultralytics 回调上报每个 epoch 的损失和验证指标，记录到任务中供轮询或 SSE 推送；
+训练结束后子进程继续导出 ONNX / OpenVINO 等变体并在验证集上校验（model_export），再登记到模型索引。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from database import database, Database
+from jobs import job_manager, COMPLETED as JOB_COMPLETED, FAILED as JOB_FAILED, FINISHED_STATES as JOB_FINISHED_STATES
+from model_index import model_index
+from model_manager import model_manager
+from model_export import EXPORT_FORMATS, EXPORT_DYNAMIC, parse_variants
+from training_worker import PROGRESS_PREFIX, EXIT_CANCELLED
+from request_logging import get_logger
+
+logger = get_logger("training_queue")
+
+BASE_DIR = Path(__file__).parent
+
+# ==================== 配置 ====================
+
+WORKER_SCRIPT = BASE_DIR / "training_worker.py"
+# 运行训练进程的 Python 解释器（默认与服务相同）
+TRAIN_PYTHON = os.environ.get("YOLO_TRAIN_PYTHON", sys.executable)
+# 请求取消后等待训练进程自行停止（保存检查点）的秒数，超时后强制结束
+TRAIN_CANCEL_GRACE = float(os.environ.get("YOLO_TRAIN_CANCEL_GRACE", "120"))
+SPEC_NAME = "train_job.json"
+CANCEL_NAME = "cancel"
+
+QUEUED = "queued"
+PREPARING = "preparing"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+FINISHED_STATES = {COMPLETED, FAILED, CANCELLED, INTERRUPTED}
+RESUMABLE_STATES = {FAILED, CANCELLED, INTERRUPTED}
+
+_JSON_FIELDS = ("params", "metrics", "history")
+
+
+class TrainingJobError(ValueError):
+    """任务当前状态不允许该操作"""
+
+
+class TrainingQueue:
+    """训练任务队列与调度"""
+
+    def __init__(self, models_dir: Path, db: Database = database):
+        self.models_dir = Path(models_dir)
+        self.db = db
+        self._prepare_dataset: Optional[Callable[..., Any]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._cancel_requested = set()
+        # 每个任务的变更序号，进度推送据此判断是否有新内容（只在内存中，重启后从 0 开始）
+        self._seq: Dict[str, int] = {}
+
+    # ==================== 调度线程 ====================
+
+    def start(self, prepare_dataset: Callable[..., Any]):
+        """
+        启动调度线程（重复调用无副作用）
+
+        Args:
+            prepare_dataset: 后台任务函数 (job, params) -> {"dataset_path": ...}，训练前准备数据集
+        """
+        with self._start_lock:
+            self._prepare_dataset = prepare_dataset
+            if self._thread is not None:
+                return
+            with self.db.transaction() as conn:
+                interrupted = conn.execute(
+                    "UPDATE training_jobs SET status = ?, message = ?, pid = NULL, finished_at = ? WHERE status IN (?, ?)",
+                    (INTERRUPTED, "服务重启时任务中断，可以从检查点继续训练", time.time(), PREPARING, RUNNING)).rowcount
+            if interrupted:
+                logger.warning(f"{interrupted} 个训练任务在服务重启时中断")
+            self._thread = threading.Thread(target=self._loop, name="training-scheduler", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wakeup.clear()
+            row = self.db.connection().execute(
+                "SELECT id FROM training_jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                self._wakeup.wait()
+                continue
+            try:
+                self._run(row["id"])
+            except Exception as e:
+                logger.exception(f"训练任务 {row['id']} 执行失败: {e}")
+                self._update(row["id"], status=FAILED, error=str(e), finished_at=time.time(), pid=None)
+
+    # ==================== 任务记录 ====================
+
+    def _update(self, job_id: str, **fields):
+        for key in _JSON_FIELDS:
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.db.transaction() as conn:
+            conn.execute(f"UPDATE training_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        with self._lock:
+            self._seq[job_id] = self._seq.get(job_id, 0) + 1
+
+    def _to_dict(self, row, include_history: bool = True) -> Dict[str, Any]:
+        job = dict(row)
+        for key in _JSON_FIELDS:
+            job[key] = json.loads(job[key]) if job[key] else None
+        if not include_history:
+            job.pop("history")
+        job["resume"] = bool(job["resume"])
+        job["run_dir"] = str(self.models_dir / job["run_name"])
+        job["seq"] = self.seq(job["id"])
+        job["resumable"] = job["status"] in RESUMABLE_STATES and self._last_weights(job["run_name"]).exists()
+        return job
+
+    def _last_weights(self, run_name: str) -> Path:
+        return self.models_dir / run_name / "weights" / "last.pt"
+
+    def seq(self, job_id: str) -> int:
+        with self._lock:
+            return self._seq.get(job_id, 0)
+
+    def get(self, job_id: str, include_history: bool = True) -> Optional[Dict[str, Any]]:
+        row = self.db.connection().execute("SELECT * FROM training_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row, include_history) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近的训练任务（不含逐 epoch 历史），排队中的任务带 queue_position"""
+        conn = self.db.connection()
+        if status:
+            rows = conn.execute("SELECT * FROM training_jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                                (status, limit)).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM training_jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        queued = [row[0] for row in conn.execute(
+            "SELECT id FROM training_jobs WHERE status = ? ORDER BY created_at", (QUEUED,))]
+        jobs = [self._to_dict(row, include_history=False) for row in rows]
+        for job in jobs:
+            if job["id"] in queued:
+                job["queue_position"] = queued.index(job["id"]) + 1
+        return jobs
+
+    # ==================== 提交、取消与继续 ====================
+
+    def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """加入队列，返回任务记录"""
+        job_id = uuid.uuid4().hex[:12]
+        run_name = f"train_{time.strftime('%Y%m%d_%H%M%S')}_{job_id[:6]}"
+        with self.db.transaction() as conn:
+            conn.execute(
+                """INSERT INTO training_jobs (id, status, params, run_name, epochs, message, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, QUEUED, json.dumps(params, ensure_ascii=False), run_name, params.get("epochs", 0),
+                 "等待训练", time.time()))
+        logger.info(f"训练任务已加入队列: {job_id} -> {run_name}")
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取消任务：排队中的直接取消，准备中的取消数据集准备，训练中的在当前 batch 结束时停止（保留上一个 epoch 的检查点）"""
+        job = self.get(job_id, include_history=False)
+        if job is None:
+            return None
+        status = job["status"]
+        if status == QUEUED:
+            with self.db.transaction() as conn:
+                cancelled = conn.execute(
+                    "UPDATE training_jobs SET status = ?, message = ?, finished_at = ? WHERE id = ? AND status = ?",
+                    (CANCELLED, "已取消", time.time(), job_id, QUEUED)).rowcount
+            if not cancelled:
+                # 调度线程刚开始执行该任务
+                return self.cancel(job_id)
+            with self._lock:
+                self._seq[job_id] = self._seq.get(job_id, 0) + 1
+        elif status in (PREPARING, RUNNING):
+            with self._lock:
+                self._cancel_requested.add(job_id)
+            if job["prepare_job_id"]:
+                job_manager.cancel(job["prepare_job_id"])
+            if status == RUNNING:
+                (self.models_dir / job["run_name"] / CANCEL_NAME).touch()
+            self._update(job_id, message="正在取消")
+        else:
+            raise TrainingJobError(f"任务已结束（{status}），无法取消")
+        return self.get(job_id)
+
+    def resume(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """从上次保存的检查点（weights/last.pt）继续训练已取消、失败或中断的任务"""
+        job = self.get(job_id, include_history=False)
+        if job is None:
+            return None
+        if job["status"] not in RESUMABLE_STATES:
+            raise TrainingJobError(f"只有已取消、失败或中断的任务可以继续（当前: {job['status']}）")
+        if not self._last_weights(job["run_name"]).exists():
+            raise TrainingJobError("没有可以继续训练的检查点（weights/last.pt）")
+        self._update(job_id, status=QUEUED, resume=1, error=None, message="等待继续训练", finished_at=None)
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def _cancelling(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancel_requested
+
+    # ==================== 执行 ====================
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        params = job["params"]
+        run_dir = self.models_dir / job["run_name"]
+        # 只在任务仍在排队时开始（与取消请求竞争时以先到者为准）
+        with self.db.transaction() as conn:
+            claimed = conn.execute(
+                "UPDATE training_jobs SET status = ?, started_at = ?, message = ? WHERE id = ? AND status = ?",
+                (PREPARING, time.time(), "正在准备数据集", job_id, QUEUED)).rowcount
+        if not claimed:
+            return
+        with self._lock:
+            self._seq[job_id] = self._seq.get(job_id, 0) + 1
+        try:
+            # 数据集准备在后台任务中执行（构建器内部并行），进度通过 prepare_job_id 查询；使用专用通道，
+            # 不会排在共享线程池中的导入、缩略图等长任务之后
+            prepare_job = job_manager.submit(
+                "dataset-prepare", self._prepare_dataset, params, lane="training",
+                params={"training_job_id": job_id, "task_type": params.get("task_type")})
+            self._update(job_id, prepare_job_id=prepare_job.id)
+            if self._cancelling(job_id):
+                job_manager.cancel(prepare_job.id)
+            while prepare_job.status not in JOB_FINISHED_STATES:
+                time.sleep(0.2)
+            if self._cancelling(job_id) or prepare_job.status != JOB_COMPLETED:
+                cancelled = self._cancelling(job_id) or prepare_job.status != JOB_FAILED
+                self._update(job_id, status=CANCELLED if cancelled else FAILED, finished_at=time.time(),
+                             message="已取消" if cancelled else "数据集准备失败", error=prepare_job.error)
+                return
+
+            run_dir.mkdir(parents=True, exist_ok=True)
+            cancel_file = run_dir / CANCEL_NAME
+            if cancel_file.exists():
+                cancel_file.unlink()
+            spec_path = run_dir / SPEC_NAME
+            spec = {
+                "params": params,
+                "data": str(Path(prepare_job.result["dataset_path"]) / "data.yaml"),
+                "project": str(self.models_dir),
+                "name": job["run_name"],
+                "resume": job["resume"],
+                "last_weights": str(self._last_weights(job["run_name"])),
+                "cancel_file": str(cancel_file),
+                "export_variants": (parse_variants(params["export_formats"])
+                                    if params.get("export_formats") is not None else EXPORT_FORMATS),
+                "export_dynamic": (params["export_dynamic"]
+                                   if params.get("export_dynamic") is not None else EXPORT_DYNAMIC),
+            }
+            spec_path.write_text(json.dumps(spec, ensure_ascii=False, indent=2), encoding="utf-8")
+            self._train(job_id, job, spec_path, run_dir)
+        finally:
+            with self._lock:
+                self._cancel_requested.discard(job_id)
+
+    def _train(self, job_id: str, job: Dict[str, Any], spec_path: Path, run_dir: Path):
+        process = subprocess.Popen(
+            [TRAIN_PYTHON, str(WORKER_SCRIPT), str(spec_path)],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace",
+            env={**os.environ, "PYTHONUNBUFFERED": "1", "PYTHONIOENCODING": "utf-8"})
+        logger.info(f"训练任务 {job_id} 开始，进程 {process.pid}，输出目录 {run_dir}")
+        self._update(job_id, status=RUNNING, pid=process.pid, message="正在训练")
+        if self._cancelling(job_id):
+            (run_dir / CANCEL_NAME).touch()
+        watchdog = threading.Thread(target=self._watch_cancel, args=(job_id, process), daemon=True)
+        watchdog.start()
+
+        history = (job["history"] or []) if job["resume"] else []
+        error = None
+        final_metrics: Dict[str, Any] = {}
+        for line in process.stdout:
+            if not line.startswith(PROGRESS_PREFIX):
+                if line.strip():
+                    logger.info(line.rstrip())
+                continue
+            try:
+                event = json.loads(line[len(PROGRESS_PREFIX):])
+            except ValueError:
+                continue
+            kind = event.get("event")
+            if kind == "start":
+                self._update(job_id, epochs=event["epochs"], message=f"从第 {event['start_epoch'] + 1} 个 epoch 开始训练")
+            elif kind == "epoch":
+                history = [entry for entry in history if entry["epoch"] < event["epoch"]]
+                history.append({"epoch": event["epoch"], **event["metrics"]})
+                self._update(job_id, epoch=event["epoch"], epochs=event["epochs"], metrics=event["metrics"],
+                             history=history, message=f"epoch {event['epoch']}/{event['epochs']}")
+            elif kind == "final":
+                self._update(job_id, metrics=event["metrics"], message="最终验证完成")
+            elif kind == "cancelling":
+                self._update(job_id, message="正在取消")
+            elif kind == "export":
+                self._update(job_id, message=event.get("message") or f"正在导出 {event.get('variant')}")
+            elif kind == "exported":
+                state = "失败" if event.get("error") else ("通过验证" if event.get("accepted") else "精度下降过多，未启用")
+                self._update(job_id, message=f"导出 {event.get('variant')}: {state}")
+            elif kind == "error":
+                error = event.get("error")
+            elif kind == "done":
+                final_metrics = event.get("metrics") or {}
+        code = process.wait()
+
+        if code == 0 and not self._cancelling(job_id):
+            # 登记到模型索引并设为当前模型；先卸载同一目录下的旧权重缓存
+            model_manager.unload_weights_under(run_dir)
+            model_index.register_run(run_dir, metrics=final_metrics or None, activate=True)
+            self._update(job_id, status=COMPLETED, pid=None, finished_at=time.time(), message="训练完成")
+            logger.info(f"训练任务 {job_id} 完成: {run_dir}")
+        elif code == EXIT_CANCELLED or self._cancelling(job_id):
+            self._update(job_id, status=CANCELLED, pid=None, finished_at=time.time(),
+                         message="已取消" + ("，可以从检查点继续训练" if self._last_weights(job["run_name"]).exists() else ""))
+            logger.info(f"训练任务 {job_id} 已取消")
+        else:
+            error = error or f"训练进程退出码 {code}"
+            self._update(job_id, status=FAILED, pid=None, finished_at=time.time(), message="训练失败", error=error)
+            logger.error(f"训练任务 {job_id} 失败: {error}")
+
+    def _watch_cancel(self, job_id: str, process: subprocess.Popen):
+        """请求取消后超过 TRAIN_CANCEL_GRACE 秒训练进程仍未退出时强制结束"""
+        while process.poll() is None:
+            if self._cancelling(job_id):
+                deadline = time.time() + TRAIN_CANCEL_GRACE
+                while process.poll() is None and time.time() < deadline:
+                    time.sleep(0.5)
+                if process.poll() is None:
+                    logger.warning(f"训练进程 {process.pid} 未在 {TRAIN_CANCEL_GRACE:g} 秒内停止，强制结束")
+                    process.terminate()
+                    try:
+                        process.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                return
+            time.sleep(0.5)
+
+
+# 全局训练队列（与 main.MODELS_DIR 为同一目录）
+training_queue = TrainingQueue(BASE_DIR / "models")
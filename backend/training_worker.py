@@ -0,0 +1,213 @@
+"""
+训练进程 - training_queue 为每个训练任务启动的独立 Python 进程
+
+训练不在 API 进程中执行，不会占用 API 的线程和 GIL，训练崩溃也不会影响服务。进度通过 ultralytics 回调
+以带前缀的 JSON 行写到标准输出，由 training_queue 解析；取消时 training_queue 创建取消标记文件，
+本进程在下一个 batch 结束时中止训练，之后可以从上一个 epoch 结束时保存的 last.pt 继续训练。
+
+用法: python training_worker.py <任务描述 JSON 文件>
+"""
+import sys
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+from request_logging import get_logger
+
+logger = get_logger("training_worker")
+
+# 进度行前缀（输出中其余内容为 ultralytics 和本进程的日志）
+PROGRESS_PREFIX = "@@TRAIN "
+EXIT_FAILED = 1
+EXIT_CANCELLED = 3
+
+
+class TrainingCancelled(Exception):
+    """收到取消请求（在 ultralytics 回调中抛出以中止训练循环）"""
+
+
+def emit(event: str, **fields):
+    print(PROGRESS_PREFIX + json.dumps({"event": event, **fields}, ensure_ascii=False, default=str), flush=True)
+
+
+def resolve_device(device: str):
+    """把请求中的设备参数转换为 ultralytics 的格式，CUDA 不可用时退回 CPU"""
+    if device == "cpu":
+        return "cpu"
+    if device == "0":
+        device_param = 0  # 整数0表示第一个GPU
+    elif device.startswith("cuda:"):
+        device_param = device
+    else:
+        try:
+            device_param = int(device)
+        except ValueError:
+            device_param = 0  # 默认使用第一个GPU
+    import torch
+    if not torch.cuda.is_available():
+        logger.warning("CUDA 不可用，自动切换到 CPU 训练")
+        return "cpu"
+    logger.info(f"CUDA 可用，使用设备: {device_param}，GPU: {torch.cuda.get_device_name(0)}，"
+                f"数量: {torch.cuda.device_count()}")
+    return device_param
+
+
+def model_name(params: Dict[str, Any]) -> str:
+    """根据任务类型选择预训练模型（指定了 weights_path 时直接使用）"""
+    if params.get("weights_path"):
+        return params["weights_path"]
+    model_base = params.get("model_type") or "yolo26n"
+    task_type = params.get("task_type", "detection")
+    if task_type == "segmentation":
+        return f"{model_base}-seg.pt"
+    if task_type == "obb":
+        return f"{model_base}-obb.pt"
+    return f"{model_base}.pt"
+
+
+def train_arguments(params: Dict[str, Any]) -> Dict[str, Any]:
+    """TrainRequest 参数 -> model.train 参数"""
+    return {
+        # 基础参数
+        "epochs": params["epochs"],
+        "batch": params["batch_size"],
+        "imgsz": params["image_size"],
+        "device": resolve_device(str(params["device"])),
+        # 早停机制
+        "patience": params["patience"],
+        # 数据增强参数
+        "hsv_h": params["hsv_h"],
+        "hsv_s": params["hsv_s"],
+        "hsv_v": params["hsv_v"],
+        "degrees": params["degrees"],
+        "translate": params["translate"],
+        "scale": params["scale"],
+        "shear": params["shear"],
+        "perspective": params["perspective"],
+        "flipud": params["flipud"],
+        "fliplr": params["fliplr"],
+        "mosaic": params["mosaic"],
+        "mixup": params["mixup"],
+        "copy_paste": params["copy_paste"] if params.get("task_type") == "segmentation" else 0.0,
+        # 学习率参数
+        "lr0": params["lr0"],
+        "lrf": params["lrf"],
+        "momentum": params["momentum"],
+        "weight_decay": params["weight_decay"],
+        "warmup_epochs": params["warmup_epochs"],
+        # 其他训练参数
+        "cos_lr": params["cos_lr"],
+        "close_mosaic": params["close_mosaic"],
+        "amp": params["amp"],
+        "fraction": params["fraction"],
+        # 损失权重
+        "box": params["box"],
+        "cls": params["cls"],
+        "dfl": params["dfl"],
+        # 保存和验证
+        "save": True,
+        "val": True,
+        "plots": True,
+        "verbose": True,
+    }
+
+
+def _epoch_metrics(trainer) -> Dict[str, float]:
+    """当前 epoch 的训练损失、验证指标和学习率"""
+    metrics: Dict[str, float] = {}
+    try:
+        metrics.update(trainer.label_loss_items(trainer.tloss, prefix="train"))
+    except Exception:
+        pass
+    metrics.update(getattr(trainer, "metrics", None) or {})
+    metrics.update(getattr(trainer, "lr", None) or {})
+    result = {}
+    for key, value in metrics.items():
+        try:
+            result[key] = round(float(value), 6)
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+def main(spec_path: str) -> int:
+    spec = json.loads(Path(spec_path).read_text(encoding="utf-8"))
+    params = spec["params"]
+    cancel_file = Path(spec["cancel_file"])
+
+    from ultralytics import YOLO
+
+    if spec.get("resume"):
+        logger.info(f"从检查点继续训练: {spec['last_weights']}")
+        model = YOLO(spec["last_weights"])
+        # 不传 data 时 ultralytics 会用默认数据集覆盖检查点中的路径
+        kwargs = {"resume": True, "data": spec["data"]}
+    else:
+        name = model_name(params)
+        logger.info(f"加载模型: {name}")
+        model = YOLO(name)
+        kwargs = {"data": spec["data"], "project": spec["project"], "name": spec["name"], "exist_ok": True,
+                  **train_arguments(params)}
+
+    def on_train_start(trainer):
+        emit("start", epochs=trainer.epochs, start_epoch=trainer.start_epoch, save_dir=str(trainer.save_dir))
+
+    def on_train_batch_end(trainer):
+        # 直接中止而不是设置 trainer.stop：stop 会走正常结束流程，最终验证后 last.pt 被精简（去掉优化器状态和
+        # 训练参数），无法再继续训练；中止时保留上一个 epoch 结束时保存的完整 last.pt
+        if cancel_file.exists():
+            emit("cancelling")
+            raise TrainingCancelled()
+
+    # 训练循环中每个 epoch 先触发 on_train_epoch_end 再触发 on_fit_epoch_end；训练结束后用 best.pt 做最终验证时
+    # 只触发 on_fit_epoch_end（提前停止时 epoch 仍小于总 epoch 数，不能按 epoch 判断）
+    in_epoch = {"value": False}
+
+    def on_train_epoch_end(trainer):
+        in_epoch["value"] = True
+
+    def on_fit_epoch_end(trainer):
+        if in_epoch["value"]:
+            in_epoch["value"] = False
+            emit("epoch", epoch=trainer.epoch + 1, epochs=trainer.epochs, metrics=_epoch_metrics(trainer))
+        else:
+            emit("final", epoch=trainer.epoch, epochs=trainer.epochs, metrics=_epoch_metrics(trainer))
+
+    model.add_callback("on_train_start", on_train_start)
+    model.add_callback("on_train_batch_end", on_train_batch_end)
+    model.add_callback("on_train_epoch_end", on_train_epoch_end)
+    model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+
+    try:
+        results = model.train(**kwargs)
+    except TrainingCancelled:
+        emit("done", cancelled=True, save_dir=None, metrics={})
+        return EXIT_CANCELLED
+    except Exception as e:
+        logger.exception(f"训练失败: {e}")
+        emit("error", error=str(e))
+        return EXIT_FAILED
+    save_dir = getattr(getattr(model, "trainer", None), "save_dir", None)
+    metrics = getattr(results, "results_dict", None) or {}
+    if save_dir and spec.get("export_variants"):
+        _export(Path(save_dir), spec, params)
+    emit("done", cancelled=False, save_dir=str(save_dir) if save_dir else None, metrics=metrics)
+    return 0
+
+
+def _export(save_dir: Path, spec: Dict[str, Any], params: Dict[str, Any]):
+    """训练结束后的导出阶段（导出失败不影响训练结果，best.pt 仍然可用）"""
+    from model_export import export_run
+    try:
+        export_run(save_dir, spec["data"], spec["export_variants"], imgsz=params.get("image_size"),
+                   dynamic=spec.get("export_dynamic", True), progress=emit)
+    except Exception as e:
+        logger.exception(f"导出失败: {e}")
+        emit("exported", variant=None, accepted=False, error=str(e))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python training_worker.py <任务描述 JSON 文件>", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,447 @@
+"""
+视频流会话 - 解码、推理、编码三个阶段各用一个线程，阶段之间用有界队列连接，结果由服务端主动推送
+
+原先客户端每取一帧发一次 HTTP 请求，读帧、推理、JPEG 编码和 base64 传输完全串行。现在每个会话持续运行：
+解码线程读帧 -> 推理线程检测 -> 编码线程压缩 JPEG，三个阶段并行；接收端通过 WebSocket（JSON 元数据 +
+二进制 JPEG）或 multipart MJPEG 接收结果。队列满时，摄像头和 RTSP 等实时源丢弃最旧的帧，保证显示的
+总是最新画面、延迟不会累积；视频文件则阻塞上游，逐帧处理不丢帧。
+"""
+import os
+import time
+import uuid
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+
+from request_logging import get_logger
+
+logger = get_logger("video_stream")
+
+# ==================== 配置 ====================
+
+# 阶段之间的队列长度（越小延迟越低，实时源满时丢弃最旧的帧）
+VIDEO_QUEUE_SIZE = int(os.environ.get("YOLO_VIDEO_QUEUE_SIZE", "2"))
+VIDEO_JPEG_QUALITY = int(os.environ.get("YOLO_VIDEO_JPEG_QUALITY", "80"))
+# 同时运行的会话数量上限
+VIDEO_MAX_SESSIONS = int(os.environ.get("YOLO_VIDEO_MAX_SESSIONS", "4"))
+# 没有接收端超过该时间（秒）的会话自动关闭，避免客户端异常退出后一直占用摄像头和模型
+VIDEO_IDLE_TIMEOUT = float(os.environ.get("YOLO_VIDEO_IDLE_TIMEOUT", "60"))
+# 实时源连续读帧失败的次数上限（超过后视为流已结束）
+VIDEO_READ_RETRIES = int(os.environ.get("YOLO_VIDEO_READ_RETRIES", "50"))
+
+REALTIME_SOURCES = {"camera", "rtsp"}
+# 视频结束标记（沿队列向下游传递）
+END = object()
+
+
+class VideoSessionError(Exception):
+    """会话数量已满或会话状态不允许该操作"""
+
+
+class StageQueue:
+    """阶段之间的有界队列：drop_oldest 时队列满则丢弃最旧的一项，否则阻塞生产者直到有空位或队列关闭"""
+
+    def __init__(self, maxsize: int, drop_oldest: bool):
+        self.maxsize = max(1, maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+        self.closed = False
+        self._items: deque = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item: Any) -> bool:
+        """放入一项，队列已关闭时返回 False"""
+        with self._cond:
+            while len(self._items) >= self.maxsize and not self.closed:
+                if self.drop_oldest:
+                    self._items.popleft()
+                    self.dropped += 1
+                    break
+                self._cond.wait(0.2)
+            if self.closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """取出一项，超时或队列已关闭且为空时返回 None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._items and not self.closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def clear(self):
+        with self._cond:
+            self._items.clear()
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class VideoSession:
+    """单个视频源的检测流水线"""
+
+    def __init__(self, capture, source: str, source_type: str, detector: Callable[..., List[Dict[str, Any]]],
+                 video_info: Dict[str, Any], confidence: float = 0.5, end2end: bool = True,
+                 jpeg_quality: int = VIDEO_JPEG_QUALITY, backend: Optional[str] = None,
+                 on_close: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            capture: 已打开的 cv2.VideoCapture（由解码线程独占，会话结束时释放）
+            source: 视频源（文件路径、摄像头索引或 RTSP 地址）
+            source_type: file / camera / rtsp
+            detector: detector(frame, conf=..., end2end=...) -> 检测结果列表
+            video_info: 帧率、帧数、分辨率等
+            backend: 执行推理的后端名称
+            on_close: 会话结束时调用（释放模型引用）
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.source_type = source_type
+        self.realtime = source_type in REALTIME_SOURCES
+        self.video_info = video_info
+        self.confidence = confidence
+        self.end2end = end2end
+        self.jpeg_quality = jpeg_quality
+        self.backend = backend
+        self.created_at = time.time()
+        self.ended = False
+        self.error: Optional[str] = None
+
+        self._capture = capture
+        self._detector = detector
+        self._on_close = on_close
+        self._decoded = StageQueue(VIDEO_QUEUE_SIZE, self.realtime)
+        self._inferred = StageQueue(VIDEO_QUEUE_SIZE, self.realtime)
+        self._encoded = StageQueue(VIDEO_QUEUE_SIZE, self.realtime)
+        self._stop = threading.Event()
+        self._running = threading.Event()  # 未暂停
+        self._running.set()
+        self._lock = threading.Lock()
+        self._seek: Optional[int] = None
+        self._generation = 0  # 跳转后递增，丢弃跳转前已在流水线中的帧
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+
+        self._consumers = 0
+        self._last_consumer = time.monotonic()
+        self.stats = {"decoded": 0, "inferred": 0, "encoded": 0, "sent": 0, "errors": 0}
+        self._sent_times: deque = deque(maxlen=30)
+        self._latency_ms: Optional[float] = None
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        for name, target in (("decode", self._decode_loop), ("infer", self._infer_loop), ("encode", self._encode_loop)):
+            thread = threading.Thread(target=target, name=f"video-{self.id}-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"会话 {self.id} 已启动: {self.source_type} {self.source}")
+
+    def stop(self, timeout: float = 5.0):
+        """停止流水线，等待解码线程释放视频源后释放模型"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop.set()
+        self._running.set()
+        for queue in (self._decoded, self._inferred, self._encoded):
+            queue.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        if self._on_close is not None:
+            try:
+                self._on_close()
+            except Exception as e:
+                logger.error(f"会话 {self.id} 释放资源失败: {e}")
+        logger.info(f"会话 {self.id} 已停止: {self.stats}")
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    # ==================== 流水线阶段 ====================
+
+    def _decode_loop(self):
+        failures = 0
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    seek, self._seek = self._seek, None
+                    generation = self._generation
+                if seek is not None:
+                    self._capture.set(cv2.CAP_PROP_POS_FRAMES, seek)
+                if not self._running.is_set():
+                    # 实时源暂停时继续取出驱动缓冲中的帧（不解码），恢复时直接显示最新画面
+                    if self.realtime:
+                        self._capture.grab()
+                    else:
+                        self._running.wait(0.2)
+                    continue
+                ret, frame = self._capture.read()
+                if not ret:
+                    failures += 1
+                    if self.realtime and failures < VIDEO_READ_RETRIES:
+                        time.sleep(0.1)
+                        continue
+                    logger.info(f"会话 {self.id}: 视频结束或读取失败")
+                    self._decoded.put(END)
+                    if self.realtime:
+                        return
+                    # 视频文件播放完后保留会话，跳转后继续
+                    failures = 0
+                    while not self._stop.is_set() and self._seek is None:
+                        time.sleep(0.1)
+                    continue
+                failures = 0
+                self.stats["decoded"] += 1
+                frame_pos = int(self._capture.get(cv2.CAP_PROP_POS_FRAMES)) if not self.realtime else self.stats["decoded"]
+                self._decoded.put({"frame": frame, "frame_pos": frame_pos, "captured_at": time.monotonic(),
+                                   "generation": generation})
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"会话 {self.id} 解码错误: {e}")
+            self._decoded.put(END)
+        finally:
+            self._capture.release()
+
+    def _infer_loop(self):
+        while True:
+            packet = self._decoded.get(timeout=0.5)
+            if packet is None:
+                if self._stop.is_set():
+                    return
+                continue
+            if packet is END:
+                self._inferred.put(END)
+                continue
+            if packet["generation"] != self._generation:
+                continue
+            detections = []
+            try:
+                detections = self._detector(packet["frame"], conf=self.confidence, end2end=self.end2end)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"会话 {self.id} 检测错误: {e}")
+            self.stats["inferred"] += 1
+            packet["detections"] = detections
+            self._inferred.put(packet)
+
+    def _encode_loop(self):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), int(self.jpeg_quality)]
+        while True:
+            packet = self._inferred.get(timeout=0.5)
+            if packet is None:
+                if self._stop.is_set():
+                    return
+                continue
+            if packet is END:
+                self._encoded.put(END)
+                continue
+            if packet["generation"] != self._generation:
+                continue
+            ok, buffer = cv2.imencode(".jpg", packet["frame"], params)
+            if not ok:
+                self.stats["errors"] += 1
+                continue
+            height, width = packet["frame"].shape[:2]
+            self.stats["encoded"] += 1
+            self._encoded.put({
+                "jpeg": buffer.tobytes(),
+                "generation": packet["generation"],
+                "captured_at": packet["captured_at"],
+                "meta": {
+                    "frame_pos": packet["frame_pos"],
+                    "width": width,
+                    "height": height,
+                    "detections": packet["detections"],
+                    "backend": self.backend,
+                },
+            })
+
+    # ==================== 接收端 ====================
+
+    def add_consumer(self):
+        """
+        登记接收端（同一时间只允许一个，帧不会在多个接收端之间拆分），断开时调用 remove_consumer
+
+        Raises:
+            VideoSessionError: 已有接收端或会话已停止
+        """
+        with self._lock:
+            if self._closed:
+                raise VideoSessionError("视频会话已停止")
+            if self._consumers:
+                raise VideoSessionError("该视频会话已有接收端")
+            self._consumers += 1
+
+    def remove_consumer(self):
+        with self._lock:
+            self._consumers = max(0, self._consumers - 1)
+            self._last_consumer = time.monotonic()
+
+    def next_frame(self, timeout: float = 0.5) -> Any:
+        """
+        取出下一帧编码结果
+
+        Returns:
+            {"jpeg": bytes, "meta": {...}}；视频结束时返回 END；超时或会话已停止时返回 None
+        """
+        while True:
+            item = self._encoded.get(timeout)
+            if item is None or item is END:
+                if item is END:
+                    self.ended = True
+                return item
+            if item["generation"] != self._generation:
+                continue
+            now = time.monotonic()
+            latency = (now - item["captured_at"]) * 1000
+            self._latency_ms = latency if self._latency_ms is None else self._latency_ms * 0.9 + latency * 0.1
+            self._sent_times.append(now)
+            self.stats["sent"] += 1
+            item["meta"]["latency_ms"] = round(latency, 1)
+            return item
+
+    def idle_seconds(self) -> float:
+        with self._lock:
+            return 0.0 if self._consumers else time.monotonic() - self._last_consumer
+
+    # ==================== 控制 ====================
+
+    def control(self, action: str, frame_pos: Optional[int] = None, confidence_threshold: Optional[float] = None,
+                end2end: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        暂停、继续、跳转或修改检测参数
+
+        Raises:
+            VideoSessionError: 未知操作，或对实时源跳转
+        """
+        if action == "pause":
+            self._running.clear()
+        elif action == "resume":
+            self._running.set()
+        elif action == "seek":
+            if self.realtime:
+                raise VideoSessionError("实时视频源不能跳转")
+            with self._lock:
+                self._seek = max(0, int(frame_pos or 0))
+                self._generation += 1
+                self.ended = False
+            for queue in (self._decoded, self._inferred, self._encoded):
+                queue.clear()
+        elif action == "config":
+            if confidence_threshold is not None:
+                self.confidence = float(confidence_threshold)
+            if end2end is not None:
+                self.end2end = bool(end2end)
+        else:
+            raise VideoSessionError(f"未知的操作: {action}（可选: pause, resume, seek, config）")
+        return self.info()
+
+    def info(self) -> Dict[str, Any]:
+        fps = 0.0
+        if len(self._sent_times) > 1:
+            span = self._sent_times[-1] - self._sent_times[0]
+            fps = (len(self._sent_times) - 1) / span if span > 0 else 0.0
+        return {
+            "session_id": self.id,
+            "source": self.source,
+            "source_type": self.source_type,
+            "realtime": self.realtime,
+            "video_info": self.video_info,
+            "confidence_threshold": self.confidence,
+            "end2end": self.end2end,
+            "backend": self.backend,
+            "paused": not self._running.is_set(),
+            "ended": self.ended,
+            "stopped": self.stopped,
+            "error": self.error,
+            "consumers": self._consumers,
+            "fps": round(fps, 2),
+            "latency_ms": round(self._latency_ms, 1) if self._latency_ms is not None else None,
+            "queues": {"decoded": len(self._decoded), "inferred": len(self._inferred), "encoded": len(self._encoded)},
+            "dropped": {"decoded": self._decoded.dropped, "inferred": self._inferred.dropped,
+                        "encoded": self._encoded.dropped},
+            "stats": dict(self.stats),
+            "created_at": self.created_at,
+        }
+
+
+class VideoSessionManager:
+    """视频会话注册表，并定期关闭没有接收端的会话"""
+
+    def __init__(self, max_sessions: int = VIDEO_MAX_SESSIONS, idle_timeout: float = VIDEO_IDLE_TIMEOUT):
+        self.max_sessions = max(1, max_sessions)
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, VideoSession] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    def create(self, capture, source: str, source_type: str, detector: Callable[..., List[Dict[str, Any]]],
+               video_info: Dict[str, Any], **kwargs) -> VideoSession:
+        """
+        创建并启动会话（参数见 VideoSession）
+
+        Raises:
+            VideoSessionError: 会话数量已达上限
+        """
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise VideoSessionError(f"视频会话数量已达上限 {self.max_sessions}")
+            session = VideoSession(capture, source, source_type, detector, video_info, **kwargs)
+            self._sessions[session.id] = session
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name="video-reaper", daemon=True)
+                self._reaper.start()
+        session.start()
+        return session
+
+    def get(self, session_id: str) -> Optional[VideoSession]:
+        return self._sessions.get(session_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [session.info() for session in list(self._sessions.values())]
+
+    def stop(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.stop()
+        return True
+
+    def stop_all(self):
+        for session_id in list(self._sessions):
+            self.stop(session_id)
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(min(5.0, max(0.5, self.idle_timeout / 4)))
+            for session in list(self._sessions.values()):
+                if session.idle_seconds() > self.idle_timeout:
+                    logger.warning(f"会话 {session.id} 超过 {self.idle_timeout:.0f} 秒没有接收端，自动关闭")
+                    self.stop(session.id)
+
+
+# 全局视频会话管理器
+video_sessions = VideoSessionManager()